@@ -4,10 +4,26 @@ import socket
 import os
 import logging
 import netifaces  # 用于获取网络接口信息
-from nlp_parser import process_instruction, DialogueManager
+from nlp_parser import process_instruction, parse_instruction, parse_action_params, DialogueManager
 from video_editor import MoviePyVideoEditor
-from video_comprehension import video_comprehension, process_video_with_sam2
-from sam2_model import SAM2InstanceSegmentationModel
+from video_comprehension import video_comprehension, process_video_with_sam2, inpaint_segmented, TargetNotFound
+from media_ingest import mezzanine_manager, probe_video
+from media_preview import preview_manager
+from job_control import admission_controller, AdmissionRejected
+from cost_model import cost_estimator
+from sam2_pool import predictor_pool, PredictorBusy
+from workspace import workspace_stats, cleanup_stale_workspaces
+from feature_cache import feature_cache
+from frame_store import frame_stores
+from removal_pipeline import stage_cache
+from mask_preview import predict_frame_mask, encode_mask_png
+from sam2_model import frame_mapping
+from mask_store import encode_rle
+from segmentation_session import session_manager, SessionNotFound
+from inpainting import inpainting_pool
+import numpy as np
+import threading
+import io
 import mimetypes
 import re
 
@@ -68,6 +84,15 @@ class FileManager:
     def has_file(self, original_filename):
         return original_filename in self.filename_map
 
+# 预览资源缓存时间（秒），带版本号的请求可长期缓存
+PREVIEW_CACHE_MAX_AGE = 31536000
+
+def get_session_id():
+    """获取调度使用的会话标识：优先使用客户端提供的会话 ID，否则使用客户端 IP。"""
+    return (request.headers.get('X-Session-Id')
+            or request.form.get('session_id')
+            or request.remote_addr)
+
 # 创建文件管理器实例
 file_manager = FileManager()
 # 创建对话管理器实例
@@ -89,6 +114,25 @@ def not_found(error):
 def internal_error(error):
     return make_response(jsonify({'error': 'Internal server error'}), 500)
 
+@app.errorhandler(AdmissionRejected)
+def admission_rejected(error):
+    logger.warning(f"请求被拒绝: {error}")
+    response = make_response(jsonify({
+        'error': '服务器繁忙，请稍后再试',
+        'job_class': error.job_class,
+        'reason': error.reason,
+        'retry_after': error.retry_after
+    }), 429)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.errorhandler(PredictorBusy)
+def predictor_busy(error):
+    logger.warning(f"分割模型繁忙: {error}")
+    response = make_response(jsonify({'error': '分割模型繁忙，请稍后重试'}), 503)
+    response.headers['Retry-After'] = '5'
+    return response
+
 # 健康检查端点
 @app.route('/health-check', methods=['GET', 'OPTIONS'])
 def health_check():
@@ -130,12 +174,18 @@ def upload_video():
         file_path = os.path.join(upload_folder, simplified_name)
         video_file.save(file_path)
         logger.info(f"视频保存成功: {file_path} (原始文件名: {original_filename})")
+
+        # 后台转码为夹层格式，原始文件保留用于最终渲染
+        mezzanine_status = mezzanine_manager.submit(file_path)
+        preview_status = preview_manager.submit(file_path)
         
         return jsonify({
             "status": "success",
             "message": "视频上传成功",
             "file_path": file_path,
-            "simplified_name": simplified_name
+            "simplified_name": simplified_name,
+            "mezzanine_status": mezzanine_status,
+            "preview_status": preview_status
         })
         
     except Exception as e:
@@ -208,6 +258,369 @@ def serve_video(filename):
         logger.exception("详细错误信息：")
         return jsonify({"error": str(e)}), 500
 
+# 预览资源清单端点
+@app.route('/previews/<simplified_name>', methods=['GET', 'OPTIONS'])
+def preview_manifest(simplified_name):
+    if request.method == 'OPTIONS':
+        return make_response('', 200)
+
+    video_path = os.path.join('uploads', simplified_name)
+    if not os.path.exists(video_path):
+        return jsonify({"error": "文件不存在"}), 404
+
+    # 未生成过预览的文件（例如旧的输出文件）在首次访问时补交任务
+    preview_manager.submit(video_path)
+    status = preview_manager.get_status(video_path)
+    manifest = preview_manager.get_manifest(video_path)
+    if status.get("status") != "ready" or not manifest:
+        return jsonify({
+            "status": status.get("status"),
+            "simplified_name": simplified_name,
+            "error": status.get("error")
+        }), 202
+
+    # 资源 URL 带上版本号，客户端可放心长期缓存
+    base_url = f"/previews/{simplified_name}"
+    version = manifest["version"]
+    return jsonify({
+        "status": "ready",
+        "simplified_name": simplified_name,
+        "duration": manifest["duration"],
+        "width": manifest["width"],
+        "height": manifest["height"],
+        "proxy_url": f"{base_url}/{manifest['proxy']}?v={version}",
+        "sprite": dict(manifest["sprite"], sheets=[
+            f"{base_url}/{name}?v={version}" for name in manifest["sprite"]["sheets"]
+        ]),
+        "waveform_url": f"{base_url}/{manifest['waveform']}?v={version}" if manifest["waveform"] else None
+    })
+
+# 预览资源文件端点（代理视频、雪碧图、波形）
+@app.route('/previews/<simplified_name>/<asset>', methods=['GET'])
+def preview_asset(simplified_name, asset):
+    video_path = os.path.join('uploads', simplified_name)
+    manifest = preview_manager.get_manifest(video_path) if os.path.exists(video_path) else None
+    if not manifest:
+        return jsonify({"error": "预览资源尚未生成"}), 404
+
+    # 只允许访问清单中列出的资源
+    allowed = {manifest["proxy"], manifest["waveform"], *manifest["sprite"]["sheets"]}
+    if asset not in allowed:
+        return jsonify({"error": "文件不存在"}), 404
+
+    mimetype = mimetypes.guess_type(asset)[0] or 'application/octet-stream'
+    response = send_from_directory(
+        preview_manager.get_preview_dir(video_path),
+        asset,
+        mimetype=mimetype,
+        conditional=True
+    )
+    if request.args.get('v') == str(manifest["version"]):
+        response.headers['Cache-Control'] = f'public, max-age={PREVIEW_CACHE_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = 'public, no-cache'
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+# 处理耗时预估端点
+@app.route('/estimate', methods=['POST', 'OPTIONS'])
+def estimate():
+    if request.method == 'OPTIONS':
+        return make_response('', 200)
+
+    try:
+        data = request.get_json(silent=True) or request.form
+        simplified_name = data.get('simplified_name')
+        if not simplified_name and data.get('filename') and file_manager.has_file(data['filename']):
+            simplified_name = file_manager.get_simplified_name(data['filename'])
+        if not simplified_name:
+            return jsonify({"error": "请提供已上传视频的文件名"}), 400
+
+        video_path = os.path.join('uploads', simplified_name)
+        if not os.path.exists(video_path):
+            return jsonify({"error": "文件不存在"}), 404
+        working_path = mezzanine_manager.get_working_path(video_path)
+
+        # 操作可以直接给出，也可以由自然语言指令解析得到（预估不写入对话历史）
+        action = data.get('action')
+        if not action and data.get('instruction'):
+            with admission_controller.admit('llm', session=get_session_id()):
+                action, _ = parse_instruction(data['instruction'])
+        if action:
+            action = re.sub(r'^assistant:\s*', '', action)
+        action_parts = action.strip().split() if action else []
+        operation = data.get('op') or (action_parts[1] if len(action_parts) > 1 else None)
+        if not operation:
+            return jsonify({"error": "无法确定要预估的操作"}), 400
+
+        job_class = 'removal' if operation == 'remove_objects' else 'render'
+        # 常规编辑渲染原始文件，目标消除的分析阶段使用夹层文件
+        prediction = cost_estimator.predict(operation, video_path if job_class == 'render' else working_path)
+        queue_seconds = admission_controller.estimate_wait(job_class)
+
+        return jsonify({
+            "status": "success",
+            "op": operation,
+            "action": action,
+            "job_class": job_class,
+            "estimated_seconds": prediction["wall_time"],
+            "estimated_queue_seconds": queue_seconds,
+            "estimated_total_seconds": prediction["wall_time"] + queue_seconds,
+            "peak_memory_mb": prediction["peak_memory_mb"],
+            "stages": prediction["stages"],
+            "video": prediction["video"]
+        })
+
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.error(f"预估处理耗时时出错: {str(e)}")
+        logger.exception("详细错误信息：")
+        return jsonify({"error": str(e)}), 500
+
+def parse_prompt(data, require_box=True):
+    """
+    解析请求中的分割提示。
+
+    返回:
+        (frame_idx, points, labels, box)，points/labels/box 未提供时为 None
+
+    异常:
+        ValueError: 如果提示格式错误或缺少提示
+    """
+    try:
+        frame_idx = int(data.get('frame', 0))
+        points = np.array(data['points'], dtype=np.float32).reshape(-1, 2) if data.get('points') else None
+        labels = None
+        if points is not None:
+            labels = np.array(data.get('labels') or [1] * len(points), dtype=np.int32)
+        box = np.array(data['box'], dtype=np.float32).reshape(4) if data.get('box') else None
+    except (TypeError, ValueError):
+        raise ValueError("提示参数格式错误")
+    if points is not None and len(labels) != len(points):
+        raise ValueError("points 与 labels 的数量不一致")
+    if points is None and (box is None or not require_box):
+        raise ValueError("请提供 points 或 box" if require_box else "请提供 points")
+    return frame_idx, points, labels, box
+
+def resolve_uploaded_video(data):
+    """
+    根据请求中的 simplified_name 或 filename 找到已上传的视频。
+
+    返回:
+        (video_path, working_path)
+
+    异常:
+        ValueError: 如果没有提供文件名
+        FileNotFoundError: 如果文件不存在
+    """
+    simplified_name = data.get('simplified_name')
+    if not simplified_name and data.get('filename') and file_manager.has_file(data['filename']):
+        simplified_name = file_manager.get_simplified_name(data['filename'])
+    if not simplified_name:
+        raise ValueError("请提供已上传视频的文件名")
+
+    video_path = os.path.join('uploads', simplified_name)
+    if not os.path.exists(video_path):
+        raise FileNotFoundError("文件不存在")
+    return video_path, mezzanine_manager.get_working_path(video_path)
+
+def to_analysis_frame(video_path, working_path, frame_idx, info=None):
+    """
+    把客户端给出的原视频帧号换算为分析用的夹层文件中同一时刻的帧号。
+
+    夹层文件可能降低了帧率，帧号按时间戳对应（与把分割结果用回原视频时的 frame_mapping 一致）。
+
+    参数:
+        info (dict): 原视频的 probe_video 元数据，为 None 时重新读取
+
+    异常:
+        ValueError: 如果帧号超出原视频的帧范围
+    """
+    info = info or probe_video(video_path)
+    if not 0 <= frame_idx < info["frame_count"]:
+        raise ValueError(f"帧索引 {frame_idx} 超出视频帧范围 [0, {info['frame_count'] - 1}]")
+    if working_path == video_path:
+        return frame_idx
+    working = probe_video(working_path)
+    frame_map = frame_mapping(info["frame_count"], info["fps"], working["frame_count"], working["fps"])
+    return frame_idx if frame_map is None else int(frame_map[frame_idx])
+
+# 单帧掩码预览端点：在完整分割和目标消除之前确认提示选中的对象。
+# 请求中的 frame 是原视频的帧号（与播放器和原视频预览一致），在夹层文件上对应同一时刻的帧预测，
+# 返回的 frame 仍是原视频帧号。
+# /preview-mask、/segment、/refine-mask 和 /segment/<job_id> 返回的掩码都是原视频分辨率
+@app.route('/preview-mask', methods=['POST', 'OPTIONS'])
+def preview_mask():
+    if request.method == 'OPTIONS':
+        return make_response('', 200)
+
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            video_path, working_path = resolve_uploaded_video(data)
+        except FileNotFoundError as e:
+            return jsonify({"error": str(e)}), 404
+
+        frame_idx, points, labels, box = parse_prompt(data)
+
+        try:
+            info = probe_video(video_path)
+            analysis_idx = to_analysis_frame(video_path, working_path, frame_idx, info)
+            result = predict_frame_mask(working_path, analysis_idx, points, labels, box,
+                                        mask_size=(info["width"], info["height"]))
+        except TimeoutError:
+            response = jsonify({"error": "分割模型繁忙，请稍后重试"})
+            response.headers['Retry-After'] = '2'
+            return response, 503
+
+        mask = result["mask"]
+        if data.get('format') == 'png':
+            response = send_file(io.BytesIO(encode_mask_png(mask)), mimetype='image/png')
+            response.headers['X-Mask-Score'] = f"{result['score']:.4f}"
+            response.headers['X-Elapsed-Ms'] = f"{result['elapsed_ms']:.0f}"
+            return response
+
+        return jsonify({
+            "status": "success",
+            "frame": frame_idx,
+            "score": result["score"],
+            "area": int(mask.sum()),
+            "mask": encode_rle(mask),
+            "cache_hit": result["cache_hit"],
+            "elapsed_ms": result["elapsed_ms"]
+        })
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"生成掩码预览时出错: {str(e)}")
+        logger.exception("详细错误信息：")
+        return jsonify({"error": str(e)}), 500
+
+# 可修正的分割端点：分割结果保留在会话中，之后可以在任意帧追加点修正，再确认消除
+@app.route('/segment', methods=['POST', 'OPTIONS'])
+def segment():
+    if request.method == 'OPTIONS':
+        return make_response('', 200)
+
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            video_path, working_path = resolve_uploaded_video(data)
+        except FileNotFoundError as e:
+            return jsonify({"error": str(e)}), 404
+        frame_idx, points, labels, box = parse_prompt(data)
+
+        with admission_controller.admit('removal', op='segment',
+                                        video_path=working_path, session=get_session_id()):
+            session = session_manager.create(working_path, frame_idx, points, labels, box,
+                                             source_path=video_path)
+
+        return jsonify({
+            "status": "success",
+            "job_id": session.job_id,
+            "session": session.info(),
+            "frame": frame_idx,
+            "mask": encode_rle(session.get_mask(frame_idx))
+        })
+
+    except (AdmissionRejected, PredictorBusy):
+        raise
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"分割视频时出错: {str(e)}")
+        logger.exception("详细错误信息：")
+        return jsonify({"error": str(e)}), 500
+
+# 掩码修正端点：在任意帧追加正/负点，只重新传播受影响的帧
+@app.route('/refine-mask', methods=['POST', 'OPTIONS'])
+def refine_mask():
+    if request.method == 'OPTIONS':
+        return make_response('', 200)
+
+    try:
+        data = request.get_json(silent=True) or {}
+        if not data.get('job_id'):
+            return jsonify({"error": "请提供 job_id"}), 400
+        frame_idx, points, labels, _ = parse_prompt(data, require_box=False)
+        session = session_manager.get(data['job_id'])
+
+        # 修正与分割一样占用预测器，经过同一准入控制；预测器在 SAM2_LEASE_TIMEOUT 内不空闲时返回 503
+        with admission_controller.admit('removal', op='refine',
+                                        video_path=session.video_path, session=get_session_id()):
+            result = session.refine(frame_idx, points, labels, int(data.get('obj_id', 1)))
+        return jsonify({
+            "status": "success",
+            "job_id": session.job_id,
+            "updated": result,
+            "mask": encode_rle(session.get_mask(frame_idx))
+        })
+
+    except (AdmissionRejected, PredictorBusy):
+        raise
+    except SessionNotFound:
+        return jsonify({"error": "分割任务不存在或已过期"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"修正掩码时出错: {str(e)}")
+        logger.exception("详细错误信息：")
+        return jsonify({"error": str(e)}), 500
+
+# 查询或关闭分割会话
+@app.route('/segment/<job_id>', methods=['GET', 'DELETE'])
+def segment_session(job_id):
+    try:
+        if request.method == 'DELETE':
+            session_manager.close(job_id)
+            return jsonify({"status": "success", "job_id": job_id})
+
+        session = session_manager.get(job_id)
+        if request.args.get('frame') is None:
+            return jsonify({"status": "success", "session": session.info()})
+        frame_idx = int(request.args['frame'])
+        return jsonify({
+            "status": "success",
+            "job_id": job_id,
+            "frame": frame_idx,
+            "mask": encode_rle(session.get_mask(frame_idx))
+        })
+
+    except SessionNotFound:
+        return jsonify({"error": "分割任务不存在或已过期"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+# 运行指标端点
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "status": "success",
+        "admission": admission_controller.metrics(),
+        "sam2_pool": predictor_pool.stats(),
+        "workspaces": workspace_stats(),
+        "feature_cache": feature_cache.stats(),
+        "frame_store": frame_stores.stats(),
+        "pipeline": stage_cache.stats(),
+        "segment_sessions": session_manager.stats(),
+        "inpainting": inpainting_pool.stats()
+    })
+
+# 查询视频标准化状态端点
+@app.route('/ingest-status/<simplified_name>', methods=['GET'])
+def ingest_status(simplified_name):
+    video_path = os.path.join('uploads', simplified_name)
+    if not os.path.exists(video_path):
+        return jsonify({"error": "文件不存在"}), 404
+    status = mezzanine_manager.get_status(video_path)
+    return jsonify({
+        "status": "success",
+        "simplified_name": simplified_name,
+        "mezzanine": status
+    })
+
 # 修改处理视频编辑请求的函数
 @app.route('/process-video', methods=['POST', 'OPTIONS'])
 def process_video():
@@ -224,7 +637,10 @@ def process_video():
             return jsonify({"error": "请提供处理指令"}), 400
             
         video_file = request.files['video']
-        instruction = request.form['instruction']
+        # 自然语言指令只有一条；多个目标由解析结果中的 objects=A|B 表示
+        instruction = request.form.get('instruction')
+        # refresh=true 时重新调用大模型定位和检测目标，不复用上次的结果
+        refresh = request.form.get('refresh', '').lower() in ('1', 'true', 'yes')
         
         if video_file.filename == '':
             return jsonify({"error": "未选择文件"}), 400
@@ -244,10 +660,16 @@ def process_video():
         if not os.path.exists(video_path):
             video_file.save(video_path)
             logger.info(f"视频保存成功: {video_path} (原始文件名: {original_filename})")
+
+        # 夹层文件就绪时用于定位和分割，最终渲染始终使用原始文件
+        mezzanine_manager.submit(video_path)
+        working_path = mezzanine_manager.get_working_path(video_path)
             
         # 处理视频
         dialogue_manager.set_current_video(video_path)
-        action, confirmation, _ = process_instruction(instruction)
+        session_id = get_session_id()
+        with admission_controller.admit('llm', session=session_id):
+            action, confirmation, _ = process_instruction(instruction)
 
         # 清理action中的前缀
         if action:
@@ -263,16 +685,19 @@ def process_video():
                 output_simplified_name = f"removed_{simplified_name}"
                 output_path = os.path.join(upload_folder, output_simplified_name)
                 
-                # 从action中提取目标描述
-                match = re.search(r'objects=([^ ]+)', clean_action)
-                if match:
-                    target_description = match.group(1)
+                # 从action中提取目标描述（可能包含空格，与确认消息使用同一套参数解析）
+                target_description = parse_action_params(clean_action).get('objects', '')
+                if target_description:
                     logger.info(f"提取的目标描述: {target_description}")
-                    process_video_with_sam2(video_path, target_description, output_path)
+                    with admission_controller.admit('removal', op='remove_objects',
+                                                    video_path=working_path, session=session_id):
+                        process_video_with_sam2(video_path, target_description, output_path,
+                                                analysis_path=working_path, refresh=refresh)
                     
                     # 确保输出文件存在
                     if not os.path.exists(output_path):
                         raise Exception("处理后的视频文件未生成")
+                    preview_manager.submit(output_path)
                         
                     # 构建相对路径的URL
                     video_url = f"/uploads/{output_simplified_name}"
@@ -295,21 +720,25 @@ def process_video():
                 logger.info(f"检测到常规编辑操作: {clean_action}")
                 # 使用常规视频编辑处理
                 logger.info("使用常规视频编辑处理")
-                editor = MoviePyVideoEditor(video_path)
-                result = editor.execute_action(clean_action)
-                
                 # 为处理后的视频创建新的简化文件名
                 output_simplified_name = f"output_{simplified_name}"
                 output_path = os.path.join(upload_folder, output_simplified_name)
-                
-                # 保存处理后的视频
-                editor.output_path = output_path
-                editor.save()
-                editor.close()
+
+                operation = clean_action.split()[1] if len(clean_action.split()) > 1 else 'render'
+                with admission_controller.admit('render', op=operation,
+                                                video_path=video_path, session=session_id):
+                    editor = MoviePyVideoEditor(video_path)
+                    result = editor.execute_action(clean_action)
+
+                    # 保存处理后的视频
+                    editor.output_path = output_path
+                    editor.save()
+                    editor.close()
 
                 # 确保输出文件存在
                 if not os.path.exists(output_path):
                     raise Exception("处理后的视频文件未生成")
+                preview_manager.submit(output_path)
 
                 # 构建相对路径的URL
                 video_url = f"/uploads/{output_simplified_name}"
@@ -329,6 +758,10 @@ def process_video():
                 "message": confirmation
             }), 400
             
+    except (AdmissionRejected, PredictorBusy):
+        raise
+    except TargetNotFound as e:
+        return jsonify({"error": str(e), "missing_targets": e.missing}), 422
     except Exception as e:
         logger.error(f"处理请求时出错: {str(e)}")
         logger.exception("详细错误信息：")
@@ -369,6 +802,11 @@ def remove_target():
     
     try:
         logger.info(f"收到目标消除请求，来自: {request.remote_addr}")
+
+        # 提供 job_id 时使用已确认（可能经过修正）的分割结果直接消除
+        job_id = request.form.get('job_id') or (request.get_json(silent=True) or {}).get('job_id')
+        if job_id:
+            return remove_segmented_target(job_id)
         
         # 检查文件和指令
         if 'video' not in request.files:
@@ -377,7 +815,11 @@ def remove_target():
             return jsonify({"error": "请提供目标描述"}), 400
             
         video_file = request.files['video']
-        instruction = request.form['instruction']
+        # 可以重复提交 instruction 字段同时消除多个目标，共用一次分割和消除
+        instructions = request.form.getlist('instruction')
+        instruction = instructions if len(instructions) > 1 else instructions[0]
+        # refresh=true 时重新调用大模型定位和检测目标，不复用上次的结果
+        refresh = request.form.get('refresh', '').lower() in ('1', 'true', 'yes')
         
         if video_file.filename == '':
             return jsonify({"error": "未选择文件"}), 400
@@ -397,17 +839,25 @@ def remove_target():
         if not os.path.exists(video_path):
             video_file.save(video_path)
             logger.info(f"视频保存成功: {video_path} (原始文件名: {original_filename})")
+
+        # 夹层文件就绪时用于定位和分割，修复和音轨合并始终使用原始文件
+        mezzanine_manager.submit(video_path)
+        working_path = mezzanine_manager.get_working_path(video_path)
         
         # 为处理后的视频创建新的简化文件名
         output_simplified_name = f"removed_{simplified_name}"
         output_path = os.path.join(upload_folder, output_simplified_name)
         
         # 处理视频目标消除
-        process_video_with_sam2(video_path, instruction, output_path)
+        with admission_controller.admit('removal', op='remove_objects',
+                                        video_path=working_path, session=get_session_id()):
+            process_video_with_sam2(video_path, instruction, output_path, analysis_path=working_path,
+                                    refresh=refresh)
         
         # 确保输出文件存在
         if not os.path.exists(output_path):
             raise Exception("处理后的视频文件未生成")
+        preview_manager.submit(output_path)
             
         # 构建相对路径的URL
         video_url = f"/uploads/{output_simplified_name}"
@@ -421,11 +871,51 @@ def remove_target():
             "simplified_name": output_simplified_name
         })
             
+    except (AdmissionRejected, PredictorBusy):
+        raise
+    except TargetNotFound as e:
+        return jsonify({"error": str(e), "missing_targets": e.missing}), 422
     except Exception as e:
         logger.error(f"处理请求时出错: {str(e)}")
         logger.exception("详细错误信息：")
         return jsonify({"error": str(e)}), 500
 
+def remove_segmented_target(job_id):
+    """使用分割会话中的掩码消除目标，完成后关闭会话。"""
+    try:
+        session = session_manager.get(job_id)
+    except SessionNotFound:
+        return jsonify({"error": "分割任务不存在或已过期"}), 404
+
+    output_simplified_name = f"removed_{job_id[:8]}_{os.path.basename(session.source_path)}"
+    output_path = os.path.join('uploads', output_simplified_name)
+
+    # 准入被拒绝时会话保留，客户端可以稍后重试
+    with admission_controller.admit('removal', op='inpaint_segmented',
+                                    video_path=session.source_path, session=get_session_id()):
+        try:
+            session = session_manager.pop(job_id)
+        except SessionNotFound:
+            return jsonify({"error": "分割任务不存在或已过期"}), 404
+        try:
+            if not inpaint_segmented(session.model, session.workspace, session.source_path, output_path):
+                raise Exception("目标消除失败")
+        finally:
+            session.close()
+
+    if not os.path.exists(output_path):
+        raise Exception("处理后的视频文件未生成")
+    preview_manager.submit(output_path)
+
+    video_url = f"/uploads/{output_simplified_name}"
+    logger.info(f"目标消除完成，输出URL: {video_url}")
+    return jsonify({
+        "status": "success",
+        "message": "目标消除成功",
+        "output_path": video_url,
+        "simplified_name": output_simplified_name
+    })
+
 if __name__ == "__main__":
     print("\n" + "="*50)
     print("服务器启动配置:")
@@ -448,6 +938,26 @@ if __name__ == "__main__":
     print("4. 如果仍然无法访问，请检查防火墙设置")
     print("="*50 + "\n")
     
+    # 清理上次异常退出时遗留的任务工作区
+    cleanup_stale_workspaces()
+
+    # 启动 SAM2 预测器池的后台清理；设置 SAM2_PRELOAD（如 "tiny,small"）时在后台预加载模型
+    predictor_pool.start_janitor()
+    session_manager.start_janitor()
+    preload_sizes = os.environ.get("SAM2_PRELOAD", "")
+    if preload_sizes:
+        print(f"后台预加载 SAM2 模型: {preload_sizes}")
+        threading.Thread(
+            target=predictor_pool.preload,
+            args=(preload_sizes.split(","),),
+            daemon=True
+        ).start()
+
+    # 设置 INPAINT_PRELOAD=1 时在后台启动 E2FGVI 修复进程，第一个消除请求无需等待模型加载
+    if os.environ.get("INPAINT_PRELOAD", "0") != "0":
+        print("后台启动 E2FGVI 修复进程")
+        threading.Thread(target=inpainting_pool.start, daemon=True).start()
+
     try:
         # 启动 Flask 服务器
         app.run(
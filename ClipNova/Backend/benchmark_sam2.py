@@ -0,0 +1,121 @@
+"""
+SAM2 推理配置基准测试。
+
+对同一段视频和同一个提示，依次使用不同的推理配置和工作分辨率完成分割，报告每秒处理帧数，
+以及与原分辨率 CPU float32 基线相比的平均掩码 IoU（低分辨率掩码先放大回原分辨率再比较）。
+
+示例:
+    python benchmark_sam2.py --video D:/test1/video001.mp4 --frame 50 --box 0 250 200 700 \
+        --profiles fp32,channels_last,int8,compile --scales 1.0,0.5,0.25
+"""
+import time
+import argparse
+import numpy as np
+from sam2.build_sam import build_sam2_video_predictor
+from sam2_model import SAM2InstanceSegmentationModel
+from sam2_pool import get_checkpoint_paths, SAM2_DEFAULT_SIZE
+from inference_profile import InferenceProfile
+from workspace import JobWorkspace
+
+# 可选的推理配置：名称 -> InferenceProfile 参数
+PROFILES = {
+    'fp32': dict(channels_last=False, quantize='none', compile_encoder=False),
+    'channels_last': dict(channels_last=True, quantize='none', compile_encoder=False),
+    'int8': dict(channels_last=True, quantize='int8', compile_encoder=False),
+    'compile': dict(channels_last=True, quantize='none', compile_encoder=True),
+}
+
+
+def mask_iou(model_a, model_b) -> float:
+    """
+    计算两个模型分割结果在所有帧上并集掩码的平均 IoU（两者都为空的帧记为 1）。
+
+    model_b 的掩码按输出黑白掩码时的方式放大到 model_a 的掩码尺寸后再比较。
+    """
+    store_a, store_b = model_a.video_segments, model_b.video_segments
+    if store_a.num_frames != store_b.num_frames:
+        raise ValueError("两个分割结果的帧数不一致")
+    ious = []
+    for frame_idx in range(store_a.num_frames):
+        a = store_a.get_union(frame_idx)
+        b = model_b._upsample_mask(store_b.get_union(frame_idx), (store_a.width, store_a.height))
+        union = np.logical_or(a, b).sum()
+        ious.append(1.0 if union == 0 else np.logical_and(a, b).sum() / union)
+    return float(np.mean(ious)) if ious else 1.0
+
+
+def run_profile(args, name: str, scale: float, workspace: JobWorkspace) -> dict:
+    """使用指定配置和工作分辨率加载模型并完成一次分割，返回耗时和分割结果。"""
+    model_cfg, checkpoint = get_checkpoint_paths(args.size)
+    profile = InferenceProfile("cpu", threads=args.threads, interop_threads=args.interop_threads, **PROFILES[name])
+    predictor = build_sam2_video_predictor(model_cfg, checkpoint, device="cpu")
+    profile.apply(predictor)
+
+    model = SAM2InstanceSegmentationModel(model_cfg, checkpoint, device="cpu", predictor=predictor,
+                                          work_dir=workspace.path(f"{name}_{scale}", ""), profile=profile)
+    model.set_video_path(args.video, workspace.path(f"{name}_{scale}", "result.mp4"))
+    model.window_size = args.window
+    model.working_scale = scale
+
+    start = time.perf_counter()
+    if args.box:
+        model.segment_with_box(np.array(args.box, dtype=np.float32), args.frame)
+    else:
+        model.segment_with_points(np.array([args.point], dtype=np.float32), np.array([1], dtype=np.int32),
+                                  args.frame)
+    elapsed = time.perf_counter() - start
+    return {"name": f"{profile.name}@{scale:g}", "model": model, "seconds": elapsed,
+            "frames": model.num_frames}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SAM2 推理配置基准测试")
+    parser.add_argument("--video", required=True, help="输入视频路径")
+    parser.add_argument("--frame", type=int, default=0, help="提示所在帧")
+    parser.add_argument("--box", type=float, nargs=4, metavar=("X1", "Y1", "X2", "Y2"), help="矩形框提示")
+    parser.add_argument("--point", type=float, nargs=2, metavar=("X", "Y"), help="前景点提示")
+    parser.add_argument("--size", default=SAM2_DEFAULT_SIZE, help="模型尺寸")
+    parser.add_argument("--profiles", default="fp32,channels_last,int8", help="逗号分隔的配置名称")
+    parser.add_argument("--threads", type=int, default=0, help="CPU 算子内线程数，0 表示自动")
+    parser.add_argument("--interop-threads", type=int, default=1, help="CPU 算子间线程数")
+    parser.add_argument("--scales", default="1.0", help="逗号分隔的工作分辨率缩放比例，如 1.0,0.5,0.25")
+    parser.add_argument("--window", type=int, default=0, help="传播窗口帧数，0 表示一次加载整个视频")
+    args = parser.parse_args()
+    if not args.box and not args.point:
+        parser.error("必须提供 --box 或 --point")
+
+    names = [name.strip() for name in args.profiles.split(",") if name.strip()]
+    unknown = [name for name in names if name not in PROFILES]
+    if unknown:
+        parser.error(f"未知的配置: {', '.join(unknown)}")
+    scales = [float(scale) for scale in args.scales.split(",") if scale.strip()]
+    if any(not 0 < scale <= 1 for scale in scales):
+        parser.error("缩放比例必须在 (0, 1] 范围内")
+
+    # IoU 以原分辨率 float32 的结果为基线，基线排在第一个
+    runs = [("fp32", 1.0)] + [(name, scale) for name in names for scale in scales
+                              if (name, scale) != ("fp32", 1.0)]
+
+    results = []
+    with JobWorkspace("benchmark") as workspace:
+        baseline = None
+        for name, scale in runs:
+            print(f"\n运行配置: {name}，工作分辨率缩放 {scale:g}")
+            result = run_profile(args, name, scale, workspace)
+            if baseline is None:
+                baseline = result
+            result["iou"] = mask_iou(baseline["model"], result["model"])
+            results.append(result)
+        for result in results:
+            result["model"].cleanup()
+
+    print("\n" + "=" * 60)
+    print(f"{'配置':<32}{'帧/秒':>10}{'耗时(秒)':>10}{'IoU':>8}")
+    for result in results:
+        fps = result["frames"] / result["seconds"] if result["seconds"] > 0 else 0.0
+        print(f"{result['name']:<32}{fps:>10.2f}{result['seconds']:>10.1f}{result['iou']:>8.4f}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os
+import logging
+import warnings
+import cv2
+import numpy as np
+from typing import List, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 静止镜头判定：每隔若干帧与镜头首帧比较，拟合的全局运动使画面四角的位移都不超过阈值（像素）。
+# 特征点不足（如纯色画面）时改用未遮挡像素的平均灰度差判定
+STATIC_MAX_SHIFT = float(os.environ.get("CLIPNOVA_STATIC_MAX_SHIFT", "1.5"))
+STATIC_MAX_DIFF = float(os.environ.get("CLIPNOVA_STATIC_MAX_DIFF", "4.0"))
+STATIC_SAMPLE_STEP = int(os.environ.get("CLIPNOVA_STATIC_SAMPLE_STEP", "5"))
+
+# 背景填充方式："nearest" 取时间上最近一次未被遮挡的像素（能适应缓慢的光照变化），
+# "median" 取所有未遮挡帧的时间中值（能去掉偶尔经过的其他物体）
+CLASSICAL_FILL = os.environ.get("CLIPNOVA_CLASSICAL_FILL", "nearest")
+# 背景从未出现过的像素超过掩码面积的这一比例时，该镜头交给 E2FGVI 处理
+CLASSICAL_MAX_UNSEEN = float(os.environ.get("CLIPNOVA_CLASSICAL_MAX_UNSEEN", "0.05"))
+SPATIAL_INPAINT_RADIUS = 3
+
+
+def estimate_global_motion(ref_gray: np.ndarray, gray: np.ndarray,
+                           mask: Optional[np.ndarray] = None) -> Optional[float]:
+    """
+    估计两帧之间的全局（相机）运动。
+
+    在参考帧上检测角点（避开掩码区域，即被移除的运动目标），用 LK 光流跟踪后以 RANSAC 拟合相似变换。
+
+    返回:
+        Optional[float]: 变换后画面四角的最大位移（像素），特征点不足时返回 None
+    """
+    feature_mask = None if mask is None else (mask == 0).astype(np.uint8) * 255
+    points = cv2.goodFeaturesToTrack(ref_gray, maxCorners=200, qualityLevel=0.01, minDistance=8,
+                                     mask=feature_mask)
+    if points is None or len(points) < 8:
+        return None
+    moved, status, _ = cv2.calcOpticalFlowPyrLK(ref_gray, gray, points, None)
+    good = status.ravel() == 1
+    if good.sum() < 8:
+        return None
+    matrix, _ = cv2.estimateAffinePartial2D(points[good], moved[good], method=cv2.RANSAC,
+                                            ransacReprojThreshold=2.0)
+    if matrix is None:
+        return None
+    h, w = gray.shape
+    corners = np.array([[0, 0], [w, 0], [0, h], [w, h]], dtype=np.float32)
+    mapped = corners @ matrix[:, :2].T + matrix[:, 2]
+    return float(np.abs(mapped - corners).max())
+
+
+def is_static(frames: np.ndarray, masks: np.ndarray, step: int = STATIC_SAMPLE_STEP,
+              max_shift: float = STATIC_MAX_SHIFT) -> bool:
+    """
+    判断一段帧是否来自静止的相机（三脚架拍摄、录屏等）。
+
+    参数:
+        frames (np.ndarray): 形状为 (T, H, W, 3) 的 uint8 RGB 帧
+        masks (np.ndarray): 形状为 (T, H, W) 的掩码，非 0 表示被移除的目标
+    """
+    length = len(frames)
+    ref_gray = cv2.cvtColor(frames[0], cv2.COLOR_RGB2GRAY)
+    samples = sorted(set(range(step, length, max(1, step))) | {length - 1} - {0})
+    for idx in samples:
+        gray = cv2.cvtColor(frames[idx], cv2.COLOR_RGB2GRAY)
+        mask = np.maximum(masks[0], masks[idx])
+        shift = estimate_global_motion(ref_gray, gray, mask)
+        if shift is None:
+            visible = mask == 0
+            if not visible.any():
+                return False
+            diff = np.abs(ref_gray[visible].astype(np.int16) - gray[visible]).mean()
+            if diff > STATIC_MAX_DIFF:
+                return False
+        elif shift > max_shift:
+            return False
+    return True
+
+
+def fill_from_background(frames: np.ndarray, masks: np.ndarray,
+                         mode: str = CLASSICAL_FILL) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    用其他帧中露出的背景填充掩码区域（整段向量化计算）。
+
+    参数:
+        frames (np.ndarray): 形状为 (T, H, W, 3) 的 uint8 RGB 帧
+        masks (np.ndarray): 形状为 (T, H, W) 的掩码，非 0 表示需要填充
+        mode (str): "nearest" 或 "median"
+
+    返回:
+        Tuple[np.ndarray, np.ndarray]: (填充后的帧, 背景从未出现、仍需空间修复的像素 (T, H, W))
+    """
+    valid = masks == 0
+    filled = frames.copy()
+    if mode == "median":
+        stack = frames.astype(np.float32)
+        stack[~valid] = np.nan
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # 从未露出的像素全部为 NaN
+            background = np.nanmedian(stack, axis=0)
+        del stack
+        seen = valid.any(axis=0)
+        fill = ~valid & seen[None]
+        background = np.nan_to_num(background).round().astype(np.uint8)
+        filled[fill] = np.broadcast_to(background, frames.shape)[fill]
+        return filled, ~valid & ~seen[None]
+
+    # 对每个像素分别求向前、向后最近一次未被遮挡的帧号
+    length = len(frames)
+    dtype = np.int16 if length < np.iinfo(np.int16).max else np.int32
+    t = np.arange(length, dtype=dtype)[:, None, None]
+    prev = np.where(valid, t, dtype(-1))
+    np.maximum.accumulate(prev, axis=0, out=prev)
+    nxt = np.where(valid, t, dtype(length))[::-1]
+    nxt = np.minimum.accumulate(nxt, axis=0)[::-1]
+    has_prev, has_next = prev >= 0, nxt < length
+    use_prev = has_prev & (~has_next | (t - prev <= nxt - t))
+    source = np.where(use_prev, prev, np.where(has_next, nxt, t))
+    del prev, nxt
+    filled = np.take_along_axis(frames, source[..., None].astype(np.intp), axis=0)
+    return filled, ~has_prev & ~has_next
+
+
+def classical_inpaint(frames: np.ndarray, masks: np.ndarray, shots: List[Tuple[int, int]],
+                      force: bool = False) -> Tuple[np.ndarray, List[Tuple[int, int]]]:
+    """
+    对静止镜头用背景模型快速消除目标，其余镜头留给 E2FGVI。
+
+    每个含掩码的镜头先判定相机是否静止；静止时用其他帧露出的背景填充，背景从未出现的少量像素
+    用 cv2.inpaint 空间修复。相机运动或未出现的背景过多的镜头不处理，返回给调用方升级处理。
+
+    参数:
+        frames (np.ndarray): 形状为 (T, H, W, 3) 的 uint8 RGB 帧
+        masks (np.ndarray): 形状为 (T, H, W) 的掩码，非 0 表示需要修复
+        shots (List[Tuple[int, int]]): 镜头范围 [start, end)
+        force (bool): 为 True 时所有镜头都用快速方法处理，不升级
+
+    返回:
+        Tuple[np.ndarray, List[Tuple[int, int]]]: (修复后的帧, 需要升级为 E2FGVI 的镜头)
+    """
+    result = frames.copy()
+    escalated = []
+    for start, end in shots:
+        shot_frames, shot_masks = frames[start:end], masks[start:end]
+        masked = int(np.count_nonzero(shot_masks))
+        if masked == 0:
+            continue
+        if not force and not is_static(shot_frames, shot_masks):
+            logger.info(f"镜头 [{start}, {end}) 相机在运动，使用 E2FGVI")
+            escalated.append((start, end))
+            continue
+
+        filled, unseen = fill_from_background(shot_frames, shot_masks)
+        unseen_fraction = np.count_nonzero(unseen) / masked
+        if not force and unseen_fraction > CLASSICAL_MAX_UNSEEN:
+            logger.info(f"镜头 [{start}, {end}) 有 {unseen_fraction:.1%} 的背景从未出现，使用 E2FGVI")
+            escalated.append((start, end))
+            continue
+
+        # 背景从未出现的像素用周围像素空间修复
+        for idx in np.flatnonzero(unseen.reshape(len(unseen), -1).any(axis=1)):
+            filled[idx] = cv2.inpaint(filled[idx], unseen[idx].astype(np.uint8), SPATIAL_INPAINT_RADIUS,
+                                      cv2.INPAINT_TELEA)
+        result[start:end] = filled
+        logger.info(f"镜头 [{start}, {end}) 使用背景填充完成，空间修复像素占 {unseen_fraction:.1%}")
+    return result, escalated
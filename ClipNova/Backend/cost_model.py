@@ -0,0 +1,450 @@
+import os
+import json
+import time
+import tempfile
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple, List
+from media_ingest import probe_video
+
+try:
+    import psutil
+except ImportError:  # psutil 不可用时只记录耗时，不记录内存
+    psutil = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 历史耗时记录文件，服务重启后继续使用已学习到的模型。与帧存储、阶段缓存一样放在系统临时目录下，
+# 不随进程的当前工作目录变化
+COST_HISTORY_PATH = os.environ.get("CLIPNOVA_COST_HISTORY",
+                                   os.path.join(tempfile.gettempdir(), "clipnova_cost_history.json"))
+
+# 各操作的先验耗时模型：(固定开销秒数, 每单位耗时秒数)
+# 单位为“帧·百万像素”，即 帧数 × 宽 × 高 / 1e6
+DEFAULT_COST_PRIORS: Dict[str, Tuple[float, float]] = {
+    'llm': (2.0, 0.0),
+    'trim': (1.0, 0.004),
+    'add_transition': (1.0, 0.01),
+    'speed': (1.0, 0.01),
+    'add_text': (1.5, 0.015),
+    'concatenate': (1.5, 0.01),
+    'adjust_volume': (1.0, 0.008),
+    'rotate': (1.0, 0.02),
+    'crop': (1.0, 0.01),
+    'add_background_music': (1.5, 0.008),
+    'adjust_brightness': (1.0, 0.015)
+}
+DEFAULT_RENDER_PRIOR = (1.0, 0.01)
+
+# 各处理阶段的先验模型：(固定耗时秒, 每单位耗时秒, 固定峰值内存MB, 每单位峰值内存MB)
+DEFAULT_STAGE_PRIORS: Dict[str, Tuple[float, float, float, float]] = {
+    'vlm_locate': (10.0, 0.002, 50.0, 0.5),
+    'extract_frames': (0.5, 0.002, 20.0, 0.0),
+    'sam2_propagation': (5.0, 0.3, 1500.0, 2.0),
+    'mask_generation': (0.2, 0.01, 50.0, 0.2),
+    'inpainting': (10.0, 0.25, 2000.0, 3.0),
+    'write_videofile': (1.0, 0.01, 200.0, 0.05)
+}
+
+# 各操作依次经过的处理阶段，未列出的操作视为 MoviePy 渲染
+OPERATION_STAGES: Dict[str, List[str]] = {
+    'remove_objects': ['vlm_locate', 'extract_frames', 'sam2_propagation', 'mask_generation', 'inpainting'],
+    'segment': ['extract_frames', 'sam2_propagation'],
+    'refine': ['sam2_propagation'],  # 修正只传播到收敛为止，按整段传播估计为上限
+    'inpaint_segmented': ['mask_generation', 'inpainting'],
+    'llm': []
+}
+
+
+class OnlineLinearModel:
+    """
+    带遗忘因子的一元线性回归：y = intercept + slope * x。
+
+    使用先验作为伪观测值，随着真实样本增加逐渐被历史数据取代。
+    """
+
+    def __init__(self, intercept: float, slope: float, decay: float = 0.95, prior_weight: float = 2.0):
+        self.prior = (intercept, slope)
+        self.decay = decay
+        self.prior_weight = prior_weight
+        self.n = 0.0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sum_xx = 0.0
+        self.sum_xy = 0.0
+        self.samples = 0
+
+    def update(self, x: float, y: float) -> None:
+        """加入一个观测样本，旧样本按遗忘因子衰减。"""
+        self.n = self.n * self.decay + 1.0
+        self.sum_x = self.sum_x * self.decay + x
+        self.sum_y = self.sum_y * self.decay + y
+        self.sum_xx = self.sum_xx * self.decay + x * x
+        self.sum_xy = self.sum_xy * self.decay + x * y
+        self.samples += 1
+
+    def coefficients(self) -> Tuple[float, float]:
+        """返回当前的 (截距, 斜率)，样本不足以确定斜率时只修正截距。"""
+        intercept0, slope0 = self.prior
+        if self.n <= 0:
+            return intercept0, slope0
+
+        # 先验以两个伪观测点的形式加入：x=0 和 x=参考单位
+        ref_x = max(self.sum_x / self.n, 1.0)
+        w = self.prior_weight / 2.0
+        n = self.n + 2 * w
+        sum_x = self.sum_x + w * ref_x
+        sum_y = self.sum_y + w * intercept0 + w * (intercept0 + slope0 * ref_x)
+        sum_xx = self.sum_xx + w * ref_x * ref_x
+        sum_xy = self.sum_xy + w * ref_x * (intercept0 + slope0 * ref_x)
+
+        denominator = n * sum_xx - sum_x * sum_x
+        if abs(denominator) < 1e-9:
+            return sum_y / n, slope0
+        slope = max((n * sum_xy - sum_x * sum_y) / denominator, 0.0)
+        intercept = max((sum_y - slope * sum_x) / n, 0.0)
+        return intercept, slope
+
+    def predict(self, x: float) -> float:
+        """预测给定单位数对应的值。"""
+        intercept, slope = self.coefficients()
+        return intercept + slope * x
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "prior": list(self.prior),
+            "n": self.n, "sum_x": self.sum_x, "sum_y": self.sum_y,
+            "sum_xx": self.sum_xx, "sum_xy": self.sum_xy, "samples": self.samples
+        }
+
+    def load_dict(self, data: Dict[str, Any]) -> None:
+        for key in ("n", "sum_x", "sum_y", "sum_xx", "sum_xy", "samples"):
+            if key in data:
+                setattr(self, key, data[key])
+
+
+def get_video_features(video_path: Optional[str]) -> Dict[str, Any]:
+    """
+    读取用于估算任务开销的视频特征，结果按文件修改时间缓存。
+
+    参数:
+        video_path (Optional[str]): 视频文件路径。
+
+    返回:
+        Dict[str, Any]: 包含 duration、width、height、frame_count 和 units（帧·百万像素）的字典，
+        无法读取时各项为 0。
+    """
+    empty = {"duration": 0.0, "width": 0, "height": 0, "frame_count": 0, "fps": 0.0, "units": 0.0}
+    if not video_path or not os.path.exists(video_path):
+        return empty
+
+    key = (video_path, os.path.getmtime(video_path))
+    with _probe_cache_lock:
+        if key in _probe_cache:
+            return _probe_cache[key]
+    try:
+        info = probe_video(video_path)
+    except Exception as e:
+        logger.warning(f"读取视频元数据失败: {video_path}, 错误: {e}")
+        return empty
+
+    features = {
+        "duration": info["duration"],
+        "width": info["width"],
+        "height": info["height"],
+        "frame_count": info["frame_count"],
+        "fps": info["fps"],
+        "units": info["frame_count"] * info["width"] * info["height"] / 1e6
+    }
+    with _probe_cache_lock:
+        if len(_probe_cache) > 256:
+            _probe_cache.clear()
+        _probe_cache[key] = features
+    return features
+
+
+_probe_cache: Dict[Tuple[str, float], Dict[str, Any]] = {}
+_probe_cache_lock = threading.Lock()
+
+
+class StageCostModel:
+    """
+    分阶段的耗时与峰值内存模型。
+
+    每个阶段（抽帧、SAM2 传播、掩码生成、E2FGVI 修复、写出视频等）分别拟合
+    “固定开销 + 每帧·百万像素开销”的线性模型，每次阶段结束后在线更新。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.time_models: Dict[str, OnlineLinearModel] = {}
+        self.memory_models: Dict[str, OnlineLinearModel] = {}
+
+    def _get_models(self, stage: str) -> Tuple[OnlineLinearModel, OnlineLinearModel]:
+        if stage not in self.time_models:
+            t0, t1, m0, m1 = DEFAULT_STAGE_PRIORS.get(stage, (1.0, 0.01, 100.0, 0.1))
+            self.time_models[stage] = OnlineLinearModel(t0, t1)
+            self.memory_models[stage] = OnlineLinearModel(m0, m1)
+        return self.time_models[stage], self.memory_models[stage]
+
+    def predict(self, stage: str, units: float) -> Tuple[float, float]:
+        """返回阶段的 (预计耗时秒, 预计峰值内存MB)。"""
+        with self.lock:
+            time_model, memory_model = self._get_models(stage)
+            return time_model.predict(units), memory_model.predict(units)
+
+    def update(self, stage: str, units: float, elapsed: float, peak_memory_mb: Optional[float]) -> None:
+        """记录阶段的一次实际耗时与峰值内存。"""
+        with self.lock:
+            time_model, memory_model = self._get_models(stage)
+            time_model.update(units, elapsed)
+            if peak_memory_mb is not None:
+                memory_model.update(units, peak_memory_mb)
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                stage: {
+                    "time": self.time_models[stage].coefficients(),
+                    "memory_mb": self.memory_models[stage].coefficients(),
+                    "samples": self.time_models[stage].samples
+                }
+                for stage in self.time_models
+            }
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                stage: {"time": self.time_models[stage].to_dict(),
+                        "memory": self.memory_models[stage].to_dict()}
+                for stage in self.time_models
+            }
+
+    def load_dict(self, data: Dict[str, Any]) -> None:
+        with self.lock:
+            for stage, models in data.items():
+                time_model, memory_model = self._get_models(stage)
+                time_model.load_dict(models.get("time", {}))
+                memory_model.load_dict(models.get("memory", {}))
+
+
+class _MemorySampler(threading.Thread):
+    """
+    后台采样当前进程及其子进程的常驻内存，记录阶段内的峰值增量。
+
+    进程内存无法按任务区分，采样期间有其他线程的阶段在运行时（shared 为 True）峰值里混入了
+    其他任务的内存，这样的样本不用于更新内存模型。
+    """
+
+    def __init__(self, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.owner = threading.get_ident()
+        self.shared = False
+        self.baseline = self._rss()
+        self.peak = self.baseline
+
+    @staticmethod
+    def _rss() -> int:
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.peak = max(self.peak, self._rss())
+            except psutil.Error:
+                pass
+
+    def stop(self) -> float:
+        """停止采样并返回峰值内存增量（MB）。"""
+        self.stop_event.set()
+        self.join()
+        return max(self.peak - self.baseline, 0) / (1024 * 1024)
+
+
+class JobCostEstimator:
+    """根据操作类型、视频特征和历史耗时估计任务执行时间与峰值内存。"""
+
+    def __init__(self, history_path: Optional[str] = COST_HISTORY_PATH):
+        self.history_path = history_path
+        self.lock = threading.Lock()
+        self.models: Dict[str, OnlineLinearModel] = {}
+        self.stages = StageCostModel()
+        self._samplers = set()  # 正在运行的阶段的内存采样器
+        self._load()
+
+    def _get_model(self, op: str) -> OnlineLinearModel:
+        if op not in self.models:
+            intercept, slope = DEFAULT_COST_PRIORS.get(op, DEFAULT_RENDER_PRIOR)
+            self.models[op] = OnlineLinearModel(intercept, slope)
+        return self.models[op]
+
+    def estimate(self, op: str, video_path: Optional[str] = None) -> float:
+        """
+        估计任务耗时（秒）。
+
+        参数:
+            op (str): 操作类型，例如 'trim'、'remove_objects' 或 'llm'。
+            video_path (Optional[str]): 输入视频路径。
+
+        返回:
+            float: 预计耗时秒数。
+        """
+        return self.predict(op, video_path)["wall_time"]
+
+    def predict(self, op: str, video_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        预测任务的耗时与峰值内存。目标消除等多阶段操作按阶段模型累加，
+        MoviePy 渲染操作使用按操作拟合的整体模型。
+
+        参数:
+            op (str): 操作类型。
+            video_path (Optional[str]): 输入视频路径。
+
+        返回:
+            Dict[str, Any]: 包含 wall_time（秒）、peak_memory_mb、video（视频特征）
+            和 stages（各阶段预测）的字典。
+        """
+        features = get_video_features(video_path)
+        units = features["units"]
+        stages = OPERATION_STAGES.get(op, ['write_videofile'])
+
+        stage_predictions = []
+        for stage in stages:
+            stage_time, stage_memory = self.stages.predict(stage, units)
+            stage_predictions.append({"stage": stage, "seconds": stage_time, "peak_memory_mb": stage_memory})
+
+        if op in OPERATION_STAGES and stages:
+            wall_time = sum(p["seconds"] for p in stage_predictions)
+        else:
+            with self.lock:
+                wall_time = self._get_model(op).predict(units)
+
+        return {
+            "op": op,
+            "wall_time": wall_time,
+            "peak_memory_mb": max((p["peak_memory_mb"] for p in stage_predictions), default=0.0),
+            "video": features,
+            "stages": stage_predictions
+        }
+
+    @contextmanager
+    def record_stage(self, stage: str, video_path: Optional[str] = None, units: Optional[float] = None):
+        """
+        记录一个处理阶段的耗时与峰值内存，阶段正常结束后更新阶段模型。
+
+        内存只在阶段独占进程时记录：与其他线程的阶段（通常是并发的其他任务）有重叠时，
+        只更新耗时模型。同一线程内嵌套的阶段不算重叠。
+
+        参数:
+            stage (str): 阶段名称，例如 'extract_frames'、'sam2_propagation'。
+            video_path (Optional[str]): 阶段处理的视频路径，用于计算单位数。
+            units (Optional[float]): 直接指定单位数（帧·百万像素），优先于 video_path。
+        """
+        if units is None:
+            units = get_video_features(video_path)["units"]
+        sampler = None
+        if psutil is not None:
+            sampler = _MemorySampler()
+            with self.lock:
+                for other in self._samplers:
+                    if other.owner != sampler.owner:
+                        other.shared = sampler.shared = True
+                self._samplers.add(sampler)
+            sampler.start()
+        start = time.monotonic()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            peak_memory = None
+            if sampler is not None:
+                peak_memory = sampler.stop()
+                with self.lock:
+                    self._samplers.discard(sampler)
+                if sampler.shared:
+                    peak_memory = None
+            if not failed:
+                self.stages.update(stage, units, elapsed, peak_memory)
+                with self.lock:
+                    self._save()
+                logger.info(f"阶段 {stage} 耗时 {elapsed:.2f} 秒"
+                            + (f"，峰值内存增量 {peak_memory:.0f}MB" if peak_memory is not None else ""))
+
+    def record_sample(self, stage: str, units: float, elapsed: float) -> None:
+        """
+        记录一个阶段的耗时样本，用于分散在其他阶段中完成、无法用 record_stage 包住的工作
+        （例如按需解码的帧存储分块），只更新耗时模型。
+
+        参数:
+            stage (str): 阶段名称。
+            units (float): 实际处理的单位数（帧·百万像素）。
+            elapsed (float): 实际耗时（秒）。
+        """
+        self.stages.update(stage, units, elapsed, None)
+        with self.lock:
+            self._save()
+        logger.info(f"阶段 {stage} 耗时 {elapsed:.2f} 秒")
+
+    def record(self, op: str, video_path: Optional[str], elapsed: float) -> None:
+        """记录一次实际耗时并更新操作模型（多阶段操作由各阶段自行记录）。"""
+        if OPERATION_STAGES.get(op):
+            return
+        units = get_video_features(video_path)["units"] if video_path else 0.0
+        with self.lock:
+            self._get_model(op).update(units, elapsed)
+            self._save()
+
+    def summary(self) -> Dict[str, Any]:
+        """返回各操作和各阶段当前的模型系数与样本数。"""
+        with self.lock:
+            ops = {
+                op: {"intercept": model.coefficients()[0], "slope": model.coefficients()[1],
+                     "samples": model.samples}
+                for op, model in self.models.items()
+            }
+        return {"ops": ops, "stages": self.stages.summary()}
+
+    def _load(self) -> None:
+        if not self.history_path or not os.path.exists(self.history_path):
+            return
+        try:
+            with open(self.history_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for op, model_data in data.get("ops", {}).items():
+                self._get_model(op).load_dict(model_data)
+            self.stages.load_dict(data.get("stages", {}))
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取历史耗时记录失败: {e}")
+
+    def _save(self) -> None:
+        if not self.history_path:
+            return
+        try:
+            data = {
+                "ops": {op: model.to_dict() for op, model in self.models.items()},
+                "stages": self.stages.to_dict()
+            }
+            with open(self.history_path + ".part", "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(self.history_path + ".part", self.history_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"保存历史耗时记录失败: {e}")
+
+
+# 全局开销估计器实例
+cost_estimator = JobCostEstimator()
@@ -0,0 +1,354 @@
+import os
+import types
+import hashlib
+import logging
+import queue
+import shutil
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, Optional, List
+import torch
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# SAM2 图像特征磁盘缓存配置，可通过环境变量覆盖
+FEATURE_CACHE_ENABLED = os.environ.get("SAM2_FEATURE_CACHE", "1") != "0"
+FEATURE_CACHE_DIR = os.environ.get("SAM2_FEATURE_CACHE_DIR", "./feature_cache")
+FEATURE_CACHE_MAX_MB = int(os.environ.get("SAM2_FEATURE_CACHE_MAX_MB", "4096"))
+FEATURE_CACHE_WRITE_QUEUE = int(os.environ.get("SAM2_FEATURE_CACHE_WRITE_QUEUE", "32"))  # 后台写队列长度（帧）
+FEATURE_CACHE_DTYPE = torch.float16  # 特征以半精度保存，读取时恢复为原精度
+
+# 内容哈希只读取文件头、中、尾各一段，避免对大文件完整计算哈希
+_HASH_CHUNK = 4 * 1024 * 1024
+
+
+def video_content_hash(path: str) -> str:
+    """
+    计算视频内容哈希：文件大小加上头、中、尾各 4MB 数据的 SHA1。
+
+    文件被覆盖（内容变化）后哈希随之变化，旧缓存自然失效。结果按 (路径, 大小, 修改时间) 缓存在内存中。
+    """
+    stat = os.stat(path)
+    return _content_hash(path, stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=256)
+def _content_hash(path: str, size: int, mtime_ns: int) -> str:
+    sha1 = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in sorted({0, max(0, size // 2 - _HASH_CHUNK // 2), max(0, size - _HASH_CHUNK)}):
+            f.seek(offset)
+            sha1.update(f.read(_HASH_CHUNK))
+    return sha1.hexdigest()
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def feature_variant(working_scale: float, profile_name: str) -> str:
+    """返回影响特征数值的分割配置描述（工作分辨率、帧来源和推理配置），作为 make_key 的 variant。"""
+    return f"scale={working_scale}|frames=raw|profile={profile_name}"
+
+
+class FeatureCache:
+    """
+    SAM2 图像编码器输出的磁盘缓存。
+
+    每帧的特征按 (视频内容哈希, 检查点, 分割配置, 帧索引) 保存为一个文件，位置编码对同一视频的
+    所有帧相同，只保存一份。淘汰以视频（缓存键目录）为单位按最近最少使用的顺序进行：逐帧淘汰时
+    顺序扫描长视频会不断淘汰即将用到的帧，命中率为零。预计放不进上限的视频不缓存。
+    写入由后台线程完成，不阻塞传播；写队列满时丢弃该帧的缓存。
+    同一视频换一个提示重新分割时，图像编码器不再重复计算，只需要掩码解码和记忆注意力。
+    """
+
+    def __init__(self, root: str = FEATURE_CACHE_DIR, max_bytes: int = FEATURE_CACHE_MAX_MB * 1024 * 1024,
+                 enabled: bool = FEATURE_CACHE_ENABLED, write_queue: int = FEATURE_CACHE_WRITE_QUEUE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, int]" = OrderedDict()  # 缓存键 -> 字节数，末尾为最近使用
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dropped = 0
+        self._loaded = False
+        self._expected_frames: Dict[str, int] = {}  # 缓存键 -> 视频帧数，用于预估视频特征总大小
+        self._oversized: set = set()  # 预计超过上限而不缓存的键
+        self._pos_queued: set = set()  # 已提交位置编码的键
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, write_queue))
+        self._writer: Optional[threading.Thread] = None
+
+    def _load_index(self) -> None:
+        """首次使用时扫描磁盘上已有的缓存目录，按最近修改时间重建 LRU 顺序。"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.isdir(self.root):
+            return
+        keys = []
+        for key in os.listdir(self.root):
+            folder = os.path.join(self.root, key)
+            if not os.path.isdir(folder):
+                continue
+            size, mtime = 0, 0.0
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(".part"):
+                    # 上次进程退出时未写完的文件
+                    _remove_file(path)
+                    continue
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime)
+            keys.append((mtime, key, size))
+        for _, key, size in sorted(keys):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    def make_key(self, video_path: str, checkpoint: str, variant: str = "") -> str:
+        """
+        返回视频在缓存中的目录名。
+
+        参数:
+            video_path (str): 源视频路径。
+            checkpoint (str): 模型检查点路径。
+            variant (str): 影响特征数值的其他配置，例如工作分辨率和推理配置名称。
+        """
+        parts = [video_content_hash(video_path), os.path.splitext(os.path.basename(checkpoint))[0]]
+        if variant:
+            parts.append(hashlib.sha1(variant.encode()).hexdigest()[:8])
+        return "_".join(parts)
+
+    def _frame_path(self, key: str, frame_idx: int) -> str:
+        return os.path.join(self.root, key, f"{frame_idx:05d}.pt")
+
+    def _touch(self, key: str) -> None:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+        try:
+            os.utime(os.path.join(self.root, key))
+        except OSError:
+            pass
+
+    def get(self, key: str, frame_idx: int) -> Optional[Dict[str, Any]]:
+        """读取一帧的 backbone 输出，不存在时返回 None。"""
+        path = self._frame_path(key, frame_idx)
+        pos_path = os.path.join(self.root, key, "pos_enc.pt")
+        with self.lock:
+            self._load_index()
+        if not (os.path.exists(path) and os.path.exists(pos_path)):
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            frame = torch.load(path, map_location="cpu")
+            pos_enc = torch.load(pos_path, map_location="cpu")
+        except Exception as e:
+            logger.warning(f"读取特征缓存失败，将重新计算: {path}, 错误: {e}")
+            with self.lock:
+                self.misses += 1
+            return None
+        self._touch(key)
+        with self.lock:
+            self.hits += 1
+
+        dtype = getattr(torch, frame["dtype"])
+        backbone_fpn = [t.to(dtype) for t in frame["backbone_fpn"]]
+        return {
+            "vision_features": backbone_fpn[-1],
+            "vision_pos_enc": [t.to(dtype) for t in pos_enc],
+            "backbone_fpn": backbone_fpn
+        }
+
+    def put(self, key: str, frame_idx: int, backbone_out: Dict[str, Any]) -> None:
+        """
+        提交一帧的 backbone 输出，由后台线程写入磁盘（vision_features 与 backbone_fpn 最后一层相同，不重复保存）。
+
+        调用线程只把特征复制为 CPU 半精度张量；视频预计超过缓存上限或写队列已满时直接放弃。
+        """
+        with self.lock:
+            if key in self._oversized:
+                return
+            need_pos = key not in self._pos_queued
+
+        fpn = backbone_out["backbone_fpn"]
+        frame = {
+            "dtype": str(fpn[-1].dtype).replace("torch.", ""),
+            "backbone_fpn": [t.detach().to("cpu", FEATURE_CACHE_DTYPE) for t in fpn]
+        }
+        pos_enc = None
+        if need_pos:
+            pos_enc = [t.detach().to("cpu", FEATURE_CACHE_DTYPE) for t in backbone_out["vision_pos_enc"]]
+
+        frame_bytes = sum(t.numel() * t.element_size() for t in frame["backbone_fpn"])
+        with self.lock:
+            expected = self._expected_frames.get(key)
+            if expected and frame_bytes * expected > self.max_bytes:
+                self._oversized.add(key)
+                logger.info(f"视频特征预计 {frame_bytes * expected / 1024 ** 2:.0f}MB，超过缓存上限，不缓存: {key}")
+                return
+            try:
+                self._queue.put_nowait((key, frame_idx, frame, pos_enc))
+            except queue.Full:
+                self.dropped += 1
+                return
+            if need_pos:
+                self._pos_queued.add(key)
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="feature-cache-writer", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self) -> None:
+        """后台写线程：依次保存队列中的特征并更新占用。"""
+        while True:
+            key, frame_idx, frame, pos_enc = self._queue.get()
+            try:
+                self._write(key, frame_idx, frame, pos_enc)
+            except Exception as e:
+                logger.warning(f"写入特征缓存失败: {e}")
+                if pos_enc is not None:
+                    with self.lock:
+                        self._pos_queued.discard(key)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, key: str, frame_idx: int, frame: Dict[str, Any], pos_enc: Optional[List[torch.Tensor]]) -> None:
+        # 先读取磁盘上已有的索引，之后写入的文件不会在首次扫描时被重复计入
+        with self.lock:
+            self._load_index()
+        folder = os.path.join(self.root, key)
+        os.makedirs(folder, exist_ok=True)
+        written = 0
+        pos_path = os.path.join(folder, "pos_enc.pt")
+        if pos_enc is not None and not os.path.exists(pos_path):
+            written += self._atomic_save(pos_enc, pos_path)
+        path = self._frame_path(key, frame_idx)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        written += self._atomic_save(frame, path) - previous
+
+        with self.lock:
+            self.entries[key] = self.entries.get(key, 0) + written
+            self.entries.move_to_end(key)
+            self.total_bytes += written
+        self._evict()
+
+    def flush(self) -> None:
+        """等待已提交的特征全部写入磁盘。"""
+        self._queue.join()
+
+    @staticmethod
+    def _atomic_save(obj, path: str) -> int:
+        part_path = path + ".part"
+        torch.save(obj, part_path)
+        os.replace(part_path, path)
+        return os.path.getsize(path)
+
+    def _evict(self) -> None:
+        """缓存超过上限时删除最久未用的视频目录，最近写入的视频保留。"""
+        victims: List[str] = []
+        with self.lock:
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                key, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                self.evictions += 1
+                self._pos_queued.discard(key)
+                victims.append(key)
+        for key in victims:
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中率和占用空间。"""
+        with self.lock:
+            self._load_index()
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "pending_writes": self._queue.qsize(),
+                "dropped": self.dropped,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+    def install(self, predictor) -> None:
+        """
+        在预测器实例上包装 _get_image_feature，使其先查询磁盘缓存。
+
+        只有通过 attach 设置了缓存键的推理状态才会使用缓存，其余调用保持原行为。重复调用不会重复包装。
+        """
+        if not self.enabled or getattr(predictor, "_feature_cache_installed", False):
+            return
+        original = predictor._get_image_feature
+        cache = self
+
+        def _get_image_feature(self, inference_state, frame_idx, batch_size):
+            key = inference_state.get("feature_cache_key")
+            if key is None or frame_idx in inference_state["cached_features"]:
+                return original(inference_state, frame_idx, batch_size)
+
+            # 分窗口或关键帧模式下推理状态只包含部分帧，需要换算为全局帧索引
+            index_map = inference_state.get("feature_cache_frames")
+            global_idx = index_map[frame_idx] if index_map is not None else frame_idx
+
+            cached = cache.get(key, global_idx)
+            if cached is not None:
+                # 命中时把特征放入推理状态自带的单帧缓存，原方法会直接使用而不运行图像编码器
+                device = inference_state["device"]
+                image = inference_state["images"][frame_idx].to(device).float().unsqueeze(0)
+                backbone_fpn = [t.to(device) for t in cached["backbone_fpn"]]
+                inference_state["cached_features"] = {frame_idx: (image, {
+                    "vision_features": backbone_fpn[-1],
+                    "vision_pos_enc": [t.to(device) for t in cached["vision_pos_enc"]],
+                    "backbone_fpn": backbone_fpn
+                })}
+                return original(inference_state, frame_idx, batch_size)
+
+            result = original(inference_state, frame_idx, batch_size)
+            _, backbone_out = inference_state["cached_features"].get(frame_idx, (None, None))
+            if backbone_out is not None:
+                try:
+                    cache.put(key, global_idx, backbone_out)
+                except OSError as e:
+                    logger.warning(f"写入特征缓存失败: {e}")
+            return result
+
+        predictor._get_image_feature = types.MethodType(_get_image_feature, predictor)
+        predictor._feature_cache_installed = True
+
+    def attach(self, inference_state: dict, key: str, frame_indices: Optional[List[int]] = None,
+               num_frames: Optional[int] = None) -> None:
+        """
+        为推理状态设置缓存键。
+
+        参数:
+            inference_state (dict): SAM2 推理状态。
+            key (str): make_key 返回的缓存键。
+            frame_indices (Optional[List[int]]): 推理状态中各帧对应的全局帧索引，为 None 表示一一对应。
+            num_frames (Optional[int]): 视频总帧数，用于预估整段视频的特征大小，超过缓存上限时不缓存。
+        """
+        if self.enabled and key:
+            inference_state["feature_cache_key"] = key
+            inference_state["feature_cache_frames"] = frame_indices
+            if num_frames:
+                with self.lock:
+                    self._expected_frames[key] = num_frames
+
+
+# 全局特征缓存实例
+feature_cache = FeatureCache()
@@ -0,0 +1,315 @@
+import os
+import logging
+import threading
+import subprocess
+from collections import deque
+from typing import Iterator, Optional, Sequence, Tuple
+import numpy as np
+from media_ingest import probe_video
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# FFmpeg 可执行文件，可通过环境变量覆盖
+FFMPEG_BINARY = os.environ.get("CLIPNOVA_FFMPEG", "ffmpeg")
+# 出错时随异常返回的 stderr 行数
+STDERR_TAIL_LINES = 50
+# 等待 FFmpeg 完成编码并退出的最长秒数
+FFMPEG_CLOSE_TIMEOUT = float(os.environ.get("CLIPNOVA_FFMPEG_CLOSE_TIMEOUT", "600"))
+
+
+class _StderrDrain:
+    """
+    在后台线程中持续读取 FFmpeg 的 stderr，只保留最后若干行。
+
+    stderr 管道写满后 FFmpeg 会阻塞，而读写帧的主线程不会去读 stderr，必须单独排空。
+    """
+
+    def __init__(self, stream, max_lines: int = STDERR_TAIL_LINES):
+        self.lines = deque(maxlen=max_lines)
+        self._thread = threading.Thread(target=self._run, args=(stream,), name="ffmpeg-stderr", daemon=True)
+        self._thread.start()
+
+    def _run(self, stream) -> None:
+        for line in iter(stream.readline, b""):
+            self.lines.append(line.decode("utf-8", errors="replace").rstrip())
+        stream.close()
+
+    def join(self, timeout: float = 5.0) -> str:
+        self._thread.join(timeout)
+        return "\n".join(self.lines)
+
+
+class _FFmpegProcess:
+    """FFmpeg 子进程的公共部分：启动、排空 stderr、结束时检查退出码并确保进程被回收。"""
+
+    def __init__(self, command: Sequence[str]):
+        self.command = list(command)
+        self.process: Optional[subprocess.Popen] = None
+        self._stderr: Optional[_StderrDrain] = None
+
+    def _start(self, stdin=None, stdout=None) -> None:
+        self.process = subprocess.Popen(self.command, stdin=stdin, stdout=stdout, stderr=subprocess.PIPE,
+                                        bufsize=0)
+        self._stderr = _StderrDrain(self.process.stderr)
+
+    def _error(self, returncode: int) -> subprocess.CalledProcessError:
+        stderr = self._stderr.join() if self._stderr is not None else ""
+        return subprocess.CalledProcessError(returncode, self.command, stderr=stderr)
+
+    def _wait(self, timeout: Optional[float] = FFMPEG_CLOSE_TIMEOUT) -> None:
+        """等待进程退出，退出码非 0 时抛出 subprocess.CalledProcessError（stderr 为最后若干行输出）。"""
+        try:
+            returncode = self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.kill()
+            raise
+        if returncode != 0:
+            raise self._error(returncode)
+        self._stderr.join()
+
+    def kill(self) -> None:
+        """立即结束进程并回收，用于出错或提前退出。"""
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        process.kill()
+        for stream in (process.stdin, process.stdout):
+            if stream is not None:
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+        process.wait()
+        if self._stderr is not None:
+            self._stderr.join()
+
+
+class FFmpegReader(_FFmpegProcess):
+    """
+    通过 rawvideo 管道逐帧读取视频，帧为 (H, W, 3) 的 uint8 BGR 数组，不经过任何中间文件。
+
+    管道本身提供背压：调用方不读取时 FFmpeg 在写满管道后暂停解码。
+
+    用法:
+        with FFmpegReader(video_path) as reader:
+            for frame in reader:
+                ...
+    """
+
+    def __init__(self, video_path: str, size: Optional[Tuple[int, int]] = None, input_args: Sequence[str] = ()):
+        """
+        参数:
+            video_path (str): 输入视频路径。
+            size (Optional[Tuple[int, int]]): 输出帧尺寸 (宽, 高)，为 None 时用 ffprobe 读取显示尺寸
+                （FFmpeg 会自动应用旋转）。
+            input_args (Sequence[str]): 放在 -i 之前的额外参数，例如 ['-ss', '10']。
+        """
+        if size is None:
+            info = probe_video(video_path)
+            size = (info["width"], info["height"])
+        self.video_path = video_path
+        self.width, self.height = size
+        self.frame_bytes = self.width * self.height * 3
+        command = [FFMPEG_BINARY, '-v', 'error', *input_args, '-i', video_path, '-map', '0:v:0', '-an', '-sn',
+                   # 保持解码出的每一帧，不按输出帧率复制或丢弃，帧序号与逐帧解码一致
+                   '-vsync', 'passthrough',
+                   '-vf', f"scale={self.width}:{self.height}",
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+        super().__init__(command)
+        self.frames_read = 0
+
+    def __enter__(self) -> "FFmpegReader":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close(check=exc_type is None)
+
+    def open(self) -> None:
+        """启动解码进程（不使用 with 时调用，使用完后调用 close）。"""
+        self._start(stdout=subprocess.PIPE)
+
+    def read_into(self, out: np.ndarray) -> bool:
+        """
+        把下一帧直接读入 out（形状为 (H, W, 3) 的 C 连续 uint8 数组，可以是内存映射），
+        视频结束时返回 False。
+
+        异常:
+            subprocess.CalledProcessError: 如果 FFmpeg 解码失败。
+            ValueError: 如果 out 的形状或类型不符。
+        """
+        if out.shape != (self.height, self.width, 3) or out.dtype != np.uint8 or not out.flags.c_contiguous:
+            raise ValueError(f"帧缓冲区应为 ({self.height}, {self.width}, 3) 的连续 uint8 数组")
+        view = memoryview(out).cast("B")
+        filled = 0
+        while filled < self.frame_bytes:
+            count = self.process.stdout.readinto(view[filled:])
+            if not count:
+                break
+            filled += count
+        if filled == 0:
+            return False
+        if filled < self.frame_bytes:
+            # 管道在帧中间结束：FFmpeg 异常退出
+            self.kill()
+            raise self._error(self.process.returncode)
+        self.frames_read += 1
+        return True
+
+    def read(self) -> Optional[np.ndarray]:
+        """读取下一帧（新分配的数组），视频结束时返回 None。"""
+        frame = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        return frame if self.read_into(frame) else None
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def close(self, check: bool = True) -> None:
+        """
+        关闭管道并回收进程。check 为 True 且已读到结尾时检查 FFmpeg 的退出码；
+        提前关闭（没有读完）时直接结束进程。
+        """
+        if self.process is None:
+            return
+        if check and self.process.stdout.read(1) == b"":
+            self.process.stdout.close()
+            self._wait()
+        else:
+            self.kill()
+
+
+class FFmpegWriter(_FFmpegProcess):
+    """
+    通过 rawvideo 管道把 (H, W, 3) 的 uint8 BGR 帧直接编码为视频，可选地从源视频复制音轨。
+
+    写入先进入临时文件，正常关闭后才原子替换为目标文件，中途失败不会留下不完整的视频。
+    管道写满时 write 阻塞，编码速度自然约束生成帧的速度。
+
+    用法:
+        with FFmpegWriter(output_path, (width, height), fps, audio_from=video_path) as writer:
+            for frame in frames:
+                writer.write(frame)
+    """
+
+    def __init__(self, output_path: str, size: Tuple[int, int], fps: float, codec: str = 'libx264',
+                 pix_fmt: str = 'yuv420p', crf: Optional[int] = 18, preset: Optional[str] = 'veryfast',
+                 audio_from: Optional[str] = None, audio_codec: str = 'copy'):
+        """
+        参数:
+            output_path (str): 输出视频路径。
+            size (Tuple[int, int]): 帧尺寸 (宽, 高)。
+            fps (float): 帧率。
+            codec (str): 视频编码器，默认为 'libx264'。
+            pix_fmt (str): 输出像素格式，默认为 'yuv420p'（奇数尺寸会在右侧和底部补齐 1 像素）。
+            crf (Optional[int]): 编码质量，为 None 时使用编码器默认值。
+            preset (Optional[str]): 编码速度预设，为 None 时使用编码器默认值。
+            audio_from (Optional[str]): 提供时复制该视频的第一条音轨（没有音轨时忽略），时长以较短者为准。
+            audio_codec (str): 音频编码方式，默认直接复制。
+        """
+        self.output_path = output_path
+        self.width, self.height = size
+        root, ext = os.path.splitext(output_path)
+        self.part_path = f"{root}.part{ext or '.mp4'}"
+        command = [FFMPEG_BINARY, '-v', 'error', '-y',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{self.width}x{self.height}",
+                   '-framerate', str(fps or 30), '-i', '-']
+        if audio_from:
+            command += ['-i', audio_from, '-map', '0:v:0', '-map', '1:a:0?', '-c:a', audio_codec, '-shortest']
+        if pix_fmt == 'yuv420p' and (self.width % 2 or self.height % 2):
+            command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+        command += ['-c:v', codec, '-pix_fmt', pix_fmt]
+        if crf is not None:
+            command += ['-crf', str(crf)]
+        if preset is not None:
+            command += ['-preset', preset]
+        if ext.lower() in ('.mp4', '.mov', '.m4v'):
+            command += ['-movflags', '+faststart']
+        command.append(self.part_path)
+        super().__init__(command)
+        self.frames_written = 0
+
+    def __enter__(self) -> "FFmpegWriter":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self) -> None:
+        out_dir = os.path.dirname(self.output_path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        self._start(stdin=subprocess.PIPE)
+
+    def write(self, frame: np.ndarray) -> None:
+        """
+        写入一帧，管道已满时阻塞直到 FFmpeg 消费。
+
+        异常:
+            ValueError: 如果帧的形状或类型不符。
+            subprocess.CalledProcessError: 如果 FFmpeg 已经异常退出。
+        """
+        if frame.shape != (self.height, self.width, 3) or frame.dtype != np.uint8:
+            raise ValueError(f"帧应为 ({self.height}, {self.width}, 3) 的 uint8 数组，实际为 {frame.shape} {frame.dtype}")
+        try:
+            self.process.stdin.write(memoryview(np.ascontiguousarray(frame)).cast("B"))
+        except (BrokenPipeError, ValueError):
+            self.kill()
+            raise self._error(self.process.returncode)
+        self.frames_written += 1
+
+    def close(self) -> None:
+        """结束输入并等待编码完成，成功后把临时文件替换为输出文件。"""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self._wait()
+        except BaseException:
+            self.abort()
+            raise
+        os.replace(self.part_path, self.output_path)
+
+    def abort(self) -> None:
+        """结束进程并删除未完成的输出。"""
+        self.kill()
+        if os.path.exists(self.part_path):
+            try:
+                os.remove(self.part_path)
+            except OSError as e:
+                logger.warning(f"删除未完成的视频失败: {self.part_path} ({e})")
+
+
+def mux_audio(video_path: str, audio_from: str, output_path: str, audio_codec: str = 'copy') -> None:
+    """
+    把 video_path 的视频流（不重新编码）与 audio_from 的第一条音轨合并为 output_path，
+    audio_from 没有音轨时只复制视频。先写入临时文件，成功后才原子替换为输出文件。
+
+    异常:
+        subprocess.CalledProcessError: 如果 FFmpeg 执行失败。
+    """
+    root, ext = os.path.splitext(output_path)
+    part_path = f"{root}.part{ext or '.mp4'}"
+    command = [FFMPEG_BINARY, '-v', 'error', '-y', '-i', video_path, '-i', audio_from,
+               '-map', '0:v:0', '-map', '1:a:0?', '-c:v', 'copy', '-c:a', audio_codec, '-shortest']
+    if ext.lower() in ('.mp4', '.mov', '.m4v'):
+        command += ['-movflags', '+faststart']
+    command.append(part_path)
+    process = _FFmpegProcess(command)
+    try:
+        process._start(stdin=subprocess.DEVNULL)
+        process._wait()
+    except BaseException:
+        process.kill()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    os.replace(part_path, output_path)
@@ -0,0 +1,579 @@
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+import numpy as np
+from feature_cache import video_content_hash
+from media_ingest import probe_video
+from ffmpeg_io import FFmpegReader
+from workspace import WorkspaceQuotaError
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 解码帧存储配置，可通过环境变量覆盖。帧按固定帧数的分块在第一次被访问时解码，保存为原始 uint8 数组，
+# 各处理阶段以内存映射方式共享；视频不会整段解码到磁盘，所有视频的分块总大小超过上限时淘汰最久未用的分块，
+# 任何长度的视频都只占用上限以内的磁盘空间
+FRAME_STORE_DIR = os.environ.get("CLIPNOVA_FRAME_STORE_DIR",
+                                 os.path.join(tempfile.gettempdir(), "clipnova_frames"))
+FRAME_STORE_MAX_MB = int(os.environ.get("CLIPNOVA_FRAME_STORE_MAX_MB", "20480"))
+FRAME_STORE_CHUNK_FRAMES = int(os.environ.get("CLIPNOVA_FRAME_STORE_CHUNK_FRAMES", "32"))
+# 解码后磁盘至少保留的剩余空间，以及中断的临时文件多久未修改后视为遗留
+FRAME_STORE_MIN_FREE_MB = int(os.environ.get("CLIPNOVA_FRAME_STORE_MIN_FREE_MB", "1024"))
+FRAME_STORE_TMP_STALE_SECONDS = float(os.environ.get("CLIPNOVA_FRAME_STORE_TMP_STALE_SECONDS", "3600"))
+# 解码进程向前跳过的帧数不超过该值时继续顺序读取，否则按时间戳重新定位
+FRAME_STORE_MAX_SKIP = int(os.environ.get("CLIPNOVA_FRAME_STORE_MAX_SKIP", "64"))
+
+META_FILE = "meta.json"
+LEGACY_FRAMES_FILE = "frames.raw"  # 旧版整段解码的帧数据
+
+
+def _chunk_name(chunk_idx: int) -> str:
+    return f"chunk_{chunk_idx:06d}.raw"
+
+
+def _parse_chunk_name(name: str) -> Optional[int]:
+    if not (name.startswith("chunk_") and name.endswith(".raw")):
+        return None
+    try:
+        return int(name[len("chunk_"):-len(".raw")])
+    except ValueError:
+        return None
+
+
+def _seek_args(frame_idx: int, fps: float, start_time: float = 0.0) -> List[str]:
+    """
+    返回让 FFmpeg 从第 frame_idx 帧开始输出的输入参数（只适用于恒定帧率的视频）。
+
+    定位到该帧与前一帧之间的时间点：FFmpeg 从之前的关键帧开始解码并丢弃该时间点之前的帧，
+    输出的第一帧就是第 frame_idx 帧。
+    """
+    if frame_idx <= 0 or not fps:
+        return []
+    return ['-ss', f"{start_time + (frame_idx - 0.5) / fps:.6f}"]
+
+
+class FrameStore:
+    """
+    一个视频的帧，按分块在第一次访问时解码。
+
+    每 chunk_frames 帧为一个分块，保存为 (N, H, W, 3) 的 uint8 BGR 原始数组并以只读内存映射方式打开：
+    frame 返回的是 NumPy 视图，不复制数据，多个阶段（大模型检测、SAM2、掩码渲染、目标消除）共享同一份页缓存。
+    帧数、尺寸和帧率来自 ffprobe 元数据，打开帧存储不需要解码。
+
+    解码进程在分块之间保持打开，顺序访问时整段视频只启动一次 FFmpeg；随机访问时按时间戳定位到分块开头。
+    可变帧率的视频无法按时间戳准确定位，从头顺序解码。
+
+    用法:
+        with frame_stores.acquire(video_path) as frames:
+            first = frames.frame(0)                      # (H, W, 3) 视图
+            for frame in frames.iter_frames(10, 20):     # 顺序读取，不写入分块
+                ...
+    """
+
+    def __init__(self, root: str, cache: Optional["FrameStoreCache"] = None):
+        """
+        打开帧存储目录。
+
+        参数:
+            root (str): 帧存储目录，其中的元数据由 FrameStoreCache 写入。
+            cache (Optional[FrameStoreCache]): 所属的缓存，用于分块的空间检查和淘汰；为 None 时不限制。
+
+        异常:
+            FileNotFoundError: 如果目录中没有元数据。
+        """
+        self.root = root
+        self.key = os.path.basename(root)
+        self.cache = cache
+        with open(os.path.join(root, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.video_path = meta["video_path"]
+        self.fps = meta["fps"]
+        self.num_frames = meta["frames"]
+        self.width = meta["width"]
+        self.height = meta["height"]
+        self.chunk_frames = meta["chunk_frames"]
+        self.start_time = meta.get("start_time", 0.0)
+        self.is_vfr = meta.get("is_vfr", False)
+        self.lock = threading.Lock()               # 保护 _maps
+        self._decode_lock = threading.RLock()      # 解码进程同一时间只给一个线程使用
+        self._maps: Dict[int, np.memmap] = {}      # 分块索引 -> 内存映射
+        self._reader: Optional[FFmpegReader] = None
+        self._reader_pos = 0                       # 解码进程输出的下一帧的帧号
+        self._last_touched = -1
+        self.decoded_frames = 0                    # 累计解码的帧数与耗时，供开销模型记录解码阶段
+        self.decode_seconds = 0.0
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """画面尺寸 (宽, 高)。"""
+        return self.width, self.height
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.width * self.height * 3
+
+    def __len__(self) -> int:
+        return self.num_frames
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return np.stack([self.frame(i) for i in range(*index.indices(self.num_frames))])
+        return self.frame(index + self.num_frames if index < 0 else index)
+
+    def chunk_range(self, chunk_idx: int) -> Tuple[int, int]:
+        """分块包含的帧范围 [start, end)。"""
+        start = chunk_idx * self.chunk_frames
+        return start, min(self.num_frames, start + self.chunk_frames)
+
+    def chunk_bytes(self, chunk_idx: int) -> int:
+        start, end = self.chunk_range(chunk_idx)
+        return max(0, end - start) * self.frame_bytes
+
+    def _chunk_path(self, chunk_idx: int) -> str:
+        return os.path.join(self.root, _chunk_name(chunk_idx))
+
+    def has_chunk(self, chunk_idx: int) -> bool:
+        """分块是否已经解码（在磁盘上）。"""
+        with self.lock:
+            if chunk_idx in self._maps:
+                return True
+        return os.path.exists(self._chunk_path(chunk_idx))
+
+    def frame(self, frame_idx: int) -> np.ndarray:
+        """
+        返回一帧的只读视图（BGR），所在分块还没有解码时先解码该分块。
+
+        异常:
+            IndexError: 如果帧索引超出范围。
+            WorkspaceQuotaError: 如果磁盘剩余空间不足以解码该分块。
+            subprocess.CalledProcessError: 如果 FFmpeg 解码失败。
+        """
+        if not 0 <= frame_idx < self.num_frames:
+            raise IndexError(f"帧索引 {frame_idx} 超出视频帧范围 [0, {self.num_frames - 1}]")
+        chunk_idx = frame_idx // self.chunk_frames
+        return self._chunk(chunk_idx)[frame_idx - chunk_idx * self.chunk_frames]
+
+    def iter_frames(self, start: int, stop: int) -> Iterator[np.ndarray]:
+        """
+        按顺序返回 [start, stop) 的帧，用于只顺序读取一次的整段输出（例如目标消除时原样写出的帧）。
+
+        已解码的分块直接返回视图；其余帧从解码进程顺序读出为新数组，不写入分块，不占用帧存储的磁盘空间。
+        可变帧率的视频无法重新定位，仍然经过分块，之后回头读取时不必从头解码。
+        """
+        for frame_idx in range(max(0, start), min(stop, self.num_frames)):
+            chunk_idx = frame_idx // self.chunk_frames
+            if self.is_vfr or self.has_chunk(chunk_idx):
+                yield self.frame(frame_idx)
+                continue
+            frame = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            with self._decode_lock:
+                begin = time.perf_counter()
+                self._position(frame_idx)
+                ok = self._reader.read_into(frame)
+                if ok:
+                    self._reader_pos += 1
+                    self.decoded_frames += 1
+                self.decode_seconds += time.perf_counter() - begin
+            # 实际帧数少于元数据时由分块解码补齐
+            yield frame if ok else self.frame(frame_idx)
+
+    def seek_frame(self, frame_idx: int) -> np.ndarray:
+        """
+        用单独的 FFmpeg 进程按时间戳定位，只解码第 frame_idx 帧（新数组），不写入分块，也不影响顺序解码进程。
+        只适用于恒定帧率的视频。
+
+        异常:
+            IndexError: 如果帧索引超出范围。
+            subprocess.CalledProcessError: 如果 FFmpeg 解码失败。
+        """
+        if not 0 <= frame_idx < self.num_frames:
+            raise IndexError(f"帧索引 {frame_idx} 超出视频帧范围 [0, {self.num_frames - 1}]")
+        with FFmpegReader(self.video_path, self.size,
+                          input_args=_seek_args(frame_idx, self.fps, self.start_time)) as reader:
+            frame = reader.read()
+        # 元数据中的帧数偏多、定位越过了视频结尾时，由分块解码补齐
+        return frame if frame is not None else np.array(self.frame(frame_idx))
+
+    def _chunk(self, chunk_idx: int) -> np.ndarray:
+        with self.lock:
+            chunk = self._maps.get(chunk_idx)
+        if chunk is None:
+            chunk = self._open_chunk(chunk_idx)
+        if self.cache is not None and chunk_idx != self._last_touched:
+            self._last_touched = chunk_idx
+            self.cache._touch(self.key, chunk_idx)
+        return chunk
+
+    def _open_chunk(self, chunk_idx: int) -> np.ndarray:
+        start, end = self.chunk_range(chunk_idx)
+        shape = (end - start, self.height, self.width, 3)
+        path = self._chunk_path(chunk_idx)
+        with self._decode_lock:
+            with self.lock:
+                chunk = self._maps.get(chunk_idx)
+            if chunk is not None:
+                return chunk
+            try:
+                chunk = np.memmap(path, dtype=np.uint8, mode="r", shape=shape)
+                if self.cache is not None:
+                    self.cache._hit()
+            except FileNotFoundError:
+                self._decode_chunk(chunk_idx, path, shape)
+                chunk = np.memmap(path, dtype=np.uint8, mode="r", shape=shape)
+            with self.lock:
+                self._maps[chunk_idx] = chunk
+            return chunk
+
+    def _decode_chunk(self, chunk_idx: int, path: str, shape: tuple) -> None:
+        """把一个分块解码到 path：先写入临时文件，完成后再改名，中途失败不会留下不完整的分块。"""
+        start, _ = self.chunk_range(chunk_idx)
+        nbytes = int(np.prod(shape))
+        if self.cache is not None:
+            self.cache._reserve(nbytes)
+        part_path = f"{path}.part{os.getpid()}_{threading.get_ident()}"
+        begin = time.perf_counter()
+        try:
+            out = np.memmap(part_path, dtype=np.uint8, mode="w+", shape=shape)
+            self._position(start)
+            count = 0
+            while count < len(out) and self._reader.read_into(out[count]):
+                count += 1
+            self._reader_pos += count
+            if count < len(out):
+                # 元数据中的帧数偏多（部分容器只记录估计值），用最后一帧补齐，帧号保持与元数据一致
+                logger.warning(f"视频实际帧数少于元数据中的 {self.num_frames} 帧，"
+                               f"第 {start + count} 帧起用最后一帧补齐: {self.video_path}")
+                if count == 0 and start == 0:
+                    raise ValueError(f"无法读取视频帧: {self.video_path}")
+                out[count:] = out[count - 1] if count else np.array(self.frame(start - 1))
+            out.flush()
+            del out
+            os.replace(part_path, path)
+        except BaseException:
+            self._close_reader()
+            if self.cache is not None:
+                self.cache._unreserve(nbytes)
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+        self.decoded_frames += shape[0]
+        self.decode_seconds += time.perf_counter() - begin
+        if self.cache is not None:
+            self.cache._add_chunk(self.key, chunk_idx, nbytes)
+
+    def _position(self, frame_idx: int) -> None:
+        """让解码进程输出的下一帧为 frame_idx：向前不远时跳过中间的帧，否则重新定位。调用时持有 _decode_lock。"""
+        skip = frame_idx - self._reader_pos
+        if self._reader is None or skip < 0 or (skip > FRAME_STORE_MAX_SKIP and not self.is_vfr):
+            self._close_reader()
+            input_args = [] if self.is_vfr else _seek_args(frame_idx, self.fps, self.start_time)
+            self._reader = FFmpegReader(self.video_path, self.size, input_args=input_args)
+            self._reader.open()
+            self._reader_pos = frame_idx if input_args else 0
+        if self._reader_pos < frame_idx:
+            scratch = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            while self._reader_pos < frame_idx and self._reader.read_into(scratch):
+                self._reader_pos += 1
+
+    def _close_reader(self) -> None:
+        """结束顺序解码进程（下次解码时重新启动）。"""
+        with self._decode_lock:
+            if self._reader is not None:
+                self._reader.close(check=False)
+                self._reader = None
+
+    def _drop_chunk(self, chunk_idx: int) -> None:
+        """分块被淘汰时释放其内存映射，仍在使用的视图保持有效。"""
+        with self.lock:
+            self._maps.pop(chunk_idx, None)
+
+    def close(self) -> None:
+        """结束解码进程并释放所有内存映射的引用，仍在使用的视图保持有效，全部释放后映射自动关闭。"""
+        self._close_reader()
+        with self.lock:
+            self._maps.clear()
+
+
+class FrameStoreCache:
+    """
+    按视频内容哈希缓存帧存储。
+
+    打开帧存储只读取元数据，不解码；帧按分块在第一次访问时解码。所有视频的分块总大小超过上限时，
+    删除最久未用的分块（包括正在使用的视频中早先读过的分块，再次访问时重新解码），
+    长视频因此只占用上限以内的磁盘空间，同时分析用的夹层文件和原视频也不会各自整段解码。
+    解码每个分块前确认磁盘（扣除其他正在解码的分块）在解码后仍有 min_free_bytes 的剩余空间。
+    """
+
+    def __init__(self, root: str = FRAME_STORE_DIR, max_bytes: int = FRAME_STORE_MAX_MB * 1024 * 1024,
+                 min_free_bytes: int = FRAME_STORE_MIN_FREE_MB * 1024 * 1024,
+                 chunk_frames: int = FRAME_STORE_CHUNK_FRAMES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.chunk_frames = max(1, chunk_frames)
+        self.lock = threading.Lock()
+        self._pending_bytes = 0  # 正在解码的分块的大小合计
+        self.stores: Dict[str, FrameStore] = {}  # 内容哈希 -> 帧存储
+        self.chunks: "OrderedDict[Tuple[str, int], int]" = OrderedDict()  # (内容哈希, 分块) -> 字节数，末尾为最近使用
+        self.refs: Dict[str, int] = {}
+        self._opening: Dict[str, threading.Lock] = {}
+        self.hits = 0        # 直接打开已解码的分块的次数
+        self.misses = 0      # 解码的分块数
+        self.evictions = 0   # 淘汰的分块数
+        self._loaded = False
+
+    def _load_index(self) -> None:
+        """首次使用时打开磁盘上已有的帧存储和分块（例如服务重启前解码的），按修改时间重建 LRU 顺序。"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.isdir(self.root):
+            return
+        found = []
+        for name in os.listdir(self.root):
+            root = os.path.join(self.root, name)
+            if not os.path.isdir(root):
+                continue
+            if not os.path.exists(os.path.join(root, META_FILE)):
+                # 中断的临时目录；最近仍在写入的可能属于另一个进程，保留
+                if ".tmp" in name and idle_seconds(root) > FRAME_STORE_TMP_STALE_SECONDS:
+                    shutil.rmtree(root, ignore_errors=True)
+                continue
+            if os.path.exists(os.path.join(root, LEGACY_FRAMES_FILE)):
+                shutil.rmtree(root, ignore_errors=True)  # 旧版整段解码的帧存储，改为按分块重新解码
+                continue
+            try:
+                store = FrameStore(root, self)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"帧存储已损坏，删除: {root} ({e})")
+                shutil.rmtree(root, ignore_errors=True)
+                continue
+            self.stores[name] = store
+            for entry in os.listdir(root):
+                path = os.path.join(root, entry)
+                if ".part" in entry:
+                    if idle_seconds(path) > FRAME_STORE_TMP_STALE_SECONDS:
+                        _remove(path)  # 中断的分块解码
+                    continue
+                chunk_idx = _parse_chunk_name(entry)
+                if chunk_idx is None:
+                    continue
+                nbytes = store.chunk_bytes(chunk_idx)
+                if nbytes == 0 or os.path.getsize(path) != nbytes:
+                    _remove(path)
+                    continue
+                found.append((os.path.getmtime(path), (name, chunk_idx), nbytes))
+        for _, entry, nbytes in sorted(found, key=lambda item: item[0]):
+            self.chunks[entry] = nbytes
+
+    def _open(self, key: str, video_path: str) -> FrameStore:
+        """返回已打开的帧存储，没有时由 ffprobe 元数据创建（不解码）。调用时不持有 self.lock。"""
+        with self.lock:
+            self._load_index()
+            open_lock = self._opening.setdefault(key, threading.Lock())
+        with open_lock:
+            with self.lock:
+                store = self.stores.get(key)
+            if store is not None:
+                return store
+            info = probe_video(video_path)
+            if not info["frame_count"]:
+                raise ValueError(f"无法读取视频帧数: {video_path}")
+            root = os.path.join(self.root, key)
+            os.makedirs(root, exist_ok=True)
+            meta = {"video_path": video_path, "fps": info["fps"] or 30, "frames": info["frame_count"],
+                    "width": info["width"], "height": info["height"], "chunk_frames": self.chunk_frames,
+                    "start_time": info.get("start_time", 0.0), "is_vfr": info.get("is_vfr", False)}
+            meta_path = os.path.join(root, META_FILE)
+            with open(meta_path + ".part", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(meta_path + ".part", meta_path)
+            store = FrameStore(root, self)
+            with self.lock:
+                self.stores[key] = store
+            return store
+
+    def open(self, video_path: str) -> FrameStore:
+        """
+        打开视频的帧存储并占用（只读取元数据，帧在访问时解码），调用方使用完后必须调用 release。
+
+        异常:
+            FileNotFoundError: 如果视频文件不存在。
+            ValueError: 如果无法读取视频的帧数。
+            subprocess.CalledProcessError: 如果 ffprobe 执行失败。
+        """
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(f"输入视频文件不存在: {video_path}")
+        key = video_content_hash(video_path)
+        with self.lock:
+            self.refs[key] = self.refs.get(key, 0) + 1
+        try:
+            return self._open(key, video_path)
+        except BaseException:
+            self._unref(key)
+            raise
+
+    def release(self, store: FrameStore) -> None:
+        """释放 open 返回的帧存储，不再被占用时结束其解码进程。"""
+        if self._unref(store.key) == 0:
+            store._close_reader()
+
+    def _unref(self, key: str) -> int:
+        with self.lock:
+            count = self.refs.get(key, 0) - 1
+            if count > 0:
+                self.refs[key] = count
+            else:
+                self.refs.pop(key, None)
+            return max(0, count)
+
+    @contextmanager
+    def acquire(self, video_path: str):
+        """在 with 块内占用视频的帧存储。"""
+        store = self.open(video_path)
+        try:
+            yield store
+        finally:
+            self.release(store)
+
+    def read_frame(self, video_path: str, frame_idx: int) -> np.ndarray:
+        """
+        读取一帧的副本（BGR），用于单帧预览和大模型检测。
+
+        该帧所在的分块已经解码时直接复制；否则按时间戳定位后只解码这一帧（夹层文件的 GOP 很短，定位很快），
+        不解码、也不写入整个分块。可变帧率的视频无法按时间戳准确定位，解码该帧所在的分块。
+
+        异常:
+            FileNotFoundError: 如果视频文件不存在。
+            IndexError: 如果帧索引超出范围。
+            subprocess.CalledProcessError: 如果 FFmpeg 解码失败。
+        """
+        with self.acquire(video_path) as frames:
+            if not 0 <= frame_idx < len(frames):
+                raise IndexError(f"帧索引 {frame_idx} 超出视频帧范围 [0, {len(frames) - 1}]")
+            if frames.is_vfr or frames.has_chunk(frame_idx // frames.chunk_frames):
+                return np.array(frames.frame(frame_idx))
+            return frames.seek_frame(frame_idx)
+
+    def _touch(self, key: str, chunk_idx: int) -> None:
+        with self.lock:
+            if (key, chunk_idx) in self.chunks:
+                self.chunks.move_to_end((key, chunk_idx))
+
+    def _hit(self) -> None:
+        with self.lock:
+            self.hits += 1
+
+    def _reserve(self, nbytes: int) -> None:
+        """
+        解码分块前的空间检查：先淘汰旧分块腾出配额，再确认磁盘有足够剩余空间。
+
+        异常:
+            WorkspaceQuotaError: 如果磁盘剩余空间不足。
+        """
+        self.evict(reserve=nbytes)
+        with self.lock:
+            free = shutil.disk_usage(self.root).free - self._pending_bytes
+            if nbytes + self.min_free_bytes > free:
+                raise WorkspaceQuotaError(
+                    f"帧存储剩余空间不足: 需要 {nbytes / 1024 / 1024:.0f}MB，"
+                    f"可用 {max(0, free - self.min_free_bytes) / 1024 / 1024:.0f}MB")
+            self._pending_bytes += nbytes
+
+    def _unreserve(self, nbytes: int) -> None:
+        with self.lock:
+            self._pending_bytes -= nbytes
+
+    def _add_chunk(self, key: str, chunk_idx: int, nbytes: int) -> None:
+        with self.lock:
+            self._pending_bytes -= nbytes
+            self.chunks[(key, chunk_idx)] = nbytes
+            self.misses += 1
+
+    def evict(self, reserve: int = 0) -> int:
+        """
+        删除最久未用的分块，直到总大小（加上 reserve）不超过上限，返回删除数量。
+        分块全部被删除且没有被占用的帧存储目录一并删除。
+
+        参数:
+            reserve (int): 即将解码的分块的大小，为其预先腾出配额。
+        """
+        victims = []
+        with self.lock:
+            total = sum(self.chunks.values()) + self._pending_bytes + reserve
+            while self.chunks and total > self.max_bytes:
+                entry, nbytes = self.chunks.popitem(last=False)
+                total -= nbytes
+                victims.append((self.stores.get(entry[0]), entry))
+            self.evictions += len(victims)
+        for store, (key, chunk_idx) in victims:
+            if store is not None:
+                store._drop_chunk(chunk_idx)
+            _remove(os.path.join(self.root, key, _chunk_name(chunk_idx)))
+        if victims:
+            self._prune({key for _, (key, _) in victims})
+            logger.info(f"帧存储超过容量上限，已删除 {len(victims)} 个分块")
+        return len(victims)
+
+    def _prune(self, keys) -> None:
+        """删除已经没有分块、也没有被占用的帧存储。"""
+        with self.lock:
+            live = {key for key, _ in self.chunks}
+            empty = [key for key in keys
+                     if key in self.stores and key not in live and not self.refs.get(key)
+                     and not self._opening.get(key, threading.Lock()).locked()]
+            stores = [self.stores.pop(key) for key in empty]
+            for key in empty:
+                self._opening.pop(key, None)
+        for store in stores:
+            store.close()
+            shutil.rmtree(store.root, ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "root": self.root,
+                "stores": len(self.stores),
+                "in_use": len(self.refs),
+                "chunks": len(self.chunks),
+                "total_mb": round(sum(self.chunks.values()) / 1024 / 1024, 1),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        # Windows 上仍被内存映射的文件无法删除
+        logger.warning(f"删除帧存储文件失败: {path} ({e})")
+
+
+def idle_seconds(root: str) -> float:
+    """返回目录（或文件）及其中文件最近一次修改距今的秒数（写入文件不会更新目录自身的修改时间）。"""
+    latest = 0.0
+    try:
+        latest = os.path.getmtime(root)
+        for name in os.listdir(root):
+            latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+    except OSError:
+        pass
+    return time.time() - latest
+
+
+# 全局帧存储缓存实例
+frame_stores = FrameStoreCache()
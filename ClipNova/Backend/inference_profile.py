@@ -0,0 +1,154 @@
+import os
+import logging
+import threading
+from contextlib import nullcontext
+from typing import Dict, Any, Optional
+import torch
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# CPU 推理配置，可通过环境变量覆盖
+SAM2_CPU_THREADS = int(os.environ.get("SAM2_CPU_THREADS", "0"))                  # 算子内线程数，0 表示使用物理核心数
+SAM2_CPU_INTEROP_THREADS = int(os.environ.get("SAM2_CPU_INTEROP_THREADS", "1"))  # 算子间线程数
+SAM2_CHANNELS_LAST = os.environ.get("SAM2_CHANNELS_LAST", "1") != "0"
+SAM2_CPU_QUANTIZE = os.environ.get("SAM2_CPU_QUANTIZE", "none")                  # 'none' 或 'int8'
+SAM2_COMPILE = os.environ.get("SAM2_COMPILE", "0") != "0"
+
+_threads_lock = threading.Lock()
+_threads_configured = False
+
+
+class InferenceProfile:
+    """
+    SAM2 推理配置。
+
+    GPU 上使用 bfloat16 autocast（并在 Ampere 及以上启用 TF32）；CPU 上保持 float32，
+    按配置设置线程数、channels-last 内存布局，并可选地对图像编码器做动态 int8 量化或 torch.compile。
+    """
+
+    def __init__(self, device: str, threads: int = SAM2_CPU_THREADS,
+                 interop_threads: int = SAM2_CPU_INTEROP_THREADS, channels_last: bool = SAM2_CHANNELS_LAST,
+                 quantize: str = SAM2_CPU_QUANTIZE, compile_encoder: bool = SAM2_COMPILE):
+        """
+        参数:
+            device (str): 运行设备（'cuda' 或 'cpu'）。
+            threads (int): CPU 算子内线程数，0 表示自动。
+            interop_threads (int): CPU 算子间线程数。
+            channels_last (bool): 是否将图像编码器转换为 channels-last 内存布局。
+            quantize (str): 'int8' 表示对图像编码器的线性层做动态 int8 量化（仅 CPU），'none' 表示不量化。
+            compile_encoder (bool): 是否使用 torch.compile 编译图像编码器。
+
+        异常:
+            ValueError: 如果量化方式不受支持。
+        """
+        if quantize not in ("none", "int8"):
+            raise ValueError(f"不支持的量化方式: {quantize}")
+        self.device = device
+        self.threads = threads
+        self.interop_threads = interop_threads
+        self.channels_last = channels_last
+        self.quantize = quantize if device == "cpu" else "none"
+        self.compile_encoder = compile_encoder
+
+    @property
+    def name(self) -> str:
+        """配置的简短名称，用于日志和基准测试报告。"""
+        if self.device != "cpu":
+            return f"{self.device}-bf16"
+        parts = ["cpu-fp32"]
+        if self.channels_last:
+            parts.append("channels_last")
+        if self.quantize != "none":
+            parts.append(self.quantize)
+        if self.compile_encoder:
+            parts.append("compile")
+        return "+".join(parts)
+
+    def configure_threads(self) -> None:
+        """
+        设置 PyTorch 的 CPU 线程数。
+
+        算子间线程数只能在进程内第一次并行计算之前设置一次，之后的设置请求会被忽略。
+        """
+        global _threads_configured
+        if self.device != "cpu":
+            return
+        threads = self.threads or _physical_cores()
+        torch.set_num_threads(threads)
+        with _threads_lock:
+            if not _threads_configured:
+                try:
+                    torch.set_num_interop_threads(self.interop_threads)
+                except RuntimeError as e:
+                    logger.warning(f"无法设置算子间线程数: {e}")
+                _threads_configured = True
+
+    def apply(self, predictor):
+        """
+        将配置应用到已加载的 SAM2 预测器上（原地修改图像编码器）。
+
+        参数:
+            predictor: SAM2 视频预测器。
+
+        返回:
+            应用配置后的预测器。
+        """
+        if self.device == "cuda" and torch.cuda.get_device_properties(0).major >= 8:
+            # 为 Ampere GPU 启用 TensorFloat32
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
+        self.configure_threads()
+
+        encoder = predictor.image_encoder
+        if self.channels_last:
+            encoder = encoder.to(memory_format=torch.channels_last)
+            # 输入图像同样转换为 channels-last，避免卷积层内部反复转换布局
+            encoder.register_forward_pre_hook(
+                lambda module, args: (args[0].contiguous(memory_format=torch.channels_last),) + tuple(args[1:]))
+        if self.quantize == "int8":
+            encoder = torch.ao.quantization.quantize_dynamic(encoder, {torch.nn.Linear}, dtype=torch.qint8)
+        if self.compile_encoder:
+            encoder = torch.compile(encoder, dynamic=False)
+        predictor.image_encoder = encoder
+
+        logger.info(f"SAM2 推理配置: {self.name}，CPU 线程数 {torch.get_num_threads()}")
+        return predictor
+
+    def autocast(self):
+        """
+        返回推理时使用的精度上下文：GPU 上为 bfloat16 autocast，CPU 上不做类型转换。
+
+        与旧实现在构造函数中进入且从不退出的全局 autocast 不同，该上下文只在推理调用期间生效。
+        """
+        if self.device == "cuda":
+            return torch.autocast(device_type="cuda", dtype=torch.bfloat16)
+        return nullcontext()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "device": self.device,
+            "threads": self.threads or _physical_cores(),
+            "interop_threads": self.interop_threads,
+            "channels_last": self.channels_last,
+            "quantize": self.quantize,
+            "compile": self.compile_encoder
+        }
+
+
+def _physical_cores() -> int:
+    """返回物理核心数（超线程对卷积和矩阵乘法几乎没有收益），无法获取时返回逻辑核心数。"""
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False)
+    except ImportError:
+        cores = None
+    return cores or os.cpu_count() or 1
+
+
+def default_profile(device: Optional[str] = None) -> InferenceProfile:
+    """按环境变量配置返回指定设备的推理配置。"""
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return InferenceProfile(device)
@@ -0,0 +1,188 @@
+"""
+E2FGVI 常驻修复进程。
+
+在 videoedit 环境中运行：启动时只加载一次模型，之后通过本地 socket（multiprocessing.connection）
+接收修复请求，帧和掩码通过共享内存传递，修复结果直接写回帧所在的共享内存。
+进程由 inpainting.InpaintSupervisor 启动和监控，崩溃后由其重新启动。
+
+启动方式（通常不需要手动运行）:
+    python inpaint_worker.py --e2fgvi-root D:/GitHub/sitp-bronze96/E2FGVI_master \
+        --ckpt D:/GitHub/sitp-bronze96/E2FGVI_master/release_model/E2FGVI-CVPR22.pth --model e2fgvi
+
+请求（dict）:
+    {"cmd": "ping"}
+    {"cmd": "shutdown"}
+    {"cmd": "inpaint", "frames": 共享内存名, "masks": 共享内存名, "shape": (T, H, W)}
+        frames 为 (T, H, W, 3) 的 uint8 RGB 帧，masks 为 (T, H, W) 的 uint8 掩码（1 表示需要修复）
+
+响应（dict）:
+    {"status": "ok", ...} 或 {"status": "error", "error": 错误信息, "traceback": 调用栈}
+"""
+import os
+import sys
+import time
+import argparse
+import importlib
+import logging
+import traceback
+from multiprocessing import shared_memory
+from multiprocessing.connection import Listener
+import numpy as np
+import torch
+
+# 日志输出到 stderr，stdout 只用于向主进程报告就绪
+logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                    format='%(asctime)s - inpaint_worker - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 与 E2FGVI test.py 一致的推理参数
+NEIGHBOR_STRIDE = 5
+REF_LENGTH = 10
+MOD_SIZE_H = 60
+MOD_SIZE_W = 108
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """打开主进程创建的共享内存。"""
+    shm = shared_memory.SharedMemory(name=name)
+    # 共享内存由主进程创建和释放，避免本进程退出时被 resource_tracker 删除
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+class E2FGVIInpainter:
+    """加载一次的 E2FGVI 模型，按 test.py 的滑动窗口方式修复整段帧序列。"""
+
+    def __init__(self, root: str, ckpt: str, model_name: str = "e2fgvi", device: str = None):
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        sys.path.insert(0, root)
+        net = importlib.import_module("model." + model_name)
+        self.model = net.InpaintGenerator().to(self.device)
+        self.model.load_state_dict(torch.load(ckpt, map_location=self.device))
+        self.model.eval()
+        logger.info(f"E2FGVI 模型加载完成: {model_name} ({self.device})")
+
+    @staticmethod
+    def _ref_index(neighbor_ids: list, length: int) -> list:
+        return [i for i in range(0, length, REF_LENGTH) if i not in neighbor_ids]
+
+    @torch.no_grad()
+    def inpaint(self, frames: np.ndarray, masks: np.ndarray) -> None:
+        """
+        修复帧序列，结果写回 frames。
+
+        参数:
+            frames (np.ndarray): 形状为 (T, H, W, 3) 的 uint8 RGB 帧
+            masks (np.ndarray): 形状为 (T, H, W) 的 uint8 掩码，非 0 表示需要修复
+        """
+        length, h, w = masks.shape
+        imgs = torch.from_numpy(frames).permute(0, 3, 1, 2).float().div(255).mul(2).sub(1).unsqueeze(0)
+        binary_masks = (masks != 0).astype(np.uint8)[..., None]
+        mask_tensor = torch.from_numpy(binary_masks).permute(0, 3, 1, 2).float().unsqueeze(0)
+        h_pad = (MOD_SIZE_H - h % MOD_SIZE_H) % MOD_SIZE_H
+        w_pad = (MOD_SIZE_W - w % MOD_SIZE_W) % MOD_SIZE_W
+
+        comp_frames = [None] * length
+        for f in range(0, length, NEIGHBOR_STRIDE):
+            neighbor_ids = list(range(max(0, f - NEIGHBOR_STRIDE), min(length, f + NEIGHBOR_STRIDE + 1)))
+            ids = neighbor_ids + self._ref_index(neighbor_ids, length)
+            selected_imgs = imgs[:, ids].to(self.device)
+            selected_masks = mask_tensor[:, ids].to(self.device)
+
+            masked_imgs = selected_imgs * (1 - selected_masks)
+            masked_imgs = torch.cat([masked_imgs, torch.flip(masked_imgs, [3])], 3)[:, :, :, :h + h_pad, :]
+            masked_imgs = torch.cat([masked_imgs, torch.flip(masked_imgs, [4])], 4)[:, :, :, :, :w + w_pad]
+            pred_imgs, _ = self.model(masked_imgs, len(neighbor_ids))
+            pred_imgs = (pred_imgs[:, :, :h, :w] + 1) / 2
+            pred_imgs = pred_imgs.cpu().permute(0, 2, 3, 1).numpy() * 255
+
+            for i, idx in enumerate(neighbor_ids):
+                img = pred_imgs[i].astype(np.uint8) * binary_masks[idx] + frames[idx] * (1 - binary_masks[idx])
+                if comp_frames[idx] is None:
+                    comp_frames[idx] = img
+                else:
+                    comp_frames[idx] = comp_frames[idx].astype(np.float32) * 0.5 + img.astype(np.float32) * 0.5
+
+        for idx, comp in enumerate(comp_frames):
+            frames[idx] = comp.astype(np.uint8)
+
+
+def handle_inpaint(inpainter: E2FGVIInpainter, request: dict) -> dict:
+    """处理一次修复请求：打开共享内存，修复后写回。"""
+    length, h, w = request["shape"]
+    frames_shm = attach_shared_memory(request["frames"])
+    masks_shm = attach_shared_memory(request["masks"])
+    try:
+        frames = np.ndarray((length, h, w, 3), dtype=np.uint8, buffer=frames_shm.buf)
+        masks = np.ndarray((length, h, w), dtype=np.uint8, buffer=masks_shm.buf)
+        start = time.perf_counter()
+        inpainter.inpaint(frames, masks)
+        elapsed = time.perf_counter() - start
+        del frames, masks
+    finally:
+        frames_shm.close()
+        masks_shm.close()
+    logger.info(f"修复完成: {length} 帧 {w}x{h}，耗时 {elapsed:.1f} 秒")
+    return {"status": "ok", "frames": length, "elapsed": elapsed}
+
+
+def serve(inpainter: E2FGVIInpainter, listener: Listener) -> None:
+    """依次处理连接上的请求，收到 shutdown 时退出。"""
+    while True:
+        with listener.accept() as conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    break
+                cmd = request.get("cmd")
+                if cmd == "ping":
+                    conn.send({"status": "ok", "pid": os.getpid()})
+                elif cmd == "shutdown":
+                    conn.send({"status": "ok"})
+                    return
+                elif cmd == "inpaint":
+                    try:
+                        reply = handle_inpaint(inpainter, request)
+                    except Exception as e:
+                        logger.error(f"修复失败: {e}")
+                        reply = {"status": "error", "error": str(e), "traceback": traceback.format_exc()}
+                    finally:
+                        if inpainter.device.type == "cuda":
+                            torch.cuda.empty_cache()
+                    conn.send(reply)
+                else:
+                    conn.send({"status": "error", "error": f"未知命令: {cmd}"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="E2FGVI 常驻修复进程")
+    parser.add_argument("--e2fgvi-root", required=True, help="E2FGVI 代码目录")
+    parser.add_argument("--ckpt", required=True, help="E2FGVI 检查点路径")
+    parser.add_argument("--model", default="e2fgvi", help="模型名称（e2fgvi 或 e2fgvi_hq）")
+    parser.add_argument("--device", default=None, help="推理设备，默认有 GPU 时使用 cuda")
+    parser.add_argument("--port", type=int, default=0, help="监听端口，0 表示自动选择")
+    parser.add_argument("--threads", type=int, default=0, help="torch CPU 线程数，0 表示使用默认值")
+    args = parser.parse_args()
+
+    # 多个修复进程并行时各自只使用分配到的核数，避免线程数超过核数互相争抢
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    # 认证密钥由主进程通过环境变量传入，不出现在命令行中
+    authkey = bytes.fromhex(os.environ["CLIPNOVA_INPAINT_AUTHKEY"])
+    inpainter = E2FGVIInpainter(args.e2fgvi_root, args.ckpt, args.model, args.device)
+
+    with Listener(("127.0.0.1", args.port), authkey=authkey) as listener:
+        # 模型加载完成后才报告就绪，主进程据此得知端口
+        print(f"READY {listener.address[1]}", flush=True)
+        serve(inpainter, listener)
+    logger.info("修复进程退出")
+
+
+if __name__ == "__main__":
+    main()
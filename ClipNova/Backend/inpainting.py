@@ -0,0 +1,737 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+import subprocess
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+import cv2
+import numpy as np
+from shot_detection import ShotDetector
+from classical_inpaint import (classical_inpaint, STATIC_MAX_SHIFT, STATIC_MAX_DIFF, STATIC_SAMPLE_STEP,
+                               CLASSICAL_FILL, CLASSICAL_MAX_UNSEEN)
+from frame_store import FrameStore, frame_stores
+from ffmpeg_io import FFmpegWriter
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# E2FGVI 修复进程配置，可通过环境变量覆盖
+E2FGVI_ROOT = os.environ.get("E2FGVI_ROOT", "D:/GitHub/sitp-bronze96/E2FGVI_master")
+E2FGVI_MODEL = os.environ.get("E2FGVI_MODEL", "e2fgvi")
+E2FGVI_CKPT = os.environ.get("E2FGVI_CKPT", os.path.join(E2FGVI_ROOT, "release_model", "E2FGVI-CVPR22.pth"))
+INPAINT_PYTHON = os.environ.get(
+    "INPAINT_PYTHON",
+    "D:/anaconda3/envs/videoedit/python.exe" if os.name == 'nt' else "/root/miniconda3/envs/videoedit/bin/python"
+)
+INPAINT_START_TIMEOUT = float(os.environ.get("INPAINT_START_TIMEOUT", "300"))  # 启动并加载模型的最长秒数
+INPAINT_TIMEOUT = float(os.environ.get("INPAINT_TIMEOUT", "3600"))  # 单次修复的最长秒数
+INPAINT_MASK_DILATION = int(os.environ.get("INPAINT_MASK_DILATION", "4"))  # 与 E2FGVI test.py 一致的膨胀次数
+
+# 修复区域裁剪配置：目标包围框四周按其尺寸的比例（且不少于最小像素数）保留上下文，
+# 区域超过画面的一定比例时直接处理完整画面；目标出现的帧段前后各保留若干帧作为参考
+INPAINT_ROI_MARGIN = float(os.environ.get("INPAINT_ROI_MARGIN", "0.5"))
+INPAINT_ROI_MIN_MARGIN = int(os.environ.get("INPAINT_ROI_MIN_MARGIN", "32"))
+INPAINT_ROI_MAX_FRACTION = float(os.environ.get("INPAINT_ROI_MAX_FRACTION", "0.6"))
+INPAINT_TEMPORAL_MARGIN = int(os.environ.get("INPAINT_TEMPORAL_MARGIN", "10"))
+
+# 修复帧段划分：每帧包围框先在前后 INPAINT_TUBE_SMOOTH 帧内取外包框（平滑抖动），再按时间切成帧段，
+# 每段使用自己的裁剪区域。目标消失超过 MAX_GAP 帧、帧段超过 MAX_FRAMES 帧，或目标移动使帧段的
+# 外包框面积超过单帧框的 MAX_GROWTH 倍（且帧段已有 MIN_FRAMES 帧）时开始新的帧段
+INPAINT_TUBE_SMOOTH = int(os.environ.get("INPAINT_TUBE_SMOOTH", "5"))
+INPAINT_TUBE_MAX_GAP = int(os.environ.get("INPAINT_TUBE_MAX_GAP", "20"))
+INPAINT_TUBE_MAX_FRAMES = int(os.environ.get("INPAINT_TUBE_MAX_FRAMES", "240"))
+INPAINT_TUBE_MIN_FRAMES = int(os.environ.get("INPAINT_TUBE_MIN_FRAMES", "16"))
+INPAINT_TUBE_MAX_GROWTH = float(os.environ.get("INPAINT_TUBE_MAX_GROWTH", "2.0"))
+
+# 修复进程池与时间分块配置：长片段按镜头切分，镜头内再切成互相重叠的窗口，
+# 各窗口分发到多个修复进程并行处理，重叠部分线性过渡融合。
+# CPU 节点上修复进程数可设为核数的若干分之一，每个进程的线程数默认平分 CPU 核数
+INPAINT_WORKERS = int(os.environ.get("INPAINT_WORKERS", "1"))
+INPAINT_WORKER_THREADS = int(os.environ.get("INPAINT_WORKER_THREADS", "0"))  # 0 表示按核数平分
+INPAINT_CHUNK_FRAMES = int(os.environ.get("INPAINT_CHUNK_FRAMES", "80"))  # 0 表示不分块
+INPAINT_CHUNK_OVERLAP = int(os.environ.get("INPAINT_CHUNK_OVERLAP", "10"))
+
+# 修复方式："e2fgvi" 全部使用 E2FGVI（默认，与原有输出一致）；"auto" 对静止镜头使用背景填充，
+# 只有需要的镜头升级为 E2FGVI；"classical" 全部使用背景填充和空间修复
+INPAINT_MODE = os.environ.get("INPAINT_MODE", "e2fgvi")
+INPAINT_MODES = ('auto', 'e2fgvi', 'classical')
+
+# 各模型的推理分辨率 (宽, 高)，None 表示使用原分辨率
+E2FGVI_MODEL_SIZES: Dict[str, Optional[Tuple[int, int]]] = {
+    'e2fgvi': (432, 240),
+    'e2fgvi_hq': None
+}
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "inpaint_worker.py")
+
+
+class InpaintWorkerError(RuntimeError):
+    """修复进程返回错误或无法启动时抛出。"""
+
+
+class InpaintSupervisor:
+    """
+    管理常驻的 E2FGVI 修复进程。
+
+    修复进程运行在 videoedit 环境中，模型只在启动时加载一次；主进程通过本地 socket 发送请求，
+    帧和掩码通过共享内存传递。进程崩溃或连接中断时自动重启，并重试一次当前请求。
+    """
+
+    def __init__(self, python: str = INPAINT_PYTHON, model: str = E2FGVI_MODEL, ckpt: str = E2FGVI_CKPT,
+                 root: str = E2FGVI_ROOT, threads: int = 0):
+        self.python = python
+        self.model = model
+        self.ckpt = ckpt
+        self.root = root
+        self.threads = threads  # 修复进程的 torch 线程数，0 表示使用默认值
+        self.lock = threading.Lock()  # 一个修复进程同一时间只处理一个请求
+        self.process: Optional[subprocess.Popen] = None
+        self.conn = None
+        self.authkey = os.urandom(16)
+        self.started_at = None
+        self.starts = 0
+        self.restarts = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_elapsed = None
+
+    @property
+    def model_size(self) -> Optional[Tuple[int, int]]:
+        return E2FGVI_MODEL_SIZES.get(self.model)
+
+    def _start(self) -> None:
+        """启动修复进程并等待其加载完模型。"""
+        if not os.path.exists(self.python):
+            raise FileNotFoundError(f"找不到videoedit环境的Python解释器: {self.python}")
+
+        start = time.monotonic()
+        env = dict(os.environ, CLIPNOVA_INPAINT_AUTHKEY=self.authkey.hex())
+        self.process = subprocess.Popen(
+            [self.python, WORKER_SCRIPT, "--e2fgvi-root", self.root, "--ckpt", self.ckpt, "--model", self.model,
+             "--threads", str(self.threads)],
+            stdout=subprocess.PIPE, env=env, text=True
+        )
+
+        # 修复进程加载完模型后在 stdout 输出 "READY <端口>"
+        lines = queue.Queue()
+        threading.Thread(target=lambda: lines.put(self.process.stdout.readline()), daemon=True).start()
+        try:
+            line = lines.get(timeout=INPAINT_START_TIMEOUT)
+        except queue.Empty:
+            self._stop()
+            raise InpaintWorkerError(f"修复进程在 {INPAINT_START_TIMEOUT:.0f} 秒内未就绪")
+        if not line.startswith("READY"):
+            code = self.process.wait()
+            self.process = None
+            raise InpaintWorkerError(f"修复进程启动失败，退出代码: {code}")
+
+        port = int(line.split()[1])
+        self.conn = Client(("127.0.0.1", port), authkey=self.authkey)
+        self.started_at = time.monotonic()
+        self.starts += 1
+        logger.info(f"修复进程已就绪: pid={self.process.pid}, 端口 {port}，耗时 {time.monotonic() - start:.1f} 秒")
+
+    def _stop(self) -> None:
+        """关闭连接并结束修复进程。"""
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except OSError:
+                pass
+            self.conn = None
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+            self.process = None
+
+    def _ensure_running(self) -> None:
+        if self.process is not None and self.process.poll() is not None:
+            logger.warning(f"修复进程已退出（退出代码 {self.process.returncode}），重新启动")
+            self.restarts += 1
+            self._stop()
+        if self.process is None:
+            self._start()
+
+    def start(self) -> None:
+        """预先启动修复进程（例如服务启动时在后台调用），避免第一个请求等待模型加载。"""
+        with self.lock:
+            self._ensure_running()
+
+    def _call(self, request: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        self.conn.send(request)
+        if not self.conn.poll(timeout):
+            raise TimeoutError(f"修复进程在 {timeout:.0f} 秒内没有返回结果")
+        return self.conn.recv()
+
+    def inpaint(self, frames: np.ndarray, masks: np.ndarray, timeout: float = INPAINT_TIMEOUT) -> np.ndarray:
+        """
+        修复一段帧序列。
+
+        参数:
+            frames (np.ndarray): 形状为 (T, H, W, 3) 的 uint8 RGB 帧
+            masks (np.ndarray): 形状为 (T, H, W) 的掩码，非 0 表示需要修复
+            timeout (float): 等待修复结果的最长秒数
+
+        返回:
+            np.ndarray: 修复后的帧，形状与 frames 相同
+
+        异常:
+            InpaintWorkerError: 如果修复进程返回错误或重启后仍然失败
+            TimeoutError: 如果修复超时（超时的进程会被结束，下次请求时重新启动）
+        """
+        length, h, w = masks.shape[:3]
+        frames_shm = shared_memory.SharedMemory(create=True, size=frames.nbytes)
+        masks_shm = shared_memory.SharedMemory(create=True, size=length * h * w)
+        try:
+            shared_frames = np.ndarray((length, h, w, 3), dtype=np.uint8, buffer=frames_shm.buf)
+            shared_frames[:] = frames
+            np.ndarray((length, h, w), dtype=np.uint8, buffer=masks_shm.buf)[:] = masks != 0
+            request = {"cmd": "inpaint", "frames": frames_shm.name, "masks": masks_shm.name,
+                       "shape": (length, h, w)}
+
+            with self.lock:
+                self.requests += 1
+                for attempt in range(2):
+                    try:
+                        self._ensure_running()
+                        reply = self._call(request, timeout)
+                        break
+                    except FileNotFoundError:
+                        raise
+                    except TimeoutError:
+                        self.failures += 1
+                        self._stop()
+                        raise
+                    except (EOFError, OSError) as e:
+                        # 进程崩溃或连接中断：重启后重试一次
+                        self.failures += 1
+                        logger.warning(f"修复进程连接中断: {e}")
+                        self._stop()
+                        self.restarts += 1
+                        if attempt:
+                            raise InpaintWorkerError(f"修复进程重启后仍然失败: {e}")
+
+            if reply.get("status") != "ok":
+                self.failures += 1
+                logger.error(f"修复进程出错:\n{reply.get('traceback', '')}")
+                raise InpaintWorkerError(f"修复进程出错: {reply.get('error')}")
+            self.last_elapsed = reply.get("elapsed")
+            result = shared_frames.copy()
+        finally:
+            # 释放对共享内存的引用后才能关闭
+            shared_frames = None
+            for shm in (frames_shm, masks_shm):
+                shm.close()
+                shm.unlink()
+        return result
+
+    def shutdown(self) -> None:
+        """通知修复进程退出。"""
+        with self.lock:
+            if self.conn is not None and self.process is not None and self.process.poll() is None:
+                try:
+                    self._call({"cmd": "shutdown"}, timeout=10)
+                except (EOFError, OSError, TimeoutError):
+                    pass
+            self._stop()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回修复进程的运行状态。"""
+        process = self.process
+        running = process is not None and process.poll() is None
+        return {
+            "model": self.model,
+            "running": running,
+            "pid": process.pid if running else None,
+            "uptime_seconds": time.monotonic() - self.started_at if running and self.started_at else None,
+            "starts": self.starts,
+            "restarts": self.restarts,
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_elapsed": self.last_elapsed
+        }
+
+
+def plan_chunks(shots: List[Tuple[int, int]], chunk_frames: int = INPAINT_CHUNK_FRAMES,
+                overlap: int = INPAINT_CHUNK_OVERLAP) -> List[Tuple[int, int]]:
+    """
+    将帧序列划分为修复窗口：镜头之间直接切开（内容无关，不需要重叠），
+    超过 chunk_frames 的镜头再切成相邻窗口重叠 overlap 帧的多个窗口。
+
+    参数:
+        shots (List[Tuple[int, int]]): 各镜头的帧范围 [start, end)
+        chunk_frames (int): 窗口帧数，0 表示每个镜头一个窗口
+        overlap (int): 相邻窗口的重叠帧数
+
+    返回:
+        List[Tuple[int, int]]: 各窗口的帧范围 [start, end)
+    """
+    chunks = []
+    for start, end in shots:
+        if chunk_frames <= 0 or end - start <= chunk_frames:
+            chunks.append((start, end))
+            continue
+        overlap = min(max(0, overlap), chunk_frames // 2)
+        step = chunk_frames - overlap
+        chunk_start = start
+        while True:
+            chunk_end = min(end, chunk_start + chunk_frames)
+            # 最后一个窗口太短时并入前一个窗口的范围
+            if end - chunk_end < overlap:
+                chunk_end = end
+            chunks.append((chunk_start, chunk_end))
+            if chunk_end == end:
+                break
+            chunk_start += step
+    return chunks
+
+
+def _blend_weights(chunk: Tuple[int, int], chunks: List[Tuple[int, int]]) -> np.ndarray:
+    """返回窗口内各帧的融合权重：与相邻窗口重叠的部分线性过渡，其余为 1。"""
+    start, end = chunk
+    weights = np.ones(end - start, dtype=np.float32)
+    for other_start, other_end in chunks:
+        if (other_start, other_end) == chunk:
+            continue
+        if other_start < start < other_end:  # 与前一个窗口重叠
+            n = min(other_end, end) - start
+            weights[:n] = np.minimum(weights[:n], np.arange(1, n + 1, dtype=np.float32) / (n + 1))
+        if other_start < end < other_end or (start < other_start < end and other_end >= end):
+            n = end - max(other_start, start)  # 与后一个窗口重叠
+            if 0 < n < end - start:
+                weights[-n:] = np.minimum(weights[-n:], np.arange(n, 0, -1, dtype=np.float32) / (n + 1))
+    return weights
+
+
+class InpaintWorkerPool:
+    """
+    多个常驻修复进程组成的池。
+
+    inpaint 按镜头和时间窗口把帧序列切块，并行分发给空闲的修复进程，
+    修复结果在重叠部分按线性权重融合，使 CPU 节点上的修复速度随核数扩展。
+    """
+
+    def __init__(self, workers: int = INPAINT_WORKERS, threads: int = INPAINT_WORKER_THREADS, **kwargs):
+        workers = max(1, workers)
+        if threads <= 0 and workers > 1:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+        self.supervisors = [InpaintSupervisor(threads=threads, **kwargs) for _ in range(workers)]
+        self.idle: "queue.Queue[InpaintSupervisor]" = queue.Queue()
+        for supervisor in self.supervisors:
+            self.idle.put(supervisor)
+        self.chunks_total = 0
+
+    @property
+    def model_size(self) -> Optional[Tuple[int, int]]:
+        return self.supervisors[0].model_size
+
+    @contextmanager
+    def lease(self):
+        """取得一个空闲的修复进程，用完后归还。"""
+        supervisor = self.idle.get()
+        try:
+            yield supervisor
+        finally:
+            self.idle.put(supervisor)
+
+    def _inpaint_chunk(self, frames: np.ndarray, masks: np.ndarray) -> np.ndarray:
+        with self.lease() as supervisor:
+            return supervisor.inpaint(frames, masks)
+
+    def inpaint(self, frames: np.ndarray, masks: np.ndarray,
+                shots: Optional[List[Tuple[int, int]]] = None) -> np.ndarray:
+        """
+        修复一段帧序列。
+
+        参数:
+            frames (np.ndarray): 形状为 (T, H, W, 3) 的 uint8 RGB 帧
+            masks (np.ndarray): 形状为 (T, H, W) 的掩码，非 0 表示需要修复
+            shots (Optional[List[Tuple[int, int]]]): 镜头范围 [start, end)，为 None 时视为一个镜头
+
+        返回:
+            np.ndarray: 修复后的帧，形状与 frames 相同
+        """
+        length = len(frames)
+        chunks = plan_chunks(shots or [(0, length)])
+        # 不含掩码的窗口不需要修复
+        chunks = [chunk for chunk in chunks if masks[chunk[0]:chunk[1]].any()]
+        self.chunks_total += len(chunks)
+        if len(chunks) == 1 and chunks[0] == (0, length):
+            return self._inpaint_chunk(frames, masks)
+
+        result = frames.copy()
+        if not chunks:
+            return result
+        logger.info(f"修复分为 {len(chunks)} 个窗口，使用 {len(self.supervisors)} 个修复进程")
+        accum = np.zeros(frames.shape, dtype=np.float32)
+        total_weight = np.zeros(length, dtype=np.float32)
+        with ThreadPoolExecutor(max_workers=len(self.supervisors)) as executor:
+            futures = [executor.submit(self._inpaint_chunk, frames[start:end], masks[start:end])
+                       for start, end in chunks]
+            for (start, end), future in zip(chunks, futures):
+                weights = _blend_weights((start, end), chunks)
+                accum[start:end] += future.result().astype(np.float32) * weights[:, None, None, None]
+                total_weight[start:end] += weights
+
+        covered = total_weight > 0
+        result[covered] = np.clip(accum[covered] / total_weight[covered, None, None, None] + 0.5,
+                                  0, 255).astype(np.uint8)
+        return result
+
+    def start(self) -> None:
+        """预先启动所有修复进程。"""
+        with ThreadPoolExecutor(max_workers=len(self.supervisors)) as executor:
+            list(executor.map(lambda supervisor: supervisor.start(), self.supervisors))
+
+    def shutdown(self) -> None:
+        for supervisor in self.supervisors:
+            supervisor.shutdown()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self.supervisors),
+            "idle": self.idle.qsize(),
+            "chunks_total": self.chunks_total,
+            "chunk_frames": INPAINT_CHUNK_FRAMES,
+            "chunk_overlap": INPAINT_CHUNK_OVERLAP,
+            "processes": [supervisor.stats() for supervisor in self.supervisors]
+        }
+
+
+def _box_area(box) -> int:
+    return max(0, int(box[2]) - int(box[0])) * max(0, int(box[3]) - int(box[1]))
+
+
+def plan_tubes(boxes: np.ndarray, smooth: int = INPAINT_TUBE_SMOOTH, max_gap: int = INPAINT_TUBE_MAX_GAP,
+               max_frames: int = INPAINT_TUBE_MAX_FRAMES, min_frames: int = INPAINT_TUBE_MIN_FRAMES,
+               max_growth: float = INPAINT_TUBE_MAX_GROWTH) -> List[Tuple[int, int, Tuple[int, int, int, int]]]:
+    """
+    由每帧的目标包围框划分修复帧段，每段一个裁剪框。
+
+    移动的目标如果整段视频只用一个外包框，裁剪区域会覆盖目标经过的全部位置，
+    缩放到模型输入尺寸后分辨率损失很大；按帧段划分后每段的框只覆盖这一段内目标的位置。
+
+    参数:
+        boxes (np.ndarray): 形状为 (T, 4) 的包围框 (x1, y1, x2, y2)，没有目标的帧为 -1
+        smooth (int): 平滑半径（帧），每帧的框取前后 smooth 帧内所有框的外包框
+        max_gap (int): 目标消失不超过该帧数时仍属于同一帧段
+        max_frames (int): 帧段的最大帧数
+        min_frames (int): 帧段至少包含的帧数，之后才会因目标移动而切开
+        max_growth (float): 帧段外包框面积与其中最大单帧框面积之比的上限
+
+    返回:
+        List[Tuple]: 按时间排列的 (首帧, 末帧, (x1, y1, x2, y2))，没有任何目标时为空列表
+    """
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    present = np.flatnonzero(boxes[:, 0] >= 0)
+    if len(present) == 0:
+        return []
+
+    smoothed = {}
+    for frame_idx in present:
+        lo = np.searchsorted(present, frame_idx - smooth)
+        hi = np.searchsorted(present, frame_idx + smooth, side="right")
+        window = boxes[present[lo:hi]]
+        smoothed[frame_idx] = (int(window[:, 0].min()), int(window[:, 1].min()),
+                               int(window[:, 2].max()), int(window[:, 3].max()))
+
+    tubes = []
+    start = last = None
+    box = None
+    peak = 0
+    for frame_idx in present:
+        frame_box = smoothed[frame_idx]
+        if start is not None:
+            merged = (min(box[0], frame_box[0]), min(box[1], frame_box[1]),
+                      max(box[2], frame_box[2]), max(box[3], frame_box[3]))
+            split = (frame_idx - last - 1 > max_gap
+                     or (max_frames > 0 and frame_idx - start >= max_frames)
+                     or (frame_idx - start >= min_frames
+                         and _box_area(merged) > max_growth * max(peak, _box_area(frame_box))))
+            if split:
+                tubes.append((int(start), int(last), box))
+                start = None
+            else:
+                box = merged
+                peak = max(peak, _box_area(frame_box))
+        if start is None:
+            start, box, peak = frame_idx, frame_box, _box_area(frame_box)
+        last = frame_idx
+    tubes.append((int(start), int(last), box))
+    return tubes
+
+
+def compute_roi(box: Tuple[int, int, int, int], frame_size: Tuple[int, int],
+                aspect: Optional[float] = None) -> Tuple[int, int, int, int]:
+    """
+    在目标包围框四周加上上下文边距，得到送入修复模型的区域。
+
+    参数:
+        box (Tuple[int, int, int, int]): 目标包围框 (x1, y1, x2, y2)
+        frame_size (Tuple[int, int]): 画面尺寸 (宽, 高)
+        aspect (Optional[float]): 模型输入的宽高比，提供时扩展区域使其一致，缩放时不变形
+
+    返回:
+        Tuple[int, int, int, int]: 区域 (x1, y1, x2, y2)，位于画面之内
+    """
+    width, height = frame_size
+    x1, y1, x2, y2 = box
+    margin_x = max(INPAINT_ROI_MIN_MARGIN, int((x2 - x1) * INPAINT_ROI_MARGIN))
+    margin_y = max(INPAINT_ROI_MIN_MARGIN, int((y2 - y1) * INPAINT_ROI_MARGIN))
+    roi_w = min(width, x2 - x1 + 2 * margin_x)
+    roi_h = min(height, y2 - y1 + 2 * margin_y)
+    if aspect:
+        if roi_w / roi_h < aspect:
+            roi_w = min(width, int(round(roi_h * aspect)))
+        else:
+            roi_h = min(height, int(round(roi_w / aspect)))
+
+    # 以目标为中心放置区域，超出画面时向内平移
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    left = int(min(max(0, round(cx - roi_w / 2)), width - roi_w))
+    top = int(min(max(0, round(cy - roi_h / 2)), height - roi_h))
+    return left, top, left + roi_w, top + roi_h
+
+
+def read_mask(mask_dir: str, frame_idx: int) -> Optional[np.ndarray]:
+    """读取一帧的黑白掩码（文件名为 %05d.png），缺失时返回 None。"""
+    return cv2.imread(os.path.join(mask_dir, f"{frame_idx:05d}.png"), cv2.IMREAD_GRAYSCALE)
+
+
+def prepare_mask(mask: Optional[np.ndarray], roi: Tuple[int, int, int, int], size: Tuple[int, int]) -> np.ndarray:
+    """
+    裁剪掩码的修复区域，缩放到模型输入尺寸并膨胀（与 E2FGVI test.py 的处理一致）。
+
+    返回:
+        np.ndarray: 形状为 (H, W) 的 uint8 掩码，1 表示需要修复
+    """
+    width, height = size
+    if mask is None:
+        return np.zeros((height, width), dtype=np.uint8)
+    x1, y1, x2, y2 = roi
+    mask = mask[y1:y2, x1:x2]
+    if (mask.shape[1], mask.shape[0]) != size:
+        mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+    mask = (mask > 127).astype(np.uint8)
+    if INPAINT_MASK_DILATION > 0:
+        mask = cv2.dilate(mask, np.ones((3, 3), np.uint8), iterations=INPAINT_MASK_DILATION)
+    return mask
+
+
+def _inpaint_resized(pool: InpaintWorkerPool, frames: np.ndarray, masks: np.ndarray, shots: List[Tuple[int, int]],
+                     model_size: Optional[Tuple[int, int]]) -> np.ndarray:
+    """缩放到模型输入尺寸后交给修复进程池，结果缩放回原尺寸；model_size 为 None 或尺寸相同时直接修复。"""
+    height, width = frames.shape[1:3]
+    if model_size is None or (width, height) == tuple(model_size):
+        return pool.inpaint(frames, masks, shots)
+    small_frames = np.empty((len(frames), model_size[1], model_size[0], 3), dtype=np.uint8)
+    small_masks = np.zeros((len(frames), model_size[1], model_size[0]), dtype=np.uint8)
+    for idx in range(len(frames)):
+        small_frames[idx] = cv2.resize(frames[idx], model_size, interpolation=cv2.INTER_AREA)
+        if masks[idx].any():
+            small_masks[idx] = cv2.resize(masks[idx], model_size, interpolation=cv2.INTER_NEAREST)
+    inpainted = pool.inpaint(small_frames, small_masks, shots)
+    result = frames.copy()
+    for idx in range(len(frames)):
+        if masks[idx].any():
+            result[idx] = cv2.resize(inpainted[idx], (width, height), interpolation=cv2.INTER_LINEAR)
+    return result
+
+
+def inpaint_frames(frames: np.ndarray, masks: np.ndarray, shots: List[Tuple[int, int]],
+                   mode: str = INPAINT_MODE, pool: Optional[InpaintWorkerPool] = None,
+                   model_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """
+    按修复方式修复帧序列：auto 模式下静止镜头用背景填充，其余镜头交给 E2FGVI 修复进程池。
+
+    背景填充和静止判定在传入的分辨率上进行（通常为原分辨率的裁剪区域，像素级的阈值才有意义）；
+    提供 model_size 时，交给 E2FGVI 的镜头先缩放到模型输入尺寸，修复结果再缩放回来。
+
+    参数:
+        frames (np.ndarray): 形状为 (T, H, W, 3) 的 uint8 RGB 帧
+        masks (np.ndarray): 形状为 (T, H, W) 的掩码，非 0 表示需要修复
+        shots (List[Tuple[int, int]]): 镜头范围 [start, end)
+        mode (str): "auto"、"e2fgvi" 或 "classical"
+        model_size (Optional[Tuple[int, int]]): E2FGVI 的输入尺寸 (宽, 高)，为 None 时不缩放
+
+    异常:
+        ValueError: 如果修复方式不受支持
+    """
+    if mode not in INPAINT_MODES:
+        raise ValueError(f"不支持的修复方式: {mode}")
+    pool = pool or inpainting_pool
+    if mode == 'e2fgvi':
+        return _inpaint_resized(pool, frames, masks, shots, model_size)
+
+    result, escalated = classical_inpaint(frames, masks, shots, force=mode == 'classical')
+    if escalated:
+        # 只有升级的镜头保留掩码，其余镜头的窗口在进程池中直接跳过
+        escalated_masks = np.zeros_like(masks)
+        for start, end in escalated:
+            escalated_masks[start:end] = masks[start:end]
+        inpainted = _inpaint_resized(pool, frames, escalated_masks, shots, model_size)
+        for start, end in escalated:
+            result[start:end] = inpainted[start:end]
+    logger.info(f"共 {len(shots)} 个镜头，{len(escalated)} 个使用 E2FGVI 修复")
+    return result
+
+
+def inpaint_settings(mode: str = INPAINT_MODE, pool: Optional[InpaintWorkerPool] = None) -> Dict[str, Any]:
+    """返回影响修复结果的全部配置（修复方式、模型、区域裁剪、分块和背景填充参数），用于缓存修复结果的键。"""
+    supervisor = (pool or inpainting_pool).supervisors[0]
+    return {
+        "mode": mode,
+        "model": supervisor.model,
+        "ckpt": supervisor.ckpt,
+        "mask_dilation": INPAINT_MASK_DILATION,
+        "roi": (INPAINT_ROI_MARGIN, INPAINT_ROI_MIN_MARGIN, INPAINT_ROI_MAX_FRACTION, INPAINT_TEMPORAL_MARGIN),
+        "tube": (INPAINT_TUBE_SMOOTH, INPAINT_TUBE_MAX_GAP, INPAINT_TUBE_MAX_FRAMES, INPAINT_TUBE_MIN_FRAMES,
+                 INPAINT_TUBE_MAX_GROWTH),
+        "chunk": (INPAINT_CHUNK_FRAMES, INPAINT_CHUNK_OVERLAP),
+        "classical": (STATIC_MAX_SHIFT, STATIC_MAX_DIFF, STATIC_SAMPLE_STEP, CLASSICAL_FILL, CLASSICAL_MAX_UNSEEN)
+    }
+
+
+def inpaint_video(input_video_path: str, mask_dir: str, output_video_path: str, boxes=None,
+                  mode: str = INPAINT_MODE, pool: Optional[InpaintWorkerPool] = None,
+                  copy_audio: bool = True) -> None:
+    """
+    使用常驻修复进程消除视频中掩码覆盖的目标。
+
+    提供每帧的目标包围框时，按 plan_tubes 把目标出现的帧划分为帧段，每段（前后各留
+    INPAINT_TEMPORAL_MARGIN 帧参考）只把该段内目标附近的区域裁剪出来、缩放到模型输入尺寸后送入修复进程，
+    计算量随目标大小而不是画面大小变化，移动的目标也不会让裁剪区域扩大到整条运动轨迹。
+    修复结果放大回原尺寸后只替换掩码区域，其余像素保持原视频画质。
+    帧取自共享帧存储（与分割阶段共用，不再重新解码），同时检测镜头切换；静止镜头直接用背景填充，
+    其余镜头由修复进程池按时间窗口并行修复。合成后的帧通过管道直接交给 FFmpeg 编码，并复制原视频的音轨。
+
+    参数:
+        input_video_path (str): 输入视频路径
+        mask_dir (str): 黑白掩码图像目录
+        output_video_path (str): 输出视频路径
+        boxes (np.ndarray): 形状为 (帧数, 4) 的每帧目标包围框，原视频坐标系，没有目标的帧为 -1；
+            为 None 时处理整段视频的完整画面
+        mode (str): 修复方式，见 INPAINT_MODE
+        pool (InpaintWorkerPool): 修复进程池，默认为全局实例
+        copy_audio (bool): 是否复制原视频的音轨，为 False 时只输出视频流（由调用方另行合并音轨）
+    """
+    if mode not in INPAINT_MODES:
+        raise ValueError(f"不支持的修复方式: {mode}")
+    pool = pool or inpainting_pool
+    with frame_stores.acquire(input_video_path) as frames:
+        _inpaint_frame_store(frames, mask_dir, output_video_path, boxes, mode, pool,
+                             audio_from=input_video_path if copy_audio else None)
+    logger.info(f"目标消除完成: {output_video_path}")
+
+
+def _inpaint_frame_store(frames: FrameStore, mask_dir: str, output_video_path: str, boxes,
+                         mode: str, pool: InpaintWorkerPool, audio_from: Optional[str] = None) -> None:
+    """inpaint_video 的实现：逐个帧段修复，修复后按帧序合成写出，帧段之外的帧原样写出。"""
+    width, height = frames.size
+    total = len(frames)
+    if boxes is None:
+        tubes = [(0, total - 1, None)]
+    else:
+        tubes = plan_tubes(boxes)
+        logger.info(f"修复分为 {len(tubes)} 个帧段")
+
+    with FFmpegWriter(output_video_path, (width, height), frames.fps, audio_from=audio_from) as writer:
+        next_frame = 0
+        for tube in tubes:
+            composite = _inpaint_tube(frames, mask_dir, tube, mode, pool)
+            first, last, _ = tube
+            # 帧段之外的帧只顺序读取一次，不写入帧存储的分块
+            for frame in frames.iter_frames(next_frame, first):
+                writer.write(frame)
+            for frame_idx in range(max(first, next_frame), last + 1):
+                writer.write(composite(frame_idx))
+            next_frame = max(next_frame, last + 1)
+        for frame in frames.iter_frames(next_frame, total):
+            writer.write(frame)
+
+
+def _inpaint_tube(frames: FrameStore, mask_dir: str, tube, mode: str, pool: InpaintWorkerPool):
+    """
+    修复一个帧段：在帧存储的只读视图上裁剪修复区域并修复。
+
+    参数:
+        tube (tuple): (首帧, 末帧, 包围框)，包围框为 None 时处理完整画面且不加前后参考帧
+
+    返回:
+        Callable[[int], np.ndarray]: 按帧索引返回合成后的帧（BGR），只对首帧到末帧之间的帧调用
+    """
+    width, height = frames.size
+    total = len(frames)
+    model_size = pool.model_size
+    tube_first, tube_last, box = tube
+    roi = (0, 0, width, height)
+    first, last = tube_first, tube_last
+    if box is not None:
+        aspect = model_size[0] / model_size[1] if model_size else None
+        roi = compute_roi(box, (width, height), aspect)
+        if (roi[2] - roi[0]) * (roi[3] - roi[1]) > INPAINT_ROI_MAX_FRACTION * width * height:
+            roi = (0, 0, width, height)  # 目标占画面大部分时裁剪没有收益
+        first = max(0, first - INPAINT_TEMPORAL_MARGIN)
+        last = min(total - 1, last + INPAINT_TEMPORAL_MARGIN)
+    x1, y1, x2, y2 = roi
+    roi_size = (x2 - x1, y2 - y1)
+    model_input = model_size or roi_size
+    # 只用 E2FGVI 时直接裁剪到模型输入尺寸；背景填充需要在原分辨率上判定静止和填充，
+    # 升级为 E2FGVI 的镜头在 inpaint_frames 中再缩放
+    size = model_input if mode == 'e2fgvi' else roi_size
+    logger.info(f"修复区域: 第 {first}-{last} 帧，画面 {roi}（原画面 {width}x{height}），"
+                f"处理尺寸 {size[0]}x{size[1]}，模型输入 {model_input[0]}x{model_input[1]}")
+
+    # 1. 裁剪（必要时缩放）修复区域（帧存储中的视图，只在缩放和颜色转换时复制）
+    length = last - first + 1
+    crops = np.empty((length, size[1], size[0], 3), dtype=np.uint8)
+    masks = np.empty((length, size[1], size[0]), dtype=np.uint8)
+    detector = ShotDetector()
+    for local_idx in range(length):
+        frame = frames.frame(first + local_idx)
+        detector.update(frame)
+        crop = frame[y1:y2, x1:x2]
+        if roi_size != size:
+            crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(crop, cv2.COLOR_BGR2RGB, dst=crops[local_idx])
+        masks[local_idx] = prepare_mask(read_mask(mask_dir, first + local_idx), roi, size)
+
+    shots = detector.shots(length)
+    if len(shots) > 1:
+        logger.info(f"修复帧段内检测到 {len(shots)} 个镜头")
+    inpainted = inpaint_frames(crops, masks, shots, mode, pool, model_size=model_input)
+    del crops
+
+    # 2. 把修复结果贴回原画面的掩码区域
+    def composite(frame_idx: int) -> np.ndarray:
+        frame = frames.frame(frame_idx)
+        local_idx = frame_idx - first
+        mask = masks[local_idx]
+        if not mask.any():
+            return frame
+        result = cv2.cvtColor(inpainted[local_idx], cv2.COLOR_RGB2BGR)
+        if roi_size != size:
+            result = cv2.resize(result, roi_size, interpolation=cv2.INTER_LINEAR)
+            mask = cv2.resize(mask, roi_size, interpolation=cv2.INTER_NEAREST)
+        frame = frame.copy()  # 帧存储为只读，只复制需要合成的帧
+        region = frame[y1:y2, x1:x2]
+        frame[y1:y2, x1:x2] = np.where(mask[..., None] != 0, result, region)
+        return frame
+
+    return composite
+
+
+# 全局修复进程池实例
+inpainting_pool = InpaintWorkerPool()
+atexit.register(inpainting_pool.shutdown)
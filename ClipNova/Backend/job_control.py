@@ -0,0 +1,339 @@
+import os
+import math
+import time
+import itertools
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List
+from cost_model import cost_estimator
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    """读取整数类型的环境变量，未设置时返回默认值。"""
+    return int(os.environ.get(name, default))
+
+
+# 各任务类别的并发预算与排队上限，可通过环境变量覆盖
+JOB_CLASSES: Dict[str, Dict[str, Any]] = {
+    'llm': {
+        'concurrency': _env_int("CLIPNOVA_LLM_CONCURRENCY", 8),
+        'queue_size': _env_int("CLIPNOVA_LLM_QUEUE", 32),
+        'queue_timeout': _env_int("CLIPNOVA_LLM_QUEUE_TIMEOUT", 30),
+        'weight': 1.0,
+        'uses_compute': False,
+        'description': '仅调用大模型解析指令'
+    },
+    'render': {
+        'concurrency': _env_int("CLIPNOVA_RENDER_CONCURRENCY", 2),
+        'queue_size': _env_int("CLIPNOVA_RENDER_QUEUE", 8),
+        'queue_timeout': _env_int("CLIPNOVA_RENDER_QUEUE_TIMEOUT", 120),
+        'weight': 1.0,
+        'uses_compute': True,
+        'description': 'MoviePy 渲染'
+    },
+    'removal': {
+        # 默认与 SAM2 预测器池的容量（每个检查点的预测器数量）一致，多出的任务只会在租借预测器时空等
+        'concurrency': _env_int("CLIPNOVA_REMOVAL_CONCURRENCY", _env_int("SAM2_POOL_SIZE", 1)),
+        'queue_size': _env_int("CLIPNOVA_REMOVAL_QUEUE", 4),
+        'queue_timeout': _env_int("CLIPNOVA_REMOVAL_QUEUE_TIMEOUT", 1800),
+        'weight': 1.0,
+        'uses_compute': True,
+        'description': 'SAM2 分割与目标消除'
+    }
+}
+
+# 渲染与目标消除共享的计算名额总数（CPU 密集型任务）
+COMPUTE_SLOTS = _env_int("CLIPNOVA_COMPUTE_SLOTS", 2)
+# 排队老化速率：每等待 1 秒，调度优先级提前的虚拟秒数，保证重任务不会被持续到达的短任务饿死
+AGING_RATE = float(os.environ.get("CLIPNOVA_SCHEDULER_AGING", "1.0"))
+# 单个任务推进虚拟时间的上限（虚拟秒）。预计耗时只决定排队顺序，重任务的完成时间被截断，
+# 否则预计几千秒的目标消除要排队同样久才能靠老化追上短任务，在等待超时之前永远得不到名额
+MAX_TAG_SECONDS = float(os.environ.get("CLIPNOVA_SCHEDULER_MAX_TAG", "120"))
+
+
+class AdmissionRejected(Exception):
+    """排队已满或等待超时时抛出，由 API 层转换为 429 响应。"""
+
+    def __init__(self, job_class: str, retry_after: int, reason: str):
+        super().__init__(f"{job_class} 任务繁忙: {reason}")
+        self.job_class = job_class
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class JobClassLimiter:
+    """单个任务类别的并发预算与统计信息，由 AdmissionController 在同一把锁下维护。"""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, queue_timeout: float,
+                 weight: float = 1.0, uses_compute: bool = False):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout = queue_timeout
+        self.weight = weight
+        self.uses_compute = uses_compute
+        self.running = 0
+        self.waiting = 0
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.completed_total = 0
+        self.failed_total = 0
+        self.avg_service_time = None  # 平均执行耗时（秒），指数滑动平均
+        self.avg_wait_time = 0.0
+        self.avg_estimate_error = None  # 预计耗时与实际耗时之比的滑动平均
+
+    def has_capacity(self) -> bool:
+        return self.running < self.concurrency
+
+    def record_completion(self, elapsed: float, estimated: float, failed: bool) -> None:
+        """更新完成计数和耗时统计。"""
+        self.completed_total += 1
+        if failed:
+            self.failed_total += 1
+        if self.avg_service_time is None:
+            self.avg_service_time = elapsed
+        else:
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * elapsed
+        if estimated > 0:
+            ratio = elapsed / estimated
+            self.avg_estimate_error = ratio if self.avg_estimate_error is None \
+                else 0.8 * self.avg_estimate_error + 0.2 * ratio
+
+    def metrics(self) -> Dict[str, Any]:
+        """返回当前类别的运行指标。"""
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "queue_timeout": self.queue_timeout,
+            "weight": self.weight,
+            "running": self.running,
+            "waiting": self.waiting,
+            "admitted_total": self.admitted_total,
+            "rejected_total": self.rejected_total,
+            "completed_total": self.completed_total,
+            "failed_total": self.failed_total,
+            "avg_service_time": self.avg_service_time,
+            "avg_wait_time": self.avg_wait_time,
+            "avg_actual_to_estimate": self.avg_estimate_error
+        }
+
+
+class _Waiter:
+    """排队中的任务。"""
+
+    def __init__(self, seq: int, limiter: JobClassLimiter, session: str, cost: float,
+                 start_tag: float, finish_tag: float):
+        self.seq = seq
+        self.limiter = limiter
+        self.session = session
+        self.cost = cost
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+    def priority(self, now: float) -> float:
+        """调度优先级，数值越小越先执行。"""
+        return self.finish_tag - AGING_RATE * (now - self.enqueued_at)
+
+
+class AdmissionController:
+    """
+    按任务类别进行准入控制，并按预计开销调度排队任务。
+
+    每个类别拥有独立的并发预算和有界等待队列；渲染与目标消除还共享 COMPUTE_SLOTS 个计算名额。
+    排队任务按会话加权公平排队（start-time fair queuing）：任务到达时根据预计耗时计算虚拟完成时间，
+    名额空出时优先调度虚拟完成时间最小且所在类别有空闲名额的任务。短任务因此很快得到执行，
+    同一会话连续提交的重任务会推迟自己的虚拟时间，不会挤占其他会话；排队老化保证重任务也能稳定推进。
+    """
+
+    def __init__(self, job_classes: Dict[str, Dict[str, Any]] = JOB_CLASSES,
+                 compute_slots: int = COMPUTE_SLOTS, estimator=cost_estimator):
+        self.limiters = {
+            name: JobClassLimiter(name, cfg['concurrency'], cfg['queue_size'], cfg['queue_timeout'],
+                                  cfg.get('weight', 1.0), cfg.get('uses_compute', False))
+            for name, cfg in job_classes.items()
+        }
+        self.compute_slots = max(1, compute_slots)
+        self.compute_running = 0
+        self.estimator = estimator
+        self.condition = threading.Condition()
+        self.waiters: List[_Waiter] = []
+        self.sequence = itertools.count()
+        self.virtual_time = 0.0
+        self.session_finish: Dict[str, float] = {}  # 会话 -> 最近一个任务的虚拟完成时间
+
+    def _can_run(self, limiter: JobClassLimiter) -> bool:
+        if not limiter.has_capacity():
+            return False
+        return not limiter.uses_compute or self.compute_running < self.compute_slots
+
+    def _start(self, limiter: JobClassLimiter, start_tag: float) -> None:
+        limiter.running += 1
+        limiter.admitted_total += 1
+        if limiter.uses_compute:
+            self.compute_running += 1
+        self.virtual_time = max(self.virtual_time, start_tag)
+
+    def _dispatch(self) -> None:
+        """按虚拟完成时间顺序把空闲名额分配给排队任务。"""
+        granted_any = False
+        now = time.monotonic()
+        for waiter in sorted(self.waiters, key=lambda w: (w.priority(now), w.seq)):
+            if self._can_run(waiter.limiter):
+                waiter.granted = True
+                self.waiters.remove(waiter)
+                self._start(waiter.limiter, waiter.start_tag)
+                granted_any = True
+        if granted_any:
+            self.condition.notify_all()
+
+    def _tag_cost(self, limiter: JobClassLimiter, cost: float) -> float:
+        """
+        任务在虚拟时间上的长度：预计耗时按权重换算后截断到 MAX_TAG_SECONDS，
+        且不超过排队超时的一半所能老化的量，保证任何排队任务都能在超时之前领先新到达的任务。
+        """
+        cap = MAX_TAG_SECONDS
+        if limiter.queue_timeout and AGING_RATE > 0:
+            cap = min(cap, 0.5 * limiter.queue_timeout * AGING_RATE)
+        return min(cost / limiter.weight, cap)
+
+    def _retry_after(self, limiter: JobClassLimiter) -> int:
+        """根据同类别排队任务的预计耗时估计客户端应等待的秒数。"""
+        queued = sum(w.cost for w in self.waiters if w.limiter is limiter)
+        service_time = limiter.avg_service_time or 5.0
+        return max(1, int(math.ceil((queued + service_time) / limiter.concurrency)))
+
+    def _acquire(self, limiter: JobClassLimiter, session: str, cost: float,
+                 timeout: Optional[float]) -> float:
+        timeout = limiter.queue_timeout if timeout is None else timeout
+        start = time.monotonic()
+        with self.condition:
+            previous_finish = self.session_finish.get(session)
+            start_tag = max(self.virtual_time, previous_finish or 0.0)
+            finish_tag = start_tag + self._tag_cost(limiter, cost)
+
+            if not self.waiters and self._can_run(limiter):
+                self.session_finish[session] = finish_tag
+                self._start(limiter, start_tag)
+                return 0.0
+
+            if limiter.waiting >= limiter.queue_size:
+                limiter.rejected_total += 1
+                raise AdmissionRejected(limiter.name, self._retry_after(limiter), "等待队列已满")
+
+            self.session_finish[session] = finish_tag
+
+            waiter = _Waiter(next(self.sequence), limiter, session, cost, start_tag, finish_tag)
+            self.waiters.append(waiter)
+            limiter.waiting += 1
+            try:
+                self._dispatch()
+                deadline = start + timeout
+                while not waiter.granted:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.waiters.remove(waiter)
+                        limiter.rejected_total += 1
+                        # 没有执行的任务不推迟会话的虚拟时间（之后同会话又有任务排队时保留其时间）
+                        if self.session_finish.get(session) == finish_tag:
+                            if previous_finish is None:
+                                self.session_finish.pop(session, None)
+                            else:
+                                self.session_finish[session] = previous_finish
+                        raise AdmissionRejected(limiter.name, self._retry_after(limiter), "排队等待超时")
+                    self.condition.wait(remaining)
+            finally:
+                limiter.waiting -= 1
+
+            waited = time.monotonic() - start
+            limiter.avg_wait_time = 0.8 * limiter.avg_wait_time + 0.2 * waited
+            return waited
+
+    def _release(self, limiter: JobClassLimiter, elapsed: float, estimated: float, failed: bool) -> None:
+        with self.condition:
+            limiter.running -= 1
+            if limiter.uses_compute:
+                self.compute_running -= 1
+            limiter.record_completion(elapsed, estimated, failed)
+            # 清理已无排队任务的会话记录，避免字典无限增长
+            if len(self.session_finish) > 1024:
+                active = {w.session for w in self.waiters}
+                self.session_finish = {s: f for s, f in self.session_finish.items()
+                                       if s in active or f > self.virtual_time}
+            self._dispatch()
+
+    @contextmanager
+    def admit(self, job_class: str, op: Optional[str] = None, video_path: Optional[str] = None,
+              session: Optional[str] = None, timeout: Optional[float] = None):
+        """
+        在指定类别的并发预算内执行代码块。
+
+        参数:
+            job_class (str): 任务类别，必须是 JOB_CLASSES 中定义的类别之一。
+            op (Optional[str]): 操作类型，用于估计开销，默认与类别同名。
+            video_path (Optional[str]): 输入视频路径，用于读取时长、分辨率和帧数。
+            session (Optional[str]): 会话标识，用于会话间公平调度。
+            timeout (Optional[float]): 最长排队秒数。
+
+        异常:
+            ValueError: 如果任务类别未定义。
+            AdmissionRejected: 如果无法在队列限制内获得执行名额。
+        """
+        if job_class not in self.limiters:
+            raise ValueError(f"未知的任务类别: {job_class}")
+        limiter = self.limiters[job_class]
+        op = op or job_class
+        estimated = self.estimator.estimate(op, video_path)
+
+        waited = self._acquire(limiter, session or "anonymous", estimated, timeout)
+        if waited > 0:
+            logger.info(f"{job_class} 任务 ({op}, 预计 {estimated:.1f} 秒) 排队 {waited:.2f} 秒后开始执行")
+        start = time.monotonic()
+        failed = False
+        try:
+            yield estimated
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            self._release(limiter, elapsed, estimated, failed)
+            if not failed:
+                self.estimator.record(op, video_path, elapsed)
+
+    def estimate_wait(self, job_class: str) -> float:
+        """估计新提交的任务在指定类别中需要排队的秒数。"""
+        with self.condition:
+            limiter = self.limiters[job_class]
+            queued = sum(w.cost for w in self.waiters if w.limiter is limiter)
+            if queued == 0 and self._can_run(limiter):
+                return 0.0
+            # 运行中的任务平均还剩一半的执行时间
+            in_service = limiter.running * (limiter.avg_service_time or 0.0) / 2
+            return (queued + in_service) / limiter.concurrency
+
+    def metrics(self) -> Dict[str, Any]:
+        """返回所有类别的运行指标和调度器状态。"""
+        now = time.monotonic()
+        with self.condition:
+            return {
+                "classes": {name: limiter.metrics() for name, limiter in self.limiters.items()},
+                "compute_slots": self.compute_slots,
+                "compute_running": self.compute_running,
+                "virtual_time": self.virtual_time,
+                "queue": [
+                    {"job_class": w.limiter.name, "session": w.session,
+                     "estimated_seconds": w.cost, "finish_tag": w.finish_tag}
+                    for w in sorted(self.waiters, key=lambda w: (w.priority(now), w.seq))
+                ],
+                "cost_model": self.estimator.summary()
+            }
+
+
+# 全局准入控制器实例
+admission_controller = AdmissionController()
@@ -0,0 +1,155 @@
+import cv2
+import numpy as np
+from typing import Callable, Dict, Optional
+
+# 计算光流时图像的最大宽度，光流只用于搬运掩码，不需要原分辨率
+FLOW_MAX_WIDTH = 480
+
+
+def mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    """返回两个二值掩码的 IoU，两者都为空时返回 1。"""
+    union = np.logical_or(a, b).sum()
+    if union == 0:
+        return 1.0
+    return float(np.logical_and(a, b).sum() / union)
+
+
+def area_change(a: np.ndarray, b: np.ndarray) -> float:
+    """返回两个掩码面积的相对变化 |Aa - Ab| / max(Aa, Ab)，两者都为空时返回 0。"""
+    area_a, area_b = int(a.sum()), int(b.sum())
+    if max(area_a, area_b) == 0:
+        return 0.0
+    return abs(area_a - area_b) / max(area_a, area_b)
+
+
+def _signed_distance(mask: np.ndarray) -> np.ndarray:
+    """返回掩码的有符号距离场：内部为正，外部为负。"""
+    mask = mask.astype(np.uint8)
+    inside = cv2.distanceTransform(mask, cv2.DIST_L2, 3)
+    outside = cv2.distanceTransform(1 - mask, cv2.DIST_L2, 3)
+    return inside - outside
+
+
+def shape_interpolate(mask_a: np.ndarray, mask_b: np.ndarray, weight: float) -> np.ndarray:
+    """
+    按有符号距离场线性插值两个关键帧之间的掩码形状。
+
+    参数:
+        mask_a (np.ndarray): 前一关键帧的掩码，形状为 (H, W)。
+        mask_b (np.ndarray): 后一关键帧的掩码，形状为 (H, W)。
+        weight (float): 插值位置，0 表示 mask_a，1 表示 mask_b。
+
+    返回:
+        np.ndarray: 插值后的布尔掩码。
+    """
+    sdf = (1 - weight) * _signed_distance(mask_a) + weight * _signed_distance(mask_b)
+    return sdf > 0
+
+
+class FlowInterpolator:
+    """
+    用光流把两个关键帧的掩码搬运到中间帧，再按时间距离加权融合。
+
+    对每个中间帧分别计算到前后关键帧的反向光流（中间帧像素在关键帧中的位置），
+    以 remap 取出关键帧掩码，因此不会出现正向搬运时的空洞。
+    光流只与帧对有关，同一对帧的光流只计算一次，所有对象的掩码共用。
+    """
+
+    def __init__(self, read_frame: Callable[[int], np.ndarray], max_width: int = FLOW_MAX_WIDTH):
+        """
+        参数:
+            read_frame (Callable[[int], np.ndarray]): 按帧索引返回 BGR 帧，通常为 FrameStore.frame。
+            max_width (int): 计算光流时帧的最大宽度。
+        """
+        self.read_frame = read_frame
+        self.max_width = max_width
+        self._gray_cache = {}
+        self._flow_cache = {}
+
+    def _load_gray(self, frame_idx: int) -> np.ndarray:
+        gray = self._gray_cache.get(frame_idx)
+        if gray is None:
+            gray = cv2.cvtColor(self.read_frame(frame_idx), cv2.COLOR_BGR2GRAY)
+            if gray.shape[1] > self.max_width:
+                height = int(round(gray.shape[0] * self.max_width / gray.shape[1]))
+                gray = cv2.resize(gray, (self.max_width, height), interpolation=cv2.INTER_AREA)
+            # 只缓存关键帧附近的少量帧
+            if len(self._gray_cache) > 8:
+                self._gray_cache.clear()
+            self._gray_cache[frame_idx] = gray
+        return gray
+
+    def _flow_maps(self, target_idx: int, source_idx: int):
+        """返回 target 帧像素在 source 帧中的位置 (map_x, map_y)，同一对帧只计算一次光流。"""
+        key = (target_idx, source_idx)
+        maps = self._flow_cache.get(key)
+        if maps is None:
+            gray_target = self._load_gray(target_idx)
+            flow = cv2.calcOpticalFlowFarneback(gray_target, self._load_gray(source_idx), None,
+                                                0.5, 3, 15, 3, 5, 1.2, 0)
+            height, width = gray_target.shape
+            grid_x, grid_y = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+            maps = (grid_x + flow[..., 0], grid_y + flow[..., 1])
+            # 每个中间帧只与前后两个关键帧配对，保留当前帧的两个光流即可
+            if len(self._flow_cache) >= 2:
+                self._flow_cache.clear()
+            self._flow_cache[key] = maps
+        return maps
+
+    @staticmethod
+    def _warp(mask: np.ndarray, maps) -> np.ndarray:
+        """按光流位置图搬运掩码，返回 [0, 1] 的浮点掩码（掩码分辨率）。"""
+        map_x, map_y = maps
+        height, width = map_x.shape
+        small = cv2.resize(mask.astype(np.float32), (width, height), interpolation=cv2.INTER_LINEAR)
+        warped = cv2.remap(small, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        return cv2.resize(warped, (mask.shape[1], mask.shape[0]), interpolation=cv2.INTER_LINEAR)
+
+    def interpolate(self, frame_idx: int, idx_a: int, mask_a: Optional[np.ndarray],
+                    idx_b: int, mask_b: Optional[np.ndarray], weight: float) -> np.ndarray:
+        """
+        生成中间帧的掩码。
+
+        参数:
+            frame_idx (int): 中间帧索引。
+            idx_a, mask_a: 前一关键帧的帧索引和掩码（掩码可为 None）。
+            idx_b, mask_b: 后一关键帧的帧索引和掩码（掩码可为 None）。
+            weight (float): 中间帧在两个关键帧之间的位置，0 表示前一关键帧，1 表示后一关键帧。
+
+        返回:
+            np.ndarray: 布尔掩码，形状与关键帧掩码相同。
+        """
+        return self.interpolate_objects(frame_idx, idx_a, {0: mask_a}, idx_b, {0: mask_b}, weight)[0]
+
+    def interpolate_objects(self, frame_idx: int, idx_a: int, masks_a: Dict[int, Optional[np.ndarray]],
+                            idx_b: int, masks_b: Dict[int, Optional[np.ndarray]],
+                            weight: float) -> Dict[int, np.ndarray]:
+        """
+        生成中间帧上多个对象的掩码，到两个关键帧的光流各计算一次，所有对象共用。
+
+        参数:
+            frame_idx (int): 中间帧索引。
+            idx_a, masks_a: 前一关键帧的帧索引和 {对象 ID: 掩码}（掩码可为 None）。
+            idx_b, masks_b: 后一关键帧的帧索引和 {对象 ID: 掩码}，对象与 masks_a 一致。
+            weight (float): 中间帧在两个关键帧之间的位置，0 表示前一关键帧，1 表示后一关键帧。
+
+        返回:
+            Dict[int, np.ndarray]: {对象 ID: 布尔掩码}，形状与关键帧掩码相同。
+        """
+        results = {}
+        for obj_id in masks_a:
+            mask_a, mask_b = masks_a[obj_id], masks_b.get(obj_id)
+            blended = None
+            total_weight = 0.0
+            for idx, mask, w in ((idx_a, mask_a, 1 - weight), (idx_b, mask_b, weight)):
+                if mask is None or w <= 0:
+                    continue
+                warped = self._warp(mask, self._flow_maps(frame_idx, idx))
+                blended = warped * w if blended is None else blended + warped * w
+                total_weight += w
+            if blended is None:
+                shape = mask_a.shape if mask_a is not None else mask_b.shape
+                results[obj_id] = np.zeros(shape, dtype=bool)
+            else:
+                results[obj_id] = blended / total_weight >= 0.5
+        return results
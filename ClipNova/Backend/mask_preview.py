@@ -0,0 +1,147 @@
+import time
+import logging
+import cv2
+import numpy as np
+import torch
+from typing import Dict, Any, Optional
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+from sam2_pool import predictor_pool, get_checkpoint_paths, SAM2_DEFAULT_SIZE
+from sam2_model import SAM2_WORKING_SCALE, preprocess_frame, upsample_mask
+from frame_store import frame_stores
+from inference_profile import default_profile
+from feature_cache import feature_cache, feature_variant
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 租借预测器的最长等待秒数，预览请求不应排在长时间的分割任务后面
+PREVIEW_LEASE_TIMEOUT = 2.0
+
+def read_frame(video_path: str, frame_idx: int) -> np.ndarray:
+    """
+    读取一帧的副本（BGR）。
+
+    该帧已在共享帧存储中解码时直接复制，否则按时间戳定位后只解码这一帧：首次预览不需要解码整段视频。
+    两种方式解码出的帧相同，预览写入的特征缓存可以被之后的完整分割直接复用。
+
+    异常:
+        ValueError: 如果帧索引超出范围。
+    """
+    try:
+        return frame_stores.read_frame(video_path, frame_idx)
+    except IndexError as e:
+        raise ValueError(str(e)) from e
+
+
+def _get_image_predictor(predictor) -> SAM2ImagePredictor:
+    """为池中的视频预测器创建（并复用）共享同一模型权重的单帧预测器。"""
+    image_predictor = getattr(predictor, "_preview_image_predictor", None)
+    if image_predictor is None:
+        image_predictor = SAM2ImagePredictor(predictor)
+        predictor._preview_image_predictor = image_predictor
+    return image_predictor
+
+
+def _set_features(image_predictor: SAM2ImagePredictor, predictor, backbone_out: Dict[str, Any],
+                  orig_hw: tuple) -> None:
+    """把 backbone 输出直接设置为单帧预测器的图像特征（与 SAM2ImagePredictor.set_image 的处理一致）。"""
+    _, vision_feats, _, _ = predictor._prepare_backbone_features(backbone_out)
+    if predictor.directly_add_no_mem_embed:
+        vision_feats[-1] = vision_feats[-1] + predictor.no_mem_embed
+    feats = [
+        feat.permute(1, 2, 0).view(1, -1, *feat_size)
+        for feat, feat_size in zip(vision_feats[::-1], image_predictor._bb_feat_sizes[::-1])
+    ][::-1]
+    image_predictor._features = {"image_embed": feats[-1], "high_res_feats": feats[:-1]}
+    image_predictor._orig_hw = [orig_hw]
+    image_predictor._is_image_set = True
+    image_predictor._is_batch = False
+
+
+def predict_frame_mask(video_path: str, frame_idx: int, points: Optional[np.ndarray] = None,
+                       labels: Optional[np.ndarray] = None, box: Optional[np.ndarray] = None,
+                       size: str = SAM2_DEFAULT_SIZE, mask_size: Optional[tuple] = None) -> Dict[str, Any]:
+    """
+    只对一帧运行 SAM2，返回该帧的掩码，用于在传播和目标消除之前确认提示是否选中了正确的对象。
+
+    使用预测器池中已加载的模型；该帧的图像特征优先从特征缓存读取，未命中时计算并写入缓存，
+    之后对同一视频的完整分割也能直接复用。
+
+    参数:
+        video_path (str): 视频路径（与完整分割使用同一个工作文件，才能共用特征缓存）。
+        frame_idx (int): 帧索引。
+        points (Optional[np.ndarray]): 点坐标，形状为 (N, 2)，原视频坐标系。
+        labels (Optional[np.ndarray]): 点标签，形状为 (N,)，1 表示前景，0 表示背景。
+        box (Optional[np.ndarray]): 矩形框 [x1, y1, x2, y2]，原视频坐标系。
+        size (str): 模型尺寸。
+        mask_size (Optional[tuple]): 返回掩码的尺寸 (宽, 高)，通常为原视频分辨率；为 None 时与 video_path 的帧相同。
+
+    返回:
+        Dict[str, Any]: {"mask": 形状为 (H, W) 的布尔掩码, "score": 置信度,
+            "cache_hit": 是否命中特征缓存, "elapsed_ms": 耗时}
+
+    异常:
+        ValueError: 如果没有提供提示或帧索引无效。
+        TimeoutError: 如果预测器在 PREVIEW_LEASE_TIMEOUT 秒内没有空闲。
+    """
+    if points is None and box is None:
+        raise ValueError("必须提供点或矩形框提示")
+    start = time.perf_counter()
+    frame = read_frame(video_path, frame_idx)
+    orig_hw = frame.shape[:2]
+    _, checkpoint = get_checkpoint_paths(size)
+
+    with predictor_pool.lease(size, timeout=PREVIEW_LEASE_TIMEOUT) as predictor:
+        profile = default_profile(predictor.device.type)
+        key = None
+        if feature_cache.enabled:
+            key = feature_cache.make_key(video_path, checkpoint,
+                                         variant=feature_variant(SAM2_WORKING_SCALE, profile.name))
+
+        with torch.inference_mode(), profile.autocast():
+            backbone_out = feature_cache.get(key, frame_idx) if key else None
+            cache_hit = backbone_out is not None
+            if cache_hit:
+                device = predictor.device
+                backbone_fpn = [t.to(device) for t in backbone_out["backbone_fpn"]]
+                backbone_out = {
+                    "vision_features": backbone_fpn[-1],
+                    "vision_pos_enc": [t.to(device) for t in backbone_out["vision_pos_enc"]],
+                    "backbone_fpn": backbone_fpn
+                }
+            else:
+                # 与完整分割的帧加载（sam2_model.StoreFrameLoader）使用同一预处理，特征可以共用
+                image = preprocess_frame(frame, predictor.image_size).to(predictor.device).unsqueeze(0)
+                backbone_out = predictor.forward_image(image)
+                if key:
+                    feature_cache.put(key, frame_idx, backbone_out)
+
+            image_predictor = _get_image_predictor(predictor)
+            _set_features(image_predictor, predictor, backbone_out, orig_hw)
+            masks, scores, _ = image_predictor.predict(
+                point_coords=points,
+                point_labels=labels,
+                box=box,
+                multimask_output=False
+            )
+            image_predictor.reset_predictor()
+
+    mask = np.asarray(masks[0]) > 0
+    if mask_size is not None:
+        mask = upsample_mask(mask, mask_size)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logger.info(f"单帧掩码预览完成: 第 {frame_idx} 帧，缓存{'命中' if cache_hit else '未命中'}，耗时 {elapsed_ms:.0f}ms")
+    return {
+        "mask": mask,
+        "score": float(scores[0]),
+        "cache_hit": cache_hit,
+        "elapsed_ms": elapsed_ms
+    }
+
+
+def encode_mask_png(mask: np.ndarray) -> bytes:
+    """将二值掩码编码为单通道 PNG（前景为 255）。"""
+    ok, buffer = cv2.imencode('.png', mask.astype(np.uint8) * 255)
+    if not ok:
+        raise ValueError("掩码 PNG 编码失败")
+    return buffer.tobytes()
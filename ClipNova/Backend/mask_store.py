@@ -0,0 +1,287 @@
+import os
+import json
+import shutil
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Iterator, Tuple
+
+
+class MaskStore:
+    """
+    按帧、按对象存储二值掩码的紧凑容器。
+
+    每个掩码按位压缩（np.packbits，1/8 的空间），指定 root 时写入内存映射文件，
+    否则保存在内存中。支持按帧和对象随机访问、批量从设备写入以及 RLE 编码导出。
+    """
+
+    META_FILE = "meta.json"
+
+    def __init__(self, num_frames: int, height: int, width: int, root: Optional[str] = None):
+        """
+        创建空的掩码存储。
+
+        参数:
+            num_frames (int): 视频总帧数。
+            height (int): 掩码高度。
+            width (int): 掩码宽度。
+            root (Optional[str]): 内存映射文件所在目录，为 None 时保存在内存中。
+        """
+        self.num_frames = num_frames
+        self.height = height
+        self.width = width
+        self.packed_len = (height * width + 7) // 8
+        self.root = root
+        self.read_only = False
+        self.bits: Dict[int, np.ndarray] = {}     # 对象 ID -> (num_frames, packed_len) 的位数组
+        self.present: Dict[int, np.ndarray] = {}  # 对象 ID -> (num_frames,) 是否已写入
+        if root:
+            os.makedirs(root, exist_ok=True)
+
+    @classmethod
+    def open(cls, root: str, read_only: bool = False) -> "MaskStore":
+        """
+        打开已持久化到磁盘的掩码存储。
+
+        参数:
+            read_only (bool): 以只读方式打开（例如缓存中不可修改的分割结果），不能写入，关闭时也不写回磁盘。
+        """
+        with open(os.path.join(root, cls.META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        store = cls(meta["num_frames"], meta["height"], meta["width"])
+        store.root = root
+        store.read_only = read_only
+        for obj_id in meta["obj_ids"]:
+            store.bits[obj_id] = np.memmap(os.path.join(root, f"obj_{obj_id}.bits"), dtype=np.uint8,
+                                           mode="r" if read_only else "r+",
+                                           shape=(store.num_frames, store.packed_len))
+            store.present[obj_id] = np.load(os.path.join(root, f"obj_{obj_id}.present.npy"))
+        return store
+
+    def _ensure_object(self, obj_id: int) -> None:
+        if obj_id in self.bits:
+            return
+        shape = (self.num_frames, self.packed_len)
+        if self.root:
+            path = os.path.join(self.root, f"obj_{obj_id}.bits")
+            self.bits[obj_id] = np.memmap(path, dtype=np.uint8, mode="w+", shape=shape)
+        else:
+            self.bits[obj_id] = np.zeros(shape, dtype=np.uint8)
+        self.present[obj_id] = np.zeros(self.num_frames, dtype=bool)
+
+    def put(self, frame_idx: int, obj_id: int, mask: np.ndarray) -> None:
+        """
+        写入一帧中一个对象的掩码。
+
+        参数:
+            frame_idx (int): 帧索引。
+            obj_id (int): 对象 ID。
+            mask (np.ndarray): 二值掩码，形状为 (H, W) 或 (1, H, W)。
+        """
+        mask = np.asarray(mask).reshape(self.height, self.width)
+        self._ensure_object(obj_id)
+        self.bits[obj_id][frame_idx] = np.packbits(mask.astype(bool, copy=False).ravel())
+        self.present[obj_id][frame_idx] = True
+
+    def put_packed(self, frame_idx: int, obj_id: int, packed: np.ndarray) -> None:
+        """写入已按位压缩的掩码。"""
+        self._ensure_object(obj_id)
+        self.bits[obj_id][frame_idx] = packed
+        self.present[obj_id][frame_idx] = True
+
+    @contextmanager
+    def batch_writer(self, batch_size: int = 16):
+        """
+        返回批量写入器：掩码 logits 先在设备上累积，每 batch_size 帧统一阈值化并传回 CPU。
+
+        用法:
+            with store.batch_writer() as writer:
+                for frame_idx, obj_ids, logits in predictor.propagate_in_video(state):
+                    writer.add(frame_idx, obj_ids, logits)
+        """
+        writer = _MaskBatchWriter(self, batch_size)
+        try:
+            yield writer
+        finally:
+            writer.flush()
+
+    def get(self, frame_idx: int, obj_id: int) -> Optional[np.ndarray]:
+        """返回一帧中一个对象的掩码，形状为 (H, W)，未写入时返回 None。"""
+        if obj_id not in self.bits or not self.present[obj_id][frame_idx]:
+            return None
+        bits = np.unpackbits(self.bits[obj_id][frame_idx], count=self.height * self.width)
+        return bits.reshape(self.height, self.width).astype(bool)
+
+    def get_union(self, frame_idx: int) -> np.ndarray:
+        """返回一帧中所有对象掩码的并集，形状为 (H, W)。"""
+        packed = np.zeros(self.packed_len, dtype=np.uint8)
+        for obj_id in self.bits:
+            if self.present[obj_id][frame_idx]:
+                packed |= self.bits[obj_id][frame_idx]
+        bits = np.unpackbits(packed, count=self.height * self.width)
+        return bits.reshape(self.height, self.width).astype(bool)
+
+    def masks(self, frame_idx: int) -> Iterator[Tuple[int, np.ndarray]]:
+        """按对象 ID 顺序遍历一帧中的 (对象 ID, 掩码)。"""
+        for obj_id in sorted(self.bits):
+            mask = self.get(frame_idx, obj_id)
+            if mask is not None:
+                yield obj_id, mask
+
+    def area(self, frame_idx: int, obj_id: Optional[int] = None) -> int:
+        """返回掩码面积（像素数），obj_id 为 None 时返回所有对象并集的面积。"""
+        if obj_id is None:
+            return int(self.get_union(frame_idx).sum())
+        if obj_id not in self.bits or not self.present[obj_id][frame_idx]:
+            return 0
+        return int(np.unpackbits(self.bits[obj_id][frame_idx], count=self.height * self.width).sum())
+
+    def to_rle(self, frame_idx: int, obj_id: Optional[int] = None) -> Dict[str, object]:
+        """
+        将掩码编码为行优先的游程编码（RLE）。
+
+        返回:
+            Dict[str, object]: {"size": [H, W], "counts": [...]}，counts 从 0 值游程开始交替记录长度。
+        """
+        mask = self.get_union(frame_idx) if obj_id is None else self.get(frame_idx, obj_id)
+        if mask is None:
+            mask = np.zeros((self.height, self.width), dtype=bool)
+        return encode_rle(mask)
+
+    def frame_boxes(self) -> np.ndarray:
+        """
+        返回每帧所有对象掩码并集的包围框。
+
+        返回:
+            np.ndarray: 形状为 (num_frames, 4) 的 int32 数组，每行为 (x1, y1, x2, y2)，x2/y2 不包含在内；
+            没有掩码的帧为 -1。
+        """
+        boxes = np.full((self.num_frames, 4), -1, dtype=np.int32)
+        for frame_idx in self.frames():
+            mask = self.get_union(frame_idx)
+            ys = np.flatnonzero(mask.any(axis=1))
+            if len(ys) == 0:
+                continue
+            xs = np.flatnonzero(mask.any(axis=0))
+            boxes[frame_idx] = (xs[0], ys[0], xs[-1] + 1, ys[-1] + 1)
+        return boxes
+
+    def tube(self) -> Optional[Tuple[int, int, Tuple[int, int, int, int]]]:
+        """
+        返回所有对象掩码在时空上的包围范围。
+
+        返回:
+            Optional[Tuple]: (首帧, 末帧, (x1, y1, x2, y2))，x2/y2 不包含在内；没有任何掩码时返回 None。
+        """
+        boxes = self.frame_boxes()
+        present = np.flatnonzero(boxes[:, 0] >= 0)
+        if len(present) == 0:
+            return None
+        boxes = boxes[present]
+        return (int(present[0]), int(present[-1]),
+                (int(boxes[:, 0].min()), int(boxes[:, 1].min()), int(boxes[:, 2].max()), int(boxes[:, 3].max())))
+
+    @property
+    def obj_ids(self) -> List[int]:
+        return sorted(self.bits)
+
+    def frames(self) -> List[int]:
+        """返回至少有一个对象掩码的帧索引。"""
+        if not self.present:
+            return []
+        any_present = np.logical_or.reduce([p for p in self.present.values()])
+        return np.flatnonzero(any_present).tolist()
+
+    def __contains__(self, frame_idx: int) -> bool:
+        return 0 <= frame_idx < self.num_frames and any(p[frame_idx] for p in self.present.values())
+
+    def __getitem__(self, frame_idx: int) -> Dict[int, np.ndarray]:
+        """兼容旧的 video_segments 字典接口：返回 {对象 ID: 形状为 (1, H, W) 的掩码}。"""
+        return {obj_id: mask[None] for obj_id, mask in self.masks(frame_idx)}
+
+    def __len__(self) -> int:
+        return len(self.frames())
+
+    @property
+    def nbytes(self) -> int:
+        return sum(b.nbytes for b in self.bits.values())
+
+    def flush(self) -> None:
+        """将内存映射数据和元信息写回磁盘（只读打开时不写）。"""
+        if not self.root or self.read_only:
+            return
+        for obj_id, bits in self.bits.items():
+            if isinstance(bits, np.memmap):
+                bits.flush()
+            np.save(os.path.join(self.root, f"obj_{obj_id}.present.npy"), self.present[obj_id])
+        with open(os.path.join(self.root, self.META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"num_frames": self.num_frames, "height": self.height, "width": self.width,
+                       "obj_ids": self.obj_ids}, f)
+
+    def close(self, delete: bool = False) -> None:
+        """释放内存映射文件，delete 为 True 时删除磁盘上的数据。"""
+        if not delete:
+            self.flush()
+        self.bits.clear()
+        self.present.clear()
+        if delete and self.root and os.path.exists(self.root):
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+class _MaskBatchWriter:
+    """在设备上累积掩码 logits，按批次阈值化后一次性传回 CPU 并写入存储。"""
+
+    def __init__(self, store: MaskStore, batch_size: int):
+        self.store = store
+        self.batch_size = max(1, batch_size)
+        self.pending: List[Tuple[int, List[int], object]] = []
+
+    def add(self, frame_idx: int, obj_ids, mask_logits) -> None:
+        """
+        加入一帧的分割结果。
+
+        参数:
+            frame_idx (int): 帧索引。
+            obj_ids: 对象 ID 列表。
+            mask_logits: 形状为 (N, 1, H, W) 的 logits 张量（torch.Tensor 或 np.ndarray）。
+        """
+        self.pending.append((frame_idx, list(obj_ids), mask_logits))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        logits = [item[2] for item in self.pending]
+        if hasattr(logits[0], "cpu"):
+            import torch
+            # 同一批次的对象数一致时在设备上拼接后一次传输，否则逐帧传输
+            if len({tuple(t.shape) for t in logits}) == 1:
+                masks = (torch.stack(logits) > 0.0).cpu().numpy()
+            else:
+                masks = [(t > 0.0).cpu().numpy() for t in logits]
+        else:
+            masks = [np.asarray(t) > 0.0 for t in logits]
+
+        for (frame_idx, obj_ids, _), frame_masks in zip(self.pending, masks):
+            for i, obj_id in enumerate(obj_ids):
+                self.store.put(frame_idx, obj_id, frame_masks[i])
+        self.pending.clear()
+
+
+def encode_rle(mask: np.ndarray) -> Dict[str, object]:
+    """将二值掩码编码为行优先 RLE：{"size": [H, W], "counts": [0 游程, 1 游程, ...]}。"""
+    flat = np.asarray(mask, dtype=bool).ravel()
+    changes = np.flatnonzero(np.diff(flat.astype(np.int8))) + 1
+    boundaries = np.concatenate([[0], changes, [flat.size]])
+    counts = np.diff(boundaries).tolist()
+    if flat.size and flat[0]:
+        counts = [0] + counts
+    return {"size": [int(mask.shape[0]), int(mask.shape[1])], "counts": counts}
+
+
+def decode_rle(rle: Dict[str, object]) -> np.ndarray:
+    """将 encode_rle 的结果解码为二值掩码。"""
+    height, width = rle["size"]
+    values = np.arange(len(rle["counts"])) % 2 == 1
+    flat = np.repeat(values, rle["counts"])
+    return flat.reshape(height, width)
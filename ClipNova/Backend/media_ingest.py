@@ -0,0 +1,259 @@
+import os
+import json
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 夹层(mezzanine)格式配置，可通过环境变量覆盖
+MEZZANINE_ENABLED = os.environ.get("CLIPNOVA_MEZZANINE", "1") != "0"
+MEZZANINE_MAX_FPS = int(os.environ.get("CLIPNOVA_MEZZANINE_MAX_FPS", "30"))
+MEZZANINE_GOP = int(os.environ.get("CLIPNOVA_MEZZANINE_GOP", "15"))
+MEZZANINE_CRF = int(os.environ.get("CLIPNOVA_MEZZANINE_CRF", "18"))
+INGEST_WORKERS = int(os.environ.get("CLIPNOVA_INGEST_WORKERS", "1"))
+MEZZANINE_DIR_NAME = "mezzanine"
+
+
+def _parse_rate(rate: Optional[str]) -> float:
+    """将 ffprobe 返回的 '30000/1001' 形式帧率转换为浮点数。"""
+    if not rate or rate == "0/0":
+        return 0.0
+    if "/" in rate:
+        num, den = rate.split("/", 1)
+        return float(num) / float(den) if float(den) else 0.0
+    return float(rate)
+
+
+def probe_video(video_path: str) -> Dict[str, Any]:
+    """
+    使用 ffprobe 读取视频元数据。
+
+    参数:
+        video_path (str): 视频文件路径。
+
+    返回:
+        Dict[str, Any]: 包含 width、height（已按旋转角度换算为显示尺寸）、fps、
+        frame_count、duration、rotation、start_time（视频流相对文件开头的起始秒数）、
+        has_audio 和 is_vfr 的字典。
+
+    异常:
+        subprocess.CalledProcessError: 如果 ffprobe 执行失败。
+    """
+    command = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_streams',
+        '-show_format',
+        '-of', 'json',
+        video_path
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    info = json.loads(output)
+
+    video_stream = next((s for s in info.get("streams", []) if s.get("codec_type") == "video"), None)
+    if video_stream is None:
+        raise ValueError(f"文件中没有视频流: {video_path}")
+    has_audio = any(s.get("codec_type") == "audio" for s in info.get("streams", []))
+
+    # 旋转信息可能在 tags.rotate（旧版）或 displaymatrix side data（新版）中
+    rotation = int(video_stream.get("tags", {}).get("rotate", 0) or 0)
+    for side_data in video_stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            rotation = int(side_data["rotation"])
+    rotation %= 360
+
+    width = int(video_stream.get("width", 0))
+    height = int(video_stream.get("height", 0))
+    if rotation in (90, 270):
+        width, height = height, width
+
+    avg_fps = _parse_rate(video_stream.get("avg_frame_rate"))
+    real_fps = _parse_rate(video_stream.get("r_frame_rate"))
+    fps = avg_fps or real_fps
+    duration = float(video_stream.get("duration") or info.get("format", {}).get("duration") or 0.0)
+    frame_count = int(video_stream.get("nb_frames") or 0) or int(round(duration * fps))
+    # 视频流相对文件开头的起始时间：FFmpeg 的 -ss 输入定位以文件开头为基准，按帧号定位时需要加上
+    format_start = float(info.get("format", {}).get("start_time") or 0.0)
+    start_time = max(0.0, float(video_stream.get("start_time") or format_start) - format_start)
+
+    return {
+        "width": width,
+        "height": height,
+        "fps": fps,
+        "frame_count": frame_count,
+        "duration": duration,
+        "rotation": rotation,
+        "start_time": start_time,
+        "has_audio": has_audio,
+        "is_vfr": bool(avg_fps and real_fps and abs(avg_fps - real_fps) > 0.01)
+    }
+
+
+class MezzanineManager:
+    """
+    上传视频的后台标准化管理器。
+
+    每个上传文件会在后台转码为统一的夹层格式（恒定帧率、短固定 GOP、应用旋转、
+    音频响度归一化）。夹层文件只用于分析（大模型定位、SAM2 分割、预览），
+    编辑器渲染、目标消除的修复和音轨合并始终使用原始文件，输出不受夹层的帧率上限和重新编码影响。
+    转码失败的结果会被记住，原始文件没有变化时不会在每次请求时重新转码。
+    """
+
+    def __init__(self, enabled: bool = MEZZANINE_ENABLED, max_workers: int = INGEST_WORKERS):
+        self.enabled = enabled
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self.lock = threading.Lock()
+        self.jobs = {}  # 原始路径 -> {"status", "path", "error", "future"}
+
+    def get_mezzanine_path(self, video_path: str) -> str:
+        """返回原始视频对应的夹层文件路径。"""
+        folder, name = os.path.split(video_path)
+        return os.path.join(folder, MEZZANINE_DIR_NAME, name)
+
+    def submit(self, video_path: str) -> Optional[str]:
+        """
+        提交后台标准化任务，重复提交同一文件不会重复转码；转码失败后只有原始文件变化时才重新提交。
+
+        参数:
+            video_path (str): 原始上传文件路径。
+
+        返回:
+            Optional[str]: 当前任务状态（'pending'、'ready'、'failed'），未启用时返回 None。
+        """
+        if not self.enabled:
+            return None
+
+        mezzanine_path = self.get_mezzanine_path(video_path)
+        source_mtime = os.path.getmtime(video_path)
+        with self.lock:
+            job = self.jobs.get(video_path)
+            if job and job["status"] in ("pending", "ready"):
+                if job["status"] == "pending" or self._is_fresh(video_path, mezzanine_path):
+                    return job["status"]
+            if job and job["status"] == "failed" and job.get("source_mtime") == source_mtime:
+                return "failed"
+
+            # 服务重启后磁盘上可能已有可用的夹层文件
+            if self._is_fresh(video_path, mezzanine_path):
+                self.jobs[video_path] = {"status": "ready", "path": mezzanine_path, "error": None,
+                                         "source_mtime": source_mtime}
+                return "ready"
+
+            job = {"status": "pending", "path": mezzanine_path, "error": None, "source_mtime": source_mtime}
+            self.jobs[video_path] = job
+            job["future"] = self.executor.submit(self._run, video_path, mezzanine_path)
+            logger.info(f"已提交视频标准化任务: {video_path} -> {mezzanine_path}")
+            return "pending"
+
+    def get_status(self, video_path: str) -> Dict[str, Any]:
+        """返回标准化任务状态，不包含内部的 future 对象。"""
+        with self.lock:
+            job = self.jobs.get(video_path)
+            if not job:
+                return {"status": "disabled" if not self.enabled else "unknown"}
+            return {k: v for k, v in job.items() if k != "future"}
+
+    def get_working_path(self, video_path: str) -> str:
+        """
+        返回分析阶段应使用的文件路径：夹层文件就绪时返回夹层文件，否则返回原始文件。
+
+        最终渲染（编辑器输出、目标消除的修复与音轨合并）应使用原始文件，不要使用这里返回的路径。
+
+        参数:
+            video_path (str): 原始上传文件路径。
+
+        返回:
+            str: 用于抽帧、大模型定位和分割的视频路径。
+        """
+        with self.lock:
+            job = self.jobs.get(video_path)
+            if job and job["status"] == "ready" and os.path.exists(job["path"]):
+                return job["path"]
+        return video_path
+
+    def wait(self, video_path: str, timeout: Optional[float] = None) -> str:
+        """等待标准化完成（失败或超时则回退到原始文件），返回可用的视频路径。"""
+        with self.lock:
+            job = self.jobs.get(video_path)
+            future = job.get("future") if job else None
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+        return self.get_working_path(video_path)
+
+    def _is_fresh(self, video_path: str, mezzanine_path: str) -> bool:
+        """判断磁盘上的夹层文件是否比原始文件新。"""
+        return (os.path.exists(mezzanine_path)
+                and os.path.getmtime(mezzanine_path) >= os.path.getmtime(video_path))
+
+    def _run(self, video_path: str, mezzanine_path: str) -> None:
+        """后台线程中执行转码并更新任务状态。"""
+        try:
+            self.transcode(video_path, mezzanine_path)
+            status, error = "ready", None
+            logger.info(f"视频标准化完成: {mezzanine_path}")
+        except Exception as e:
+            status, error = "failed", str(e)
+            logger.error(f"视频标准化失败: {video_path}, 错误: {e}")
+        with self.lock:
+            job = self.jobs.get(video_path)
+            if job:
+                job["status"] = status
+                job["error"] = error
+
+    def transcode(self, video_path: str, mezzanine_path: str) -> None:
+        """
+        将视频转码为夹层格式。先写入临时文件再原子替换，读取方不会看到未完成的文件。
+
+        参数:
+            video_path (str): 原始视频路径。
+            mezzanine_path (str): 夹层文件输出路径。
+
+        异常:
+            subprocess.CalledProcessError: 如果 FFmpeg 命令执行失败。
+        """
+        os.makedirs(os.path.dirname(mezzanine_path), exist_ok=True)
+        info = probe_video(video_path)
+
+        # 恒定帧率：沿用源视频平均帧率，但不超过上限
+        fps = min(max(int(round(info["fps"])), 1), MEZZANINE_MAX_FPS) if info["fps"] else MEZZANINE_MAX_FPS
+        part_path = mezzanine_path + ".part.mp4"
+
+        command = [
+            'ffmpeg', '-y',
+            '-i', video_path,
+            '-map', '0:v:0',
+            '-map', '0:a:0?',
+            # FFmpeg 默认自动应用旋转；偶数尺寸保证 yuv420p 可编码
+            '-vf', f"fps={fps},scale=trunc(iw/2)*2:trunc(ih/2)*2,format=yuv420p",
+            '-c:v', 'libx264',
+            '-preset', 'veryfast',
+            '-crf', str(MEZZANINE_CRF),
+            '-g', str(MEZZANINE_GOP),
+            '-keyint_min', str(MEZZANINE_GOP),
+            '-sc_threshold', '0',
+            '-metadata:s:v:0', 'rotate=0',
+            '-af', 'loudnorm=I=-16:TP=-1.5:LRA=11',
+            '-ar', '48000',
+            '-c:a', 'aac',
+            '-b:a', '192k',
+            '-movflags', '+faststart',
+            part_path
+        ]
+
+        try:
+            subprocess.run(command, check=True, capture_output=True, text=True)
+            os.replace(part_path, mezzanine_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+
+# 全局夹层管理器实例
+mezzanine_manager = MezzanineManager()
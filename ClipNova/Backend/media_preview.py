@@ -0,0 +1,253 @@
+import os
+import json
+import math
+import logging
+import threading
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
+from media_ingest import probe_video
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 预览资源配置，可通过环境变量覆盖
+PREVIEW_ENABLED = os.environ.get("CLIPNOVA_PREVIEW", "1") != "0"
+PREVIEW_WORKERS = int(os.environ.get("CLIPNOVA_PREVIEW_WORKERS", "1"))
+PROXY_HEIGHT = int(os.environ.get("CLIPNOVA_PROXY_HEIGHT", "360"))
+PROXY_VIDEO_BITRATE = os.environ.get("CLIPNOVA_PROXY_BITRATE", "400k")
+THUMBNAIL_INTERVAL = float(os.environ.get("CLIPNOVA_THUMBNAIL_INTERVAL", "2.0"))  # 秒
+THUMBNAIL_WIDTH = int(os.environ.get("CLIPNOVA_THUMBNAIL_WIDTH", "160"))
+SPRITE_COLUMNS = 10
+SPRITE_ROWS = 10
+WAVEFORM_SAMPLE_RATE = 8000
+WAVEFORM_PEAKS_PER_SECOND = 50
+PREVIEW_DIR_NAME = "previews"
+
+
+class PreviewManager:
+    """
+    视频预览资源的后台生成器。
+
+    为每个上传文件和输出文件生成低码率代理视频、固定间隔的缩略图雪碧图和音频波形峰值文件，
+    供手机端时间轴拖动预览使用，避免拉取全分辨率视频。
+    """
+
+    def __init__(self, enabled: bool = PREVIEW_ENABLED, max_workers: int = PREVIEW_WORKERS):
+        self.enabled = enabled
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="preview")
+        self.lock = threading.Lock()
+        self.jobs = {}  # 源文件路径 -> {"status", "version", "error"}
+
+    def get_preview_dir(self, video_path: str) -> str:
+        """返回视频对应的预览资源目录，例如 uploads/previews/output_001/。"""
+        folder, name = os.path.split(video_path)
+        return os.path.join(folder, PREVIEW_DIR_NAME, os.path.splitext(name)[0])
+
+    def submit(self, video_path: str) -> Optional[str]:
+        """
+        提交后台预览生成任务。源文件被覆盖（修改时间变化）后会重新生成。
+
+        参数:
+            video_path (str): 源视频路径。
+
+        返回:
+            Optional[str]: 当前任务状态（'pending'、'ready'、'failed'），未启用时返回 None。
+        """
+        if not self.enabled:
+            return None
+
+        version = int(os.path.getmtime(video_path))
+        with self.lock:
+            job = self.jobs.get(video_path)
+            if job and job["version"] == version and job["status"] in ("pending", "ready"):
+                return job["status"]
+
+            # 服务重启后磁盘上可能已有同版本的预览资源
+            manifest = self._read_manifest(video_path)
+            if manifest and manifest.get("version") == version:
+                self.jobs[video_path] = {"status": "ready", "version": version, "error": None}
+                return "ready"
+
+            self.jobs[video_path] = {"status": "pending", "version": version, "error": None}
+            self.executor.submit(self._run, video_path, version)
+            logger.info(f"已提交预览生成任务: {video_path}")
+            return "pending"
+
+    def get_status(self, video_path: str) -> Dict[str, Any]:
+        """返回预览生成状态。"""
+        with self.lock:
+            job = self.jobs.get(video_path)
+            if job:
+                return dict(job)
+        manifest = self._read_manifest(video_path)
+        if manifest:
+            return {"status": "ready", "version": manifest.get("version"), "error": None}
+        return {"status": "disabled" if not self.enabled else "unknown"}
+
+    def get_manifest(self, video_path: str) -> Optional[Dict[str, Any]]:
+        """返回已生成的预览资源清单，尚未生成时返回 None。"""
+        return self._read_manifest(video_path)
+
+    def _read_manifest(self, video_path: str) -> Optional[Dict[str, Any]]:
+        manifest_path = os.path.join(self.get_preview_dir(video_path), "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _run(self, video_path: str, version: int) -> None:
+        """后台线程中生成全部预览资源并写入清单。"""
+        try:
+            self.generate(video_path, version)
+            status, error = "ready", None
+            logger.info(f"预览资源生成完成: {video_path}")
+        except Exception as e:
+            status, error = "failed", str(e)
+            logger.error(f"预览资源生成失败: {video_path}, 错误: {e}")
+        with self.lock:
+            job = self.jobs.get(video_path)
+            if job and job["version"] == version:
+                job["status"] = status
+                job["error"] = error
+
+    def generate(self, video_path: str, version: int) -> Dict[str, Any]:
+        """
+        生成代理视频、缩略图雪碧图和波形峰值，最后写入 manifest.json。
+
+        参数:
+            video_path (str): 源视频路径。
+            version (int): 源文件版本（修改时间），用于客户端缓存失效。
+
+        返回:
+            Dict[str, Any]: 预览资源清单。
+
+        异常:
+            subprocess.CalledProcessError: 如果 FFmpeg 命令执行失败。
+        """
+        preview_dir = self.get_preview_dir(video_path)
+        os.makedirs(preview_dir, exist_ok=True)
+        info = probe_video(video_path)
+
+        self._create_proxy(video_path, os.path.join(preview_dir, "proxy.mp4"))
+        sprite = self._create_sprites(video_path, preview_dir, info["duration"])
+        waveform = None
+        if info["has_audio"]:
+            waveform = self._create_waveform(video_path, os.path.join(preview_dir, "waveform.json"))
+
+        manifest = {
+            "version": version,
+            "duration": info["duration"],
+            "width": info["width"],
+            "height": info["height"],
+            "proxy": "proxy.mp4",
+            "sprite": sprite,
+            "waveform": "waveform.json" if waveform else None
+        }
+        manifest_path = os.path.join(preview_dir, "manifest.json")
+        with open(manifest_path + ".part", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".part", manifest_path)
+        return manifest
+
+    def _create_proxy(self, video_path: str, proxy_path: str) -> None:
+        """生成低码率代理视频，使用短 GOP 便于拖动定位。"""
+        part_path = proxy_path + ".part.mp4"
+        command = [
+            'ffmpeg', '-y',
+            '-i', video_path,
+            '-vf', f"scale=-2:'min({PROXY_HEIGHT},ih)',format=yuv420p",
+            '-c:v', 'libx264',
+            '-preset', 'veryfast',
+            '-b:v', PROXY_VIDEO_BITRATE,
+            '-maxrate', PROXY_VIDEO_BITRATE,
+            '-bufsize', PROXY_VIDEO_BITRATE,
+            '-g', '15',
+            '-c:a', 'aac',
+            '-b:a', '64k',
+            '-ac', '1',
+            '-movflags', '+faststart',
+            part_path
+        ]
+        try:
+            subprocess.run(command, check=True, capture_output=True, text=True)
+            os.replace(part_path, proxy_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    def _create_sprites(self, video_path: str, preview_dir: str, duration: float) -> Dict[str, Any]:
+        """
+        按固定间隔截取缩略图并拼接为雪碧图，每张雪碧图最多 SPRITE_COLUMNS x SPRITE_ROWS 个缩略图。
+
+        返回:
+            Dict[str, Any]: 雪碧图描述，包含间隔、缩略图尺寸、网格大小和每张雪碧图的文件名。
+        """
+        count = max(1, int(math.ceil(duration / THUMBNAIL_INTERVAL)))
+        per_sheet = SPRITE_COLUMNS * SPRITE_ROWS
+        sheet_count = int(math.ceil(count / per_sheet))
+
+        # 清理旧版本遗留的雪碧图
+        for name in os.listdir(preview_dir):
+            if name.startswith("sprite_") and name.endswith(".jpg"):
+                os.remove(os.path.join(preview_dir, name))
+
+        command = [
+            'ffmpeg', '-y',
+            '-i', video_path,
+            '-vf', f"fps=1/{THUMBNAIL_INTERVAL},scale={THUMBNAIL_WIDTH}:-2,tile={SPRITE_COLUMNS}x{SPRITE_ROWS}",
+            '-q:v', '5',
+            '-an',
+            '-start_number', '0',
+            os.path.join(preview_dir, 'sprite_%03d.jpg')
+        ]
+        subprocess.run(command, check=True, capture_output=True, text=True)
+
+        sheets = sorted(name for name in os.listdir(preview_dir)
+                        if name.startswith("sprite_") and name.endswith(".jpg"))
+        return {
+            "interval": THUMBNAIL_INTERVAL,
+            "thumbnail_width": THUMBNAIL_WIDTH,
+            "columns": SPRITE_COLUMNS,
+            "rows": SPRITE_ROWS,
+            "count": count,
+            "sheets": sheets[:sheet_count] or sheets
+        }
+
+    def _create_waveform(self, video_path: str, waveform_path: str) -> bool:
+        """将音频解码为单声道 PCM，按固定窗口计算峰值并保存为 JSON。"""
+        command = [
+            'ffmpeg',
+            '-i', video_path,
+            '-vn',
+            '-ac', '1',
+            '-ar', str(WAVEFORM_SAMPLE_RATE),
+            '-f', 's16le',
+            '-'
+        ]
+        result = subprocess.run(command, check=True, capture_output=True)
+        samples = np.frombuffer(result.stdout, dtype=np.int16)
+        if samples.size == 0:
+            return False
+
+        window = WAVEFORM_SAMPLE_RATE // WAVEFORM_PEAKS_PER_SECOND
+        padded = np.pad(samples, (0, (-samples.size) % window))
+        frames = padded.reshape(-1, window).astype(np.int32)
+        # 每个窗口保存最小值和最大值，归一化到 [-1, 1] 并保留三位小数
+        peaks = np.stack([frames.min(axis=1), frames.max(axis=1)], axis=1) / 32768.0
+
+        with open(waveform_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "peaks_per_second": WAVEFORM_PEAKS_PER_SECOND,
+                "length": int(peaks.shape[0]),
+                "peaks": np.round(peaks, 3).ravel().tolist()
+            }, f)
+        return True
+
+
+# 全局预览管理器实例
+preview_manager = PreviewManager()
@@ -1,3 +1,4 @@
+import re
 import uuid
 import time
 import requests
@@ -33,7 +34,7 @@ OPERATIONS: Dict[str, Dict[str, Any]] = {
         'params': {
             'objects': {'type': str, 'default': '', 'required': True}
         },
-        'description': '移除视频中的目标对象，objects=目标描述。例：移除穿红色衣服的人 → action: remove_objects objects=穿红色衣服的人',
+        'description': '移除视频中的目标对象，objects=目标描述，多个目标用 | 分隔。例：移除穿红色衣服的人 → action: remove_objects objects=穿红色衣服的人',
         'supported_editors': ['moviepy']
     },
     'add_transition': {
@@ -124,6 +125,7 @@ def init_config() -> Callable:
         "3. 对于任何涉及移除视频中物体或人物的请求，都应该使用 remove_objects。"
         "4. 返回的action必须完全匹配以下格式：action: remove_objects objects=<目标描述> editor=moviepy"
         "5. 不要添加任何额外的空格或换行符。"
+        "6. 需要同时移除多个目标时，在一个 remove_objects 操作中用 | 分隔各个目标描述。"
       
         "例如："
         "- '去掉视频中的人' → action: remove_objects objects=人 editor=moviepy"
@@ -131,6 +133,7 @@ def init_config() -> Callable:
         "- '去掉在椅子上摇晃的人' → action: remove_objects objects=在椅子上摇晃的人 editor=moviepy"
         "- '删除画面中的汽车' → action: remove_objects objects=汽车 editor=moviepy"
         "- '移除背景中的树木' → action: remove_objects objects=树木 editor=moviepy"
+        "- '去掉画面里的男人和汽车' → action: remove_objects objects=男人|汽车 editor=moviepy"
         
         "其他操作示例："
         "- '剪掉前 1 秒' → action: trim start=1.0 editor=moviepy"
@@ -199,6 +202,26 @@ def init_config() -> Callable:
 
     return ask_vivogpt
 
+# 操作指令中参数的开头：空白（或开头）后的 key=，参数值可以包含空格、| 和 =，一直到下一个参数为止
+_PARAM_PATTERN = re.compile(r'(?:^|\s)([A-Za-z_]\w*)=')
+
+def parse_action_params(params_str: str) -> Dict[str, str]:
+    """
+    解析操作名之后的参数部分，例如 'objects=穿红衣服的 女人|狗 editor=moviepy'。
+
+    Args:
+        params_str: 操作指令中操作名之后的部分。
+
+    Returns:
+        Dict[str, str]: 参数名到参数值（去除首尾空白）的映射，第一个参数之前的内容被忽略。
+    """
+    matches = list(_PARAM_PATTERN.finditer(params_str))
+    params = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(params_str)
+        params[match.group(1)] = params_str[match.end():end].strip()
+    return params
+
 def generate_confirmation(action_str: str) -> str:
     """
     根据 LLM 的操作指令生成自然语言确认消息。
@@ -213,18 +236,16 @@ def generate_confirmation(action_str: str) -> str:
         return "没看懂你的指令，啥也没干哦！"
 
     try:
-        action_parts = action_str.strip().split()
-        if not action_parts or action_parts[0] != 'action:':
+        action_parts = action_str.strip().split(maxsplit=2)
+        if len(action_parts) < 2 or action_parts[0] != 'action:':
             return "指令格式有点问题，检查一下吧！"
         
         action = action_parts[1]
         if action not in OPERATIONS:
             return f"嘿，这个操作 '{action}' 我还不会呢！"
 
-        params = {}
-        for param in action_parts[2:]:
-            key, value = param.split('=')
-            params[key] = value
+        # 参数值可能包含空格（目标描述）或 =，不能按空白切分
+        params = parse_action_params(action_parts[2] if len(action_parts) > 2 else "")
 
         operation = OPERATIONS[action]
         confirmation = f"OK，{operation['description'].split('，')[0]}啦"
@@ -252,6 +273,20 @@ def process_instruction(user_input: str) -> Tuple[Optional[str], str, List[Dict[
     content, confirmation, history = ask_vivogpt(user_input, history)
     return content, confirmation, history
 
+def parse_instruction(user_input: str) -> Tuple[Optional[str], str]:
+    """
+    解析自然语言指令但不记录到对话历史，用于耗时预估等不执行操作的请求。
+
+    Args:
+        user_input: 用户输入的自然语言指令。
+
+    Returns:
+        Tuple: (操作指令, 确认消息)。
+    """
+    ask_vivogpt = init_config()
+    content, confirmation, _ = ask_vivogpt(user_input, list(history))
+    return content, confirmation
+
 class DialogueManager:
     """对话管理器，用于处理用户交互和生成自然语言响应"""
     
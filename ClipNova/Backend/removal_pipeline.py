@@ -0,0 +1,522 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from cost_model import cost_estimator
+from feature_cache import video_content_hash, feature_variant
+from frame_store import frame_stores, idle_seconds
+from media_ingest import probe_video
+from workspace import WorkspaceQuotaError
+from ffmpeg_io import mux_audio
+from mask_store import MaskStore
+from inference_profile import default_profile
+from inpainting import inpaint_video, inpaint_settings, INPAINT_MODE
+from sam2_pool import predictor_pool, get_checkpoint_paths, SAM2_DEFAULT_SIZE, SAM2_LEASE_TIMEOUT
+from sam2_model import (SAM2InstanceSegmentationModel, write_white_masks, store_boxes, frame_mapping,
+                        SAM2_MASK_DILATION, SAM2_EDGE_REFINE, SAM2_EDGE_REFINE_EPS, SAM2_WORKING_SCALE,
+                        SAM2_WINDOW_FRAMES, SAM2_WINDOW_OVERLAP, SAM2_KEYFRAME_STRIDE,
+                        SAM2_STRIDE_INTERPOLATION, SAM2_STRIDE_MIN_IOU, SAM2_STRIDE_MAX_AREA_CHANGE)
+from video_comprehension import (locate_target_frame, detect_target, detection_to_prompt, TargetNotFound,
+                                 VLM_MODEL, VLM_LOCATE_WORKERS)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 阶段输出缓存配置，可通过环境变量覆盖。每个阶段的输出按输入（上游阶段的键和本阶段参数）的哈希保存，
+# 重试或调整参数时从第一个输入发生变化的阶段继续；总大小超过上限时淘汰最久未用且未被占用的输出
+PIPELINE_CACHE_DIR = os.environ.get("CLIPNOVA_PIPELINE_DIR",
+                                    os.path.join(tempfile.gettempdir(), "clipnova_pipeline"))
+PIPELINE_CACHE_MAX_MB = int(os.environ.get("CLIPNOVA_PIPELINE_MAX_MB", "10240"))
+# 阶段输出写入后磁盘至少保留的剩余空间，以及中断的临时目录多久未修改后视为遗留
+PIPELINE_MIN_FREE_MB = int(os.environ.get("CLIPNOVA_PIPELINE_MIN_FREE_MB", "1024"))
+PIPELINE_TMP_STALE_SECONDS = float(os.environ.get("CLIPNOVA_PIPELINE_TMP_STALE_SECONDS", "3600"))
+# 阶段输出格式或算法变化时加一，使旧的输出全部失效
+PIPELINE_VERSION = 2
+
+# 目标消除的各阶段，按执行顺序排列；前三个阶段在分析视频（夹层文件）上进行，其余阶段使用原视频。
+# 最后的音轨合并直接写到输出路径，不作为阶段缓存
+STAGES = ('locate', 'detect', 'segment', 'render', 'inpaint')
+ANALYSIS_STAGES = ('locate', 'detect', 'segment')
+VLM_STAGES = ('locate', 'detect')
+
+# 估计阶段输出大小时每个像素的字节数：位压缩掩码 1/8（每个对象），PNG 黑白掩码和修复后的视频约 1/50
+_MASK_BITS_RATIO = 1 / 8
+_PNG_MASK_RATIO = 1 / 50
+_VIDEO_RATIO = 1 / 50
+
+RESULT_FILE = "result.json"
+
+
+def stage_key(stage: str, inputs: Dict[str, Any]) -> str:
+    """由阶段名称、输出格式版本和全部输入计算阶段输出的键。"""
+    payload = json.dumps({"stage": stage, "version": PIPELINE_VERSION, "inputs": inputs},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _dir_bytes(root: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _write_result(root: str, result: Dict[str, Any]) -> None:
+    with open(os.path.join(root, RESULT_FILE), "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+def _read_result(root: str) -> Dict[str, Any]:
+    with open(os.path.join(root, RESULT_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class StageCache:
+    """
+    阶段输出的磁盘缓存，每个输出是 root/<阶段>/<键>/ 下的一个目录。
+
+    输出先写入临时目录，阶段成功后才原子改名为最终目录，所以目录存在即表示该阶段已完整完成；
+    阶段失败时临时目录被删除，不会留下不完整的输出。同一输出并发请求时只有一个线程计算。
+    run 返回的输出在 release 之前不会被淘汰。生成输出前按预计大小检查配额和磁盘剩余空间。
+    """
+
+    def __init__(self, root: str = PIPELINE_CACHE_DIR, max_bytes: int = PIPELINE_CACHE_MAX_MB * 1024 * 1024,
+                 min_free_bytes: int = PIPELINE_MIN_FREE_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self._pending_bytes = 0  # 正在生成的输出的预计大小合计
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Tuple[str, str], int]" = OrderedDict()  # (阶段, 键) -> 字节数，末尾为最近使用
+        self.refs: Dict[Tuple[str, str], int] = {}
+        self._building: Dict[Tuple[str, str], threading.Lock] = {}
+        self.hits = {stage: 0 for stage in STAGES}
+        self.misses = {stage: 0 for stage in STAGES}
+        self.evictions = 0
+        self._loaded = False
+
+    def path(self, stage: str, key: str) -> str:
+        return os.path.join(self.root, stage, key)
+
+    def _load_index(self) -> None:
+        """首次使用时登记磁盘上已有的输出（例如服务重启前完成的阶段），按修改时间重建 LRU 顺序。"""
+        if self._loaded:
+            return
+        self._loaded = True
+        found = []
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                if name not in STAGES:
+                    shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)  # 已不再缓存的阶段
+        for stage in STAGES:
+            stage_dir = os.path.join(self.root, stage)
+            if not os.path.isdir(stage_dir):
+                continue
+            for name in os.listdir(stage_dir):
+                root = os.path.join(stage_dir, name)
+                if ".tmp" in name:
+                    # 上次中断的阶段留下的临时目录；最近仍在写入的可能属于另一个进程，保留
+                    if idle_seconds(root) > PIPELINE_TMP_STALE_SECONDS:
+                        shutil.rmtree(root, ignore_errors=True)
+                    continue
+                found.append((os.path.getmtime(root), (stage, name), _dir_bytes(root)))
+        for _, entry, nbytes in sorted(found, key=lambda item: item[0]):
+            self.entries[entry] = nbytes
+
+    def run(self, stage: str, key: str, build: Callable[[str], None], refresh: bool = False,
+            expected_bytes: int = 0) -> Tuple[str, bool]:
+        """
+        返回阶段输出目录并占用，没有时调用 build(临时目录) 生成。调用方使用完后必须调用 release。
+
+        参数:
+            refresh (bool): 为 True 时忽略已有输出重新生成，完成后替换旧的输出。
+            expected_bytes (int): 输出的预计大小，生成前据此检查配额和磁盘剩余空间。
+
+        返回:
+            Tuple[str, bool]: (输出目录, 是否命中已有输出)
+
+        异常:
+            WorkspaceQuotaError: 如果预计大小超过上限或磁盘剩余空间不足。
+        """
+        entry = (stage, key)
+        with self.lock:
+            self._load_index()
+            self.refs[entry] = self.refs.get(entry, 0) + 1
+            build_lock = self._building.setdefault(entry, threading.Lock())
+        root = self.path(stage, key)
+        try:
+            with build_lock:
+                with self.lock:
+                    hit = not refresh and entry in self.entries and os.path.isdir(root)
+                    if hit:
+                        self.entries.move_to_end(entry)
+                        self.hits[stage] += 1
+                    else:
+                        self.entries.pop(entry, None)  # 输出目录已被外部删除或要求重新生成
+                if hit:
+                    os.utime(root)
+                    return root, True
+
+                self._reserve(expected_bytes)
+                tmp_root = f"{root}.tmp{os.getpid()}_{threading.get_ident()}"
+                try:
+                    shutil.rmtree(tmp_root, ignore_errors=True)
+                    os.makedirs(tmp_root)
+                    build(tmp_root)
+                    shutil.rmtree(root, ignore_errors=True)  # 索引中没有登记的残留目录或被替换的旧输出
+                    os.replace(tmp_root, root)
+                except BaseException:
+                    shutil.rmtree(tmp_root, ignore_errors=True)
+                    raise
+                finally:
+                    with self.lock:
+                        self._pending_bytes -= expected_bytes
+                with self.lock:
+                    self.misses[stage] += 1
+                    self.entries[entry] = _dir_bytes(root)
+                return root, False
+        except BaseException:
+            self._unref(entry)
+            raise
+
+    def _reserve(self, expected_bytes: int) -> None:
+        """
+        生成输出前的空间检查：先淘汰旧输出腾出配额，再确认磁盘（扣除其他正在生成的输出）有足够剩余空间。
+
+        异常:
+            WorkspaceQuotaError: 如果预计大小超过上限或磁盘剩余空间不足。
+        """
+        if expected_bytes > self.max_bytes:
+            raise WorkspaceQuotaError(
+                f"阶段输出预计 {expected_bytes / 1024 / 1024:.0f}MB，超过缓存上限 "
+                f"{self.max_bytes / 1024 / 1024:.0f}MB")
+        self.evict(reserve=expected_bytes)
+        os.makedirs(self.root, exist_ok=True)
+        with self.lock:
+            free = shutil.disk_usage(self.root).free - self._pending_bytes
+            if expected_bytes + self.min_free_bytes > free:
+                raise WorkspaceQuotaError(
+                    f"阶段输出目录剩余空间不足: 需要 {expected_bytes / 1024 / 1024:.0f}MB，"
+                    f"可用 {max(0, free - self.min_free_bytes) / 1024 / 1024:.0f}MB")
+            self._pending_bytes += expected_bytes
+
+    def release(self, entries: List[Tuple[str, str]]) -> None:
+        """释放 run 返回的输出，并在超过容量上限时淘汰。"""
+        for entry in entries:
+            self._unref(entry)
+        self.evict()
+
+    def _unref(self, entry: Tuple[str, str]) -> None:
+        with self.lock:
+            count = self.refs.get(entry, 0) - 1
+            if count > 0:
+                self.refs[entry] = count
+            else:
+                self.refs.pop(entry, None)
+
+    def evict(self, reserve: int = 0) -> int:
+        """
+        删除最久未用且未被占用的输出，直到总大小（加上 reserve）不超过上限，返回删除数量。
+
+        参数:
+            reserve (int): 即将生成的输出的预计大小，为其预先腾出配额。
+        """
+        victims = []
+        with self.lock:
+            total = sum(self.entries.values()) + self._pending_bytes + reserve
+            for entry in list(self.entries):
+                if total <= self.max_bytes:
+                    break
+                if self.refs.get(entry):
+                    continue
+                total -= self.entries.pop(entry)
+                self._building.pop(entry, None)
+                victims.append(entry)
+            self.evictions += len(victims)
+        for stage, key in victims:
+            shutil.rmtree(self.path(stage, key), ignore_errors=True)
+        if victims:
+            logger.info(f"阶段输出超过容量上限，已删除 {len(victims)} 个")
+        return len(victims)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "root": self.root,
+                "entries": len(self.entries),
+                "in_use": len(self.refs),
+                "total_mb": round(sum(self.entries.values()) / 1024 / 1024, 1),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "evictions": self.evictions
+            }
+
+
+class RemovalPipeline:
+    """
+    目标消除流程：定位帧 -> 检测目标 -> 分割 -> 生成掩码 -> 修复 -> 合并音轨。
+
+    每个阶段的键由上游阶段的键和本阶段的参数计算，输出保存在 StageCache 中。修复失败后重试时，
+    大模型定位、检测和 SAM2 传播的结果直接复用；调整某个阶段的参数（例如修复方式或掩码膨胀）时，
+    只有该阶段及其下游重新计算。多个目标各自定位和检测，再合并为一次分割。
+    refresh 为 True 时重新调用大模型定位和检测；下游阶段的键由检测结果的内容计算，
+    结果不变时分割等阶段仍然复用。最后把音轨合并后直接写入输出路径。
+
+    定位、检测和分割可以在分析视频（夹层文件）上进行；掩码按时间戳和尺寸映射到原视频，
+    修复和音轨合并始终读取原视频，输出保持原视频的帧率和画质。
+
+    用法:
+        RemovalPipeline(video_path, ["穿粉色外套的女性"], output_path, analysis_path=mezzanine_path).run()
+    """
+
+    def __init__(self, video_path: str, targets: List[str], output_video_path: str = "./result.mp4",
+                 mode: str = INPAINT_MODE, model_size: str = SAM2_DEFAULT_SIZE,
+                 mask_dilation: int = SAM2_MASK_DILATION, cache: Optional[StageCache] = None,
+                 analysis_path: Optional[str] = None, refresh: bool = False):
+        """
+        参数:
+            video_path (str): 输入视频路径（原始文件，用于修复和最终输出）。
+            targets (List[str]): 目标描述，每个目标一个对象 ID。
+            output_video_path (str): 输出视频路径。
+            mode (str): 修复方式，见 inpainting.INPAINT_MODE。
+            model_size (str): SAM2 模型大小。
+            mask_dilation (int): 黑白掩码的膨胀像素数。
+            cache (StageCache): 阶段输出缓存，默认为全局实例。
+            analysis_path (Optional[str]): 定位和分割使用的视频（通常为夹层文件），为 None 时使用 video_path。
+            refresh (bool): 是否忽略缓存的大模型定位和检测结果，重新调用大模型。
+        """
+        self.video_path = video_path
+        self.analysis_path = analysis_path or video_path
+        self.targets = targets
+        self.output_video_path = output_video_path
+        self.mode = mode
+        self.model_size = model_size
+        self.mask_dilation = mask_dilation
+        self.cache = cache or stage_cache
+        self.refresh = refresh
+        self.video_hash = None
+        self.analysis_hash = None
+        self.analysis_info = None  # 分析视频的 probe_video 元数据，首次使用时读取
+        self.held: List[Tuple[str, str]] = []
+        self.held_lock = threading.Lock()
+
+    def _stage(self, stage: str, inputs: Dict[str, Any], build: Callable[[str], None],
+               cost_stage: Optional[str] = None, expected_bytes: int = 0) -> Tuple[str, str]:
+        """
+        运行（或复用）一个阶段，返回 (键, 输出目录)。
+
+        cost_stage 为实际计算时记录耗时的阶段名称，expected_bytes 为输出的预计大小（用于空间检查）。
+        """
+        key = stage_key(stage, inputs)
+
+        def timed_build(root: str) -> None:
+            if cost_stage is None:
+                build(root)
+                return
+            video_path = self.analysis_path if stage in ANALYSIS_STAGES else self.video_path
+            with cost_estimator.record_stage(cost_stage, video_path):
+                build(root)
+
+        start = time.perf_counter()
+        root, hit = self.cache.run(stage, key, timed_build, refresh=self.refresh and stage in VLM_STAGES,
+                                   expected_bytes=expected_bytes)
+        with self.held_lock:
+            self.held.append((stage, key))
+        if hit:
+            logger.info(f"阶段 {stage} 复用已有输出 {key[:12]}")
+        else:
+            logger.info(f"阶段 {stage} 完成，耗时 {time.perf_counter() - start:.1f} 秒，输出 {key[:12]}")
+        return key, root
+
+    def run(self) -> None:
+        """
+        执行（或从第一个失效的阶段继续）目标消除流程，结果写入 output_video_path。
+
+        任何阶段失败都抛出异常，不会留下不完整的输出文件。
+
+        异常:
+            TargetNotFound: 如果有目标无法定位或检测。
+            WorkspaceQuotaError: 如果阶段输出的磁盘空间不足。
+            FileNotFoundError: 如果输入视频文件不存在。
+            RuntimeError: 如果分割失败或所有目标的分割结果为空。
+            subprocess.CalledProcessError: 如果 FFmpeg 执行失败。
+        """
+        # 帧存储只在缓存未命中、需要读取帧的阶段中打开，全部阶段命中缓存时不解码视频
+        self.video_hash = video_content_hash(self.video_path)
+        self.analysis_hash = video_content_hash(self.analysis_path)
+        try:
+            self._run()
+        finally:
+            self.cache.release(self.held)
+            self.held = []
+
+    def _run(self) -> None:
+        print(f"第一步：使用大模型定位目标（共 {len(self.targets)} 个）...")
+        with ThreadPoolExecutor(max_workers=max(1, min(len(self.targets), VLM_LOCATE_WORKERS))) as executor:
+            futures = [executor.submit(self._locate, target) for target in self.targets]
+        located, missing = [], []
+        for target, future in zip(self.targets, futures):
+            try:
+                located.append(future.result())
+            except ValueError as e:
+                print(f"错误：{e}")
+                missing.append(target)
+        # 任何一个目标缺失都使任务失败，不能只消除其余目标后当作成功返回
+        if missing:
+            raise TargetNotFound(missing)
+
+        print("\n第二步：进行实例分割...")
+        segment_key, segment_root = self._segment(located)
+        print("\n第三步：生成黑白掩码...")
+        render_key, render_root = self._render(segment_key, segment_root)
+        print("\n第四步：进行目标消除...")
+        inpaint_key, inpaint_root = self._inpaint(render_key, render_root)
+        print("\n第五步：合并音轨...")
+        self._mux(inpaint_root)
+        print("\n处理完成！")
+
+    def _locate(self, target: str) -> Tuple[Dict[str, Any], dict]:
+        """
+        定位帧和检测目标两个阶段，返回 (检测结果, 分割提示)。检测结果的内容作为分割阶段的输入。
+
+        异常:
+            ValueError: 如果无法检测到目标。
+        """
+        inputs = {"video": self.analysis_hash, "target": target, "model": VLM_MODEL}
+
+        def locate(root: str) -> None:
+            _write_result(root, {"frame_number": locate_target_frame(self.analysis_path, target,
+                                                                     self._analysis()["frame_count"])})
+
+        locate_key, locate_root = self._stage('locate', inputs, locate, cost_stage='vlm_locate')
+        frame_number = _read_result(locate_root)["frame_number"]
+
+        def detect(root: str) -> None:
+            detection_result = detect_target(self.analysis_path, frame_number, target)
+            # 无法转换为分割提示的结果不保存，重试时重新检测
+            if detection_result is None or detection_to_prompt(frame_number, detection_result) is None:
+                raise ValueError(f"目标检测失败: {target}")
+            _write_result(root, {"frame_number": frame_number, "detection_result": detection_result})
+
+        # 以定位结果的内容而不是定位阶段的键作为输入，重新定位得到同一帧时仍复用检测结果
+        inputs = {"video": self.analysis_hash, "target": target, "frame_number": frame_number, "model": VLM_MODEL}
+        _, detect_root = self._stage('detect', inputs, detect)
+        result = _read_result(detect_root)
+        print("result:", result)
+        return result, detection_to_prompt(result["frame_number"], result["detection_result"])
+
+    def _segment(self, located: List[Tuple[Dict[str, Any], dict]]) -> Tuple[str, str]:
+        """所有目标共用一次 SAM2 传播（按顺序分配对象 ID），输出位压缩掩码存储。"""
+        model_cfg, checkpoint = get_checkpoint_paths(self.model_size)
+        profile = default_profile()
+        inputs = {
+            "detect": [result for result, _ in located],
+            "checkpoint": checkpoint,
+            "variant": feature_variant(SAM2_WORKING_SCALE, profile.name),
+            "window": (SAM2_WINDOW_FRAMES, SAM2_WINDOW_OVERLAP),
+            "stride": (SAM2_KEYFRAME_STRIDE, SAM2_STRIDE_INTERPOLATION, SAM2_STRIDE_MIN_IOU,
+                       SAM2_STRIDE_MAX_AREA_CHANGE)
+        }
+        prompts = [prompt for _, prompt in located]
+
+        def segment(root: str) -> None:
+            model = None
+            try:
+                # 预测器只在分割阶段占用，分割完成后立即归还给其他请求；等不到时失败，归还准入名额
+                with predictor_pool.lease(self.model_size, timeout=SAM2_LEASE_TIMEOUT) as predictor:
+                    model = SAM2InstanceSegmentationModel(model_cfg, checkpoint, predictor=predictor,
+                                                          work_dir=os.path.join(root, "work"), profile=profile)
+                    model.set_video_path(self.analysis_path, self.output_video_path)
+                    success = model.segment_targets(prompts)
+                model.predictor = None
+                if not success:
+                    raise RuntimeError("实例分割失败，请检查分割参数")
+                empty = [p["frame_idx"] for p in prompts
+                         if p["frame_idx"] not in model.video_segments or not model.video_segments[p["frame_idx"]]]
+                if len(empty) == len(prompts):
+                    raise RuntimeError(f"所有目标在提示帧 {empty} 上的分割结果为空")
+                # 掩码存储写回磁盘后移出模型的工作目录，作为本阶段的输出
+                model.video_segments.close()
+                model.video_segments = None
+                os.replace(model.mask_store_dir, os.path.join(root, "mask_store"))
+            finally:
+                if model is not None:
+                    model.cleanup()
+                shutil.rmtree(os.path.join(root, "work"), ignore_errors=True)
+
+        # 每个对象一份位压缩掩码
+        info = self._analysis()
+        expected = int(info["width"] * info["height"] * info["frame_count"] * _MASK_BITS_RATIO) * len(prompts)
+        return self._stage('segment', inputs, segment, expected_bytes=expected)
+
+    def _render(self, segment_key: str, segment_root: str) -> Tuple[str, str]:
+        """生成原视频分辨率和帧数的黑白掩码图像，并记录每帧掩码的包围框。"""
+
+        def render(root: str) -> None:
+            # 分割阶段的输出属于缓存，只读打开，关闭时不写回
+            store = MaskStore.open(os.path.join(segment_root, "mask_store"), read_only=True)
+            try:
+                with frame_stores.acquire(self.video_path) as source:
+                    video_size = source.size
+                    frame_map = frame_mapping(len(source), source.fps, store.num_frames,
+                                              self._analysis()["fps"] or 30)
+                    # 原视频帧作为引导，修正放大后的掩码边缘
+                    write_white_masks(store, os.path.join(root, "masks"), video_size, self.mask_dilation,
+                                      frame_map=frame_map, frames=source)
+                boxes = store_boxes(store, video_size, self.mask_dilation, frame_map)
+            finally:
+                store.close()
+            np.save(os.path.join(root, "boxes.npy"), boxes)
+
+        # 原视频的内容哈希决定了输出的尺寸、帧数和帧率
+        inputs = {"segment": segment_key, "video": self.video_hash, "dilation": self.mask_dilation,
+                  "edge_refine": (SAM2_EDGE_REFINE, SAM2_EDGE_REFINE_EPS)}
+        return self._stage('render', inputs, render, cost_stage='mask_generation',
+                           expected_bytes=self._expected_bytes(_PNG_MASK_RATIO))
+
+    def _inpaint(self, render_key: str, render_root: str) -> Tuple[str, str]:
+        """按帧段只修复目标所在的区域，输出不含音轨的视频。"""
+        boxes = np.load(os.path.join(render_root, "boxes.npy"))
+
+        def inpaint(root: str) -> None:
+            inpaint_video(self.video_path, os.path.join(render_root, "masks"), os.path.join(root, "video.mp4"),
+                          boxes=boxes, mode=self.mode, copy_audio=False)
+
+        inputs = {"render": render_key, "video": self.video_hash, "settings": inpaint_settings(self.mode)}
+        return self._stage('inpaint', inputs, inpaint, cost_stage='inpainting',
+                           expected_bytes=self._expected_bytes(_VIDEO_RATIO))
+
+    def _analysis(self) -> Dict[str, Any]:
+        """返回分析视频的元数据（帧数、尺寸和帧率，与帧存储一致），不打开帧存储。"""
+        if self.analysis_info is None:
+            self.analysis_info = probe_video(self.analysis_path)
+        return self.analysis_info
+
+    def _expected_bytes(self, ratio: float) -> int:
+        """按原视频的尺寸和帧数估计阶段输出的大小。"""
+        info = probe_video(self.video_path)
+        return int(info["width"] * info["height"] * max(1, info.get("frame_count") or 0) * ratio)
+
+    def _mux(self, inpaint_root: str) -> None:
+        """把原视频的音轨合并到修复结果中，直接写入输出路径（先写临时文件再改名，失败时不留下不完整的输出）。"""
+        out_dir = os.path.dirname(self.output_video_path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        mux_audio(os.path.join(inpaint_root, "video.mp4"), self.video_path, self.output_video_path)
+
+
+# 全局阶段输出缓存实例
+stage_cache = StageCache()
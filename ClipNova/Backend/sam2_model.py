@@ -1,18 +1,270 @@
 import os
 import cv2
-from sympy import true
 import torch
 import subprocess
 import numpy as np
 import shutil
-from PIL import Image
-from pathlib import Path
+import sam2.sam2_video_predictor as sam2_video_predictor
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from sam2.build_sam import build_sam2_video_predictor
+from cost_model import cost_estimator
+from mask_store import MaskStore
+from inference_profile import InferenceProfile, default_profile
+from feature_cache import feature_cache, feature_variant
+from mask_interpolation import FlowInterpolator, mask_iou, area_change, shape_interpolate
+from inpainting import inpaint_video, INPAINT_MODE
+from frame_store import FrameStore, frame_stores
+from ffmpeg_io import FFmpegWriter
+
+# 掩码图像写入线程数量
+MASK_WRITER_WORKERS = int(os.environ.get("CLIPNOVA_MASK_WRITERS", "4"))
+# 分窗口传播：视频帧数超过窗口大小时按重叠窗口分段加载，0 表示始终一次加载整个视频
+SAM2_WINDOW_FRAMES = int(os.environ.get("SAM2_WINDOW_FRAMES", "120"))
+SAM2_WINDOW_OVERLAP = int(os.environ.get("SAM2_WINDOW_OVERLAP", "8"))
+# 关键帧步长：大于 1 时只在每 k 帧上运行 SAM2，中间帧由插值补全
+SAM2_KEYFRAME_STRIDE = int(os.environ.get("SAM2_KEYFRAME_STRIDE", "1"))
+SAM2_STRIDE_INTERPOLATION = os.environ.get("SAM2_STRIDE_INTERPOLATION", "flow")  # 'flow' 或 'shape'
+# 相邻关键帧掩码 IoU 低于该值（运动较大）或面积变化超过该值时，该区间回退为逐帧推理
+SAM2_STRIDE_MIN_IOU = float(os.environ.get("SAM2_STRIDE_MIN_IOU", "0.75"))
+SAM2_STRIDE_MAX_AREA_CHANGE = float(os.environ.get("SAM2_STRIDE_MAX_AREA_CHANGE", "0.25"))
+# 局部修正：新旧掩码 IoU 连续若干帧达到阈值即视为收敛，停止继续传播
+REFINE_CONVERGENCE_IOU = float(os.environ.get("SAM2_REFINE_CONVERGENCE_IOU", "0.98"))
+REFINE_CONVERGENCE_FRAMES = int(os.environ.get("SAM2_REFINE_CONVERGENCE_FRAMES", "5"))
+# 分割工作分辨率（相对原视频的缩放比例），掩码输出时再放大回原分辨率
+SAM2_WORKING_SCALE = float(os.environ.get("SAM2_WORKING_SCALE", "1.0"))
+# 黑白掩码输出前的膨胀像素数（按原分辨率计），用于覆盖放大后边缘的误差
+SAM2_MASK_DILATION = int(os.environ.get("SAM2_MASK_DILATION", "0"))
+# 掩码放大时以原分辨率帧为引导图做导向滤波，使边缘贴合画面中的真实边界，0 表示只做双线性插值
+SAM2_EDGE_REFINE = os.environ.get("SAM2_EDGE_REFINE", "1") != "0"
+SAM2_EDGE_REFINE_EPS = float(os.environ.get("SAM2_EDGE_REFINE_EPS", "1e-3"))
+
+# SAM2 图像编码器输入的归一化参数（与 sam2.utils.misc.load_video_frames 一致）
+SAM2_IMG_MEAN = torch.tensor((0.485, 0.456, 0.406), dtype=torch.float32)[:, None, None]
+SAM2_IMG_STD = torch.tensor((0.229, 0.224, 0.225), dtype=torch.float32)[:, None, None]
+
+
+def preprocess_frame(frame: np.ndarray, image_size: int) -> torch.Tensor:
+    """
+    把一帧 BGR 图像转换为 SAM2 图像编码器的输入：缩放到 image_size x image_size 并归一化。
+
+    完整分割和单帧预览都使用这一函数，保证两者计算（并缓存）的图像特征一致。
+
+    返回:
+        torch.Tensor: 形状为 (3, image_size, image_size) 的 float32 张量（CPU）
+    """
+    frame = cv2.resize(frame, (image_size, image_size), interpolation=cv2.INTER_AREA)
+    img = torch.from_numpy(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)).permute(2, 0, 1).float().div_(255)
+    img -= SAM2_IMG_MEAN
+    img /= SAM2_IMG_STD
+    return img
+
+
+class StoreFrameLoader:
+    """
+    SAM2 推理状态中 images 的替代：从共享帧存储中按需取帧，缩放并归一化为模型输入。
+
+    与 SAM2 自带的 AsyncVideoFrameLoader 相同，只需要支持 len 和按帧索引取值。帧不再经过 JPEG
+    文件，推理状态也不再常驻全部帧的 float32 张量；只包含部分帧（窗口、关键帧）时按 indices 映射到全局帧。
+    """
+
+    def __init__(self, frames: FrameStore, working_size: tuple, indices: list = None):
+        self.frames = frames
+        self.working_size = working_size
+        self.indices = indices
+        self.image_size = None
+        self.compute_device = None
+        self.offload_video_to_cpu = True
+
+    def load(self, image_size: int, offload_video_to_cpu: bool, compute_device) -> tuple:
+        """替代 sam2.utils.misc.load_video_frames，返回 (images, video_height, video_width)。"""
+        self.image_size = image_size
+        self.offload_video_to_cpu = offload_video_to_cpu
+        self.compute_device = compute_device
+        return self, self.working_size[1], self.working_size[0]
+
+    def __len__(self) -> int:
+        return len(self.indices) if self.indices is not None else len(self.frames)
+
+    def __getitem__(self, index: int) -> torch.Tensor:
+        global_idx = self.indices[index] if self.indices is not None else index
+        img = preprocess_frame(self.frames.frame(global_idx), self.image_size)
+        if not self.offload_video_to_cpu:
+            img = img.to(self.compute_device, non_blocking=True)
+        return img
+
+
+def _install_frame_loader() -> None:
+    """让 SAM2 的 init_state 接受 StoreFrameLoader 作为 video_path，其余输入保持原行为。"""
+    original = sam2_video_predictor.load_video_frames
+    if getattr(original, "_frame_store_aware", False):
+        return
+
+    def load_video_frames(video_path, image_size, offload_video_to_cpu, *args, **kwargs):
+        if isinstance(video_path, StoreFrameLoader):
+            return video_path.load(image_size, offload_video_to_cpu,
+                                   kwargs.get("compute_device", torch.device("cuda")))
+        return original(video_path, image_size, offload_video_to_cpu, *args, **kwargs)
+
+    load_video_frames._frame_store_aware = True
+    sam2_video_predictor.load_video_frames = load_video_frames
+
+
+_install_frame_loader()
+
+
+def guided_filter(guide: np.ndarray, src: np.ndarray, radius: int,
+                  eps: float = SAM2_EDGE_REFINE_EPS) -> np.ndarray:
+    """
+    灰度引导图的导向滤波（He et al.），输出在引导图的边缘处保持锐利、在平坦区域平滑。
+
+    参数:
+        guide (np.ndarray): 引导图，形状为 (H, W) 的 float32，取值 [0, 1]。
+        src (np.ndarray): 待滤波的图像，形状与 guide 一致的 float32。
+        radius (int): 方框滤波半径。
+        eps (float): 正则项，越大越接近普通的均值滤波。
+
+    返回:
+        np.ndarray: 滤波结果，float32。
+    """
+    ksize = (2 * radius + 1, 2 * radius + 1)
+
+    def box(x):
+        return cv2.boxFilter(x, cv2.CV_32F, ksize, borderType=cv2.BORDER_REFLECT)
+
+    mean_i = box(guide)
+    mean_p = box(src)
+    var_i = box(guide * guide) - mean_i * mean_i
+    cov_ip = box(guide * src) - mean_i * mean_p
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    return box(a) * guide + box(b)
+
+
+def _refine_edges(soft: np.ndarray, guide: np.ndarray, radius: int) -> np.ndarray:
+    """只在掩码包围框附近用原分辨率帧对放大后的软掩码做导向滤波，返回二值掩码。"""
+    mask = soft >= 0.5
+    ys, xs = np.nonzero(soft > 0)
+    if len(ys) == 0:
+        return mask
+    height, width = soft.shape
+    pad = 2 * radius + 1
+    y1, y2 = max(0, ys.min() - pad), min(height, ys.max() + pad + 1)
+    x1, x2 = max(0, xs.min() - pad), min(width, xs.max() + pad + 1)
+    region = guide[y1:y2, x1:x2]
+    if region.ndim == 3:
+        region = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+    region = region.astype(np.float32) / 255.0
+    mask[y1:y2, x1:x2] = guided_filter(region, soft[y1:y2, x1:x2], radius) >= 0.5
+    return mask
+
+
+def propagation_mode(num_frames: int, window_size: int = SAM2_WINDOW_FRAMES,
+                     keyframe_stride: int = SAM2_KEYFRAME_STRIDE) -> str:
+    """
+    返回给定帧数的视频使用的传播方式：'strided'（关键帧步长）、'windowed'（分窗口）或
+    'full'（一次加载全部帧）。只有 'full' 模式的推理状态会按 keep_state 保留。
+    """
+    if keyframe_stride > 1 and num_frames > keyframe_stride:
+        return "strided"
+    if 0 < window_size < num_frames:
+        return "windowed"
+    return "full"
+
+
+def upsample_mask(mask: np.ndarray, size: tuple, dilation: int = 0, guide: np.ndarray = None) -> np.ndarray:
+    """
+    将工作分辨率的掩码放大到指定尺寸，并可选地膨胀。
+
+    放大时先做双线性插值得到软掩码。提供引导帧（目标尺寸的原视频帧）且 SAM2_EDGE_REFINE 开启时，
+    再以引导帧做导向滤波后以 0.5 为阈值二值化，边缘对齐到画面中的真实边界，而不是工作分辨率的像素网格；
+    否则直接以 0.5 为阈值二值化，边缘比最近邻插值平滑，不会出现块状锯齿。
+
+    参数:
+        mask (np.ndarray): 二值掩码，形状为 (h, w)。
+        size (tuple): 目标尺寸 (宽, 高)。
+        dilation (int): 膨胀像素数，0 表示不膨胀。
+        guide (np.ndarray): 目标尺寸的原视频帧（BGR 或灰度），为 None 时不做边缘修正。
+
+    返回:
+        np.ndarray: 形状为 (高, 宽) 的布尔掩码。
+    """
+    if (mask.shape[1], mask.shape[0]) != tuple(size):
+        soft = cv2.resize(mask.astype(np.float32), tuple(size), interpolation=cv2.INTER_LINEAR)
+        if SAM2_EDGE_REFINE and guide is not None and guide.shape[:2] == soft.shape:
+            # 滤波半径覆盖放大后的一个工作分辨率像素
+            radius = max(2, int(np.ceil(size[0] / mask.shape[1])))
+            mask = _refine_edges(soft, guide, radius)
+        else:
+            mask = soft >= 0.5
+    if dilation > 0:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * dilation + 1, 2 * dilation + 1))
+        mask = cv2.dilate(mask.astype(np.uint8), kernel).astype(bool)
+    return mask
+
+
+def frame_mapping(num_frames: int, fps: float, store_frames: int, store_fps: float):
+    """
+    返回输出视频每一帧对应的掩码帧索引，用于把在夹层文件上得到的分割结果用到原视频上。
+
+    夹层文件可能降低了帧率，按时间戳取最近的掩码帧；帧率一致时为逐帧对应。
+
+    参数:
+        num_frames (int): 输出视频（原视频）的帧数。
+        fps (float): 输出视频的帧率。
+        store_frames (int): 掩码存储的帧数。
+        store_fps (float): 分割所用视频的帧率。
+
+    返回:
+        Optional[np.ndarray]: 长度为 num_frames 的掩码帧索引，帧数和帧率都一致（逐帧对应）时返回 None。
+    """
+    if num_frames == store_frames and (not fps or not store_fps or abs(fps - store_fps) < 0.01):
+        return None
+    if fps and store_fps:
+        ratio = store_fps / fps
+    else:
+        ratio = store_frames / max(1, num_frames)
+    indices = np.round(np.arange(num_frames) * ratio).astype(np.int64)
+    return np.minimum(indices, store_frames - 1)
+
+
+def store_boxes(store: MaskStore, video_size: tuple = None, dilation: int = 0,
+                frame_map: np.ndarray = None) -> np.ndarray:
+    """
+    返回掩码存储中每帧目标的包围框，换算到原视频的帧和坐标系并计入黑白掩码的膨胀。
+    修复阶段据此按帧段裁剪修复区域（见 inpainting.plan_tubes）。
+
+    参数:
+        store (MaskStore): 分割结果。
+        video_size (tuple): 原视频尺寸 (宽, 高)，为 None 时保持掩码坐标系。
+        dilation (int): 黑白掩码的膨胀像素数。
+        frame_map (np.ndarray): 原视频每一帧对应的掩码帧索引（见 frame_mapping），为 None 时逐帧对应。
+
+    返回:
+        np.ndarray: 形状为 (帧数, 4) 的 int32 数组，每行为 (x1, y1, x2, y2)，没有掩码的帧为 -1
+    """
+    boxes = store.frame_boxes()
+    if frame_map is not None:
+        boxes = boxes[frame_map]
+    if not video_size:
+        return boxes
+    width, height = video_size
+    sx, sy = width / store.width, height / store.height
+    pad = dilation + 1  # 放大时的插值误差和膨胀
+    present = boxes[:, 0] >= 0
+    scaled = np.full_like(boxes, -1)
+    scaled[present, 0] = np.maximum(0, (boxes[present, 0] * sx).astype(np.int32) - pad)
+    scaled[present, 1] = np.maximum(0, (boxes[present, 1] * sy).astype(np.int32) - pad)
+    scaled[present, 2] = np.minimum(width, np.ceil(boxes[present, 2] * sx).astype(np.int32) + pad)
+    scaled[present, 3] = np.minimum(height, np.ceil(boxes[present, 3] * sy).astype(np.int32) + pad)
+    return scaled
+
 
 class SAM2InstanceSegmentationModel:
     """使用 SAM2 模型对视频进行实例分割的类。"""
 
-    def __init__(self, model_cfg: str, checkpoint: str, device: str = "cuda"):
+    def __init__(self, model_cfg: str, checkpoint: str, device: str = "cuda", predictor=None,
+                 work_dir: str = ".", profile: InferenceProfile = None):
         """
         初始化 SAM2 模型，加载配置文件和检查点。
 
@@ -20,6 +272,12 @@ class SAM2InstanceSegmentationModel:
             model_cfg (str): 模型配置文件路径。
             checkpoint (str): 模型检查点文件路径。
             device (str): 运行模型的设备（'cuda' 或 'cpu'），默认为 'cuda'。
+            predictor: 已加载的预测器（通常从 sam2_pool.predictor_pool 租借），
+                为 None 时按 model_cfg 和 checkpoint 新建。
+            work_dir (str): 临时帧、掩码等中间文件的根目录（通常为 workspace.JobWorkspace 的根目录），
+                默认为当前目录。
+            profile (InferenceProfile): 推理配置，为 None 时按环境变量配置。传入 predictor 时
+                应与该预测器加载时应用的配置一致。
 
         异常:
             RuntimeError: 如果请求使用 CUDA 但不可用。
@@ -27,33 +285,54 @@ class SAM2InstanceSegmentationModel:
         self.model_cfg = model_cfg
         self.checkpoint = checkpoint
         self.device = device if torch.cuda.is_available() else "cpu"
-        self.predictor = None
+        self.predictor = predictor
+        self.profile = profile
         self.input_video_path = None
         self.output_video_path = None
-        self.original_frames_folder = "./original_frames"
-        self.frames_mask_dir = "./frames_mask"  # 用于彩色掩码帧
-        self.white_mask_dir = "./white_mask_frames"  # 用于黑白掩码图像
-        self.original_mask_dir = "./original_mask_frames"  # 用于原始对象掩码图像
-        self.frame_names = []
-        self.video_segments = None  # 存储分割结果
+        self.work_dir = work_dir
+        self.white_mask_dir = os.path.join(work_dir, "white_mask_frames")  # 用于黑白掩码图像
+        self.original_mask_dir = os.path.join(work_dir, "original_mask_frames")  # 用于原始对象掩码图像
+        self.mask_store_dir = os.path.join(work_dir, "mask_store")  # 位压缩掩码的内存映射文件
+        self.window_size = SAM2_WINDOW_FRAMES
+        self.window_overlap = SAM2_WINDOW_OVERLAP
+        self.keyframe_stride = SAM2_KEYFRAME_STRIDE
+        self.stride_interpolation = SAM2_STRIDE_INTERPOLATION
+        self.working_scale = SAM2_WORKING_SCALE
+        self.mask_dilation = SAM2_MASK_DILATION
+        self.video_size = None    # 原视频显示尺寸 (宽, 高)
+        self.working_size = None  # 抽帧后的分割工作尺寸 (宽, 高)
+        self.frames = None       # 共享帧存储（frame_store.FrameStore），首次分割时打开
+        self._decode_mark = (0, 0.0)  # 打开帧存储时的累计解码帧数和耗时
+        self.num_frames = 0
+        self.video_segments = None  # 存储分割结果（MaskStore）
+        self.feature_cache_key = None  # 图像特征缓存键，首次初始化推理状态时计算
+        self.keep_state = False        # 为 True 时一次加载全部帧的推理状态在分割后保留，用于局部修正
+        self.inference_state = None
 
         # 配置张量计算精度
         self._setup_precision()
 
-        # 初始化 SAM2 视频预测器
-        self._init_predictor()
+        # 未提供预测器时初始化 SAM2 视频预测器
+        if self.predictor is None:
+            self._init_predictor()
+        # 同一视频的图像特征缓存到磁盘，换提示重新分割时不再运行图像编码器
+        feature_cache.install(self.predictor)
 
     def _setup_precision(self) -> None:
-        """配置张量计算的精度设置。"""
-        torch.autocast(device_type=self.device, dtype=torch.bfloat16).__enter__()
-        if self.device == "cuda" and torch.cuda.get_device_properties(0).major >= 8:
-            # 为 Ampere GPU 启用 TensorFloat32
-            torch.backends.cuda.matmul.allow_tf32 = True
-            torch.backends.cudnn.allow_tf32 = True
+        """
+        配置推理精度。
+
+        不再进入全局 autocast：GPU 上的 bfloat16 autocast 只在分割期间通过 profile.autocast() 生效，
+        CPU 上保持 float32 并按 inference_profile 的配置设置线程数。
+        """
+        if self.profile is None:
+            self.profile = default_profile(self.device)
+        self.profile.configure_threads()
 
     def _init_predictor(self) -> None:
-        """初始化 SAM2 视频预测器。"""
-        self.predictor = build_sam2_video_predictor(self.model_cfg, self.checkpoint)
+        """初始化 SAM2 视频预测器，并应用推理配置。"""
+        self.predictor = build_sam2_video_predictor(self.model_cfg, self.checkpoint, device=self.device)
+        self.profile.apply(self.predictor)
 
     def set_video_path(self, input_video_path: str, output_video_path: str) -> None:
         """
@@ -68,43 +347,79 @@ class SAM2InstanceSegmentationModel:
         """
         self.input_video_path = input_video_path
         self.output_video_path = output_video_path
+        self.feature_cache_key = None
         if not os.path.exists(input_video_path):
             raise FileNotFoundError(f"输入视频文件不存在: {input_video_path}")
 
-    def _extract_frames(self, quality: int = 2, start_number: int = 0) -> None:
+    def _load_frames(self) -> None:
         """
-        使用 FFmpeg 从输入视频中提取帧。
+        打开输入视频的共享帧存储（只读取元数据，帧在访问时按分块解码，其他阶段直接复用），并确定分割工作分辨率。
 
-        参数:
-            quality (int): 帧质量（0-31，数值越低质量越高），默认为 2。
-            start_number (int): 起始帧编号，默认为 0。
+        working_scale 小于 1 时分割在缩小后的偶数尺寸上进行，帧在送入模型时按需缩放，不另存缩小后的帧。
 
         异常:
-            subprocess.CalledProcessError: 如果 FFmpeg 命令执行失败。
+            ValueError: 如果无法读取视频帧。
         """
-        os.makedirs(self.original_frames_folder, exist_ok=True)
-
-        command = [
-            'ffmpeg',
-            '-i', self.input_video_path,
-            '-q:v', str(quality),
-            '-start_number', str(start_number),
-            os.path.join(self.original_frames_folder, '%05d.jpg')
-        ]
-
-        try:
-            subprocess.run(command, check=True, capture_output=True, text=True)
-            print(f"帧已成功提取到 {self.original_frames_folder}")
-        except subprocess.CalledProcessError as e:
-            print(f"FFmpeg 执行失败: {e.stderr}")
-            raise
+        if self.frames is not None and self.frames.video_path == self.input_video_path:
+            return
+        self._release_frames()
+        self.frames = frame_stores.open(self.input_video_path)
+        self._decode_mark = (self.frames.decoded_frames, self.frames.decode_seconds)
+        self.num_frames = len(self.frames)
+        self.video_size = self.frames.size
+
+        width, height = self.video_size
+        if 0 < self.working_scale < 1:
+            width = int(width * self.working_scale / 2) * 2
+            height = int(height * self.working_scale / 2) * 2
+        self.working_size = (width, height)
+        print(f"视频帧已就绪: {self.num_frames} 帧，分割工作分辨率 {width}x{height}")
+
+    def _release_frames(self) -> None:
+        """归还共享帧存储，并按分割期间实际解码的帧记录解码阶段的耗时（帧已解码时不记录）。"""
+        if self.frames is not None:
+            decoded = self.frames.decoded_frames - self._decode_mark[0]
+            if decoded > 0:
+                width, height = self.frames.size
+                cost_estimator.record_sample('extract_frames', decoded * width * height / 1e6,
+                                             self.frames.decode_seconds - self._decode_mark[1])
+            frame_stores.release(self.frames)
+            self.frames = None
+
+    def _frame(self, frame_idx: int) -> np.ndarray:
+        """返回工作分辨率下的一帧（BGR），工作分辨率与原视频相同时为帧存储中的只读视图。"""
+        frame = self.frames.frame(frame_idx)
+        if self.working_size != self.video_size:
+            frame = cv2.resize(frame, self.working_size, interpolation=cv2.INTER_AREA)
+        return frame
+
+    def _scale_prompts(self, points: np.ndarray = None, box: np.ndarray = None):
+        """
+        将原视频坐标系下的点和矩形框提示换算到分割工作分辨率。
 
-        # 收集并排序帧文件名
-        self.frame_names = [
-            p for p in os.listdir(self.original_frames_folder)
-            if p.lower().endswith(('.jpg', '.jpeg'))
-        ]
-        self.frame_names.sort(key=lambda p: int(os.path.splitext(p)[0]))
+        返回:
+            tuple: (points, box)，未提供的提示保持为 None
+        """
+        if not self.video_size or not self.working_size or self.video_size == self.working_size:
+            return points, box
+        sx = self.working_size[0] / self.video_size[0]
+        sy = self.working_size[1] / self.video_size[1]
+        if points is not None:
+            points = np.asarray(points, dtype=np.float32) * np.array([sx, sy], dtype=np.float32)
+        if box is not None:
+            box = np.asarray(box, dtype=np.float32) * np.array([sx, sy, sx, sy], dtype=np.float32)
+        return points, box
+
+    def _upsample_mask(self, mask: np.ndarray, size: tuple, dilation: int = 0,
+                       guide: np.ndarray = None) -> np.ndarray:
+        """将工作分辨率的掩码放大到指定尺寸，并可选地膨胀和按引导帧修正边缘（见 upsample_mask）。"""
+        return upsample_mask(mask, size, dilation, guide)
+
+    # 彩色掩码使用的颜色（BGR），按对象顺序循环使用
+    MASK_COLORS = [
+        np.array([0, 128, 255], dtype=np.uint8),  # 蓝色
+        np.array([255, 128, 0], dtype=np.uint8)   # 橙色
+    ]
 
     def _apply_colored_mask(self, image: np.ndarray, mask: np.ndarray, color_id: int) -> np.ndarray:
         """
@@ -118,49 +433,25 @@ class SAM2InstanceSegmentationModel:
         返回:
             np.ndarray: 应用掩码后的图像，分割对象为彩色，背景保留原始图像。
         """
-        colors = [
-            np.array([0, 128, 255], dtype=np.uint8),  # 蓝色
-            np.array([255, 128, 0], dtype=np.uint8)   # 橙色
-        ]
+        mask_color = self.MASK_COLORS[color_id % len(self.MASK_COLORS)]  # 循环使用颜色
 
-        # 将掩码转换为 uint8 并创建三通道掩码
-        int_mask = mask.astype(np.uint8)
-        int_mask_3d = np.dstack((int_mask, int_mask, int_mask))
-
-        # 创建彩色掩码
-        mask_color = colors[color_id % len(colors)]  # 循环使用颜色
-        colored_mask = np.full_like(image, mask_color)
-        colored_mask[int_mask == 0] = 0
-
-        # 混合图像和掩码
+        # 整帧按 0.6:0.4 与颜色混合，再只在掩码区域拷贝混合结果
         alpha = 0.6  # 原始图像权重
-        beta = 1 - alpha  # 掩码权重
-        blended = cv2.addWeighted(image, alpha, colored_mask, beta, 0.0, dtype=cv2.CV_8U)
-
-        # 在非掩码区域保留原始图像
-        blended[int_mask_3d == 0] = image[int_mask_3d == 0]
-        return blended
+        blended = cv2.addWeighted(image, alpha, np.broadcast_to(mask_color, image.shape).copy(), 1 - alpha, 0.0)
+        return np.where(mask[..., None], blended, image)
 
     def _apply_white_mask(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
         """
-        将白色掩码应用到图像上，分割目标为白色，背景为黑色，不透明。
+        生成黑白掩码，分割目标为白色，背景为黑色。
 
         参数:
-            image (np.ndarray): 输入图像，形状为 (H, W, 3)。
+            image (np.ndarray): 输入图像（仅为兼容旧接口保留，不参与计算）。
             mask (np.ndarray): 二值掩码，形状为 (H, W)，1 表示前景，0 表示背景。
 
         返回:
-            np.ndarray: 应用掩码后的图像，分割区域为白色，背景为黑色。
+            np.ndarray: 单通道 uint8 掩码，形状为 (H, W)，分割区域为 255，背景为 0。
         """
-        # 将掩码转换为 uint8
-        int_mask = mask.astype(np.uint8)
-
-        # 创建白色掩码（255, 255, 255）和黑色背景（0, 0, 0）
-        result = np.zeros_like(image)
-        result[int_mask == 1] = [255, 255, 255]  # 分割目标设为白色
-        result[int_mask == 0] = [0, 0, 0]        # 背景设为黑色
-
-        return result
+        return mask.astype(np.uint8) * 255
 
     def _apply_original_mask(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
         """
@@ -173,25 +464,22 @@ class SAM2InstanceSegmentationModel:
         返回:
             np.ndarray: 应用掩码后的图像，分割区域为原始对象，背景为白色。
         """
-        # 将掩码转换为 uint8
-        int_mask = mask.astype(np.uint8)
-
-        # 创建结果图像，初始化为白色背景（255, 255, 255）
-        result = np.full_like(image, [255, 255, 255])
-
-        # 将掩码区域设置为原始图像的内容
-        result[int_mask == 1] = image[int_mask == 1]
-
-        return result
+        return np.where(mask[..., None], image, np.uint8(255))
 
     def cleanup(self) -> None:
         """
-        删除视频帧文件夹（保留掩码帧文件夹）。
+        归还共享帧存储并删除掩码帧等中间文件夹。
 
         异常:
             OSError: 如果删除文件夹失败。
         """
-        folders_to_delete = [self.original_frames_folder, self.frames_mask_dir,self.original_mask_dir,self.white_mask_dir]
+        if self.video_segments is not None:
+            self.video_segments.close(delete=True)
+            self.video_segments = None
+        self.inference_state = None
+        self._release_frames()
+
+        folders_to_delete = [self.original_mask_dir, self.white_mask_dir, self.mask_store_dir]
         for folder in folders_to_delete:
             if os.path.exists(folder):
                 try:
@@ -200,19 +488,6 @@ class SAM2InstanceSegmentationModel:
                 except OSError as e:
                     print(f"删除文件夹 {folder} 失败: {e}")
 
-        # 删除临时视频文件
-        temp_files = ["Backend/temp1.mp4", "Backend/temp2.mp4"]
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                    print(f"已删除临时文件: {temp_file}")
-                except OSError as e:
-                    print(f"删除临时文件 {temp_file} 失败: {e}")
-        
-        
-
-
     def _get_unique_output_path(self, output_path: str) -> str:
         """
         检查输出路径是否已存在，若存在则生成一个新的文件名。
@@ -231,131 +506,565 @@ class SAM2InstanceSegmentationModel:
             counter += 1
         return new_path
 
-    def _create_reverse_video(self, input_frames_dir: str, output_path: str, start_frame: int, end_frame: int) -> None:
+    def _create_mask_store(self, inference_state: dict, num_frames: int = None) -> MaskStore:
         """
-        创建反向播放的视频段。通过创建帧列表文件并使用FFmpeg的concat功能来实现视频反向播放。
+        为当前视频创建新的掩码存储，替换之前的分割结果。
 
         参数:
-            input_frames_dir (str): 输入帧目录，包含按序号命名的jpg图像文件
-            output_path (str): 输出视频路径，生成的mp4文件保存位置
-            start_frame (int): 起始帧索引，从该帧开始反向播放
-            end_frame (int): 结束帧索引，播放到该帧结束（通常为-1表示到第0帧）
+            inference_state (dict): 推理状态，用于获取帧数和掩码尺寸
+            num_frames (int): 视频总帧数，分窗口传播时推理状态只包含一个窗口，需要显式指定
 
-        异常:
-            subprocess.CalledProcessError: 如果FFmpeg命令执行失败
-        """
-        # 创建临时文件列表，用于FFmpeg的concat功能
-        temp_list_path = "temp_frames_list.txt"
-        with open(temp_list_path, "w") as f:
-            # 从start_frame到end_frame反向遍历帧
-            for i in range(start_frame, end_frame - 1, -1):
-                frame_path = os.path.join(input_frames_dir, f"{i:05d}.jpg")
-                f.write(f"file '{frame_path}'\n")
-
-        # 使用FFmpeg的concat功能创建反向视频
-        command = [
-            'ffmpeg',
-            '-f', 'concat',  # 使用concat格式
-            '-safe', '0',    # 允许使用绝对路径
-            '-i', temp_list_path,  # 输入帧列表文件
-            '-c:v', 'libx264',     # 使用H.264编码
-            '-pix_fmt', 'yuv420p', # 使用yuv420p像素格式（兼容性最好）
-            output_path
-        ]
+        返回:
+            MaskStore: 以内存映射文件保存的位压缩掩码存储
+        """
+        if self.video_segments is not None:
+            self.video_segments.close(delete=True)
+        self.video_segments = MaskStore(
+            num_frames or inference_state["num_frames"],
+            inference_state["video_height"],
+            inference_state["video_width"],
+            root=self.mask_store_dir
+        )
+        return self.video_segments
 
-        try:
-            subprocess.run(command, check=True, capture_output=True, text=True)
-            print(f"反向视频已创建: {output_path}")
-        finally:
-            # 清理临时文件列表
-            if os.path.exists(temp_list_path):
-                os.remove(temp_list_path)
+    def _add_prompt(self, inference_state: dict, prompt: dict, frame_idx: int) -> None:
+        """在推理状态的指定帧上添加一个对象的点或矩形框提示。"""
+        self.predictor.add_new_points_or_box(
+            inference_state=inference_state,
+            frame_idx=frame_idx,
+            obj_id=prompt["obj_id"],
+            points=prompt.get("points"),
+            labels=prompt.get("labels"),
+            box=prompt.get("box")
+        )
 
-    def _create_forward_video(self, input_frames_dir: str, output_path: str, start_frame: int) -> None:
+    def _propagate_bidirectional(self, inference_state: dict, first_frame: int, last_frame: int) -> None:
         """
-        创建正向播放的视频段。从指定帧开始，按顺序播放到视频结束。
+        在同一个推理状态上从最早的提示帧向后、从最晚的提示帧向前传播分割结果。
+
+        两个方向共用一次帧加载和图像特征，所有对象在同一次传播中一起跟踪。
 
         参数:
-            input_frames_dir (str): 输入帧目录，包含按序号命名的jpg图像文件
-            output_path (str): 输出视频路径，生成的mp4文件保存位置
-            start_frame (int): 起始帧索引，从该帧开始正向播放
+            inference_state (dict): 已添加提示的推理状态
+            first_frame (int): 最早的提示帧索引
+            last_frame (int): 最晚的提示帧索引
+        """
+        with cost_estimator.record_stage('sam2_propagation', self.input_video_path), \
+                self.video_segments.batch_writer() as writer:
+            # 从最早的提示帧正向传播到视频结束
+            for out_frame_idx, out_obj_ids, out_mask_logits in self.predictor.propagate_in_video(
+                    inference_state, start_frame_idx=first_frame, reverse=False):
+                writer.add(out_frame_idx, out_obj_ids, out_mask_logits)
+
+            # 从最晚的提示帧反向传播到第 0 帧
+            if last_frame > 0:
+                for out_frame_idx, out_obj_ids, out_mask_logits in self.predictor.propagate_in_video(
+                        inference_state, start_frame_idx=last_frame, reverse=True):
+                    writer.add(out_frame_idx, out_obj_ids, out_mask_logits)
+        self.video_segments.flush()
+
+    def _init_state(self, frame_indices: list = None) -> dict:
+        """
+        初始化推理状态，帧直接从共享帧存储中按需读取，并关联图像特征缓存。
 
-        异常:
-            subprocess.CalledProcessError: 如果FFmpeg命令执行失败
-        """
-        command = [
-            'ffmpeg',
-            '-framerate', '30',  # 设置帧率为30fps
-            '-start_number', str(start_frame),  # 设置起始帧号
-            '-i', os.path.join(input_frames_dir, '%05d.jpg'),  # 输入帧序列
-            '-c:v', 'libx264',     # 使用H.264编码
-            '-pix_fmt', 'yuv420p', # 使用yuv420p像素格式
-            output_path
-        ]
+        参数:
+            frame_indices (list): 推理状态包含的全局帧索引（按升序排列），为 None 表示整个视频
 
-        try:
-            subprocess.run(command, check=True, capture_output=True, text=True)
-            print(f"正向视频已创建: {output_path}")
-        except subprocess.CalledProcessError as e:
-            print(f"FFmpeg 执行失败: {e.stderr}")
-            raise
+        返回:
+            dict: 推理状态
+        """
+        loader = StoreFrameLoader(self.frames, self.working_size, frame_indices)
+        inference_state = self.predictor.init_state(video_path=loader)
+        if feature_cache.enabled and self.input_video_path:
+            if self.feature_cache_key is None:
+                self.feature_cache_key = feature_cache.make_key(
+                    self.input_video_path, self.checkpoint,
+                    variant=feature_variant(self.working_scale, self.profile.name))
+            feature_cache.attach(inference_state, self.feature_cache_key, frame_indices,
+                               num_frames=self.num_frames)
+        return inference_state
+
+    def _propagate_windows(self, prompts: list, reverse: bool, frames: list = None) -> None:
+        """
+        从最早（反向时为最晚）的提示帧开始按重叠窗口向一个方向传播。
+
+        每个对象的提示在包含其提示帧的窗口中加入；之后每个窗口的重叠帧以上一窗口得到的掩码
+        作为条件帧，相当于把对象记忆带入下一窗口。对象在重叠帧上暂时消失（遮挡、短暂出画）时，
+        用它最近一次非空的掩码作为下一窗口起始帧的条件帧，对象重新出现后继续跟踪，
+        不会因为某一段重叠帧为空就丢失该对象或停止传播。每个窗口传播完即写入掩码存储并释放推理状态，
+        内存占用只与窗口大小有关，与视频长度无关。
 
-    def _create_split_videos(self, frame_idx: int) -> tuple[str, str]:
+        参数:
+            prompts (list): 各对象的提示，见 _segment
+            reverse (bool): True 表示向第 0 帧方向传播
+            frames (list): 参与传播的全局帧索引（升序，需包含所有提示帧），窗口按该序列划分；
+                为 None 表示所有帧，关键帧步长模式下为关键帧序列
         """
-        将视频分割为正向和反向两段。在指定帧处分割，创建两个独立的视频文件。
+        frames = list(range(self.num_frames)) if frames is None else frames
+        position = {global_idx: pos for pos, global_idx in enumerate(frames)}
+        total = len(frames)
+        size = max(self.window_size, self.window_overlap + 2)
+        overlap = max(1, self.window_overlap)
+        pending = sorted(prompts, key=lambda p: p["frame_idx"], reverse=reverse)
+        active = set()  # 本方向上已加入提示的对象
+        last_known = {}  # 对象 -> 本方向上最近一次非空的掩码
+        anchor = position[pending[0]["frame_idx"]]
+        first = True
+
+        while True:
+            if reverse:
+                start, end = max(0, anchor - size + 1), anchor + 1
+            else:
+                start, end = anchor, min(total, anchor + size)
+            store = self.video_segments
+
+            # 用上一窗口在重叠帧上的掩码作为本窗口的条件帧
+            seeds = []
+            if not first:
+                if reverse:
+                    overlap_positions = range(anchor - overlap + 1, anchor + 1)
+                else:
+                    overlap_positions = range(anchor, anchor + overlap)
+                visible = set()
+                for pos in overlap_positions:
+                    if not start <= pos < end:
+                        continue
+                    for obj_id in sorted(active):
+                        mask = store.get(frames[pos], obj_id)
+                        if mask is not None and mask.any():
+                            seeds.append((pos, obj_id, mask))
+                            visible.add(obj_id)
+                # 在重叠帧上暂时消失的对象带着最近一次的掩码进入本窗口（只作为记忆，不写回该帧）
+                for obj_id in sorted(active - visible):
+                    if obj_id in last_known:
+                        seeds.append((anchor, obj_id, last_known[obj_id]))
+            window_prompts = [p for p in pending if start <= position[p["frame_idx"]] < end]
+
+            if not seeds and not window_prompts:
+                # 已加入的对象从未得到非空掩码，跳到下一个对象的提示帧继续
+                if not pending:
+                    print(f"第 {frames[anchor]} 帧附近已无分割目标，停止{'反向' if reverse else '正向'}传播")
+                    break
+                anchor = position[pending[0]["frame_idx"]]
+                first = True
+                continue
+
+            inference_state = self._init_state(frames[start:end])
+            if store is None:
+                store = self._create_mask_store(inference_state, num_frames=self.num_frames)
+            seeded = {}
+            for pos, obj_id, mask in seeds:
+                self.predictor.add_new_mask(inference_state, pos - start, obj_id, mask)
+                seeded.setdefault(pos, set()).add(obj_id)
+            for prompt in window_prompts:
+                self._add_prompt(inference_state, prompt, position[prompt["frame_idx"]] - start)
+                active.add(prompt["obj_id"])
+                pending.remove(prompt)
+
+            with store.batch_writer() as writer:
+                for out_frame_idx, out_obj_ids, out_mask_logits in self.predictor.propagate_in_video(
+                        inference_state, start_frame_idx=anchor - start, reverse=reverse):
+                    pos = start + out_frame_idx
+                    if pos in seeded:
+                        # 重叠帧上已作为条件帧的对象保留上一窗口的结果
+                        keep = [i for i, obj_id in enumerate(out_obj_ids) if obj_id not in seeded[pos]]
+                        if keep:
+                            writer.add(frames[pos], [out_obj_ids[i] for i in keep], out_mask_logits[keep])
+                        continue
+                    writer.add(frames[pos], out_obj_ids, out_mask_logits)
+
+            self.predictor.reset_state(inference_state)
+            del inference_state
+            self._update_last_known(last_known, active, frames[start:end], reverse)
+
+            if (reverse and start == 0) or (not reverse and end == total):
+                break
+            anchor = start + overlap - 1 if reverse else end - overlap
+            first = False
+
+    def _update_last_known(self, last_known: dict, obj_ids: set, window: list, reverse: bool) -> None:
+        """
+        从窗口的传播终点向起点查找每个对象最近一次非空的掩码，更新 last_known。
+
+        对象在窗口末尾仍可见时只读取一帧；整个窗口都不可见时保留之前的掩码。
 
         参数:
-            frame_idx (int): 分割点的帧索引，该帧将作为两个视频段的起始点
+            window (list): 窗口包含的全局帧索引（升序）
+        """
+        order = window if reverse else window[::-1]
+        store = self.video_segments
+        for obj_id in obj_ids:
+            for global_idx in order:
+                mask = store.get(global_idx, obj_id)
+                if mask is not None and mask.any():
+                    last_known[obj_id] = mask
+                    break
+
+    def _segment_windowed(self, prompts: list) -> None:
+        """分窗口地正向、反向传播，用于帧数超过 window_size 的长视频。"""
+        if self.video_segments is not None:
+            self.video_segments.close(delete=True)
+            self.video_segments = None
+
+        print(f"视频共 {self.num_frames} 帧，按 {self.window_size} 帧窗口"
+              f"（重叠 {self.window_overlap} 帧）分段传播")
+        with cost_estimator.record_stage('sam2_propagation', self.input_video_path):
+            self._propagate_windows(prompts, False)
+            if max(p["frame_idx"] for p in prompts) > 0:
+                self._propagate_windows(prompts, True)
+        self.video_segments.flush()
+
+    def _keyframe_gap_is_dense(self, start: int, end: int) -> bool:
+        """
+        判断两个相邻关键帧之间是否需要逐帧推理：对象出现或消失、掩码 IoU 过低（运动较大）
+        或面积变化过大时返回 True。
+        """
+        store = self.video_segments
+        for obj_id in store.obj_ids:
+            mask_a, mask_b = store.get(start, obj_id), store.get(end, obj_id)
+            has_a = mask_a is not None and mask_a.any()
+            has_b = mask_b is not None and mask_b.any()
+            if has_a != has_b:
+                return True
+            if not has_a:
+                continue
+            if mask_iou(mask_a, mask_b) < SAM2_STRIDE_MIN_IOU or \
+                    area_change(mask_a, mask_b) > SAM2_STRIDE_MAX_AREA_CHANGE:
+                return True
+        return False
+
+    def _interpolate_gap(self, start: int, end: int, interpolator) -> None:
+        """用光流或形状插值补全两个关键帧之间各帧的掩码，光流每对帧只计算一次，所有对象共用。"""
+        store = self.video_segments
+        masks_a, masks_b = {}, {}
+        for obj_id in store.obj_ids:
+            mask_a, mask_b = store.get(start, obj_id), store.get(end, obj_id)
+            if mask_a is None or mask_b is None or not (mask_a.any() or mask_b.any()):
+                continue
+            masks_a[obj_id], masks_b[obj_id] = mask_a, mask_b
+        if not masks_a:
+            return
+        for idx in range(start + 1, end):
+            weight = (idx - start) / (end - start)
+            if interpolator is None:
+                masks = {obj_id: shape_interpolate(masks_a[obj_id], masks_b[obj_id], weight) for obj_id in masks_a}
+            else:
+                masks = interpolator.interpolate_objects(idx, start, masks_a, end, masks_b, weight)
+            for obj_id, mask in masks.items():
+                store.put(idx, obj_id, mask)
+
+    def _propagate_dense_gap(self, start: int, end: int) -> None:
+        """
+        对运动较大的关键帧区间逐帧推理：以两端关键帧的掩码作为条件帧，只加载该区间的帧。
+        """
+        store = self.video_segments
+        inference_state = self._init_state(list(range(start, end + 1)))
+        seeded_start = seeded_end = False
+        for obj_id in store.obj_ids:
+            for global_idx in (start, end):
+                mask = store.get(global_idx, obj_id)
+                if mask is not None and mask.any():
+                    self.predictor.add_new_mask(inference_state, global_idx - start, obj_id, mask)
+                    if global_idx == start:
+                        seeded_start = True
+                    else:
+                        seeded_end = True
+
+        if seeded_start or seeded_end:
+            # 起始关键帧有目标时正向传播，否则从结束关键帧反向传播
+            reverse = not seeded_start
+            with store.batch_writer() as writer:
+                for out_frame_idx, out_obj_ids, out_mask_logits in self.predictor.propagate_in_video(
+                        inference_state, start_frame_idx=(end - start) if reverse else 0, reverse=reverse):
+                    global_idx = start + out_frame_idx
+                    if start < global_idx < end:
+                        writer.add(global_idx, out_obj_ids, out_mask_logits)
+        self.predictor.reset_state(inference_state)
+
+    def _segment_strided(self, prompts: list) -> None:
+        """
+        关键帧步长模式：只在每 keyframe_stride 帧（以及提示帧、首尾帧）上运行 SAM2，
+        中间帧用光流搬运或形状插值补全；相邻关键帧之间运动或面积变化超过阈值时，
+        该区间自动回退为逐帧推理。
+        """
+        total = self.num_frames
+        stride = self.keyframe_stride
+        prompt_frames = {p["frame_idx"] for p in prompts}
+        keyframes = sorted(set(range(min(prompt_frames) % stride, total, stride)) | {0, total - 1} | prompt_frames)
+        print(f"关键帧模式：步长 {stride}，共 {len(keyframes)} 个关键帧")
+
+        with cost_estimator.record_stage('sam2_propagation', self.input_video_path):
+            # 1. 只加载关键帧，在关键帧序列上双向传播；关键帧超过 window_size 个时同样按重叠窗口分段，
+            #    推理状态的内存只与窗口大小有关
+            if self.window_size and len(keyframes) > self.window_size:
+                if self.video_segments is not None:
+                    self.video_segments.close(delete=True)
+                    self.video_segments = None
+                self._propagate_windows(prompts, False, keyframes)
+                if keyframes.index(max(prompt_frames)) > 0:
+                    self._propagate_windows(prompts, True, keyframes)
+            else:
+                inference_state = self._init_state(keyframes)
+                self._create_mask_store(inference_state, num_frames=total)
+                for prompt in prompts:
+                    self._add_prompt(inference_state, prompt, keyframes.index(prompt["frame_idx"]))
+                first_local = keyframes.index(min(prompt_frames))
+                last_local = keyframes.index(max(prompt_frames))
+                with self.video_segments.batch_writer() as writer:
+                    for reverse, start_local in ((False, first_local), (True, last_local)):
+                        if reverse and start_local == 0:
+                            continue
+                        for out_frame_idx, out_obj_ids, out_mask_logits in self.predictor.propagate_in_video(
+                                inference_state, start_frame_idx=start_local, reverse=reverse):
+                            writer.add(keyframes[out_frame_idx], out_obj_ids, out_mask_logits)
+                self.predictor.reset_state(inference_state)
+                del inference_state
+
+            # 2. 逐个区间补全中间帧
+            interpolator = FlowInterpolator(self.frames.frame) if self.stride_interpolation == "flow" else None
+            dense_frames = interpolated_frames = 0
+            for start, end in zip(keyframes[:-1], keyframes[1:]):
+                if end - start <= 1:
+                    continue
+                if self._keyframe_gap_is_dense(start, end):
+                    self._propagate_dense_gap(start, end)
+                    dense_frames += end - start - 1
+                else:
+                    self._interpolate_gap(start, end, interpolator)
+                    interpolated_frames += end - start - 1
+        self.video_segments.flush()
+        print(f"关键帧模式完成：插值 {interpolated_frames} 帧，回退逐帧推理 {dense_frames} 帧")
+
+    def _segment(self, prompts: list) -> bool:
+        """
+        使用一个或多个对象的点或矩形框提示进行实例分割，所有对象在同一个推理状态中一起传播到整个视频。
+        keyframe_stride 大于 1 时使用关键帧步长模式；否则帧数超过 window_size 时按重叠窗口分段加载和传播。
+
+        参数:
+            prompts (list): 每个对象一个字典，包含 "obj_id"、"frame_idx" 以及 "points"/"labels" 或 "box"
+                （原视频坐标系）
 
         返回:
-            tuple[str, str]: 包含两个视频路径的元组
-                - temp1_path: 反向视频路径（从frame_idx到0）
-                - temp2_path: 正向视频路径（从frame_idx到结束）
+            bool: 分割是否成功
 
-        处理流程:
-            1. 创建反向视频（从frame_idx到0）
-            2. 创建正向视频（从frame_idx到结束）
-            3. 返回两个视频的路径
+        异常:
+            ValueError: 如果未设置视频路径、没有提示或提示帧超出范围
         """
-        # 创建临时视频文件路径
-        temp1_path = "temp1.mp4"  # 从frame_idx到0的反向视频
-        temp2_path = "temp2.mp4"  # 从frame_idx到结束的正向视频
+        if not self.input_video_path:
+            raise ValueError("必须使用 set_video_path 设置输入视频路径。")
+        if not prompts:
+            raise ValueError("至少需要一个分割提示。")
+
+        print(f"输入视频: {self.input_video_path}")
+
+        # 打开共享帧存储（帧在访问时按分块解码，解码过的分块各阶段共享）
+        self._load_frames()
+        scaled = []
+        for prompt in prompts:
+            frame_idx = prompt["frame_idx"]
+            if not 0 <= frame_idx < self.num_frames:
+                raise ValueError(f"提示帧 {frame_idx} 超出视频帧范围 [0, {self.num_frames - 1}]")
+            # 提示坐标基于原视频分辨率，换算到工作分辨率
+            points, box = self._scale_prompts(prompt.get("points"), prompt.get("box"))
+            scaled.append(dict(prompt, points=points, box=box))
+
+        # 精度上下文只在分割期间生效（GPU 上为 bfloat16 autocast，CPU 上保持 float32）
+        with self.profile.autocast():
+            mode = propagation_mode(self.num_frames, self.window_size, self.keyframe_stride)
+            if mode == "strided":
+                self._segment_strided(scaled)
+            # 长视频分窗口加载，峰值内存与视频长度无关
+            elif mode == "windowed":
+                self._segment_windowed(scaled)
+            else:
+                self._segment_full(scaled)
+
+        print(f"实例分割完成，共 {len(prompts)} 个对象，分割结果已存储。")
+        return True
 
-        # 创建反向视频段（从frame_idx到0）
-        self._create_reverse_video(self.original_frames_folder, temp1_path, frame_idx, -1)
+    def _segment_full(self, prompts: list) -> None:
+        """一次加载所有帧，在同一个推理状态上添加所有对象的提示并双向传播。"""
+        # 初始化视频状态（所有帧只加载一次）
+        inference_state = self._init_state()
 
-        # 创建正向视频段（从frame_idx到结束）
-        self._create_forward_video(self.original_frames_folder, temp2_path, frame_idx)
+        # 添加提示，每个对象使用各自的 obj_id
+        for prompt in prompts:
+            self._add_prompt(inference_state, prompt, prompt["frame_idx"])
 
-        return temp1_path, temp2_path
+        # 将分割双向传播到整个视频，掩码按批写入位压缩存储
+        self._create_mask_store(inference_state)
+        prompt_frames = [p["frame_idx"] for p in prompts]
+        self._propagate_bidirectional(inference_state, min(prompt_frames), max(prompt_frames))
 
-    def _extract_video_frames(self, video_path: str, output_dir: str) -> None:
+        # 需要局部修正时保留推理状态，否则释放其占用的帧和特征
+        if self.keep_state:
+            self.inference_state = inference_state
+        else:
+            self.predictor.reset_state(inference_state)
+        del inference_state
+
+    def _propagate_until_converged(self, outputs, obj_id: int, to_global, skip=()) -> tuple:
         """
-        从视频中提取帧。将视频分解为单独的jpg图像文件。
+        消费传播结果，更新指定对象的掩码，直到新旧掩码连续 REFINE_CONVERGENCE_FRAMES 帧
+        的 IoU 都达到 REFINE_CONVERGENCE_IOU。
 
         参数:
-            video_path (str): 输入视频路径，要提取帧的视频文件
-            output_dir (str): 输出帧目录，提取的帧将保存在此目录中
+            outputs: propagate_in_video 返回的生成器
+            obj_id (int): 被修正的对象 ID，其他对象的掩码保持不变
+            to_global: 将推理状态中的帧索引换算为全局帧索引的函数
+            skip: 不需要写入的全局帧索引（作为条件帧的重叠帧）
 
-        处理流程:
-            1. 创建输出目录（如果不存在）
-            2. 使用FFmpeg提取视频帧
-            3. 帧将以%05d.jpg格式命名（如00001.jpg, 00002.jpg等）
+        返回:
+            tuple: (最后更新的全局帧索引或 None, 是否已收敛)
+        """
+        store = self.video_segments
+        stable = 0
+        last = None
+        try:
+            for out_frame_idx, out_obj_ids, out_mask_logits in outputs:
+                global_idx = to_global(out_frame_idx)
+                out_obj_ids = list(out_obj_ids)
+                if global_idx in skip or obj_id not in out_obj_ids:
+                    continue
+                new_mask = (out_mask_logits[out_obj_ids.index(obj_id)] > 0.0).cpu().numpy().reshape(
+                    store.height, store.width)
+                old_mask = store.get(global_idx, obj_id)
+                unchanged = old_mask is not None and mask_iou(new_mask, old_mask) >= REFINE_CONVERGENCE_IOU
+                store.put(global_idx, obj_id, new_mask)
+                last = global_idx
+                stable = stable + 1 if unchanged else 0
+                if stable >= REFINE_CONVERGENCE_FRAMES:
+                    return last, True
+        finally:
+            outputs.close()
+        return last, False
 
-        异常:
-            subprocess.CalledProcessError: 如果FFmpeg命令执行失败
+    def _refine_in_windows(self, frame_idx: int, points: np.ndarray, labels: np.ndarray, obj_id: int,
+                           reverse: bool) -> int:
         """
-        os.makedirs(output_dir, exist_ok=True)
-        subprocess.run([
-            'ffmpeg',
-            '-i', video_path,  # 输入视频
-            '-q:v', '2',       # 设置图像质量（2-31，数值越低质量越高）
-            os.path.join(output_dir, '%05d.jpg')  # 输出帧序列
-        ], check=True, capture_output=True)
+        没有保留推理状态时（分窗口或关键帧模式），从修正帧开始按窗口向一个方向重新传播，收敛后停止。
 
-    def segment_with_points(self, points: np.ndarray, labels: np.ndarray, frame_idx: int = 0) -> None:
+        修正帧以现有掩码和新增的点作为提示，之后的窗口以重叠帧上的新掩码作为条件帧。
+
+        返回:
+            int: 本方向最后更新的全局帧索引
+        """
+        total = self.num_frames
+        size = max(self.window_size or SAM2_WINDOW_FRAMES, self.window_overlap + 2)
+        overlap = max(1, self.window_overlap)
+        store = self.video_segments
+        anchor = last = frame_idx
+        first = True
+
+        while True:
+            if reverse:
+                start, end = max(0, anchor - size + 1), anchor + 1
+            else:
+                start, end = anchor, min(total, anchor + size)
+            inference_state = self._init_state(list(range(start, end)))
+
+            if first:
+                seeds = [anchor]
+            elif reverse:
+                seeds = [idx for idx in range(anchor - overlap + 1, anchor + 1) if idx >= start]
+            else:
+                seeds = [idx for idx in range(anchor, anchor + overlap) if idx < end]
+            seeded = False
+            for global_idx in seeds:
+                mask = store.get(global_idx, obj_id)
+                if mask is not None and mask.any():
+                    self.predictor.add_new_mask(inference_state, global_idx - start, obj_id, mask)
+                    seeded = True
+            if first:
+                # 以现有掩码为基础叠加新的点提示
+                self.predictor.add_new_points_or_box(
+                    inference_state=inference_state,
+                    frame_idx=anchor - start,
+                    obj_id=obj_id,
+                    points=points,
+                    labels=labels,
+                    clear_old_points=False
+                )
+            elif not seeded:
+                self.predictor.reset_state(inference_state)
+                break
+
+            outputs = self.predictor.propagate_in_video(inference_state, start_frame_idx=anchor - start,
+                                                        reverse=reverse)
+            window_last, converged = self._propagate_until_converged(
+                outputs, obj_id, lambda idx: start + idx, skip=() if first else set(seeds))
+            self.predictor.reset_state(inference_state)
+            del inference_state
+            if window_last is not None:
+                last = window_last
+
+            if converged or (reverse and start == 0) or (not reverse and end == total):
+                break
+            anchor = start + overlap - 1 if reverse else end - overlap
+            first = False
+        return last
+
+    def refine(self, frame_idx: int, points: np.ndarray, labels: np.ndarray, obj_id: int = 1) -> dict:
+        """
+        在任意帧上追加正/负点修正已有的分割结果，只重新传播受影响的帧。
+
+        从修正帧分别向后、向前传播，某一方向上新旧掩码连续 REFINE_CONVERGENCE_FRAMES 帧
+        基本一致后即停止，范围之外的帧保持原有掩码。保留了推理状态（keep_state）时直接在
+        原状态上追加提示，否则按窗口重新加载受影响的帧。
+
+        参数:
+            frame_idx (int): 修正所在的帧索引
+            points (np.ndarray): 点坐标，形状为 (N, 2)，原视频坐标系
+            labels (np.ndarray): 点标签，形状为 (N,)，1 表示前景，0 表示背景
+            obj_id (int): 被修正的对象 ID
+
+        返回:
+            dict: {"frame": 修正帧, "start": 更新范围起始帧, "end": 更新范围结束帧}
+
+        异常:
+            ValueError: 如果尚未分割或帧索引超出范围
+        """
+        if self.video_segments is None:
+            raise ValueError("必须先进行实例分割才能修正掩码。")
+        if not 0 <= frame_idx < self.num_frames:
+            raise ValueError(f"修正帧 {frame_idx} 超出视频帧范围 [0, {self.num_frames - 1}]")
+        points, _ = self._scale_prompts(points)
+
+        with self.profile.autocast():
+            if self.inference_state is not None:
+                inference_state = self.inference_state
+                self.predictor.add_new_points_or_box(
+                    inference_state=inference_state,
+                    frame_idx=frame_idx,
+                    obj_id=obj_id,
+                    points=points,
+                    labels=labels,
+                    clear_old_points=False
+                )
+                end, _ = self._propagate_until_converged(
+                    self.predictor.propagate_in_video(inference_state, start_frame_idx=frame_idx),
+                    obj_id, lambda idx: idx)
+                start = frame_idx
+                if frame_idx > 0:
+                    start, _ = self._propagate_until_converged(
+                        self.predictor.propagate_in_video(inference_state, start_frame_idx=frame_idx,
+                                                          reverse=True),
+                        obj_id, lambda idx: idx)
+            else:
+                end = self._refine_in_windows(frame_idx, points, labels, obj_id, reverse=False)
+                start = frame_idx
+                if frame_idx > 0:
+                    start = self._refine_in_windows(frame_idx, points, labels, obj_id, reverse=True)
+        self.video_segments.flush()
+
+        start = frame_idx if start is None else start
+        end = frame_idx if end is None else end
+        print(f"掩码修正完成：第 {frame_idx} 帧，更新范围 [{start}, {end}]")
+        return {"frame": frame_idx, "start": start, "end": end}
+
+    def segment_with_points(self, points: np.ndarray, labels: np.ndarray, frame_idx: int = 0) -> bool:
         """
-        使用用户提供的点进行实例分割，存储分割结果，并将视频分为两段。
+        使用用户提供的点进行实例分割，存储分割结果。
 
         参数:
             points (np.ndarray): 分割点坐标，形状为 (N, 2)，每行为 [x, y]
@@ -364,87 +1073,16 @@ class SAM2InstanceSegmentationModel:
 
         处理流程:
             1. 提取原始视频帧
-            2. 将视频分割为正向和反向两段
-            3. 分别提取两段视频的帧
-            4. 对两段视频分别进行实例分割
-            5. 按照指定序号保存掩码结果
-            6. 清理临时文件
+            2. 在提示帧上添加分割点
+            3. 在同一推理状态上从提示帧正向、反向传播
+            4. 按照实际帧序号保存掩码结果
 
         异常:
             ValueError: 如果未设置视频路径
-            FileNotFoundError: 如果帧文件不存在
         """
-        if not self.input_video_path:
-            raise ValueError("必须使用 set_video_path 设置输入视频路径。")
-
-        print(f"输入视频: {self.input_video_path}")
-
-        # 提取视频帧
-        self._extract_frames()
-
-        # 创建分割视频
-        temp1_path, temp2_path = self._create_split_videos(frame_idx)
-
-        # 创建临时帧目录
-        temp1_frames_dir = "./temp1_frames"
-        temp2_frames_dir = "./temp2_frames"
-
-        # 提取temp1和temp2的帧
-        self._extract_video_frames(temp1_path, temp1_frames_dir)
-        self._extract_video_frames(temp2_path, temp2_frames_dir)
-
-        # 初始化两个视频状态
-        inference_state1 = self.predictor.init_state(video_path=temp1_frames_dir)
-        inference_state2 = self.predictor.init_state(video_path=temp2_frames_dir)
-
-        # 添加分割点
-        _, out_obj_ids1, out_mask_logits1 = self.predictor.add_new_points(
-            inference_state=inference_state1,
-            frame_idx=0,  # temp1的第一帧
-            obj_id=1,
-            points=points,
-            labels=labels
-        )
-
-        _, out_obj_ids2, out_mask_logits2 = self.predictor.add_new_points(
-            inference_state=inference_state2,
-            frame_idx=0,  # temp2的第一帧
-            obj_id=1,
-            points=points,
-            labels=labels
-        )
-
-        # 将分割传播到整个视频并存储结果
-        self.video_segments = {}
-        
-        # 处理temp1（反向视频）
-        for out_frame_idx, out_obj_ids, out_mask_logits in self.predictor.propagate_in_video(inference_state1):
-            # 计算实际帧索引：frame_idx - out_frame_idx
-            actual_frame_idx = frame_idx - out_frame_idx
-            self.video_segments[actual_frame_idx] = {
-                out_obj_id: (out_mask_logits[i] > 0.0).cpu().numpy()
-                for i, out_obj_id in enumerate(out_obj_ids)
-            }
-
-        # 处理temp2（正向视频）
-        for out_frame_idx, out_obj_ids, out_mask_logits in self.predictor.propagate_in_video(inference_state2):
-            # 计算实际帧索引：frame_idx + out_frame_idx + 1
-            actual_frame_idx = frame_idx + out_frame_idx + 1
-            self.video_segments[actual_frame_idx] = {
-                out_obj_id: (out_mask_logits[i] > 0.0).cpu().numpy()
-                for i, out_obj_id in enumerate(out_obj_ids)
-            }
-
-        print("实例分割完成，分割结果已存储。")
-        print(f"视频已分为两段：\n1. {temp1_path} (从帧{frame_idx}到帧0)\n2. {temp2_path} (从帧{frame_idx}到结束)")
-
-        # 清理临时目录
-        shutil.rmtree(temp1_frames_dir)
-        shutil.rmtree(temp2_frames_dir)
+        return self._segment([{"obj_id": 1, "frame_idx": frame_idx, "points": points, "labels": labels}])
 
-        return True
-
-    def segment_with_box(self, box: np.ndarray, frame_idx: int = 0) -> None:
+    def segment_with_box(self, box: np.ndarray, frame_idx: int = 0) -> bool:
         """
         使用矩形框进行实例分割，存储分割结果。
 
@@ -455,254 +1093,243 @@ class SAM2InstanceSegmentationModel:
 
         异常:
             ValueError: 如果未设置视频路径。
-            FileNotFoundError: 如果帧文件不存在。
         """
-        if not self.input_video_path:
-            raise ValueError("必须使用 set_video_path 设置输入视频路径。")
+        return self._segment([{"obj_id": 1, "frame_idx": frame_idx, "box": box}])
 
-        print(f"输入视频: {self.input_video_path}")
+    def segment_targets(self, targets: list) -> bool:
+        """
+        在一次分割中同时分割多个目标，每个目标使用独立的对象 ID（按列表顺序从 1 开始），
+        所有目标共用一次抽帧、图像特征和传播。
 
-        # 提取视频帧
-        self._extract_frames()
+        参数:
+            targets (list): 每个目标一个字典，包含 "frame_idx" 以及 "points"/"labels" 或 "box"
+                （原视频坐标系）
 
-        # 初始化视频状态
-        inference_state = self.predictor.init_state(video_path=self.original_frames_folder)
+        返回:
+            bool: 分割是否成功
 
-        # 添加矩形框
-        _, out_obj_ids, out_mask_logits = self.predictor.add_new_points_or_box(
-            inference_state=inference_state,
-            frame_idx=frame_idx,
-            obj_id=1,
-            box=box
-        )
+        异常:
+            ValueError: 如果未设置视频路径、没有目标或提示帧超出范围
+        """
+        return self._segment([dict(target, obj_id=obj_id) for obj_id, target in enumerate(targets, start=1)])
 
-        # 将分割传播到整个视频
-        self.video_segments = {}
-        for out_frame_idx, out_obj_ids, out_mask_logits in self.predictor.propagate_in_video(inference_state):
-            self.video_segments[out_frame_idx] = {
-                out_obj_id: (out_mask_logits[i] > 0.0).cpu().numpy()
-                for i, out_obj_id in enumerate(out_obj_ids)
-            }
+    def mask_boxes(self):
+        """
+        返回分割结果每帧的包围框（原视频坐标系，已计入黑白掩码的膨胀），目标消除只需处理这些区域。
 
-        print("实例分割完成，分割结果已存储。")
+        返回:
+            Optional[np.ndarray]: 形状为 (帧数, 4) 的包围框，没有掩码的帧为 -1；尚未分割时返回 None
+        """
+        if self.video_segments is None:
+            return None
+        return store_boxes(self.video_segments, self.video_size, self.mask_dilation)
 
-    def generate_colored_mask_video(self) -> None:
+    def render_masks(self, outputs=('colored', 'white', 'original'), workers: int = MASK_WRITER_WORKERS) -> None:
         """
-        生成彩色掩码视频，保留原始背景，分割对象覆盖为彩色。
+        单次遍历所有帧，按需生成彩色掩码帧、黑白掩码图像和原始对象掩码图像。
+
+        原图直接取自共享帧存储，不再重新解码；只有彩色掩码和原始对象掩码需要读取原图，仅生成黑白掩码时不读取。
+        黑白掩码和原始对象掩码保存为无损 PNG；彩色掩码帧只用于预览视频，按顺序直接通过管道送入
+        FFmpeg 编码，不再写出 JPEG 帧。
+        黑白掩码供目标消除使用，放大回原视频分辨率并按 mask_dilation 膨胀；彩色掩码和
+        原始对象掩码保持抽帧时的工作分辨率。
+        PNG 编码和写盘由多个写入线程并行完成（OpenCV 编码时释放 GIL）。
+
+        参数:
+            outputs: 需要生成的输出，取值为 'colored'、'white'、'original' 的任意组合。
+            workers (int): 写入线程数量。
 
         异常:
-            ValueError: 如果未进行分割或视频路径未设置。
-            FileNotFoundError: 如果帧文件不存在。
+            ValueError: 如果未进行分割、视频路径未设置或输出类型未知。
+            subprocess.CalledProcessError: 如果 FFmpeg 编码彩色掩码视频失败。
         """
+        outputs = set(outputs)
+        unknown = outputs - {'colored', 'white', 'original'}
+        if unknown:
+            raise ValueError(f"未知的掩码输出类型: {', '.join(sorted(unknown))}")
         if not self.output_video_path:
             raise ValueError("必须使用 set_video_path 设置输出视频路径。")
         if self.video_segments is None:
             raise ValueError("必须先调用 segment_with_points 进行实例分割。")
 
-        print(f"生成彩色掩码视频，输出目录: {self.frames_mask_dir}")
-
-        # 创建用于存储掩码帧的目录
-        os.makedirs(self.frames_mask_dir, exist_ok=True)
+        output_dirs = {
+            'white': self.white_mask_dir,
+            'original': self.original_mask_dir
+        }
+        for name in outputs & output_dirs.keys():
+            os.makedirs(output_dirs[name], exist_ok=True)
+        print(f"生成掩码输出: {', '.join(sorted(outputs))}")
 
-        # 处理每一帧
-        for out_frame_idx in range(len(self.frame_names)):
-            frame_path = os.path.join(self.original_frames_folder, self.frame_names[out_frame_idx])
-            if not os.path.exists(frame_path):
-                raise FileNotFoundError(f"帧文件不存在: {frame_path}")
-
-            image = cv2.imread(frame_path)
-            if image is None:
-                raise ValueError(f"无法读取帧: {frame_path}")
-
-            color_num = 0
-            for obj_id, mask in self.video_segments[out_frame_idx].items():
-                print(f"处理彩色掩码帧 {out_frame_idx}: 图像形状={image.shape}, "
-                      f"掩码形状={mask.shape}, 颜色索引={color_num}, 对象ID={obj_id}")
-                image = self._apply_colored_mask(image, np.squeeze(mask), color_num)
-                color_num += 1
+        colored_writer = self._create_video_writer() if 'colored' in outputs else None
+        try:
+            self._render_mask_frames(outputs, workers, colored_writer)
+        except BaseException:
+            if colored_writer is not None:
+                colored_writer.abort()
+            raise
+        if colored_writer is not None:
+            try:
+                colored_writer.close()
+            except subprocess.CalledProcessError as e:
+                print(f"FFmpeg 执行失败: {e.stderr}")
+                raise
+            print(f"视频已成功创建: {colored_writer.output_path}")
+        print(f"掩码输出已生成，共 {self.num_frames} 帧")
+
+    def _render_mask_frames(self, outputs: set, workers: int, colored_writer: FFmpegWriter = None) -> None:
+        """render_masks 的逐帧循环：PNG 交给写入线程，彩色掩码帧按顺序写入视频管道。"""
+        need_image = bool(outputs & {'colored', 'original'})
+        store = self.video_segments
+        output_size = self.video_size or (store.width, store.height)
+        max_pending = max(1, workers) * 4  # 限制待写入帧数，避免编码跟不上时内存持续增长
+
+        def write(path: str, image: np.ndarray) -> None:
+            if not cv2.imwrite(path, image):
+                raise IOError(f"写入掩码帧失败: {path}")
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="mask-writer") as executor:
+            pending = deque()
+            for out_frame_idx in range(self.num_frames):
+                image = None
+                if need_image:
+                    image = self._frame(out_frame_idx)
+
+                union = store.get_union(out_frame_idx)
+                if 'white' in outputs:
+                    white = self._upsample_mask(union, output_size, self.mask_dilation,
+                                                guide=self.frames.frame(out_frame_idx))
+                    pending.append(executor.submit(
+                        write, os.path.join(self.white_mask_dir, f"{out_frame_idx:05d}.png"),
+                        self._apply_white_mask(image, white)))
+                if image is not None:
+                    image_size = (image.shape[1], image.shape[0])
+                    union = self._upsample_mask(union, image_size, guide=image)
+
+                if 'original' in outputs:
+                    pending.append(executor.submit(
+                        write, os.path.join(self.original_mask_dir, f"{out_frame_idx:05d}.png"),
+                        self._apply_original_mask(image, union)))
+                if colored_writer is not None:
+                    colored = image
+                    if union.any():
+                        for color_num, (obj_id, mask) in enumerate(store.masks(out_frame_idx)):
+                            mask = self._upsample_mask(mask, image_size, guide=image)
+                            colored = self._apply_colored_mask(colored, mask, color_num)
+                    # 管道写满时阻塞，编码速度约束渲染速度
+                    colored_writer.write(colored)
+
+                while len(pending) > max_pending:
+                    pending.popleft().result()
+            while pending:
+                pending.popleft().result()
 
-            # 保存掩码帧
-            output_path = os.path.join(self.frames_mask_dir, f"{out_frame_idx:05d}.jpg")
-            cv2.imwrite(output_path, image)
+    def generate_colored_mask_video(self) -> None:
+        """
+        生成彩色掩码视频，保留原始背景，分割对象覆盖为彩色。
 
-        # 创建输出视频
-        self._create_video_from_frames()
+        异常:
+            ValueError: 如果未进行分割或视频路径未设置。
+            subprocess.CalledProcessError: 如果 FFmpeg 编码失败。
+        """
+        self.render_masks(('colored',))
 
     def generate_white_mask_images(self) -> None:
         """
-        生成黑白掩码图像，背景为黑色，分割对象为白色，保存为图片形式。
+        生成黑白掩码图像，背景为黑色，分割对象为白色，保存为 PNG 图片。
 
         异常:
             ValueError: 如果未进行分割或视频路径未设置。
-            FileNotFoundError: 如果帧文件不存在。
         """
-        if not self.output_video_path:
-            raise ValueError("必须使用 set_video_path 设置输出视频路径。")
-        if self.video_segments is None:
-            raise ValueError("必须先调用 segment_with_points 进行实例分割。")
-
-        print(f"生成黑白掩码图像，输出目录: {self.white_mask_dir}")
-
-        # 创建用于存储黑白掩码图像的目录
-        os.makedirs(self.white_mask_dir, exist_ok=True)
-
-        # 处理每一帧
-        for out_frame_idx in range(len(self.frame_names)):
-            frame_path = os.path.join(self.original_frames_folder, self.frame_names[out_frame_idx])
-            if not os.path.exists(frame_path):
-                raise FileNotFoundError(f"帧文件不存在: {frame_path}")
-
-            image = cv2.imread(frame_path)
-            if image is None:
-                raise ValueError(f"无法读取帧: {frame_path}")
-
-            for obj_id, mask in self.video_segments[out_frame_idx].items():
-                print(f"处理黑白掩码帧 {out_frame_idx}: 图像形状={image.shape}, "
-                      f"掩码形状={mask.shape}, 对象ID={obj_id}")
-                image = self._apply_white_mask(image, np.squeeze(mask))
-
-            # 保存黑白掩码图像
-            output_path = os.path.join(self.white_mask_dir, f"{out_frame_idx:05d}.jpg")
-            cv2.imwrite(output_path, image)
-
+        self.render_masks(('white',))
         print(f"黑白掩码图像已保存到: {self.white_mask_dir}")
 
     def generate_original_mask_images(self) -> None:
         """
-        生成原始对象掩码图像，背景为白色，分割对象为原始视频中的目标，保存为图片形式。
+        生成原始对象掩码图像，背景为白色，分割对象为原始视频中的目标，保存为 PNG 图片。
 
         异常:
             ValueError: 如果未进行分割或视频路径未设置。
-            FileNotFoundError: 如果帧文件不存在。
         """
-        if not self.output_video_path:
-            raise ValueError("必须使用 set_video_path 设置输出视频路径。")
-        if self.video_segments is None:
-            raise ValueError("必须先调用 segment_with_points 进行实例分割。")
-
-        print(f"生成原始对象掩码图像，输出目录: {self.original_mask_dir}")
-
-        # 创建用于存储原始对象掩码图像的目录
-        os.makedirs(self.original_mask_dir, exist_ok=True)
-
-        # 处理每一帧
-        for out_frame_idx in range(len(self.frame_names)):
-            frame_path = os.path.join(self.original_frames_folder, self.frame_names[out_frame_idx])
-            if not os.path.exists(frame_path):
-                raise FileNotFoundError(f"帧文件不存在: {frame_path}")
-
-            image = cv2.imread(frame_path)
-            if image is None:
-                raise ValueError(f"无法读取帧: {frame_path}")
-
-            for obj_id, mask in self.video_segments[out_frame_idx].items():
-                print(f"处理原始掩码帧 {out_frame_idx}: 图像形状={image.shape}, "
-                      f"掩码形状={mask.shape}, 对象ID={obj_id}")
-                image = self._apply_original_mask(image, np.squeeze(mask))
-
-            # 保存原始对象掩码图像
-            output_path = os.path.join(self.original_mask_dir, f"{out_frame_idx:05d}.jpg")
-            cv2.imwrite(output_path, image)
-
+        self.render_masks(('original',))
         print(f"原始对象掩码图像已保存到: {self.original_mask_dir}")
 
-    def _create_video_from_frames(self, framerate: int = 30, codec: str = 'libx264', pix_fmt: str = 'yuv420p') -> None:
+    def _create_video_writer(self, codec: str = 'libx264', pix_fmt: str = 'yuv420p') -> FFmpegWriter:
         """
-        使用 FFmpeg 从掩码帧创建视频。
+        打开彩色掩码预览视频的 FFmpeg 管道写入器，帧率与原视频一致，帧尺寸为分割工作分辨率。
 
         参数:
-            framerate (int): 输出视频的帧率，默认为 30。
             codec (str): 使用的视频编码器，默认为 'libx264'。
             pix_fmt (str): 像素格式，默认为 'yuv420p'。
 
-        异常:
-            subprocess.CalledProcessError: 如果 FFmpeg 命令执行失败。
+        返回:
+            FFmpegWriter: 已启动的写入器，调用方负责 close 或 abort。
         """
         # 检查并获取无冲突的输出路径
         final_output_path = self._get_unique_output_path(self.output_video_path)
+        writer = FFmpegWriter(final_output_path, self.working_size, self.frames.fps, codec=codec, pix_fmt=pix_fmt)
+        writer.open()
+        return writer
 
-        command = [
-            'ffmpeg',
-            '-framerate', str(framerate),
-            '-i', os.path.join(self.frames_mask_dir, '%05d.jpg'),
-            '-c:v', codec,
-            '-pix_fmt', pix_fmt,
-            final_output_path
-        ]
+def write_white_masks(store: MaskStore, mask_dir: str, video_size: tuple = None,
+                      dilation: int = SAM2_MASK_DILATION, workers: int = MASK_WRITER_WORKERS,
+                      frame_map: np.ndarray = None, frames: FrameStore = None) -> None:
+    """
+    直接从掩码存储生成目标消除使用的黑白掩码图像（文件名为 %05d.png），不需要分割模型。
 
-        try:
-            subprocess.run(command, check=True, capture_output=True, text=True)
-            print(f"视频已成功创建: {final_output_path}")
-        except subprocess.CalledProcessError as e:
-            print(f"FFmpeg 执行失败: {e.stderr}")
-            raise
+    与 render_masks(('white',)) 的输出一致：所有对象掩码的并集放大到原视频分辨率并按 dilation 膨胀。
+    提供原视频的帧存储时以对应帧为引导修正放大后的边缘（见 upsample_mask）。
 
-def remove_detect_target(input_video_path: str, output_video_path: str = None, 
-                        venv_python: str = None,
-                        original_python: str = None):
+    参数:
+        store (MaskStore): 分割结果。
+        mask_dir (str): 输出目录。
+        video_size (tuple): 原视频尺寸 (宽, 高)，为 None 时保持掩码尺寸。
+        dilation (int): 膨胀像素数。
+        workers (int): 写入线程数量。
+        frame_map (np.ndarray): 原视频每一帧对应的掩码帧索引（见 frame_mapping），
+            为 None 时逐帧对应；输出的图像数量与 frame_map 的长度一致。
+        frames (FrameStore): 原视频的帧存储，用作边缘修正的引导帧，为 None 时不修正。
+    """
+    os.makedirs(mask_dir, exist_ok=True)
+    output_size = video_size or (store.width, store.height)
+    max_pending = max(1, workers) * 4
+
+    def write(path: str, image: np.ndarray) -> None:
+        if not cv2.imwrite(path, image):
+            raise IOError(f"写入掩码帧失败: {path}")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="mask-writer") as executor:
+        pending = deque()
+        if frame_map is None:
+            frame_map = range(store.num_frames)
+        for frame_idx, store_idx in enumerate(frame_map):
+            union = store.get_union(int(store_idx))
+            # 只有掩码非空的帧需要引导帧，空帧不读取（也不解码）原视频
+            guide = frames.frame(frame_idx) if frames is not None and union.any() else None
+            white = upsample_mask(union, output_size, dilation, guide)
+            pending.append(executor.submit(write, os.path.join(mask_dir, f"{frame_idx:05d}.png"),
+                                           white.astype(np.uint8) * 255))
+            while len(pending) > max_pending:
+                pending.popleft().result()
+        while pending:
+            pending.popleft().result()
+
+def remove_detect_target(input_video_path: str, output_video_path: str = None,
+                         mask_dir: str = "white_mask_frames", boxes=None, mode: str = INPAINT_MODE):
     """
-    执行目标消除，使用外部脚本处理视频和掩码。
+    执行目标消除：把视频帧和掩码交给常驻的 E2FGVI 修复进程处理。
+
+    修复进程运行在 videoedit 环境中，首次调用时启动并加载模型，之后的请求直接复用；
+    解释器路径、E2FGVI 目录和检查点通过 INPAINT_PYTHON、E2FGVI_ROOT、E2FGVI_CKPT 配置。
 
     参数:
         input_video_path (str): 输入视频文件路径
         output_video_path (str): 输出视频路径，如果为None则使用默认路径
-        venv_python (str): videoedit虚拟环境的Python解释器路径，如果为None则自动检测
-        original_python (str): 原始sam2环境的Python解释器路径，如果为None则自动检测
+        mask_dir (str): 黑白掩码图像目录（SAM2InstanceSegmentationModel.white_mask_dir）
+        boxes (np.ndarray): 每帧掩码的包围框（SAM2InstanceSegmentationModel.mask_boxes），
+            提供时按帧段只修复目标附近的区域，为 None 时处理整段视频的完整画面
+        mode (str): 修复方式："auto"（静止镜头用背景填充，其余镜头用 E2FGVI）、"e2fgvi" 或 "classical"
     """
-    script_path = 'D:/GitHub/sitp-bronze96/E2FGVI_master/test.py'
-    model = 'e2fgvi'
-    mask = "white_mask_frames"
-    ckpt = "D:/GitHub/sitp-bronze96/E2FGVI_master/release_model/E2FGVI-CVPR22.pth"
-
-    # 检测操作系统类型
-    is_windows = os.name == 'nt'
-    
-    # 根据操作系统设置默认Python路径
-    if is_windows:
-        default_venv_python = "D:/anaconda3/envs/videoedit/python.exe"
-        default_original_python = "D:/anaconda3/envs/sam2/python.exe"
-    else:
-        # Linux环境下的默认路径
-        default_venv_python = "/root/miniconda3/envs/videoedit/bin/python"
-        default_original_python = "/root/miniconda3/envs/sam2/bin/python"
-
-    # 使用提供的路径或默认路径
-    venv_python = venv_python or default_venv_python
-    original_python = original_python or default_original_python
-
-    # 检查Python解释器是否存在
-    if not os.path.exists(venv_python):
-        raise FileNotFoundError(f"找不到videoedit环境的Python解释器: {venv_python}")
-    if not os.path.exists(original_python):
-        raise FileNotFoundError(f"找不到sam2环境的Python解释器: {original_python}")
-
-    try:
-        # 在videoedit环境执行脚本
-        cmd = [
-            venv_python,
-            script_path,
-            "--model", model,
-            "--video", input_video_path,
-            "--mask", mask,
-            "--ckpt", ckpt,
-        ]
-        
-        # 如果提供了输出路径，添加到命令中
-        if output_video_path:
-            cmd.extend(["--save_path", output_video_path])
-            
-        subprocess.run(cmd, check=True)
-
-        # 切换回原始环境（通过新进程）
-        subprocess.run([
-            original_python,
-            "-c",
-            "print('已切换回sam2环境')"
-        ], check=True)
-
-    except subprocess.CalledProcessError as e:
-        print(f"命令运行失败，错误代码: {e.returncode}")
-        raise
+    inpaint_video(input_video_path, mask_dir, output_video_path or "./result.mp4", boxes=boxes, mode=mode)
 
 if __name__ == "__main__":
     # 示例用法
@@ -725,16 +1352,10 @@ if __name__ == "__main__":
     #box = np.array([0, 250, 200, 700])  # [x1, y1, x2, y2] 格式的矩形框
     # model.segment_with_box(box)
 
-    # 生成彩色掩码视频
-    model.generate_colored_mask_video()
-
-    # 生成黑白掩码图像
-    model.generate_white_mask_images()
-
-    # 生成原始对象掩码图像
-    model.generate_original_mask_images()
+    # 单次遍历生成彩色掩码视频、黑白掩码图像和原始对象掩码图像
+    model.render_masks(('colored', 'white', 'original'))
 
-    remove_detect_target(input_video, output_video)
+    remove_detect_target(input_video, output_video, mask_dir=model.white_mask_dir)
 
-    # 手动清理 original_frames（可选）
+    # 删除中间文件并归还共享帧存储
     model.cleanup()
\ No newline at end of file
@@ -0,0 +1,293 @@
+import os
+import gc
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+import torch
+from sam2.build_sam import build_sam2_video_predictor
+from inference_profile import default_profile
+from feature_cache import feature_cache
+
+try:
+    import psutil
+except ImportError:  # psutil 不可用时只按空闲时间淘汰
+    psutil = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# SAM2 模型文件目录与各尺寸的 (检查点, 配置文件)
+SAM2_MODEL_DIR = os.environ.get("SAM2_MODEL_DIR", r"D:\GitHub\sitp-bronze96\models")
+SAM2_CHECKPOINTS: Dict[str, Tuple[str, str]] = {
+    'tiny': ('sam2.1_hiera_tiny.pt', 'sam2.1_hiera_t.yaml'),
+    'small': ('sam2.1_hiera_small.pt', 'sam2.1_hiera_s.yaml'),
+    'base_plus': ('sam2.1_hiera_base_plus.pt', 'sam2.1_hiera_b+.yaml'),
+    'large': ('sam2.1_hiera_large.pt', 'sam2.1_hiera_l.yaml')
+}
+SAM2_DEFAULT_SIZE = os.environ.get("SAM2_MODEL_SIZE", "tiny")
+
+# 预测器池配置
+SAM2_POOL_SIZE = int(os.environ.get("SAM2_POOL_SIZE", "1"))  # 每个检查点最多同时存在的预测器数量
+SAM2_POOL_IDLE_SECONDS = float(os.environ.get("SAM2_POOL_IDLE_SECONDS", "1800"))
+SAM2_POOL_MEMORY_THRESHOLD = float(os.environ.get("SAM2_POOL_MEMORY_THRESHOLD", "85"))  # 系统内存占用百分比
+# 分割任务等待预测器的最长秒数。超时的任务失败并归还准入名额和工作区，而不是无限期占着它们排队
+SAM2_LEASE_TIMEOUT = float(os.environ.get("SAM2_LEASE_TIMEOUT", "120"))
+
+
+class PredictorBusy(TimeoutError):
+    """在超时时间内没有空闲的 SAM2 预测器时抛出，由 API 层转换为 503 响应。"""
+
+
+def get_checkpoint_paths(size: str = SAM2_DEFAULT_SIZE) -> Tuple[str, str]:
+    """
+    返回指定尺寸模型的 (配置文件路径, 检查点路径)。
+
+    参数:
+        size (str): 模型尺寸，必须是 SAM2_CHECKPOINTS 中定义的尺寸之一。
+
+    异常:
+        ValueError: 如果尺寸未定义。
+    """
+    if size not in SAM2_CHECKPOINTS:
+        raise ValueError(f"不支持的 SAM2 模型尺寸: {size}")
+    checkpoint, model_cfg = SAM2_CHECKPOINTS[size]
+    return os.path.join(SAM2_MODEL_DIR, model_cfg), os.path.join(SAM2_MODEL_DIR, checkpoint)
+
+
+def default_device() -> str:
+    """有可用 GPU 时返回 'cuda'，否则返回 'cpu'。"""
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class _PoolEntry:
+    """同一检查点的预测器集合。"""
+
+    def __init__(self, model_cfg: str, checkpoint: str, device: str):
+        self.model_cfg = model_cfg
+        self.checkpoint = checkpoint
+        self.device = device
+        self.idle: List[Any] = []  # 空闲预测器，末尾为最近归还的
+        self.total = 0             # 已创建（含使用中）的预测器数量
+        self.loading = 0           # 正在加载中的预测器数量
+        self.last_used = time.monotonic()
+        self.leases_total = 0
+        self.load_seconds = 0.0
+
+
+class SAM2PredictorPool:
+    """
+    进程级的 SAM2 视频预测器池。
+
+    预测器在首次使用时加载，也可在服务启动时预加载。每次租借独占一个预测器，
+    推理状态（inference_state）由调用方自行持有，归还后预测器可被其他请求复用。
+    支持多个检查点尺寸，空闲过久或系统内存紧张时淘汰最久未用的空闲预测器。
+    """
+
+    def __init__(self, max_per_model: int = SAM2_POOL_SIZE, idle_seconds: float = SAM2_POOL_IDLE_SECONDS,
+                 memory_threshold: float = SAM2_POOL_MEMORY_THRESHOLD):
+        self.max_per_model = max(1, max_per_model)
+        self.idle_seconds = idle_seconds
+        self.memory_threshold = memory_threshold
+        self.condition = threading.Condition()
+        self.entries: Dict[Tuple[str, str, str], _PoolEntry] = {}
+        self.evicted_total = 0
+        self._janitor = None
+
+    def _get_entry(self, model_cfg: str, checkpoint: str, device: str) -> _PoolEntry:
+        key = (model_cfg, checkpoint, device)
+        if key not in self.entries:
+            self.entries[key] = _PoolEntry(model_cfg, checkpoint, device)
+        return self.entries[key]
+
+    def _build(self, entry: _PoolEntry):
+        """加载一个新的预测器（在锁外调用）。"""
+        start = time.monotonic()
+        predictor = build_sam2_video_predictor(entry.model_cfg, entry.checkpoint, device=entry.device)
+        default_profile(entry.device).apply(predictor)
+        feature_cache.install(predictor)
+        elapsed = time.monotonic() - start
+        logger.info(f"SAM2 预测器加载完成: {os.path.basename(entry.checkpoint)} ({entry.device})，耗时 {elapsed:.2f} 秒")
+        return predictor, elapsed
+
+    def acquire(self, size: str = SAM2_DEFAULT_SIZE, device: Optional[str] = None,
+                model_cfg: Optional[str] = None, checkpoint: Optional[str] = None,
+                timeout: Optional[float] = None):
+        """
+        租借一个预测器，没有空闲预测器且未达到上限时加载新的预测器，否则等待归还。
+
+        参数:
+            size (str): 模型尺寸（'tiny'、'small'、'base_plus'、'large'）。
+            device (Optional[str]): 运行设备，默认自动选择。
+            model_cfg (Optional[str]): 自定义配置文件路径，与 checkpoint 一起使用时忽略 size。
+            checkpoint (Optional[str]): 自定义检查点路径。
+            timeout (Optional[float]): 最长等待秒数。
+
+        返回:
+            预测器实例，使用完毕后必须调用 release 归还。
+
+        异常:
+            PredictorBusy: 如果在超时时间内没有可用的预测器。
+        """
+        if not (model_cfg and checkpoint):
+            model_cfg, checkpoint = get_checkpoint_paths(size)
+        device = device or default_device()
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.condition:
+            entry = self._get_entry(model_cfg, checkpoint, device)
+            while True:
+                if entry.idle:
+                    predictor = entry.idle.pop()
+                    entry.leases_total += 1
+                    return predictor
+                if entry.total < self.max_per_model:
+                    entry.total += 1
+                    entry.loading += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise PredictorBusy("等待 SAM2 预测器超时")
+                self.condition.wait(remaining)
+
+        # 加载较慢，在锁外进行；加载前先在内存紧张时腾出空间
+        self._evict_under_pressure()
+        try:
+            predictor, elapsed = self._build(entry)
+        except BaseException:
+            with self.condition:
+                entry.total -= 1
+                entry.loading -= 1
+                self.condition.notify_all()
+            raise
+        with self.condition:
+            entry.loading -= 1
+            entry.leases_total += 1
+            entry.load_seconds += elapsed
+        return predictor
+
+    def release(self, predictor, size: str = SAM2_DEFAULT_SIZE, device: Optional[str] = None,
+                model_cfg: Optional[str] = None, checkpoint: Optional[str] = None) -> None:
+        """归还预测器。"""
+        if not (model_cfg and checkpoint):
+            model_cfg, checkpoint = get_checkpoint_paths(size)
+        device = device or default_device()
+        with self.condition:
+            entry = self._get_entry(model_cfg, checkpoint, device)
+            entry.idle.append(predictor)
+            entry.last_used = time.monotonic()
+            self.condition.notify_all()
+        self._evict_under_pressure()
+
+    @contextmanager
+    def lease(self, size: str = SAM2_DEFAULT_SIZE, device: Optional[str] = None,
+              model_cfg: Optional[str] = None, checkpoint: Optional[str] = None,
+              timeout: Optional[float] = None):
+        """以上下文管理器的方式租借预测器，退出时自动归还。"""
+        predictor = self.acquire(size, device, model_cfg, checkpoint, timeout)
+        try:
+            yield predictor
+        finally:
+            self.release(predictor, size, device, model_cfg, checkpoint)
+
+    def preload(self, sizes: List[str], device: Optional[str] = None) -> None:
+        """预加载指定尺寸的预测器并放回池中。"""
+        for size in sizes:
+            size = size.strip()
+            if not size:
+                continue
+            try:
+                predictor = self.acquire(size, device)
+                self.release(predictor, size, device)
+            except Exception as e:
+                logger.error(f"预加载 SAM2 模型 {size} 失败: {e}")
+
+    def evict_idle(self, max_idle_seconds: Optional[float] = None) -> int:
+        """淘汰空闲超过指定时间的预测器，返回淘汰数量。"""
+        max_idle_seconds = self.idle_seconds if max_idle_seconds is None else max_idle_seconds
+        now = time.monotonic()
+        evicted = []
+        with self.condition:
+            for entry in self.entries.values():
+                if entry.idle and now - entry.last_used > max_idle_seconds:
+                    evicted.extend(entry.idle)
+                    entry.total -= len(entry.idle)
+                    entry.idle.clear()
+            self.evicted_total += len(evicted)
+            if evicted:
+                self.condition.notify_all()
+        return self._free(evicted)
+
+    def _memory_pressure(self) -> bool:
+        return psutil is not None and psutil.virtual_memory().percent >= self.memory_threshold
+
+    def _evict_under_pressure(self) -> int:
+        """系统内存占用超过阈值时，按最久未用顺序逐个淘汰空闲预测器。"""
+        count = 0
+        while self._memory_pressure():
+            with self.condition:
+                candidates = [e for e in self.entries.values() if e.idle]
+                if not candidates:
+                    break
+                entry = min(candidates, key=lambda e: e.last_used)
+                predictor = entry.idle.pop(0)
+                entry.total -= 1
+                self.evicted_total += 1
+                self.condition.notify_all()
+            logger.warning(f"内存占用过高，淘汰空闲 SAM2 预测器: {os.path.basename(entry.checkpoint)}")
+            count += self._free([predictor])
+        return count
+
+    def _free(self, predictors: List[Any]) -> int:
+        count = len(predictors)
+        predictors.clear()
+        if count:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        return count
+
+    def start_janitor(self, interval: float = 60.0) -> None:
+        """启动后台线程，定期淘汰空闲过久或内存紧张时的预测器。"""
+        if self._janitor is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict_idle()
+                    self._evict_under_pressure()
+                except Exception as e:
+                    logger.error(f"清理 SAM2 预测器池失败: {e}")
+
+        self._janitor = threading.Thread(target=run, name="sam2-pool-janitor", daemon=True)
+        self._janitor.start()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回预测器池的运行状态。"""
+        now = time.monotonic()
+        with self.condition:
+            return {
+                "max_per_model": self.max_per_model,
+                "evicted_total": self.evicted_total,
+                "models": [
+                    {
+                        "checkpoint": os.path.basename(entry.checkpoint),
+                        "device": entry.device,
+                        "loaded": entry.total,
+                        "idle": len(entry.idle),
+                        "loading": entry.loading,
+                        "in_use": entry.total - len(entry.idle) - entry.loading,
+                        "leases_total": entry.leases_total,
+                        "load_seconds_total": entry.load_seconds,
+                        "idle_seconds": now - entry.last_used
+                    }
+                    for entry in self.entries.values()
+                ]
+            }
+
+
+# 全局预测器池实例
+predictor_pool = SAM2PredictorPool()
@@ -0,0 +1,255 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from typing import Dict, Any, Optional
+import numpy as np
+from sam2_model import SAM2InstanceSegmentationModel, upsample_mask, propagation_mode
+from sam2_pool import predictor_pool, get_checkpoint_paths, SAM2_DEFAULT_SIZE, SAM2_LEASE_TIMEOUT
+from media_ingest import probe_video
+from workspace import JobWorkspace, estimate_workspace_bytes
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 分割会话配置，可通过环境变量覆盖
+SESSION_TTL_SECONDS = float(os.environ.get("CLIPNOVA_SEGMENT_SESSION_TTL", "900"))
+MAX_SESSIONS = int(os.environ.get("CLIPNOVA_SEGMENT_SESSIONS", "4"))
+# 保留推理状态（用于在原状态上局部修正）的内存预算：所有会话合计上限，以及每帧每个对象的估计占用
+STATE_BUDGET_MB = int(os.environ.get("CLIPNOVA_SEGMENT_STATE_MAX_MB", "1024"))
+STATE_MB_PER_FRAME = float(os.environ.get("CLIPNOVA_SEGMENT_STATE_MB_PER_FRAME", "1.5"))
+
+
+class SessionNotFound(KeyError):
+    """分割会话不存在或已过期时抛出。"""
+
+
+class SegmentationSession:
+    """
+    一次可修正的分割任务。
+
+    持有任务工作区、分割模型和（一次加载全部帧且在内存预算内时）保留的推理状态。预测器只在分割和修正期间从池中租借，
+    推理状态与具体的预测器实例无关，同一检查点的任意预测器都可以继续使用。
+    分割在 video_path（通常为夹层文件）上进行，确认消除时修复 source_path（原始文件）。
+    返回给客户端的掩码统一为原视频分辨率（mask_size），与单帧预览一致。
+    """
+
+    def __init__(self, video_path: str, size: str = SAM2_DEFAULT_SIZE, source_path: Optional[str] = None):
+        self.job_id = uuid.uuid4().hex
+        self.video_path = video_path
+        self.source_path = source_path or video_path
+        self.size = size
+        self.lock = threading.Lock()  # 同一会话的操作串行执行
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.refinements = 0
+        self.keep_state = False  # 由会话管理器按内存预算决定
+        self.state_bytes = 0     # 保留推理状态的估计占用，keep_state 为 False 时为 0
+        self.on_close = None     # 关闭时的回调（归还推理状态预算）
+
+        info = probe_video(video_path)
+        self.num_frames = info["frame_count"]
+        source_info = info if self.source_path == video_path else probe_video(self.source_path)
+        self.mask_size = (source_info["width"], source_info["height"])
+        expected_bytes = estimate_workspace_bytes(info["width"], info["height"], info["frame_count"])
+        self.workspace = JobWorkspace("segment", expected_bytes=expected_bytes)
+        self.workspace.create()
+
+        self.model = None  # 首次分割时使用租借到的预测器创建
+
+    def _run(self, method_name: str, *args, **kwargs):
+        """
+        租借预测器执行模型方法，完成后立即归还。
+
+        异常:
+            PredictorBusy: 如果在 SAM2_LEASE_TIMEOUT 秒内没有空闲的预测器。
+        """
+        with self.lock:
+            self.last_used = time.monotonic()
+            with predictor_pool.lease(self.size, timeout=SAM2_LEASE_TIMEOUT) as predictor:
+                if self.model is None:
+                    model_cfg, checkpoint = get_checkpoint_paths(self.size)
+                    self.model = SAM2InstanceSegmentationModel(model_cfg, checkpoint, predictor=predictor,
+                                                               work_dir=self.workspace.root)
+                    self.model.keep_state = self.keep_state
+                    self.model.set_video_path(self.video_path, os.path.join(self.workspace.root, "result.mp4"))
+                self.model.predictor = predictor
+                try:
+                    return getattr(self.model, method_name)(*args, **kwargs)
+                finally:
+                    self.model.predictor = None
+                    self.last_used = time.monotonic()
+
+    def segment(self, frame_idx: int, points: Optional[np.ndarray] = None, labels: Optional[np.ndarray] = None,
+                box: Optional[np.ndarray] = None) -> bool:
+        """使用点或矩形框完成首次分割。"""
+        if box is not None:
+            return self._run("segment_with_box", box, frame_idx)
+        return self._run("segment_with_points", points, labels, frame_idx)
+
+    def refine(self, frame_idx: int, points: np.ndarray, labels: np.ndarray, obj_id: int = 1) -> Dict[str, Any]:
+        """在任意帧上追加点修正掩码，只重新传播受影响的帧。"""
+        result = self._run("refine", frame_idx, points, labels, obj_id)
+        self.refinements += 1
+        return result
+
+    def get_mask(self, frame_idx: int) -> np.ndarray:
+        """返回一帧中所有对象掩码的并集（原视频分辨率，mask_size）。"""
+        store = self.model.video_segments if self.model is not None else None
+        if store is None:
+            raise ValueError("分割尚未完成")
+        if not 0 <= frame_idx < store.num_frames:
+            raise ValueError(f"帧索引 {frame_idx} 超出视频帧范围 [0, {store.num_frames - 1}]")
+        self.last_used = time.monotonic()
+        return upsample_mask(store.get_union(frame_idx), self.mask_size)
+
+    def estimate_state_bytes(self) -> int:
+        """估计保留推理状态需要的内存；视频不会以一次加载全部帧的方式分割时返回 0（不会保留状态）。"""
+        if self.num_frames <= 0 or propagation_mode(self.num_frames) != "full":
+            return 0
+        return int(self.num_frames * STATE_MB_PER_FRAME * 1024 * 1024)
+
+    def close(self) -> None:
+        """释放推理状态并删除工作区。"""
+        with self.lock:
+            if self.model is not None:
+                self.model.cleanup()
+            self.workspace.cleanup()
+            on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            on_close(self)
+
+    def info(self) -> Dict[str, Any]:
+        model = self.model
+        store = model.video_segments if model is not None else None
+        return {
+            "job_id": self.job_id,
+            "frames": model.num_frames if model is not None else 0,
+            "objects": store.obj_ids if store is not None else [],
+            "state_kept": model is not None and model.inference_state is not None,
+            "refinements": self.refinements,
+            "idle_seconds": time.monotonic() - self.last_used
+        }
+
+
+class SegmentationSessionManager:
+    """
+    管理可修正的分割会话，超过空闲时间或数量上限时关闭最久未用的会话。
+
+    只有一次加载全部帧分割的短视频会保留推理状态，且所有会话保留的状态合计不超过 state_budget，
+    超出预算的会话修正时按窗口重新加载受影响的帧。
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL_SECONDS, max_sessions: int = MAX_SESSIONS,
+                 state_budget: int = STATE_BUDGET_MB * 1024 * 1024):
+        self.ttl = ttl
+        self.max_sessions = max(1, max_sessions)
+        self.state_budget = state_budget
+        self.state_bytes = 0  # 已保留推理状态的估计占用合计
+        self.lock = threading.Lock()
+        self.sessions: Dict[str, SegmentationSession] = {}
+        self._janitor = None
+
+    def create(self, video_path: str, frame_idx: int, points: Optional[np.ndarray] = None,
+               labels: Optional[np.ndarray] = None, box: Optional[np.ndarray] = None,
+               source_path: Optional[str] = None) -> SegmentationSession:
+        """
+        创建会话并完成首次分割。video_path 为分割使用的视频，source_path 为最终修复的原始文件（默认相同）。
+
+        异常:
+            RuntimeError: 如果分割失败。
+        """
+        self.evict_expired()
+        session = SegmentationSession(video_path, source_path=source_path)
+        self._reserve_state(session)
+        try:
+            if not session.segment(frame_idx, points, labels, box):
+                raise RuntimeError("实例分割失败，请检查分割参数")
+        except BaseException:
+            session.close()
+            raise
+
+        with self.lock:
+            self.sessions[session.job_id] = session
+            victims = []
+            while len(self.sessions) > self.max_sessions:
+                oldest = min(self.sessions.values(), key=lambda s: s.last_used)
+                victims.append(self.sessions.pop(oldest.job_id))
+        for victim in victims:
+            logger.info(f"分割会话数量超过上限，关闭最久未用的会话: {victim.job_id}")
+            victim.close()
+        return session
+
+    def _reserve_state(self, session: SegmentationSession) -> None:
+        """在预算内时为会话预留推理状态内存并设置 keep_state，会话关闭时归还。"""
+        needed = session.estimate_state_bytes()
+        with self.lock:
+            if needed <= 0 or self.state_bytes + needed > self.state_budget:
+                return
+            self.state_bytes += needed
+        session.keep_state = True
+        session.state_bytes = needed
+        session.on_close = self._release_state
+
+    def _release_state(self, session: SegmentationSession) -> None:
+        with self.lock:
+            self.state_bytes -= session.state_bytes
+        session.state_bytes = 0
+
+    def get(self, job_id: str) -> SegmentationSession:
+        with self.lock:
+            session = self.sessions.get(job_id)
+        if session is None:
+            raise SessionNotFound(job_id)
+        return session
+
+    def pop(self, job_id: str) -> SegmentationSession:
+        """取出会话（不再由管理器自动关闭），调用方负责 close。"""
+        with self.lock:
+            session = self.sessions.pop(job_id, None)
+        if session is None:
+            raise SessionNotFound(job_id)
+        return session
+
+    def close(self, job_id: str) -> None:
+        self.pop(job_id).close()
+
+    def evict_expired(self) -> int:
+        """关闭空闲超过 ttl 的会话，返回关闭数量。"""
+        now = time.monotonic()
+        with self.lock:
+            expired = [s for s in self.sessions.values() if now - s.last_used > self.ttl and not s.lock.locked()]
+            for session in expired:
+                del self.sessions[session.job_id]
+        for session in expired:
+            logger.info(f"分割会话已过期: {session.job_id}")
+            session.close()
+        return len(expired)
+
+    def start_janitor(self, interval: float = 60.0) -> None:
+        """启动后台线程，定期关闭过期会话。"""
+        if self._janitor is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict_expired()
+                except Exception as e:
+                    logger.error(f"清理分割会话失败: {e}")
+
+        self._janitor = threading.Thread(target=run, name="segment-session-janitor", daemon=True)
+        self._janitor.start()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return {"active": len(sessions), "max_sessions": self.max_sessions, "ttl": self.ttl,
+                "state_bytes": self.state_bytes, "state_budget": self.state_budget,
+                "sessions": [s.info() for s in sessions]}
+
+
+# 全局分割会话管理器实例
+session_manager = SegmentationSessionManager()
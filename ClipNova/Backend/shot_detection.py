@@ -0,0 +1,80 @@
+import os
+import cv2
+import numpy as np
+from typing import List, Optional, Tuple
+from ffmpeg_io import FFmpegReader
+
+# 镜头切换检测配置：相邻帧 HSV 直方图的 Bhattacharyya 距离超过阈值视为切换，
+# 两次切换之间至少间隔若干帧，避免闪光等瞬时变化被误判
+SHOT_THRESHOLD = float(os.environ.get("CLIPNOVA_SHOT_THRESHOLD", "0.5"))
+SHOT_MIN_LENGTH = int(os.environ.get("CLIPNOVA_SHOT_MIN_LENGTH", "8"))
+
+# 计算直方图前先缩小画面，检测只需要整体色彩分布
+THUMBNAIL_SIZE = (64, 36)
+
+
+def frame_histogram(frame: np.ndarray) -> np.ndarray:
+    """返回 BGR 帧缩略图的归一化 H-S 直方图。"""
+    small = cv2.resize(frame, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [16, 16], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+class ShotDetector:
+    """
+    逐帧检测镜头切换。
+
+    用法:
+        detector = ShotDetector()
+        for frame in frames:
+            detector.update(frame)
+        shots = detector.shots(len(frames))
+    """
+
+    def __init__(self, threshold: float = SHOT_THRESHOLD, min_length: int = SHOT_MIN_LENGTH):
+        self.threshold = threshold
+        self.min_length = max(1, min_length)
+        self.boundaries: List[int] = []  # 各镜头的起始帧（不含第 0 帧）
+        self._prev_hist: Optional[np.ndarray] = None
+        self._frame_idx = 0
+
+    def update(self, frame: np.ndarray) -> bool:
+        """输入下一帧（BGR），该帧是新镜头的第一帧时返回 True。"""
+        hist = frame_histogram(frame)
+        cut = False
+        if self._prev_hist is not None:
+            distance = cv2.compareHist(self._prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA)
+            last = self.boundaries[-1] if self.boundaries else 0
+            if distance > self.threshold and self._frame_idx - last >= self.min_length:
+                self.boundaries.append(self._frame_idx)
+                cut = True
+        self._prev_hist = hist
+        self._frame_idx += 1
+        return cut
+
+    def shots(self, num_frames: Optional[int] = None) -> List[Tuple[int, int]]:
+        """返回各镜头的帧范围 [start, end)。"""
+        num_frames = self._frame_idx if num_frames is None else num_frames
+        starts = [0] + [b for b in self.boundaries if b < num_frames]
+        ends = starts[1:] + [num_frames]
+        return [(start, end) for start, end in zip(starts, ends) if end > start]
+
+
+def detect_shots(video_path: str, threshold: float = SHOT_THRESHOLD,
+                 min_length: int = SHOT_MIN_LENGTH) -> List[Tuple[int, int]]:
+    """
+    解码视频并检测镜头切换。
+
+    返回:
+        List[Tuple[int, int]]: 各镜头的帧范围 [start, end)
+
+    异常:
+        subprocess.CalledProcessError: 如果 FFmpeg 解码失败。
+    """
+    detector = ShotDetector(threshold, min_length)
+    # 直方图只需要缩略图，由 FFmpeg 缩小后再通过管道传出，减少传输和缩放开销
+    with FFmpegReader(video_path, THUMBNAIL_SIZE) as reader:
+        for frame in reader:
+            detector.update(frame)
+    return detector.shots()
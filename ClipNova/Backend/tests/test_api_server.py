@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import api_server
+
+SOURCE = {"fps": 60.0, "frame_count": 120, "width": 8, "height": 6}
+MEZZANINE = {"fps": 30.0, "frame_count": 60, "width": 8, "height": 6}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    calls = []
+
+    def predict(video_path, frame_idx, points, labels, box, mask_size):
+        calls.append((video_path, frame_idx))
+        mask = np.zeros((mask_size[1], mask_size[0]), dtype=bool)
+        mask[1:3, 2:5] = True
+        return {"mask": mask, "score": 0.9, "cache_hit": False, "elapsed_ms": 1.0}
+
+    monkeypatch.setattr(api_server, "resolve_uploaded_video", lambda data: ("source.mp4", "mezzanine.mp4"))
+    monkeypatch.setattr(api_server, "probe_video",
+                        lambda path: dict(SOURCE if path == "source.mp4" else MEZZANINE))
+    monkeypatch.setattr(api_server, "predict_frame_mask", predict)
+    api_server.app.config["TESTING"] = True
+    with api_server.app.test_client() as test_client:
+        test_client.calls = calls
+        yield test_client
+
+
+def test_preview_mask_maps_source_frame_to_mezzanine(client):
+    response = client.post("/preview-mask", json={"simplified_name": "a.mp4", "frame": 50, "points": [[3, 2]]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["frame"] == 50
+    assert body["area"] == 6
+    assert client.calls == [("mezzanine.mp4", 25)]
+
+
+@pytest.mark.parametrize("frame", [-1, 120])
+def test_preview_mask_rejects_out_of_range_frame(client, frame):
+    response = client.post("/preview-mask", json={"simplified_name": "a.mp4", "frame": frame, "points": [[3, 2]]})
+    assert response.status_code == 400
+    assert client.calls == []
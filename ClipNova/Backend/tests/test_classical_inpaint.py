@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from classical_inpaint import fill_from_background
+
+
+def _moving_block(length=6, size=16):
+    """静止背景上一个逐帧右移的方块，返回 (带方块的帧, 背景, 掩码)。"""
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    frames = np.repeat(background[None], length, axis=0)
+    masks = np.zeros((length, size, size), dtype=np.uint8)
+    for t in range(length):
+        masks[t, 4:8, 2 * t:2 * t + 4] = 1
+        frames[t][masks[t] > 0] = 255
+    return frames, background, masks
+
+
+@pytest.mark.parametrize("mode", ["nearest", "median"])
+def test_fill_restores_revealed_background(mode):
+    frames, background, masks = _moving_block()
+    filled, unseen = fill_from_background(frames, masks, mode=mode)
+
+    assert filled.shape == frames.shape and filled.dtype == np.uint8
+    assert not unseen.any()
+    for t in range(len(frames)):
+        assert np.array_equal(filled[t], background)
+
+
+@pytest.mark.parametrize("mode", ["nearest", "median"])
+def test_fill_reports_never_seen_pixels(mode):
+    frames, background, masks = _moving_block()
+    masks[:, 0, 0] = 1  # 在所有帧中都被遮挡
+    filled, unseen = fill_from_background(frames, masks, mode=mode)
+
+    assert unseen[:, 0, 0].all()
+    assert unseen.sum() == len(frames)
+    # 未遮挡的像素保持不变
+    valid = masks == 0
+    assert np.array_equal(filled[valid], frames[valid])
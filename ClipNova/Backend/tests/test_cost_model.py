@@ -0,0 +1,58 @@
+import pytest
+
+from cost_model import OnlineLinearModel, JobCostEstimator
+
+
+def test_prior_until_samples_arrive():
+    model = OnlineLinearModel(2.0, 0.5)
+    assert model.coefficients() == (2.0, 0.5)
+    assert model.predict(10) == pytest.approx(7.0)
+
+
+def test_converges_towards_observed_line():
+    model = OnlineLinearModel(10.0, 1.0)
+    for _ in range(30):
+        for x in (1.0, 5.0, 10.0):
+            model.update(x, 3.0 + 2.0 * x)
+    intercept, slope = model.coefficients()
+    # 先验以伪观测点的形式保留少量权重
+    assert intercept == pytest.approx(3.0, abs=1.5)
+    assert slope == pytest.approx(2.0, abs=0.2)
+    assert model.samples == 90
+
+
+def test_old_samples_decay():
+    model = OnlineLinearModel(1.0, 0.0, decay=0.5, prior_weight=0.01)
+    for _ in range(10):
+        model.update(4.0, 100.0)
+    for _ in range(10):
+        model.update(4.0, 10.0)
+    assert model.predict(4.0) == pytest.approx(10.0, rel=0.1)
+
+
+def test_coefficients_are_not_negative():
+    model = OnlineLinearModel(1.0, 1.0)
+    for x, y in ((1.0, 10.0), (10.0, 0.0)) * 10:
+        model.update(x, y)
+    intercept, slope = model.coefficients()
+    assert slope == 0.0 and intercept >= 0.0
+
+
+def test_round_trip_through_dict():
+    model = OnlineLinearModel(1.0, 0.1)
+    model.update(3.0, 2.0)
+    restored = OnlineLinearModel(1.0, 0.1)
+    restored.load_dict(model.to_dict())
+    assert restored.coefficients() == model.coefficients()
+    assert restored.samples == 1
+
+
+def test_record_sample_updates_stage_time_model(tmp_path):
+    history = str(tmp_path / "history.json")
+    estimator = JobCostEstimator(history_path=history)
+    estimator.record_sample("extract_frames", 50.0, 4.0)
+    summary = estimator.summary()["stages"]["extract_frames"]
+    assert summary["samples"] == 1
+
+    reloaded = JobCostEstimator(history_path=history)
+    assert reloaded.summary()["stages"]["extract_frames"]["samples"] == 1
@@ -0,0 +1,71 @@
+import os
+
+import torch
+
+from feature_cache import FeatureCache, feature_variant, video_content_hash
+
+
+def _video(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+    return str(path)
+
+
+def _backbone(value=1.0):
+    fpn = [torch.full((1, 2, 4, 4), value), torch.full((1, 2, 2, 2), value)]
+    return {"backbone_fpn": fpn, "vision_features": fpn[-1], "vision_pos_enc": [torch.zeros(1, 2, 4, 4)] * 2}
+
+
+def test_content_hash_follows_content_not_path(tmp_path):
+    a = _video(tmp_path / "a.mp4", b"same bytes")
+    b = _video(tmp_path / "b.mp4", b"same bytes")
+    c = _video(tmp_path / "c.mp4", b"other bytes")
+    assert video_content_hash(a) == video_content_hash(b)
+    assert video_content_hash(a) != video_content_hash(c)
+
+    # 覆盖文件后哈希随内容变化
+    _video(tmp_path / "a.mp4", b"new content!")
+    os.utime(a, ns=(1, 1))
+    assert video_content_hash(a) != video_content_hash(b)
+
+
+def test_key_includes_checkpoint_and_variant(tmp_path):
+    video = _video(tmp_path / "v.mp4", b"video")
+    cache = FeatureCache(str(tmp_path / "cache"))
+    key = cache.make_key(video, "/models/sam2.1_hiera_small.pt", feature_variant(0.5, "fp16"))
+    assert key.startswith(video_content_hash(video) + "_sam2.1_hiera_small_")
+    assert key == cache.make_key(video, "/other/sam2.1_hiera_small.pt", feature_variant(0.5, "fp16"))
+    assert key != cache.make_key(video, "/models/sam2.1_hiera_large.pt", feature_variant(0.5, "fp16"))
+    assert key != cache.make_key(video, "/models/sam2.1_hiera_small.pt", feature_variant(1.0, "fp16"))
+    assert key != cache.make_key(video, "/models/sam2.1_hiera_small.pt", feature_variant(0.5, "fp32"))
+
+
+def test_put_get_round_trip(tmp_path):
+    cache = FeatureCache(str(tmp_path / "cache"), max_bytes=1 << 20)
+    assert cache.get("k", 0) is None
+    cache.put("k", 0, _backbone(0.25))
+    cache.flush()
+    out = cache.get("k", 0)
+    assert out["backbone_fpn"][0].dtype == torch.float32
+    assert torch.equal(out["vision_features"], out["backbone_fpn"][-1])
+    assert torch.allclose(out["backbone_fpn"][0], torch.full((1, 2, 4, 4), 0.25))
+    assert cache.hits == 1 and cache.misses == 1
+
+
+def test_evicts_whole_least_recently_used_video(tmp_path):
+    root = str(tmp_path / "cache")
+    cache = FeatureCache(root, max_bytes=1 << 20)
+    for key in ("old", "new"):
+        cache.put(key, 0, _backbone())
+        cache.flush()
+    per_video = cache.entries["old"]
+    cache.max_bytes = per_video + per_video // 2
+    cache.put("newest", 0, _backbone())
+    cache.flush()
+    assert list(cache.entries) == ["newest"]
+    assert sorted(os.listdir(root)) == ["newest"]
+
+    # 重启后按修改时间恢复索引
+    restarted = FeatureCache(root, max_bytes=1 << 20)
+    assert restarted.get("newest", 0) is not None
+    assert list(restarted.entries) == ["newest"]
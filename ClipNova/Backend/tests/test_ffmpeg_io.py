@@ -0,0 +1,130 @@
+import os
+import stat
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+import pytest
+
+import ffmpeg_io
+from ffmpeg_io import FFmpegReader, FFmpegWriter, mux_audio
+
+# 代替 FFmpeg 的脚本：解码时输出 FAKE_FRAMES 帧（每个像素等于帧号），编码时把输入原样写入输出文件。
+# FAKE_FAIL=1 时解码在帧中间结束、编码读完输入后失败，都以非 0 退出码退出并在 stderr 输出错误
+FAKE_FFMPEG = textwrap.dedent("""
+    import os, sys
+    args = sys.argv[1:]
+    fail = os.environ.get("FAKE_FAIL") == "1"
+    if args[-1] == "-":
+        width, height = map(int, args[args.index("-vf") + 1].split("=")[1].split(":"))
+        frame_bytes = width * height * 3
+        for idx in range(int(os.environ.get("FAKE_FRAMES", "3"))):
+            sys.stdout.buffer.write(bytes([idx]) * frame_bytes)
+        if fail:
+            sys.stdout.buffer.write(b"\\0" * (frame_bytes // 2))
+            sys.stderr.write("decode error\\n")
+            sys.exit(1)
+    else:
+        data = sys.stdin.buffer.read() if "-" in args else b"muxed"
+        if fail:
+            sys.stderr.write("encode error\\n")
+            sys.exit(1)
+        with open(args[-1], "wb") as f:
+            f.write(data)
+""")
+
+
+@pytest.fixture(autouse=True)
+def fake_ffmpeg(tmp_path, monkeypatch):
+    path = tmp_path / "ffmpeg"
+    path.write_text(f"#!{sys.executable}\n{FAKE_FFMPEG}")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(ffmpeg_io, "FFMPEG_BINARY", str(path))
+    monkeypatch.delenv("FAKE_FAIL", raising=False)
+    monkeypatch.setenv("FAKE_FRAMES", "3")
+
+
+def test_reader_reads_frames_through_pipe():
+    with FFmpegReader("in.mp4", (5, 4)) as reader:
+        frames = list(reader)
+    assert [frame.shape for frame in frames] == [(4, 5, 3)] * 3
+    assert [int(frame[0, 0, 0]) for frame in frames] == [0, 1, 2]
+    assert reader.frames_read == 3
+
+
+def test_reader_read_into_preallocated_buffer():
+    out = np.zeros((2, 4, 5, 3), dtype=np.uint8)
+    reader = FFmpegReader("in.mp4", (5, 4), input_args=["-ss", "1.0"])
+    assert reader.command.index("-ss") < reader.command.index("-i")
+    reader.open()
+    try:
+        assert reader.read_into(out[1]) and out[1].max() == 0
+        with pytest.raises(ValueError):
+            reader.read_into(np.zeros((4, 5), dtype=np.uint8))
+    finally:
+        reader.close(check=False)
+    assert reader.process.poll() is not None
+
+
+def test_reader_partial_frame_raises_with_stderr(monkeypatch):
+    monkeypatch.setenv("FAKE_FAIL", "1")
+    monkeypatch.setenv("FAKE_FRAMES", "1")
+    with pytest.raises(subprocess.CalledProcessError) as info:
+        with FFmpegReader("in.mp4", (5, 4)) as reader:
+            list(reader)
+    assert info.value.returncode == 1
+    assert "decode error" in info.value.stderr
+
+
+def test_writer_replaces_output_atomically(tmp_path):
+    output = str(tmp_path / "out" / "video.mp4")
+    frames = [np.full((4, 5, 3), idx, dtype=np.uint8) for idx in range(3)]
+    with FFmpegWriter(output, (5, 4), 25) as writer:
+        for frame in frames:
+            writer.write(frame)
+        assert not os.path.exists(output)  # 关闭前不出现在目标路径
+    assert writer.frames_written == 3
+    with open(output, "rb") as f:
+        assert f.read() == b"".join(frame.tobytes() for frame in frames)
+    assert not os.path.exists(writer.part_path)
+
+    with FFmpegWriter(output, (5, 4), 25) as writer:
+        with pytest.raises(ValueError):
+            writer.write(np.zeros((4, 4, 3), dtype=np.uint8))
+
+
+def test_writer_failure_keeps_previous_output(tmp_path, monkeypatch):
+    output = str(tmp_path / "video.mp4")
+    with open(output, "wb") as f:
+        f.write(b"previous")
+    monkeypatch.setenv("FAKE_FAIL", "1")
+    with pytest.raises(subprocess.CalledProcessError) as info:
+        with FFmpegWriter(output, (5, 4), 25) as writer:
+            writer.write(np.zeros((4, 5, 3), dtype=np.uint8))
+    assert "encode error" in info.value.stderr
+    assert not os.path.exists(writer.part_path)
+    with open(output, "rb") as f:
+        assert f.read() == b"previous"
+
+
+def test_writer_abort_removes_partial_output(tmp_path):
+    output = str(tmp_path / "video.mp4")
+    with pytest.raises(RuntimeError):
+        with FFmpegWriter(output, (5, 4), 25) as writer:
+            writer.write(np.zeros((4, 5, 3), dtype=np.uint8))
+            raise RuntimeError("stop")
+    assert not os.path.exists(output)
+    assert not os.path.exists(writer.part_path)
+
+
+def test_mux_audio(tmp_path, monkeypatch):
+    output = str(tmp_path / "final.mp4")
+    mux_audio("video.mp4", "source.mp4", output)
+    with open(output, "rb") as f:
+        assert f.read() == b"muxed"
+
+    monkeypatch.setenv("FAKE_FAIL", "1")
+    with pytest.raises(subprocess.CalledProcessError):
+        mux_audio("video.mp4", "source.mp4", str(tmp_path / "other.mp4"))
+    assert sorted(os.listdir(tmp_path)) == ["ffmpeg", "final.mp4"]
@@ -0,0 +1,234 @@
+import json
+import math
+import os
+import time
+
+import numpy as np
+import pytest
+
+import frame_store
+from feature_cache import video_content_hash
+from frame_store import FrameStoreCache, META_FILE, LEGACY_FRAMES_FILE, _chunk_name
+from workspace import WorkspaceQuotaError
+
+FPS = 25.0
+SIZE = (6, 4)
+
+
+class FakeReader:
+    """按帧号生成画面（每个像素等于帧号）的解码器，-ss 按帧率换算为起始帧。"""
+
+    instances = []
+
+    def __init__(self, video_path, size=None, input_args=()):
+        self.size = size
+        self.input_args = list(input_args)
+        self.total = FakeReader.total
+        self.pos = 0
+        if "-ss" in self.input_args:
+            self.pos = math.ceil(float(self.input_args[self.input_args.index("-ss") + 1]) * FPS)
+        self.reads = 0
+        FakeReader.instances.append(self)
+
+    def open(self):
+        pass
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def read_into(self, out):
+        if self.pos >= self.total:
+            return False
+        out[...] = self.pos % 256
+        self.pos += 1
+        self.reads += 1
+        return True
+
+    def read(self):
+        out = np.empty((self.size[1], self.size[0], 3), dtype=np.uint8)
+        return out if self.read_into(out) else None
+
+    def close(self, check=True):
+        pass
+
+
+@pytest.fixture
+def video(tmp_path, monkeypatch):
+    """100 帧的假视频：probe_video 和 FFmpegReader 都不调用 FFmpeg。"""
+    path = str(tmp_path / "video.mp4")
+    with open(path, "wb") as f:
+        f.write(b"not really a video")
+    FakeReader.instances = []
+    FakeReader.total = 100
+    info = {"fps": FPS, "frame_count": 100, "width": SIZE[0], "height": SIZE[1], "start_time": 0.0, "is_vfr": False}
+    monkeypatch.setattr(frame_store, "FFmpegReader", FakeReader)
+    monkeypatch.setattr(frame_store, "probe_video", lambda video_path: dict(info))
+    return path
+
+
+def _cache(tmp_path, chunks=100, chunk_frames=10):
+    frame_bytes = SIZE[0] * SIZE[1] * 3
+    return FrameStoreCache(str(tmp_path / "frames"), max_bytes=chunks * chunk_frames * frame_bytes,
+                           min_free_bytes=0, chunk_frames=chunk_frames)
+
+
+def test_frames_decode_lazily_in_chunks(tmp_path, video):
+    cache = _cache(tmp_path)
+    with cache.acquire(video) as frames:
+        assert len(frames) == 100 and frames.size == SIZE
+        assert FakeReader.instances == []  # 打开只读取元数据
+        for idx in (0, 9, 10, 57):
+            assert frames.frame(idx)[0, 0, 0] == idx
+        assert frames[-1][0, 0, 0] == 99
+        assert [frame[0, 0, 0] for frame in frames[3:6]] == [3, 4, 5]
+        with pytest.raises(IndexError):
+            frames.frame(100)
+    assert cache.misses == 4  # 分块 0、1、5、9
+    assert sorted(idx for _, idx in cache.chunks) == [0, 1, 5, 9]
+
+
+def test_sequential_access_uses_one_reader(tmp_path, video):
+    cache = _cache(tmp_path)
+    with cache.acquire(video) as frames:
+        for idx in range(100):
+            assert frames.frame(idx)[0, 0, 0] == idx
+    assert len(FakeReader.instances) == 1
+    assert FakeReader.instances[0].reads == 100
+
+
+def test_evicts_least_recently_used_chunks(tmp_path, video):
+    cache = _cache(tmp_path, chunks=3)
+    with cache.acquire(video) as frames:
+        for idx in range(0, 50, 10):
+            frames.frame(idx)
+        assert [idx for _, idx in cache.chunks] == [2, 3, 4]
+        assert not os.path.exists(os.path.join(frames.root, _chunk_name(0)))
+        assert cache.evictions == 2
+        # 淘汰的分块再次访问时重新解码
+        assert frames.frame(5)[0, 0, 0] == 5
+        assert [idx for _, idx in cache.chunks] == [3, 4, 0]
+    assert cache.stats()["chunks"] == 3
+
+
+def test_short_video_is_padded_with_last_frame(tmp_path, video):
+    FakeReader.total = 95  # 元数据中的帧数偏多
+    cache = _cache(tmp_path)
+    with cache.acquire(video) as frames:
+        assert frames.frame(99)[0, 0, 0] == 94
+        assert frames.frame(94)[0, 0, 0] == 94
+
+
+def test_iter_frames_does_not_persist_chunks(tmp_path, video):
+    cache = _cache(tmp_path)
+    with cache.acquire(video) as frames:
+        frames.frame(25)
+        values = [frame[0, 0, 0] for frame in frames.iter_frames(15, 45)]
+        assert values == list(range(15, 45))
+    assert [idx for _, idx in cache.chunks] == [2]
+
+
+def test_read_frame_seeks_when_cold(tmp_path, video):
+    cache = _cache(tmp_path)
+    frame = cache.read_frame(video, 42)
+    assert frame[0, 0, 0] == 42
+    assert cache.chunks == {}
+    assert FakeReader.instances[-1].reads == 1
+    assert "-ss" in FakeReader.instances[-1].input_args
+    with pytest.raises(IndexError):
+        cache.read_frame(video, 100)
+
+    with cache.acquire(video) as frames:
+        frames.frame(40)
+    readers = len(FakeReader.instances)
+    assert cache.read_frame(video, 42)[0, 0, 0] == 42
+    assert len(FakeReader.instances) == readers  # 分块已解码，直接复制
+
+
+def test_quota_error_releases_reservation(tmp_path, video):
+    cache = _cache(tmp_path)
+    cache.min_free_bytes = 1 << 60
+    with cache.acquire(video) as frames:
+        with pytest.raises(WorkspaceQuotaError):
+            frames.frame(0)
+    assert cache._pending_bytes == 0
+    assert cache.chunks == {}
+
+
+def _write_store(root, video_path, frames, chunk_frames=2):
+    os.makedirs(root)
+    for chunk_idx in range(0, len(frames), chunk_frames):
+        frames[chunk_idx:chunk_idx + chunk_frames].tofile(os.path.join(root, _chunk_name(chunk_idx // chunk_frames)))
+    meta = {"video_path": video_path, "fps": 25.0, "frames": len(frames), "width": frames.shape[2],
+            "height": frames.shape[1], "chunk_frames": chunk_frames}
+    with open(os.path.join(root, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+def test_load_index_recovers_stores(tmp_path):
+    root = str(tmp_path / "frames")
+    frames = np.arange(3 * 4 * 6 * 3, dtype=np.uint8).reshape(3, 4, 6, 3)
+    _write_store(os.path.join(root, "good"), "video.mp4", frames)
+    truncated = os.path.join(root, "good", _chunk_name(1))
+    with open(truncated, "r+b") as f:
+        f.truncate(10)
+
+    corrupt = os.path.join(root, "corrupt")
+    os.makedirs(corrupt)
+    with open(os.path.join(corrupt, META_FILE), "w") as f:
+        f.write("{not json")
+
+    legacy = os.path.join(root, "legacy")
+    os.makedirs(legacy)
+    for name in (META_FILE, LEGACY_FRAMES_FILE):
+        open(os.path.join(legacy, name), "w").close()
+
+    stale = os.path.join(root, "partial.tmp1_1")
+    fresh = os.path.join(root, "partial.tmp2_2")
+    for path in (stale, fresh):
+        os.makedirs(path)
+    old = time.time() - 10 * 86400
+    os.utime(stale, (old, old))
+
+    cache = FrameStoreCache(root, max_bytes=1 << 30, min_free_bytes=0)
+    cache._load_index()
+    try:
+        assert list(cache.stores) == ["good"]
+        assert list(cache.chunks) == [("good", 0)]
+        store = cache.stores["good"]
+        assert len(store) == 3 and store.size == (6, 4)
+        assert np.array_equal(store[1], frames[1])
+        assert not os.path.exists(truncated)
+        assert not os.path.exists(corrupt)
+        assert not os.path.exists(legacy)
+        assert not os.path.exists(stale)
+        assert os.path.exists(fresh)
+    finally:
+        for store in cache.stores.values():
+            store.close()
+
+
+def test_acquire_reuses_recovered_store(tmp_path, monkeypatch):
+    video_path = str(tmp_path / "video.mp4")
+    with open(video_path, "wb") as f:
+        f.write(b"not really a video")
+    root = str(tmp_path / "frames")
+    frames = np.full((3, 2, 2, 3), 7, dtype=np.uint8)
+    _write_store(os.path.join(root, video_content_hash(video_path)), video_path, frames)
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError("已有的帧存储不应重新解码")
+
+    monkeypatch.setattr(frame_store, "FFmpegReader", no_decode)
+    monkeypatch.setattr(frame_store, "probe_video", no_decode)
+    cache = FrameStoreCache(root, max_bytes=1 << 30, min_free_bytes=0)
+    with cache.acquire(video_path) as store:
+        assert len(store) == 3
+        assert np.array_equal(store.frame(2), frames[2])
+    assert cache.hits == 1 and cache.misses == 0
+    assert cache.refs == {}
+    for store in cache.stores.values():
+        store.close()
@@ -0,0 +1,40 @@
+import numpy as np
+
+from inpainting import plan_chunks, _blend_weights
+
+
+def test_plan_chunks_splits_shots_without_overlap():
+    assert plan_chunks([(0, 30), (30, 50)], chunk_frames=100, overlap=10) == [(0, 30), (30, 50)]
+    assert plan_chunks([(0, 500)], chunk_frames=0, overlap=10) == [(0, 500)]
+
+
+def test_plan_chunks_overlaps_long_shots():
+    chunks = plan_chunks([(0, 10), (10, 250)], chunk_frames=100, overlap=10)
+    assert chunks == [(0, 10), (10, 110), (100, 200), (190, 250)]
+    # 所有帧都被覆盖，且窗口不超过镜头边界
+    covered = np.zeros(250, dtype=bool)
+    for start, end in chunks:
+        covered[start:end] = True
+    assert covered.all()
+
+
+def test_plan_chunks_merges_short_tail():
+    # 剩余部分短于重叠帧数时并入最后一个窗口
+    assert plan_chunks([(0, 105)], chunk_frames=100, overlap=10) == [(0, 105)]
+
+
+def test_blend_weights_sum_to_one():
+    chunks = plan_chunks([(0, 10), (10, 250)], chunk_frames=100, overlap=10)
+    total = np.zeros(250, dtype=np.float32)
+    for chunk in chunks:
+        weights = _blend_weights(chunk, chunks)
+        assert len(weights) == chunk[1] - chunk[0]
+        assert (weights > 0).all() and (weights <= 1).all()
+        total[chunk[0]:chunk[1]] += weights
+    assert np.allclose(total, 1.0)
+
+
+def test_blend_weights_shot_boundary_is_hard_cut():
+    chunks = [(0, 10), (10, 20)]
+    assert np.array_equal(_blend_weights((0, 10), chunks), np.ones(10, dtype=np.float32))
+    assert np.array_equal(_blend_weights((10, 20), chunks), np.ones(10, dtype=np.float32))
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from job_control import AdmissionController
+
+
+class _FixedCost:
+    """按操作名返回固定预计耗时的开销模型。"""
+
+    def __init__(self, costs):
+        self.costs = costs
+
+    def estimate(self, op, video_path=None):
+        return self.costs[op]
+
+    def record(self, op, video_path, elapsed):
+        pass
+
+    def summary(self):
+        return {}
+
+
+def _controller(costs):
+    job_classes = {
+        'work': {'concurrency': 1, 'queue_size': 16, 'queue_timeout': 600, 'weight': 1.0, 'uses_compute': False}
+    }
+    return AdmissionController(job_classes, compute_slots=1, estimator=_FixedCost(costs))
+
+
+def _run_queued(controller, jobs):
+    """占住唯一的名额后按顺序提交 jobs（(会话, 操作) 列表），释放名额，返回实际执行顺序。"""
+    order = []
+    order_lock = threading.Lock()
+
+    def job(session, op):
+        with controller.admit('work', op=op, session=session):
+            with order_lock:
+                order.append((session, op))
+
+    threads = []
+    with controller.admit('work', op='short', session='holder'):
+        for i, (session, op) in enumerate(jobs):
+            thread = threading.Thread(target=job, args=(session, op))
+            thread.start()
+            threads.append(thread)
+            deadline = time.monotonic() + 5
+            while len(controller.waiters) < i + 1:
+                assert time.monotonic() < deadline, "任务没有进入等待队列"
+                time.sleep(0.005)
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_short_job_overtakes_queued_long_job():
+    controller = _controller({'short': 1.0, 'long': 100.0})
+    order = _run_queued(controller, [('a', 'long'), ('b', 'short')])
+    assert order == [('b', 'short'), ('a', 'long')]
+
+
+def test_session_backlog_does_not_block_other_sessions():
+    controller = _controller({'short': 1.0, 'medium': 10.0})
+    # 会话 a 连续提交的任务推迟自己的虚拟完成时间，会话 b 后到的任务排在 a 的第二个任务之前
+    order = _run_queued(controller, [('a', 'medium'), ('a', 'medium'), ('b', 'medium')])
+    assert [session for session, _ in order] == ['a', 'b', 'a']
+
+
+def test_equal_tags_run_in_arrival_order():
+    controller = _controller({'short': 1.0})
+    order = _run_queued(controller, [('a', 'short'), ('b', 'short'), ('c', 'short')])
+    assert [session for session, _ in order] == ['a', 'b', 'c']
@@ -0,0 +1,77 @@
+import numpy as np
+
+from mask_interpolation import FlowInterpolator, area_change, mask_iou, shape_interpolate
+from mask_store import MaskStore
+from sam2_model import SAM2InstanceSegmentationModel, propagation_mode
+
+
+def _square(x, y, size=8, shape=(32, 48)):
+    mask = np.zeros(shape, dtype=bool)
+    mask[y:y + size, x:x + size] = True
+    return mask
+
+
+def test_iou_and_area_change():
+    a, b = _square(0, 0), _square(4, 0)
+    assert mask_iou(a, a) == 1.0
+    assert mask_iou(a, b) == 32 / 96
+    assert mask_iou(np.zeros((4, 4), bool), np.zeros((4, 4), bool)) == 1.0
+    assert area_change(a, _square(0, 0, size=4)) == 0.75
+    assert area_change(np.zeros((4, 4), bool), np.zeros((4, 4), bool)) == 0.0
+
+
+def test_shape_interpolate_moves_between_keyframes():
+    a, b = _square(4, 10, size=12), _square(12, 10, size=12)
+    assert np.array_equal(shape_interpolate(a, b, 0.0), a)
+    assert np.array_equal(shape_interpolate(a, b, 1.0), b)
+    middle = shape_interpolate(a, b, 0.5)
+    ys, xs = np.nonzero(middle)
+    assert abs(xs.min() - 8) <= 1 and abs(xs.max() - 19) <= 1
+    assert ys.min() == 10 and ys.max() == 21
+
+
+def test_flow_interpolator_on_static_frames_keeps_mask():
+    frame = np.zeros((32, 48, 3), dtype=np.uint8)
+    frame[8:20, 10:30] = 200
+    interpolator = FlowInterpolator(lambda idx: frame)
+    mask = _square(12, 10)
+    out = interpolator.interpolate(2, 0, mask, 4, mask, 0.5)
+    assert mask_iou(out, mask) > 0.9
+
+
+def test_propagation_mode():
+    assert propagation_mode(100, window_size=0, keyframe_stride=4) == "strided"
+    assert propagation_mode(3, window_size=0, keyframe_stride=4) == "full"
+    assert propagation_mode(100, window_size=50, keyframe_stride=1) == "windowed"
+    assert propagation_mode(40, window_size=50, keyframe_stride=1) == "full"
+
+
+def _model_with_store(num_frames=9, shape=(32, 48)):
+    model = SAM2InstanceSegmentationModel.__new__(SAM2InstanceSegmentationModel)
+    model.video_segments = MaskStore(num_frames, *shape)
+    return model
+
+
+def test_small_motion_gap_is_interpolated():
+    model = _model_with_store()
+    model.video_segments.put(0, 1, _square(10, 10, size=12))
+    model.video_segments.put(4, 1, _square(11, 10, size=12))
+    assert not model._keyframe_gap_is_dense(0, 4)
+    model._interpolate_gap(0, 4, None)
+    assert model.video_segments.frames() == [0, 1, 2, 3, 4]
+    assert model.video_segments.area(2) > 0
+
+
+def test_large_motion_or_appearance_falls_back_to_dense():
+    model = _model_with_store()
+    store = model.video_segments
+    store.put(0, 1, _square(0, 0))
+    store.put(4, 1, _square(30, 20))  # IoU 为 0
+    assert model._keyframe_gap_is_dense(0, 4)
+
+    store.put(8, 1, np.zeros((32, 48), dtype=bool))  # 对象消失
+    assert model._keyframe_gap_is_dense(4, 8)
+
+    store.put(4, 1, _square(0, 0, size=3))
+    store.put(0, 1, _square(0, 0, size=12))  # 面积变化过大
+    assert model._keyframe_gap_is_dense(0, 4)
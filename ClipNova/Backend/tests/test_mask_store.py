@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+import pytest
+
+from mask_store import MaskStore, encode_rle, decode_rle
+
+
+def _random_mask(rng, height=7, width=13):
+    return rng.random((height, width)) > 0.5
+
+
+def test_put_get_and_union():
+    rng = np.random.default_rng(0)
+    store = MaskStore(num_frames=4, height=7, width=13)
+    a, b = _random_mask(rng), _random_mask(rng)
+    store.put(1, 1, a)
+    store.put(1, 2, b[None])
+
+    assert np.array_equal(store.get(1, 1), a)
+    assert np.array_equal(store.get(1, 2), b)
+    assert store.get(0, 1) is None
+    assert np.array_equal(store.get_union(1), a | b)
+    assert not store.get_union(0).any()
+    assert store.area(1) == int((a | b).sum())
+    assert store.frames() == [1]
+    assert 1 in store and 0 not in store
+
+
+def test_persist_and_reopen(tmp_path):
+    rng = np.random.default_rng(1)
+    root = str(tmp_path / "store")
+    store = MaskStore(num_frames=3, height=7, width=13, root=root)
+    masks = {(frame_idx, obj_id): _random_mask(rng) for frame_idx in (0, 2) for obj_id in (1, 3)}
+    for (frame_idx, obj_id), mask in masks.items():
+        store.put(frame_idx, obj_id, mask)
+    store.close()
+
+    reopened = MaskStore.open(root)
+    try:
+        assert reopened.obj_ids == [1, 3]
+        assert reopened.frames() == [0, 2]
+        for (frame_idx, obj_id), mask in masks.items():
+            assert np.array_equal(reopened.get(frame_idx, obj_id), mask)
+        assert reopened.get(1, 1) is None
+    finally:
+        reopened.close()
+
+
+def test_read_only_open_does_not_write(tmp_path):
+    root = str(tmp_path / "store")
+    store = MaskStore(num_frames=2, height=7, width=13, root=root)
+    store.put(0, 1, _random_mask(np.random.default_rng(3)))
+    store.close()
+    paths = [os.path.join(root, name) for name in sorted(os.listdir(root))]
+    old = 1_000_000_000
+    for path in paths:
+        os.utime(path, (old, old))
+
+    reopened = MaskStore.open(root, read_only=True)
+    with pytest.raises(ValueError):
+        reopened.put(1, 1, np.ones((7, 13), dtype=bool))
+    reopened.close()
+    assert [os.path.getmtime(path) for path in paths] == [old] * len(paths)
+
+
+def test_rle_round_trip():
+    rng = np.random.default_rng(2)
+    cases = [
+        _random_mask(rng),
+        np.zeros((5, 6), dtype=bool),
+        np.ones((5, 6), dtype=bool),
+    ]
+    leading = np.zeros((4, 4), dtype=bool)
+    leading[0, :2] = True  # 以 1 开头时 counts 的第一个 0 游程长度为 0
+    cases.append(leading)
+
+    for mask in cases:
+        rle = encode_rle(mask)
+        assert rle["size"] == list(mask.shape)
+        assert sum(rle["counts"]) == mask.size
+        assert np.array_equal(decode_rle(rle), mask)
+    assert encode_rle(leading)["counts"][0] == 0
+
+
+def test_store_rle_matches_union():
+    rng = np.random.default_rng(3)
+    store = MaskStore(num_frames=2, height=7, width=13)
+    a, b = _random_mask(rng), _random_mask(rng)
+    store.put(0, 1, a)
+    store.put(0, 2, b)
+
+    assert np.array_equal(decode_rle(store.to_rle(0)), a | b)
+    assert np.array_equal(decode_rle(store.to_rle(0, obj_id=2)), b)
+    assert not decode_rle(store.to_rle(1)).any()
+
+
+def test_frame_boxes():
+    store = MaskStore(num_frames=3, height=10, width=10)
+    mask = np.zeros((10, 10), dtype=bool)
+    mask[2:5, 3:8] = True
+    store.put(1, 1, mask)
+
+    boxes = store.frame_boxes()
+    assert boxes.shape == (3, 4)
+    assert boxes[1].tolist() == [3, 2, 8, 5]
+    assert (boxes[[0, 2]] == -1).all()
+    assert store.tube() == (1, 1, (3, 2, 8, 5))
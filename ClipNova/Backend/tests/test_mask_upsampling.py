@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import sam2_model
+from sam2_model import guided_filter, upsample_mask
+
+
+def test_guided_filter_keeps_constant_image():
+    rng = np.random.default_rng(0)
+    guide = rng.random((20, 30), dtype=np.float32)
+    src = np.full((20, 30), 0.7, dtype=np.float32)
+    assert np.allclose(guided_filter(guide, src, 3), 0.7, atol=1e-4)
+
+
+def test_guided_filter_follows_guide_edges():
+    guide = np.zeros((20, 40), dtype=np.float32)
+    guide[:, 20:] = 1.0
+    src = np.clip(np.linspace(-0.5, 1.5, 40, dtype=np.float32), 0, 1)[None].repeat(20, axis=0)
+    out = guided_filter(guide, src, 4, eps=1e-4)
+    # 输出在引导图的边缘处跳变，而不是沿着输入的渐变
+    assert out[10, 18] < 0.5 < out[10, 21]
+    assert out[10, 21] - out[10, 18] > src[10, 21] - src[10, 18]
+
+
+def test_upsample_mask_without_guide_is_smooth_and_sized():
+    mask = np.zeros((4, 4), dtype=bool)
+    mask[1:3, 1:3] = True
+    out = upsample_mask(mask, (16, 12))
+    assert out.shape == (12, 16) and out.dtype == bool
+    assert out[6, 8] and not out[0, 0]
+    assert upsample_mask(mask, (4, 4)) is mask  # 尺寸一致时原样返回
+
+
+def test_upsample_mask_dilation():
+    mask = np.zeros((9, 9), dtype=bool)
+    mask[4, 4] = True
+    out = upsample_mask(mask, (9, 9), dilation=2)
+    assert out.sum() > 1 and out[4, 6] and not out[4, 7]
+
+
+def test_upsample_mask_snaps_to_guide_edge(monkeypatch):
+    monkeypatch.setattr(sam2_model, "SAM2_EDGE_REFINE", True)
+    # 工作分辨率的掩码覆盖左半边，原分辨率画面的真实边界在第 34 列
+    mask = np.zeros((8, 8), dtype=bool)
+    mask[:, :4] = True
+    guide = np.zeros((64, 64, 3), dtype=np.uint8)
+    guide[:, :34] = 255
+    refined = upsample_mask(mask, (64, 64), guide=guide)
+    plain = upsample_mask(mask, (64, 64))
+    boundary = lambda m: int(m[32].sum())
+    assert boundary(plain) == 32
+    assert boundary(refined) == pytest.approx(34, abs=1)
@@ -0,0 +1,80 @@
+import json
+import subprocess
+
+import pytest
+
+import media_ingest
+from media_ingest import MezzanineManager, probe_video, _parse_rate
+
+
+def _ffprobe_output(stream, fmt=None, audio=False):
+    streams = [dict(stream, codec_type="video")]
+    if audio:
+        streams.append({"codec_type": "audio"})
+    return json.dumps({"streams": streams, "format": fmt or {}})
+
+
+@pytest.fixture
+def fake_run(monkeypatch):
+    """替换 subprocess.run：ffprobe 返回预设的 JSON，ffmpeg 记录命令并写出输出文件。"""
+    calls = []
+
+    def run(command, check=True, capture_output=True, text=True):
+        calls.append(command)
+        if command[0] == "ffprobe":
+            return subprocess.CompletedProcess(command, 0, stdout=fake_run.probe, stderr="")
+        with open(command[-1], "wb") as f:
+            f.write(b"mezzanine")
+        return subprocess.CompletedProcess(command, 0, stdout="", stderr="")
+
+    monkeypatch.setattr(media_ingest.subprocess, "run", run)
+    fake_run.calls = calls
+    return fake_run
+
+
+def test_parse_rate():
+    assert _parse_rate("30000/1001") == pytest.approx(29.97, abs=0.01)
+    assert _parse_rate("25") == 25.0
+    assert _parse_rate("0/0") == 0.0
+    assert _parse_rate(None) == 0.0
+
+
+def test_probe_video_rotation_start_and_vfr(fake_run):
+    fake_run.probe = _ffprobe_output(
+        {"width": 1920, "height": 1080, "avg_frame_rate": "60/1", "r_frame_rate": "60/1", "nb_frames": "600",
+         "duration": "10.0", "start_time": "1.5", "side_data_list": [{"rotation": -90}]},
+        fmt={"start_time": "1.0"}, audio=True)
+    info = probe_video("clip.mp4")
+    assert (info["width"], info["height"]) == (1080, 1920)
+    assert info["rotation"] == 270
+    assert info["fps"] == 60.0 and info["frame_count"] == 600
+    assert info["start_time"] == pytest.approx(0.5)
+    assert info["has_audio"] and not info["is_vfr"]
+
+    fake_run.probe = _ffprobe_output({"width": 640, "height": 480, "avg_frame_rate": "24000/1001",
+                                      "r_frame_rate": "30/1", "duration": "2.0"})
+    info = probe_video("phone.mp4")
+    assert info["is_vfr"]
+    assert info["frame_count"] == round(2.0 * 24000 / 1001)
+
+
+def test_probe_video_without_video_stream(fake_run):
+    fake_run.probe = json.dumps({"streams": [{"codec_type": "audio"}], "format": {}})
+    with pytest.raises(ValueError):
+        probe_video("audio.m4a")
+
+
+@pytest.mark.parametrize("rate, expected", [("120/1", 30), ("24000/1001", 24), ("0/0", 30)])
+def test_transcode_caps_fps(tmp_path, fake_run, rate, expected):
+    fake_run.probe = _ffprobe_output({"width": 1280, "height": 720, "avg_frame_rate": rate,
+                                      "r_frame_rate": rate, "duration": "1.0"})
+    mezzanine_path = str(tmp_path / "mezzanine" / "clip.mp4")
+    MezzanineManager(enabled=True, max_workers=1).transcode("clip.mp4", mezzanine_path)
+
+    command = fake_run.calls[-1]
+    assert command[0] == "ffmpeg"
+    assert command[command.index("-vf") + 1].startswith(f"fps={expected},")
+    assert command[command.index("-g") + 1] == str(media_ingest.MEZZANINE_GOP)
+    with open(mezzanine_path, "rb") as f:
+        assert f.read() == b"mezzanine"
+    assert not (tmp_path / "mezzanine" / "clip.mp4.part.mp4").exists()
@@ -0,0 +1,22 @@
+from nlp_parser import generate_confirmation, parse_action_params
+
+
+def test_parse_action_params_keeps_spaces_and_separators():
+    params = parse_action_params("objects=穿红衣服的 女人|一只狗 editor=moviepy")
+    assert params == {"objects": "穿红衣服的 女人|一只狗", "editor": "moviepy"}
+
+
+def test_parse_action_params_splits_on_first_equals_only():
+    assert parse_action_params("text=a=b size=24") == {"text": "a=b", "size": "24"}
+    assert parse_action_params("") == {}
+
+
+def test_confirmation_for_multi_object_removal():
+    confirmation = generate_confirmation("action: remove_objects objects=穿红衣服的 女人|狗 editor=moviepy")
+    assert "objects=穿红衣服的 女人|狗" in confirmation
+    assert confirmation.endswith("搞定！")
+
+
+def test_confirmation_reports_missing_required_param():
+    assert "objects" in generate_confirmation("action: remove_objects editor=moviepy")
+    assert generate_confirmation("action: trim start=1 end=2").endswith("搞定！")
@@ -0,0 +1,169 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from removal_pipeline import StageCache, stage_key
+from workspace import WorkspaceQuotaError
+
+
+def _writer(content, calls=None):
+    def build(root):
+        if calls is not None:
+            calls.append(root)
+        with open(os.path.join(root, "out"), "w") as f:
+            f.write(content)
+    return build
+
+
+def _read(root):
+    with open(os.path.join(root, "out")) as f:
+        return f.read()
+
+
+def test_stage_key_depends_on_inputs():
+    assert stage_key("render", {"a": 1, "b": 2}) == stage_key("render", {"b": 2, "a": 1})
+    assert stage_key("render", {"a": 1}) != stage_key("render", {"a": 2})
+    assert stage_key("render", {"a": 1}) != stage_key("inpaint", {"a": 1})
+
+
+def test_run_builds_once_then_hits(tmp_path):
+    cache = StageCache(str(tmp_path), max_bytes=1 << 20, min_free_bytes=0)
+    calls = []
+    root, hit = cache.run("locate", "k", _writer("x", calls))
+    assert not hit and _read(root) == "x"
+    cache.release([("locate", "k")])
+
+    root, hit = cache.run("locate", "k", _writer("y", calls))
+    assert hit and _read(root) == "x"
+    cache.release([("locate", "k")])
+    assert len(calls) == 1
+    assert cache.hits["locate"] == 1 and cache.misses["locate"] == 1
+
+
+def test_refresh_rebuilds_and_replaces(tmp_path):
+    cache = StageCache(str(tmp_path), max_bytes=1 << 20, min_free_bytes=0)
+    cache.run("detect", "k", _writer("old"))
+    cache.release([("detect", "k")])
+
+    root, hit = cache.run("detect", "k", _writer("new"), refresh=True)
+    cache.release([("detect", "k")])
+    assert not hit and _read(root) == "new"
+    assert os.listdir(os.path.join(str(tmp_path), "detect")) == ["k"]
+
+
+def test_failed_build_leaves_no_output(tmp_path):
+    cache = StageCache(str(tmp_path), max_bytes=1 << 20, min_free_bytes=0)
+
+    def fail(root):
+        _writer("partial")(root)
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        cache.run("segment", "k", fail)
+    assert os.listdir(os.path.join(str(tmp_path), "segment")) == []
+    assert cache.refs == {}
+
+    root, hit = cache.run("segment", "k", _writer("ok"))
+    assert not hit and _read(root) == "ok"
+
+
+def test_evicts_least_recently_used_unreferenced(tmp_path):
+    cache = StageCache(str(tmp_path), max_bytes=25, min_free_bytes=0)
+    for key in ("a", "b"):
+        cache.run("render", key, _writer("0123456789"))
+        cache.release([("render", key)])
+    # 占用中的 a 不会被淘汰，超出上限时淘汰最久未用的空闲输出 b
+    cache.run("render", "a", _writer("unused"))
+    cache.run("render", "c", _writer("0123456789"))
+    cache.release([("render", "c")])
+    assert list(cache.entries) == [("render", "a"), ("render", "c")]
+    assert not os.path.exists(cache.path("render", "b"))
+    assert cache.evictions == 1
+
+    cache.release([("render", "a")])
+    cache.run("render", "d", _writer("0123456789"))
+    cache.release([("render", "d")])
+    assert ("render", "a") not in cache.entries
+
+
+def test_space_checks(tmp_path):
+    cache = StageCache(str(tmp_path), max_bytes=100, min_free_bytes=0)
+    with pytest.raises(WorkspaceQuotaError):
+        cache.run("inpaint", "k", _writer("x"), expected_bytes=101)
+    assert cache.refs == {}
+
+    full_disk = StageCache(str(tmp_path), max_bytes=1 << 40, min_free_bytes=1 << 60)
+    with pytest.raises(WorkspaceQuotaError):
+        full_disk.run("inpaint", "k", _writer("x"), expected_bytes=1)
+    assert full_disk._pending_bytes == 0
+
+
+def test_resume_after_restart(tmp_path):
+    root = str(tmp_path)
+    cache = StageCache(root, max_bytes=1 << 20, min_free_bytes=0)
+    cache.run("locate", "k", _writer("done"))
+    cache.release([("locate", "k")])
+
+    # 中断的临时目录：很久没有修改的被清理，最近仍在写入的保留
+    stale = os.path.join(root, "segment", "s.tmp1_1")
+    fresh = os.path.join(root, "segment", "s.tmp2_2")
+    for path in (stale, fresh):
+        os.makedirs(path)
+    old = time.time() - 10 * 86400
+    os.utime(stale, (old, old))
+    os.makedirs(os.path.join(root, "mux", "old"))  # 已不再缓存的阶段
+
+    restarted = StageCache(root, max_bytes=1 << 20, min_free_bytes=0)
+    calls = []
+    path, hit = restarted.run("locate", "k", _writer("again", calls))
+    assert hit and _read(path) == "done" and calls == []
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+    assert not os.path.exists(os.path.join(root, "mux"))
+
+
+class _HitCache:
+    """每个阶段都命中的阶段缓存，输出为预先写好的目录。"""
+
+    def __init__(self, root):
+        self.root = root
+        self.released = []
+
+    def run(self, stage, key, build, refresh=False, expected_bytes=0):
+        return os.path.join(self.root, stage), True
+
+    def release(self, held):
+        self.released.extend(held)
+
+
+def test_cached_run_does_not_open_frame_stores(tmp_path, monkeypatch):
+    import removal_pipeline
+    from removal_pipeline import RemovalPipeline, _write_result
+
+    video_path = str(tmp_path / "video.mp4")
+    with open(video_path, "wb") as f:
+        f.write(b"not really a video")
+    stages = tmp_path / "stages"
+    for stage in ("locate", "detect", "segment", "render", "inpaint"):
+        (stages / stage).mkdir(parents=True)
+    _write_result(str(stages / "locate"), {"frame_number": 3})
+    _write_result(str(stages / "detect"), {"frame_number": 3, "detection_result": {"x": 1, "y": 2}})
+    np.save(str(stages / "render" / "boxes.npy"), np.zeros((10, 4), dtype=np.int32))
+
+    class NoFrames:
+        def open(self, video_path):
+            raise AssertionError("全部阶段命中缓存时不应打开帧存储")
+
+        acquire = open
+
+    muxed = []
+    monkeypatch.setattr(removal_pipeline, "frame_stores", NoFrames())
+    monkeypatch.setattr(removal_pipeline, "probe_video",
+                        lambda path: {"fps": 25.0, "frame_count": 10, "width": 8, "height": 6})
+    monkeypatch.setattr(removal_pipeline, "mux_audio", lambda *args: muxed.append(args))
+    cache = _HitCache(str(stages))
+    RemovalPipeline(video_path, ["cup"], str(tmp_path / "out.mp4"), cache=cache).run()
+    assert len(muxed) == 1
+    assert [stage for stage, _ in cache.released] == ["locate", "detect", "segment", "render", "inpaint"]
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from sam2_pool import SAM2PredictorPool, PredictorBusy
+
+MODEL = {"model_cfg": "cfg.yaml", "checkpoint": "small.pt", "device": "cpu"}
+OTHER = {"model_cfg": "cfg.yaml", "checkpoint": "large.pt", "device": "cpu"}
+
+
+class Predictor:
+    pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """不加载模型的预测器池，pressure 控制是否模拟内存紧张。"""
+    pool = SAM2PredictorPool(max_per_model=2, idle_seconds=60.0, memory_threshold=90.0)
+    pool.builds = 0
+    pool.pressure = False
+
+    def build(entry):
+        pool.builds += 1
+        return Predictor(), 0.0
+
+    monkeypatch.setattr(pool, "_build", build)
+    monkeypatch.setattr(pool, "_memory_pressure", lambda: pool.pressure and pool.stats()["evicted_total"] < 1)
+    return pool
+
+
+def _lease(pool, model):
+    predictor = pool.acquire(**model)
+    pool.release(predictor, **model)
+    return predictor
+
+
+def test_reuses_idle_predictor(pool):
+    first = _lease(pool, MODEL)
+    assert _lease(pool, MODEL) is first
+    assert pool.builds == 1
+
+
+def test_waits_when_all_loaded_predictors_are_leased(pool):
+    leased = [pool.acquire(**MODEL) for _ in range(2)]
+    with pytest.raises(PredictorBusy):
+        pool.acquire(timeout=0.05, **MODEL)
+    for predictor in leased:
+        pool.release(predictor, **MODEL)
+    assert pool.stats()["models"][0]["loaded"] == 2
+
+
+def test_evict_idle_only_removes_idle_past_deadline(pool):
+    _lease(pool, MODEL)
+    busy = pool.acquire(**OTHER)
+    assert pool.evict_idle(max_idle_seconds=60.0) == 0
+
+    time.sleep(0.02)
+    assert pool.evict_idle(max_idle_seconds=0.01) == 1
+    loaded = {model["checkpoint"]: model["loaded"] for model in pool.stats()["models"]}
+    assert loaded == {"small.pt": 0, "large.pt": 1}  # 租借中的预测器不会被淘汰
+    pool.release(busy, **OTHER)
+    assert pool.evicted_total == 1
+
+    # 淘汰后再次租借时重新加载
+    _lease(pool, MODEL)
+    assert pool.builds == 3
+
+
+def test_memory_pressure_evicts_least_recently_used(pool):
+    _lease(pool, MODEL)
+    time.sleep(0.01)
+    _lease(pool, OTHER)
+    pool.pressure = True
+    assert pool._evict_under_pressure() == 1
+    loaded = {model["checkpoint"]: model["loaded"] for model in pool.stats()["models"]}
+    assert loaded == {"small.pt": 0, "large.pt": 1}
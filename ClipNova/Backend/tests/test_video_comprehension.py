@@ -0,0 +1,14 @@
+from video_comprehension import split_targets, TargetNotFound
+
+
+def test_split_targets():
+    assert split_targets("穿红衣服的女人 | 狗|") == ["穿红衣服的女人", "狗"]
+    assert split_targets(["  猫 ", "", "路牌"]) == ["猫", "路牌"]
+    assert split_targets("   ") == []
+
+
+def test_target_not_found_lists_every_missing_target():
+    error = TargetNotFound(["猫", "路牌"])
+    assert isinstance(error, ValueError)
+    assert error.missing == ["猫", "路牌"]
+    assert "猫" in str(error) and "路牌" in str(error)
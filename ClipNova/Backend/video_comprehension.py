@@ -5,8 +5,15 @@ import cv2
 import numpy as np
 import re
 import json
-import subprocess
-from sam2_model import SAM2InstanceSegmentationModel,remove_detect_target
+from sam2_model import remove_detect_target, write_white_masks, store_boxes, frame_mapping
+from cost_model import cost_estimator
+from frame_store import frame_stores
+from media_ingest import probe_video
+
+# 多目标消除时并发定位目标的大模型请求数
+VLM_LOCATE_WORKERS = int(os.environ.get("CLIPNOVA_VLM_LOCATE_WORKERS", "4"))
+# 定位和检测目标使用的视觉大模型
+VLM_MODEL = os.environ.get("CLIPNOVA_VLM_MODEL", "qwen-vl-max-latest")
 
 #  Base64 编码格式
 def encode_video(video_path):
@@ -18,42 +25,35 @@ def encode_image(image):
     return base64.b64encode(buffer).decode('utf-8')
 
 def extract_frame(video_path, frame_number):
-    video = cv2.VideoCapture(video_path)
-    video.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-    ret, frame = video.read()
-    video.release()
-    if ret:
-        return frame
-    return None
+    """
+    读取一帧的副本（BGR），帧号超出范围时返回 None。
 
-# 将test.mp4替换为你本地视频的绝对路径
-def video_comprehension(video_path, prompt, stream_type, example_video_path="D:/test1/video016.mp4"):
-    client = OpenAI(
+    该帧已在共享帧存储中解码时直接复制，否则按时间戳定位后只解码这一帧，不解码整段视频。
+    """
+    try:
+        return frame_stores.read_frame(video_path, frame_number)
+    except IndexError:
+        return None
+
+def _vlm_client():
+    return OpenAI(
         # 若没有配置环境变量，请用百炼API Key将下行替换为：api_key="sk-xxx"
         api_key="your_qwen_api_key",
         base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
     )
 
-    # 检查视频文件
-    if not os.path.exists(video_path):
-        print(f"错误: 视频文件不存在: {video_path}")
-        return
-
-    # 获取视频信息
-    video = cv2.VideoCapture(video_path)
-    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = video.get(cv2.CAP_PROP_FPS)
-    total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-    video.release()
+def locate_target_frame(video_path, prompt, total_frames):
+    """
+    第一步：让大模型在整段视频中找出目标最显眼、最清晰的一帧。
 
-    print("视频信息：")
-    print(f"宽度: {width}")
-    print(f"高度: {height}")
-    print(f"帧率: {fps}")
-    print(f"总帧数: {total_frames}")
+    参数:
+        video_path (str): 输入视频路径
+        prompt (str): 目标描述
+        total_frames (int): 视频总帧数（与共享帧存储一致）
 
-    # 第一步：定位目标帧
+    返回:
+        int: 帧序号，无法从模型返回中提取时为 0
+    """
     print("\n第一步：正在定位目标帧...")
     base64_video = encode_video(video_path)
     
@@ -78,8 +78,8 @@ def video_comprehension(video_path, prompt, stream_type, example_video_path="D:/
         ]
     })
 
-    completion = client.chat.completions.create(
-        model="qwen-vl-max-latest",
+    completion = _vlm_client().chat.completions.create(
+        model=VLM_MODEL,
         messages=messages,
         stream=False,
     )
@@ -113,13 +113,20 @@ def video_comprehension(video_path, prompt, stream_type, example_video_path="D:/
         frame_number = 0
 
     print(f"找到目标帧：第{frame_number}帧")
+    return frame_number
+
+def detect_target(video_path, frame_number, prompt):
+    """
+    第二步：让大模型在指定帧上定位目标的边界框和中心点。
 
-    # 第二步：在目标帧上进行目标检测
+    返回:
+        dict | str | None: 解析后的检测结果，无法解析为 JSON 时为模型返回的原始文本，无法提取该帧时为 None
+    """
     print("\n第二步：正在检测目标位置...")
     target_frame = extract_frame(video_path, frame_number)
     if target_frame is None:
         print("错误：无法提取目标帧")
-        return
+        return None
 
     base64_frame = encode_image(target_frame)
     
@@ -146,8 +153,8 @@ def video_comprehension(video_path, prompt, stream_type, example_video_path="D:/
         ]
     })
 
-    completion = client.chat.completions.create(
-        model="qwen-vl-max-latest",
+    completion = _vlm_client().chat.completions.create(
+        model=VLM_MODEL,
         messages=messages,
         stream=False,
     )
@@ -166,117 +173,200 @@ def video_comprehension(video_path, prompt, stream_type, example_video_path="D:/
         json_str = json_str.strip()
         
         # 解析JSON结果
-        detection_result = json.loads(json_str)
-        return {
-            "frame_number": frame_number,
-            "detection_result": detection_result
-        }
+        return json.loads(json_str)
     except json.JSONDecodeError as e:
         print(f"警告：无法解析检测结果为JSON格式: {str(e)}")
-        return {
-            "frame_number": frame_number,
-            "detection_result": result
-        }
+        return result
+
+# 将test.mp4替换为你本地视频的绝对路径
+def video_comprehension(video_path, prompt, stream_type, example_video_path="D:/test1/video016.mp4"):
+    # 检查视频文件
+    if not os.path.exists(video_path):
+        print(f"错误: 视频文件不存在: {video_path}")
+        return
+
+    # 获取视频信息：只读取容器元数据，不为此解码整段视频（帧数可能与实际解码的帧数略有出入）
+    info = probe_video(video_path)
+    width, height = info["width"], info["height"]
+    fps = info["fps"]
+    total_frames = info["frame_count"]
 
-def process_video_with_sam2(video_path, prompt, output_video_path=None):
+    print("视频信息：")
+    print(f"宽度: {width}")
+    print(f"高度: {height}")
+    print(f"帧率: {fps}")
+    print(f"总帧数: {total_frames}")
+
+    frame_number = locate_target_frame(video_path, prompt, total_frames)
+    detection_result = detect_target(video_path, frame_number, prompt)
+    if detection_result is None:
+        return
+    return {
+        "frame_number": frame_number,
+        "detection_result": detection_result
+    }
+
+def detection_to_prompt(frame_number, detection_result):
+    """
+    将大模型的检测结果转换为分割提示，优先使用中心点，没有中心点时使用边界框。
+
+    参数:
+        frame_number (int): 目标所在帧序号
+        detection_result (dict | str): video_comprehension 返回的检测结果
+
+    返回:
+        dict | None: 包含 "frame_idx" 以及 "points"/"labels" 或 "box" 的提示，无法解析时返回 None
+    """
+    if isinstance(detection_result, dict):
+        # 优先使用中心点进行分割
+        if "x" in detection_result and "y" in detection_result:
+            print(f"使用中心点进行分割: ({detection_result['x']}, {detection_result['y']})")
+            return {
+                "frame_idx": frame_number,
+                "points": np.array([[detection_result["x"], detection_result["y"]]], dtype=np.float32),
+                "labels": np.array([1], dtype=np.int32)
+            }
+
+        # 如果没有中心点坐标，则使用边界框
+        try:
+            box = np.array([
+                detection_result["x1"],
+                detection_result["y1"],
+                detection_result["x2"],
+                detection_result["y2"]
+            ])
+        except KeyError:
+            print("检测结果中没有中心点或边界框坐标")
+            return None
+        print(f"使用边界框进行分割: [{detection_result['x1']}, {detection_result['y1']}, {detection_result['x2']}, {detection_result['y2']}]")
+        return {"frame_idx": frame_number, "box": box}
+
+    # 如果检测结果不是JSON格式，尝试提取中心点
+    try:
+        center_x = int(detection_result.split("x:")[1].split(",")[0])
+        center_y = int(detection_result.split("y:")[1].split(")")[0])
+    except (IndexError, ValueError, AttributeError):
+        print("无法提取中心点坐标，请检查检测结果格式")
+        return None
+    print(f"使用中心点进行分割: ({center_x}, {center_y})")
+    return {
+        "frame_idx": frame_number,
+        "points": np.array([[center_x, center_y]], dtype=np.float32),
+        "labels": np.array([1], dtype=np.int32)
+    }
+
+def segment_with_detection(model, frame_number, detection_result):
+    """
+    根据大模型的检测结果选择点或框提示进行实例分割。
+
+    参数:
+        model (SAM2InstanceSegmentationModel): 已设置视频路径的分割模型
+        frame_number (int): 目标所在帧序号
+        detection_result (dict | str): video_comprehension 返回的检测结果
+
+    返回:
+        bool: 分割是否成功
+    """
+    prompt = detection_to_prompt(frame_number, detection_result)
+    if prompt is None:
+        return False
+    return model.segment_targets([prompt])
+
+class TargetNotFound(ValueError):
+    """一个或多个目标无法定位或检测时抛出，missing 为这些目标的描述。"""
+
+    def __init__(self, missing):
+        self.missing = list(missing)
+        super().__init__(f"无法定位目标: {', '.join(self.missing)}")
+
+def split_targets(prompt):
+    """将目标描述拆分为列表：支持列表输入，或用 | 分隔多个目标的字符串。"""
+    if isinstance(prompt, str):
+        prompt = prompt.split("|")
+    return [target.strip() for target in prompt if target and target.strip()]
+
+def process_video_with_sam2(video_path, prompt, output_video_path=None, analysis_path=None, refresh=False):
     """
     处理视频：定位目标、生成掩码、消除目标
     
+    多个目标共用一次抽帧和 SAM2 传播（每个目标一个对象 ID），所有目标掩码的并集只经过一次 E2FGVI 消除。
+    各阶段的输出按输入保存（见 removal_pipeline），失败后重试时从第一个没有完成或输入变化的阶段继续。
+
     参数:
         video_path (str): 输入视频路径
-        prompt (str): 目标描述
+        prompt (str | list): 目标描述，多个目标时为列表或用 | 分隔的字符串
         output_video_path (str): 输出视频路径，如果为None则使用默认路径
+        analysis_path (str): 定位和分割使用的视频（通常为夹层文件），为None时使用 video_path；
+            修复和音轨合并始终使用 video_path
+        refresh (bool): 是否忽略缓存的大模型定位和检测结果，重新调用大模型
+
+    返回:
+        bool: 成功时返回 True（失败时抛出异常）
+
+    异常:
+        ValueError: 如果没有提供目标描述。
+        TargetNotFound: 如果有目标无法定位或检测（不会只消除其余目标）。
+        WorkspaceQuotaError: 如果阶段输出的磁盘空间不足。
+        RuntimeError: 如果分割或消除失败；失败会传递给调用方（准入控制据此不记录耗时）。
     """
-    # 1. 使用video_comprehension定位目标
-    print("第一步：使用大模型定位目标...")
-    result = video_comprehension(video_path, prompt, False)
-    
-    if not result or "detection_result" not in result:
-        print("错误：目标定位失败")
-        return
-    print("result:",result)
-    frame_number = result["frame_number"]
-    detection_result = result["detection_result"]
-    
-    # 2. 初始化SAM2模型
-    print("\n第二步：初始化SAM2模型...")
-    checkpoint = "D:\GitHub\sitp-bronze96\models\sam2.1_hiera_tiny.pt"
-    model_cfg = "D:\GitHub\sitp-bronze96\models\sam2.1_hiera_t.yaml"
-    
-    model = SAM2InstanceSegmentationModel(model_cfg, checkpoint)
-    model.set_video_path(video_path, output_video_path or "./result.mp4")
-    
-    # 3. 使用检测结果进行实例分割
-    print("\n第三步：进行实例分割...")
-    try:
-        if isinstance(detection_result, dict):
-            # 优先使用中心点进行分割
-            if "x" in detection_result and "y" in detection_result:
-                points = np.array([[detection_result["x"], detection_result["y"]]], dtype=np.float32)
-                labels = np.array([1], dtype=np.int32)
-                print(f"使用中心点进行分割: ({detection_result['x']}, {detection_result['y']})")
-                success = model.segment_with_points(points, labels, frame_number)
-                
-            else:
-                # 如果没有中心点坐标，则使用边界框
-                box = np.array([
-                    detection_result["x1"],
-                    detection_result["y1"],
-                    detection_result["x2"],
-                    detection_result["y2"]
-                ])
-                print(f"使用边界框进行分割: [{detection_result['x1']}, {detection_result['y1']}, {detection_result['x2']}, {detection_result['y2']}]")
-                success = model.segment_with_box(box, frame_number)
-              
-        else:
-            # 如果检测结果不是JSON格式，尝试提取中心点
-            try:
-                center_x = int(detection_result.split("x:")[1].split(",")[0])
-                center_y = int(detection_result.split("y:")[1].split(")")[0])
-                points = np.array([[center_x, center_y]], dtype=np.float32)
-                labels = np.array([1], dtype=np.int32)
-                print(f"使用中心点进行分割: ({center_x}, {center_y})")
-                success = model.segment_with_points(points, labels, frame_number)
-          
-            except:
-                print("无法提取中心点坐标，请检查检测结果格式")
-                return
-
-        if not success:
-            print("实例分割失败，请检查分割参数")
-            return
-
-        # 检查分割结果
-        if frame_number not in model.video_segments or not model.video_segments[frame_number]:
-            print(f"警告：第{frame_number}帧的分割结果为空")
-            return
-    
-        # 4. 生成黑白掩码
-        print("\n第四步：生成黑白掩码...")
-        try:
-            model.generate_colored_mask_video()
-            model.generate_white_mask_images()
-        except Exception as e:
-            print(f"生成掩码时出错: {str(e)}")
-            return
-
-        # 5. 使用E2FGVI模型进行目标消除
-        print("\n第五步：进行目标消除...")
-        try:
-            remove_detect_target(video_path, output_video_path or "./result.mp4")
-        except Exception as e:
-            print(f"目标消除时出错: {str(e)}")
-            return
+    # removal_pipeline 依赖本模块的定位和检测函数，在这里导入避免循环导入
+    from removal_pipeline import RemovalPipeline
 
-        # 6. 清理临时文件
-        print("\n第六步：清理临时文件...")
-        model.cleanup()
+    targets = split_targets(prompt)
+    if not targets:
+        raise ValueError("没有提供目标描述")
 
-        print("\n处理完成！")
-    
+    RemovalPipeline(video_path, targets, output_video_path or "./result.mp4",
+                    analysis_path=analysis_path, refresh=refresh).run()
+    return True
+
+def inpaint_segmented(model, workspace, video_path, output_video_path=None):
+    """
+    使用已完成的分割结果生成黑白掩码并消除目标。
+
+    分割可以在夹层文件上完成，掩码按时间戳和尺寸映射到 video_path（原始文件）的每一帧，
+    修复和输出都基于原始文件。
+
+    参数:
+        model (SAM2InstanceSegmentationModel): 已完成分割的模型
+        workspace (JobWorkspace): 模型所在的任务工作区
+        video_path (str): 输入视频路径（原始文件）
+        output_video_path (str): 输出视频路径，如果为None则使用默认路径
+
+    返回:
+        bool: 是否成功
+    """
+    # 4. 生成黑白掩码
+    print("\n第四步：生成黑白掩码...")
+    try:
+        with cost_estimator.record_stage('mask_generation', video_path):
+            # E2FGVI 只需要黑白掩码，不再生成彩色预览视频
+            store = model.video_segments
+            with frame_stores.acquire(model.input_video_path) as analysis, \
+                    frame_stores.acquire(video_path) as source:
+                video_size = source.size
+                frame_map = frame_mapping(len(source), source.fps, store.num_frames, analysis.fps)
+                write_white_masks(store, model.white_mask_dir, video_size, model.mask_dilation,
+                                  frame_map=frame_map, frames=source)
+            boxes = store_boxes(store, video_size, model.mask_dilation, frame_map)
+        workspace.check_quota()
     except Exception as e:
-        print(f"处理过程中出错: {str(e)}")
-        return
+        print(f"生成掩码时出错: {str(e)}")
+        return False
+
+    # 5. 使用E2FGVI模型进行目标消除
+    print("\n第五步：进行目标消除...")
+    try:
+        with cost_estimator.record_stage('inpainting', video_path):
+            # 只把目标所在的时空区域送入 E2FGVI，计算量随目标大小而不是画面大小变化
+            remove_detect_target(video_path, output_video_path or "./result.mp4",
+                                 mask_dir=model.white_mask_dir, boxes=boxes)
+    except Exception as e:
+        print(f"目标消除时出错: {str(e)}")
+        return False
+
+    print("\n处理完成！")
+    return True
 
 if __name__ == "__main__":
     video_path = r"D:\test1\video001.mp4"
@@ -10,6 +10,7 @@ from abc import ABC, abstractmethod
 from moviepy.editor import VideoFileClip, concatenate_videoclips, vfx, TextClip, CompositeVideoClip, AudioFileClip, CompositeAudioClip
 from typing import Dict, Any, Optional, Tuple, Protocol
 from nlp_parser import OPERATIONS, EDITOR_TYPES, process_instruction, DialogueManager
+from cost_model import cost_estimator
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -215,7 +216,10 @@ class MoviePyVideoEditor(AbstractVideoEditor):
 
     def save(self):
         """保存编辑后的视频。"""
-        self.video_clip.write_videofile(self.output_path, codec='libx264', audio_codec='aac')
+        clip = self.video_clip
+        units = clip.duration * (clip.fps or 0) * clip.w * clip.h / 1e6
+        with cost_estimator.record_stage('write_videofile', units=units):
+            self.video_clip.write_videofile(self.output_path, codec='libx264', audio_codec='aac')
         logger.info(f"视频已保存至: {self.output_path}")
 
     def close(self):
@@ -0,0 +1,234 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from typing import Dict, Any, Optional
+
+try:
+    import psutil
+except ImportError:  # psutil 不可用时不使用内存盘
+    psutil = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 工作区配置，可通过环境变量覆盖
+WORKSPACE_ROOT = os.environ.get("CLIPNOVA_WORKSPACE_ROOT",
+                                os.path.join(tempfile.gettempdir(), "clipnova_jobs"))
+TMPFS_ROOT = os.environ.get("CLIPNOVA_TMPFS_ROOT", "/dev/shm")
+TMPFS_ENABLED = os.environ.get("CLIPNOVA_TMPFS", "1") != "0"
+TMPFS_MAX_RAM_FRACTION = float(os.environ.get("CLIPNOVA_TMPFS_RAM_FRACTION", "0.25"))  # 单个工作区最多占可用内存的比例
+WORKSPACE_QUOTA_MB = int(os.environ.get("CLIPNOVA_WORKSPACE_QUOTA_MB", "20480"))      # 单个工作区的磁盘配额
+WORKSPACE_STALE_SECONDS = float(os.environ.get("CLIPNOVA_WORKSPACE_STALE_SECONDS", "86400"))
+WORKSPACE_PREFIX = "job_"
+
+# 每帧的估算字节数：JPEG 彩色掩码预览帧约为原始像素字节数的 1/8，PNG 黑白掩码约 1/50
+# （解码后的原始帧保存在共享帧存储 frame_store 中，不占用任务工作区）
+_FRAME_BYTES_RATIO = 3 / 8 + 1 / 50
+
+
+class WorkspaceQuotaError(RuntimeError):
+    """工作区磁盘占用超过配额或剩余空间不足时抛出。"""
+
+
+def estimate_workspace_bytes(width: int, height: int, frame_count: int) -> int:
+    """
+    估算一次目标消除任务在工作区中需要的空间（原始帧 + 掩码图像 + 位压缩掩码）。
+
+    参数:
+        width (int): 视频宽度。
+        height (int): 视频高度。
+        frame_count (int): 视频帧数。
+
+    返回:
+        int: 估算字节数。
+    """
+    pixels = width * height * frame_count
+    return int(pixels * _FRAME_BYTES_RATIO + pixels / 8)
+
+
+class JobWorkspace:
+    """
+    单个任务的独立临时工作区。
+
+    每个任务拥有自己的根目录，内存充足时放在 tmpfs（/dev/shm）上，否则放在磁盘临时目录中。
+    作为上下文管理器使用时，退出（包括异常退出）后一定删除整个目录，多个任务可以安全并行。
+
+    用法:
+        with JobWorkspace('removal', expected_bytes=...) as ws:
+            frames_dir = ws.path('original_frames')
+    """
+
+    def __init__(self, job_name: str = "job", expected_bytes: int = 0,
+                 quota_bytes: int = WORKSPACE_QUOTA_MB * 1024 * 1024, use_tmpfs: Optional[bool] = None):
+        """
+        参数:
+            job_name (str): 任务名称，作为目录名前缀的一部分便于排查。
+            expected_bytes (int): 预计占用的字节数，用于选择存储位置和创建前的空间检查。
+            quota_bytes (int): 工作区允许占用的最大字节数。
+            use_tmpfs (Optional[bool]): 是否使用内存盘，为 None 时根据可用内存自动选择。
+        """
+        self.job_name = job_name
+        self.expected_bytes = expected_bytes
+        self.quota_bytes = quota_bytes
+        self.use_tmpfs = self._can_use_tmpfs(expected_bytes) if use_tmpfs is None else use_tmpfs
+        self.root = None
+
+    @staticmethod
+    def _can_use_tmpfs(expected_bytes: int) -> bool:
+        """tmpfs 存在且预计占用不超过可用内存的 TMPFS_MAX_RAM_FRACTION 时使用内存盘。"""
+        if not TMPFS_ENABLED or psutil is None or not os.path.isdir(TMPFS_ROOT):
+            return False
+        if expected_bytes <= 0:
+            return False
+        available = psutil.virtual_memory().available
+        try:
+            available = min(available, shutil.disk_usage(TMPFS_ROOT).free)
+        except OSError:
+            return False
+        return expected_bytes <= available * TMPFS_MAX_RAM_FRACTION
+
+    def create(self) -> str:
+        """
+        创建工作区目录。
+
+        返回:
+            str: 工作区根目录。
+
+        异常:
+            WorkspaceQuotaError: 如果预计占用超过配额或所在磁盘剩余空间不足。
+        """
+        if self.expected_bytes > self.quota_bytes:
+            raise WorkspaceQuotaError(
+                f"任务预计占用 {self.expected_bytes / 1024 / 1024:.0f}MB，超过工作区配额 "
+                f"{self.quota_bytes / 1024 / 1024:.0f}MB")
+
+        base = os.path.join(TMPFS_ROOT, "clipnova_jobs") if self.use_tmpfs else WORKSPACE_ROOT
+        os.makedirs(base, exist_ok=True)
+        free = shutil.disk_usage(base).free
+        if self.expected_bytes > free:
+            raise WorkspaceQuotaError(
+                f"工作区剩余空间不足: 需要 {self.expected_bytes / 1024 / 1024:.0f}MB，"
+                f"可用 {free / 1024 / 1024:.0f}MB")
+
+        self.root = tempfile.mkdtemp(prefix=f"{WORKSPACE_PREFIX}{self.job_name}_", dir=base)
+        _registry.add(self)
+        logger.info(f"已创建任务工作区: {self.root}（{'tmpfs' if self.use_tmpfs else '磁盘'}）")
+        return self.root
+
+    def path(self, *parts: str) -> str:
+        """返回工作区内的路径，目录部分会自动创建。"""
+        if self.root is None:
+            raise RuntimeError("工作区尚未创建")
+        full_path = os.path.join(self.root, *parts)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        return full_path
+
+    def usage_bytes(self) -> int:
+        """统计工作区当前占用的字节数。"""
+        total = 0
+        if self.root is None:
+            return total
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(folder, name))
+                except OSError:
+                    pass
+        return total
+
+    def check_quota(self) -> int:
+        """
+        检查当前占用是否超过配额，应在每个会产生大量文件的阶段之后调用。
+
+        返回:
+            int: 当前占用字节数。
+
+        异常:
+            WorkspaceQuotaError: 如果超过配额。
+        """
+        usage = self.usage_bytes()
+        if usage > self.quota_bytes:
+            raise WorkspaceQuotaError(
+                f"工作区 {self.root} 占用 {usage / 1024 / 1024:.0f}MB，超过配额 "
+                f"{self.quota_bytes / 1024 / 1024:.0f}MB")
+        return usage
+
+    def cleanup(self) -> None:
+        """删除整个工作区目录。"""
+        if self.root is None:
+            return
+        shutil.rmtree(self.root, ignore_errors=True)
+        _registry.discard(self)
+        logger.info(f"已删除任务工作区: {self.root}")
+        self.root = None
+
+    def __enter__(self) -> "JobWorkspace":
+        self.create()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.cleanup()
+
+
+class _WorkspaceRegistry:
+    """记录当前进程中存活的工作区，供监控和启动时清理遗留目录使用。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = set()
+
+    def add(self, workspace: JobWorkspace) -> None:
+        with self.lock:
+            self.active.add(workspace)
+
+    def discard(self, workspace: JobWorkspace) -> None:
+        with self.lock:
+            self.active.discard(workspace)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            workspaces = list(self.active)
+        return {
+            "active": len(workspaces),
+            "tmpfs": sum(1 for ws in workspaces if ws.use_tmpfs),
+            "roots": [ws.root for ws in workspaces]
+        }
+
+
+_registry = _WorkspaceRegistry()
+
+
+def workspace_stats() -> Dict[str, Any]:
+    """返回当前存活的工作区信息。"""
+    return _registry.stats()
+
+
+def cleanup_stale_workspaces(max_age: float = WORKSPACE_STALE_SECONDS) -> int:
+    """
+    删除上次进程崩溃等原因遗留的工作区目录，返回删除数量。
+
+    参数:
+        max_age (float): 目录最后修改时间距今超过该秒数时才删除，避免误删其他进程正在使用的工作区。
+    """
+    active = set(workspace_stats()["roots"])
+    now = time.time()
+    removed = 0
+    for base in (WORKSPACE_ROOT, os.path.join(TMPFS_ROOT, "clipnova_jobs")):
+        if not os.path.isdir(base):
+            continue
+        for name in os.listdir(base):
+            path = os.path.join(base, name)
+            if not name.startswith(WORKSPACE_PREFIX) or path in active:
+                continue
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                pass
+    if removed:
+        logger.info(f"已清理 {removed} 个遗留的任务工作区")
+    return removed